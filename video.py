@@ -1,32 +1,98 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
-import cv2
 import datetime
 import threading
 import subprocess
 import os
 import sys
 import logging
+import logging.handlers
 import signal
 import atexit
-from tkinterdnd2 import TkinterDnD, DND_FILES
+import queue
+import json
+import asyncio
+import shutil
+import tempfile
+import importlib
+import re
+import time
+import uuid
+import sqlite3
+import hashlib
+import argparse
+import csv
+import gzip
+import locale
+import secrets
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 
 # Windows特定的导入
 if sys.platform == 'win32':
     import ctypes
     from ctypes import wintypes
 
-# 设置日志配置
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# 可单独开启详细日志的子系统
+LOG_SUBSYSTEMS = ('app', 'ffmpeg', 'progress', 'preview', 'metrics', 'watch', 'api', 'process')
+
+
+def configure_logging():
+    """设置日志配置
+
+    默认只输出INFO及以上级别；通过环境变量VIDEO_TOOL_DEBUG按子系统开启DEBUG，
+    例如 VIDEO_TOOL_DEBUG=ffmpeg,progress，或 VIDEO_TOOL_DEBUG=all。
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    enabled = {name.strip() for name in os.getenv('VIDEO_TOOL_DEBUG', '').split(',') if name.strip()}
+    for name in LOG_SUBSYSTEMS:
+        level = logging.DEBUG if 'all' in enabled or name in enabled else logging.INFO
+        logging.getLogger(f'video_tool.{name}').setLevel(level)
+
+
+configure_logging()
 
-logger = logging.getLogger(__name__)
+logger = logging.getLogger('video_tool.app')
+ffmpeg_log = logging.getLogger('video_tool.ffmpeg')  # FFmpeg逐行输出
+progress_log = logging.getLogger('video_tool.progress')  # 进度解析
+metrics_log = logging.getLogger('video_tool.metrics')  # 指标导出
+watch_log = logging.getLogger('video_tool.watch')  # 监视文件夹
+api_log = logging.getLogger('video_tool.api')  # 任务接口
+process_log = logging.getLogger('video_tool.process')  # 子进程监管
+preview_log = logging.getLogger('video_tool.preview')  # 预览缩略图和拖动解码
+
+
+class _LazyModule:
+    """延迟导入的模块代理，第一次访问属性时才真正导入"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# 重量级依赖延迟到第一次预览/拖放时再加载，保证窗口尽快显示
+cv2 = _LazyModule('cv2')
+Image = _LazyModule('PIL.Image')
+ImageTk = _LazyModule('PIL.ImageTk')
+np = _LazyModule('numpy')  # 随opencv-python一起安装
+tkinterdnd2 = _LazyModule('tkinterdnd2')
+
+# 程序缓存目录
+APP_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.video_tool')
+TOOLCHAIN_CACHE_FILE = os.path.join(APP_CACHE_DIR, 'toolchain.json')
 
 def send_console_ctrl_event(process_id, ctrl_event=2):
     """发送控制台控制事件到指定进程"""
@@ -113,25 +179,11 @@ def find_ffmpeg_path():
             logger.info(f"Found local FFmpeg: {abs_path}")
             return abs_path
 
-    # 使用系统PATH中的ffmpeg
-    if sys.platform == 'win32':
-        try:
-            result = subprocess.run(['where', 'ffmpeg'], capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip():
-                path = result.stdout.strip().split('\n')[0]
-                logger.info(f"Found system FFmpeg: {path}")
-                return path
-        except:
-            pass
-    else:
-        try:
-            result = subprocess.run(['which', 'ffmpeg'], capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip():
-                path = result.stdout.strip()
-                logger.info(f"Found system FFmpeg: {path}")
-                return path
-        except:
-            pass
+    # 使用系统PATH中的ffmpeg（直接查找PATH，不再启动which/where子进程）
+    path = shutil.which('ffmpeg')
+    if path:
+        logger.info(f"Found system FFmpeg: {path}")
+        return path
 
     # 默认值
     return 'ffmpeg'
@@ -181,103 +233,4713 @@ def find_ffprobe_path():
             logger.info(f"Found local FFprobe: {abs_path}")
             return abs_path
 
-    # 使用系统PATH中的ffprobe
+    # 使用系统PATH中的ffprobe（直接查找PATH，不再启动which/where子进程）
+    path = shutil.which('ffprobe')
+    if path:
+        logger.info(f"Found system FFprobe: {path}")
+        return path
+
+    # 默认值
+    return 'ffprobe'
+
+
+def find_mkvpropedit_path():
+    """查找mkvpropedit（MKVToolNix，可选），用于原地修改MKV轨道信息，找不到时返回None"""
+    env_path = os.getenv('MKVPROPEDIT_PATH')
+    if env_path and os.path.exists(env_path):
+        return env_path
+    name = 'mkvpropedit.exe' if sys.platform == 'win32' else 'mkvpropedit'
+    for path in (os.path.join('mkvtoolnix', name), name):
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return shutil.which('mkvpropedit')
+
+# FFmpeg/FFprobe路径，启动后由后台线程discover_toolchain()确定
+FFMPEG_PATH = 'ffmpeg'
+FFPROBE_PATH = 'ffprobe'
+MKVPROPEDIT_PATH = None
+FFMPEG_INFO = {}  # 版本、硬件加速方法、编码器列表
+toolchain_ready = threading.Event()
+
+
+def _binary_key(path):
+    """用绝对路径和修改时间标识一个可执行文件，文件不存在时返回None"""
+    try:
+        abs_path = os.path.abspath(path)
+        return f"{abs_path}|{os.path.getmtime(abs_path)}"
+    except OSError:
+        return None
+
+
+def load_toolchain_cache():
+    """读取磁盘上的FFmpeg检测缓存"""
+    try:
+        with open(TOOLCHAIN_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_toolchain_cache(cache):
+    """写入FFmpeg检测缓存（先写临时文件再替换，避免写坏）"""
+    try:
+        os.makedirs(APP_CACHE_DIR, exist_ok=True)
+        tmp_path = TOOLCHAIN_CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, TOOLCHAIN_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"保存FFmpeg检测缓存失败: {e}")
+
+
+# 子进程调用层：所有命令以参数列表直接启动（不经过shell），路径中的空格、引号、%都原样传递。
+# 输出读入有界缓冲：错误输出保留最后的行，标准输出超出上限时丢弃开头
+COMMAND_STDERR_LINES = 2000
+COMMAND_STDOUT_LIMIT = 16 * 1024 * 1024
+COMMAND_ENCODING = 'utf-8'  # FFmpeg在各平台都以UTF-8输出路径和元数据
+
+CommandResult = namedtuple('CommandResult', ['returncode', 'stdout', 'stderr', 'spawn_seconds'])
+
+
+def popen_kwargs(creationflags=0):
+    """各平台启动子进程的参数：Windows下不弹出控制台窗口"""
     if sys.platform == 'win32':
+        return {'creationflags': subprocess.CREATE_NO_WINDOW | creationflags}
+    return {}
+
+
+def program_name(cmd):
+    """命令的程序名（不含目录和.exe），用于按程序统计"""
+    return os.path.splitext(os.path.basename(cmd[0]))[0].lower()
+
+
+class SpawnStats:
+    """子进程启动耗时统计（从调用到进程创建完成），按程序名汇总，在指标端点中输出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}  # 程序名 -> [总耗时, 次数, 最大值]
+
+    def record(self, program, seconds):
+        with self._lock:
+            total = self.totals.setdefault(program, [0.0, 0, 0.0])
+            total[0] += seconds
+            total[1] += 1
+            total[2] = max(total[2], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {program: list(total) for program, total in self.totals.items()}
+
+
+SPAWN_STATS = SpawnStats()
+
+
+def spawn_process(cmd, creationflags=0, **kwargs):
+    """启动子进程并记录启动耗时，返回(Popen, 启动耗时秒数)"""
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd, **popen_kwargs(creationflags), **kwargs)
+    spawn_seconds = time.perf_counter() - started
+    SPAWN_STATS.record(program_name(cmd), spawn_seconds)
+    process_log.debug(f"启动进程 PID {process.pid}（{spawn_seconds * 1000:.1f}ms）: {' '.join(map(str, cmd))}")
+    return process, spawn_seconds
+
+
+class _BoundedBytes:
+    """只保留最后limit字节的缓冲"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.chunks = deque()
+        self.size = 0
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size - len(self.chunks[0]) >= self.limit:
+            self.size -= len(self.chunks.popleft())
+
+    def getvalue(self):
+        return b''.join(self.chunks)[-self.limit:]
+
+
+def _drain_stdout(stream, sink):
+    """把标准输出读入有界缓冲（在读取线程中运行）"""
+    for chunk in iter(lambda: stream.read(65536), b''):
+        sink.write(chunk)
+    stream.close()
+
+
+def _drain_stderr(stream, lines):
+    """按行读取错误输出（FFmpeg的进度行以\r结尾），跳过统计行，只保留最后的行（在读取线程中运行）"""
+    buffer = b''
+    for chunk in iter(lambda: stream.read(65536), b''):
+        parts = LINE_SPLIT_RE.split(buffer + chunk)
+        buffer = parts.pop()
+        lines.extend(part for part in parts if part and not PROGRESS_LINE_RE.match(part))
+    if buffer:
+        lines.append(buffer)
+    stream.close()
+
+
+def run_command(cmd, timeout=None, encoding=COMMAND_ENCODING):
+    """运行命令直到结束，返回CommandResult(返回码, 标准输出, 错误输出, 启动耗时)
+
+    标准输出和错误输出由读取线程读入有界缓冲，不会因输出过多占满内存；
+    超时时结束进程并抛出subprocess.TimeoutExpired。
+    """
+    process, spawn_seconds = spawn_process(cmd, stdin=subprocess.DEVNULL,
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout = _BoundedBytes(COMMAND_STDOUT_LIMIT)
+    stderr = deque(maxlen=COMMAND_STDERR_LINES)
+    readers = [threading.Thread(target=_drain_stdout, args=(process.stdout, stdout), daemon=True),
+               threading.Thread(target=_drain_stderr, args=(process.stderr, stderr), daemon=True)]
+    for reader in readers:
+        reader.start()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+    return CommandResult(
+        process.returncode,
+        stdout.getvalue().decode(encoding, errors='replace'),
+        '\n'.join(line.decode(encoding, errors='replace') for line in stderr),
+        spawn_seconds,
+    )
+
+
+def launch_detached(cmd):
+    """启动外部程序（如打开文件管理器）后立即返回，不等待、不接管输出
+
+    不用管道：被启动的程序会继承管道，界面线程等待读取线程时会一直卡到它关闭。
+    """
+    process, _ = spawn_process(cmd, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process
+
+
+def probe_ffmpeg(ffmpeg_path):
+    """运行FFmpeg获取版本、硬件加速方法和编码器列表，不可用时抛出异常"""
+
+    def run(*args):
+        return run_command([ffmpeg_path, '-hide_banner', *args], timeout=10)
+
+    result = run('-version')
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg 不可用，返回码: {result.returncode}")
+    version = result.stdout.splitlines()[0] if result.stdout else ''
+
+    # -hwaccels 输出：标题行之后每行一个方法
+    hwaccels = []
+    for line in run('-hwaccels').stdout.splitlines():
+        line = line.strip()
+        if line and not line.endswith(':'):
+            hwaccels.append(line)
+
+    # -encoders 输出：分隔线"------"之后每行为"标志 名称 描述"
+    encoders = []
+    started = False
+    for line in run('-encoders').stdout.splitlines():
+        if line.strip().startswith('------'):
+            started = True
+            continue
+        parts = line.split()
+        if started and len(parts) >= 2:
+            encoders.append(parts[1])
+
+    return {'version': version, 'hwaccels': hwaccels, 'encoders': encoders}
+
+
+def discover_toolchain():
+    """查找FFmpeg/FFprobe并检查能力，结果按路径+修改时间缓存在磁盘上
+
+    缓存命中时不启动任何子进程；FFmpeg不可用时抛出异常。
+    """
+    global FFMPEG_PATH, FFPROBE_PATH, FFMPEG_INFO, MKVPROPEDIT_PATH
+
+    ffmpeg_path = find_ffmpeg_path()
+    ffprobe_path = find_ffprobe_path()
+    MKVPROPEDIT_PATH = find_mkvpropedit_path()
+
+    key = _binary_key(ffmpeg_path)
+    cache = load_toolchain_cache()
+    info = cache.get(key) if key else None
+    if info is None:
         try:
-            result = subprocess.run(['where', 'ffprobe'], capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip():
-                path = result.stdout.strip().split('\n')[0]
-                logger.info(f"Found system FFprobe: {path}")
-                return path
-        except:
-            pass
+            info = probe_ffmpeg(ffmpeg_path)
+        except FileNotFoundError:
+            raise RuntimeError(f"找不到 FFmpeg: {ffmpeg_path}")
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"FFmpeg 响应超时: {ffmpeg_path}")
+        if key:
+            # 只保留当前可执行文件的记录，旧版本的条目自然淘汰
+            save_toolchain_cache({key: info})
     else:
+        logger.info("使用缓存的FFmpeg检测结果")
+
+    FFMPEG_PATH = ffmpeg_path
+    FFPROBE_PATH = ffprobe_path
+    FFMPEG_INFO = info
+    toolchain_ready.set()
+    logger.info(f"Using ffmpeg from: {FFMPEG_PATH} ({info.get('version', '')})")
+    return info
+
+# 界面更新事件：kind为'progress'/'status'/'call'，job为任务标识
+UIEvent = namedtuple('UIEvent', ['kind', 'job', 'payload'])
+
+
+class UIUpdateBus:
+    """线程安全的界面更新总线
+
+    工作线程只向队列投递事件，不直接接触任何Tk对象；主线程按固定帧率取出事件，
+    同一任务的进度/状态只应用一帧内的最新值，普通回调按投递顺序依次执行。
+    """
+
+    def __init__(self, root, fps=30):
+        self.root = root
+        self.interval = max(1, int(1000 / fps))
+        self.events = queue.Queue()
+        self.channels = {}  # job -> (进度变量, 状态标签)
+        self._timer = None
+        self._running = False
+
+    def register(self, job, progress_var=None, status_label=None):
+        """注册任务的进度变量和状态标签（仅在主线程调用）"""
+        self.channels[job] = (progress_var, status_label)
+
+    def progress(self, job, value):
+        """投递进度更新（可在任意线程调用）"""
+        self.events.put(UIEvent('progress', job, value))
+
+    def status(self, job, text):
+        """投递状态文字更新（可在任意线程调用）"""
+        self.events.put(UIEvent('status', job, text))
+
+    def call(self, func, *args, delay=0, **kwargs):
+        """投递需要在主线程执行的回调，delay为额外延迟的毫秒数"""
+        self.events.put(UIEvent('call', None, (func, args, kwargs, delay)))
+
+    def start(self):
+        """启动主线程上的定时取队列"""
+        if not self._running:
+            self._running = True
+            self._timer = self.root.after(self.interval, self._drain)
+
+    def stop(self):
+        """停止定时器"""
+        self._running = False
+        if self._timer is not None:
+            try:
+                self.root.after_cancel(self._timer)
+            except Exception:
+                pass
+            self._timer = None
+
+    def _drain(self):
+        """取出本帧内的所有事件，合并后应用到界面"""
+        pending = []
         try:
-            result = subprocess.run(['which', 'ffprobe'], capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip():
-                path = result.stdout.strip()
-                logger.info(f"Found system FFprobe: {path}")
-                return path
-        except:
+            while True:
+                pending.append(self.events.get_nowait())
+        except queue.Empty:
             pass
 
-    # 默认值
-    return 'ffprobe'
+        if pending:
+            # 记录每个任务进度/状态的最后一个事件，之前的值直接丢弃
+            latest = {}
+            for index, event in enumerate(pending):
+                if event.kind != 'call':
+                    latest[(event.kind, event.job)] = index
+
+            for index, event in enumerate(pending):
+                try:
+                    if event.kind == 'call':
+                        func, args, kwargs, delay = event.payload
+                        if delay:
+                            self.root.after(delay, lambda f=func, a=args, k=kwargs: f(*a, **k))
+                        else:
+                            func(*args, **kwargs)
+                    elif latest.get((event.kind, event.job)) == index:
+                        self._apply(event)
+                except Exception as e:
+                    print(f"界面更新失败: {e}")
+
+        if self._running:
+            self._timer = self.root.after(self.interval, self._drain)
+
+    def _apply(self, event):
+        """把进度/状态事件写入已注册的控件"""
+        progress_var, status_label = self.channels.get(event.job, (None, None))
+        if event.kind == 'progress' and progress_var is not None:
+            progress_var.set(event.payload)
+        elif event.kind == 'status' and status_label is not None:
+            status_label.config(text=event.payload)
+
+
+# 子进程资源策略：预览截帧优先于界面中发起的处理，界面处理优先于任务队列和监视文件夹的批处理
+# nice越大优先级越低；ionice为(类别, 级别)，类别2为尽力而为、3为空闲；cpu_share为可用核心的比例
+RESOURCE_POLICIES = {
+    'interactive': {'nice': 0, 'ionice': None, 'cpu_share': None, 'win_priority': None},
+    'foreground': {'nice': 5, 'ionice': (2, 6), 'cpu_share': None, 'win_priority': 'BELOW_NORMAL_PRIORITY_CLASS'},
+    'background': {'nice': 15, 'ionice': (3, 0), 'cpu_share': 0.5, 'win_priority': 'IDLE_PRIORITY_CLASS'},
+}
+RESOURCE_POLICY_NAMES = {
+    'interactive': '交互',
+    'foreground': '前台',
+    'background': '后台',
+}
+# 后台任务可用的CPU（如"4-7"或"0,2,4"），以及要加入的cgroup目录（需有写权限）
+BACKGROUND_CPUS_ENV = 'VIDEO_TOOL_BACKGROUND_CPUS'
+BACKGROUND_CGROUP_ENV = 'VIDEO_TOOL_BACKGROUND_CGROUP'
+
+
+def parse_cpu_list(text):
+    """解析taskset风格的CPU列表（"0-3,6"），返回排序后的列表"""
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
 
-# 获取FFmpeg路径
-FFMPEG_PATH = find_ffmpeg_path()
-logger.info(f"Using ffmpeg from: {FFMPEG_PATH}")
 
-# 检查 FFmpeg 是否可用
-def check_ffmpeg():
+def policy_cpus(policy):
+    """策略允许使用的CPU列表，不限制或系统不支持时返回None"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    available = sorted(os.sched_getaffinity(0))
+    if policy == 'background' and os.environ.get(BACKGROUND_CPUS_ENV):
+        try:
+            cpus = [cpu for cpu in parse_cpu_list(os.environ[BACKGROUND_CPUS_ENV]) if cpu in available]
+        except ValueError:
+            process_log.warning(f"{BACKGROUND_CPUS_ENV}格式不正确，忽略")
+            cpus = []
+        if cpus:
+            return cpus
+    share = RESOURCE_POLICIES[policy]['cpu_share']
+    if not share or len(available) < 2:
+        return None
+    # 留出编号靠前的核心给界面和预览
+    return available[-max(1, int(len(available) * share)):]
+
+
+# 不带参数值的FFmpeg选项，其余以-开头的参数都带一个值
+FFMPEG_FLAG_OPTIONS = frozenset({
+    '-y', '-n', '-an', '-vn', '-sn', '-dn', '-nostdin', '-stdin', '-nostats', '-stats',
+    '-hide_banner', '-shortest', '-copyts', '-re', '-autorotate', '-noautorotate',
+    '-accurate_seek', '-noaccurate_seek', '-benchmark', '-version', '-encoders', '-hwaccels',
+})
+
+
+def ffmpeg_output_indexes(cmd):
+    """FFmpeg命令中各输出文件参数的位置：不是选项值的位置参数（"-"表示标准输出）"""
+    indexes = []
+    index = 1
+    while index < len(cmd):
+        arg = str(cmd[index])
+        if arg == '-' or not arg.startswith('-'):
+            indexes.append(index)
+            index += 1
+        elif arg in FFMPEG_FLAG_OPTIONS:
+            index += 1
+        else:
+            index += 2
+    return indexes
+
+
+def with_thread_limit(cmd, cpus):
+    """限制了CPU时给FFmpeg的每个输出加上与核心数一致的-threads（-threads是输出选项，放在各输出文件前）"""
+    if not cpus or '-threads' in cmd or program_name(cmd) != 'ffmpeg':
+        return cmd
+    cmd = list(cmd)
+    for index in reversed(ffmpeg_output_indexes(cmd)):
+        cmd[index:index] = ['-threads', str(len(cpus))]
+    return cmd
+
+
+def resource_creationflags(policy):
+    """Windows下按策略设置进程优先级类"""
+    flags = subprocess.CREATE_NO_WINDOW
+    priority = RESOURCE_POLICIES[policy]['win_priority']
+    if priority:
+        flags |= getattr(subprocess, priority, 0)
+    return flags
+
+
+_resource_tools = {}  # nice/ionice/taskset的路径缓存，没有时为None
+
+
+def resource_tool(name):
+    """查找设置资源策略用的命令行工具（结果缓存，不在每次启动进程时搜索PATH）"""
+    if name not in _resource_tools:
+        _resource_tools[name] = shutil.which(name)
+    return _resource_tools[name]
+
+
+def resource_command(cmd, policy, cpus=None):
+    """按策略在命令前加上nice、ionice（Linux）和taskset（Linux），在FFmpeg启动前就设置好
+
+    各工具设置自身后exec下一个程序，进程号不变，FFmpeg创建的所有线程都继承这些设置
+    （启动后再设置时，已创建的线程不受影响）。工具不存在时跳过该项。
+    """
+    settings = RESOURCE_POLICIES[policy]
+    prefix = []
+    if settings['nice'] and resource_tool('nice'):
+        prefix += [resource_tool('nice'), '-n', str(settings['nice'])]
+    if sys.platform.startswith('linux'):
+        if settings['ionice'] and resource_tool('ionice'):
+            io_class, io_level = settings['ionice']
+            prefix += [resource_tool('ionice'), '-c', str(io_class)]
+            if io_class == 2:
+                prefix += ['-n', str(io_level)]
+        if cpus and resource_tool('taskset'):
+            prefix += [resource_tool('taskset'), '-c', ','.join(map(str, cpus))]
+    return [*prefix, *cmd]
+
+
+def join_resource_cgroup(pid, policy):
+    """后台策略的进程加入VIDEO_TOOL_BACKGROUND_CGROUP指定的cgroup（在父进程中写入子进程号）"""
+    cgroup = os.environ.get(BACKGROUND_CGROUP_ENV)
+    if policy != 'background' or not cgroup:
+        return
     try:
-        result = subprocess.run([FFMPEG_PATH, '-version'], capture_output=True, text=True, timeout=10)
-        if result.returncode == 0:
-            logger.info("FFmpeg 可用")
-            return True
+        with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as f:
+            f.write(str(pid))
+    except OSError as e:
+        process_log.debug(f"加入cgroup失败 (PID {pid}): {e}")
+
+
+def apply_resource_policy(pid, policy, cpus=None):
+    """对已启动的进程（POSIX）应用策略：nice、ionice、CPU亲和性和cgroup
+
+    只影响之后由它创建的线程和子进程，用于流水线工作进程在启动任何FFmpeg之前设置自身；
+    单独启动的FFmpeg使用resource_command/join_resource_cgroup。单项失败只记录日志。
+    """
+    if sys.platform == 'win32':
+        return
+    settings = RESOURCE_POLICIES[policy]
+    if settings['nice']:
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, settings['nice'])
+        except OSError as e:
+            process_log.debug(f"设置nice失败 (PID {pid}): {e}")
+    if settings['ionice'] and shutil.which('ionice'):
+        io_class, io_level = settings['ionice']
+        cmd = ['ionice', '-c', str(io_class), '-p', str(pid)]
+        if io_class == 2:
+            cmd[3:3] = ['-n', str(io_level)]
+        try:
+            _run_check(cmd, timeout=5)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            process_log.debug(f"设置ionice失败 (PID {pid}): {e}")
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(pid, cpus)
+        except OSError as e:
+            process_log.debug(f"设置CPU亲和性失败 (PID {pid}): {e}")
+    join_resource_cgroup(pid, policy)
+
+
+FFMPEG_TIME_RE = re.compile(r'time=\s*(-?\d+):(\d+):(\d+(?:\.\d+)?)')
+LINE_SPLIT_RE = re.compile(rb'[\r\n]')
+PROGRESS_LINE_RE = re.compile(rb'\s*(?:frame|size)=')  # 统计行（frame=... 或纯音频的size=...）
+STDERR_TAIL_LINES = 50  # 保留在内存中用于错误信息的最后几行
+
+
+def parse_ffmpeg_time(line):
+    """从FFmpeg进度行中取出time=的秒数，没有时返回None"""
+    match = FFMPEG_TIME_RE.search(line)
+    if not match:
+        return None
+    h, m, s = match.groups()
+    return max(0.0, int(h) * 3600 + int(m) * 60 + float(s))
+
+
+class ProcessRegistry:
+    """带锁的活跃进程列表，多个工作线程可以同时登记和移除
+
+    接口与list相同（append/remove/in/len/遍历），遍历的是当时的快照。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = []
+
+    def append(self, process):
+        with self._lock:
+            self._processes.append(process)
+
+    def remove(self, process):
+        """移除进程，不在列表中时忽略"""
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+
+    def clear(self):
+        with self._lock:
+            self._processes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._processes)
+
+    def __contains__(self, process):
+        with self._lock:
+            return process in self._processes
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._processes)
+
+    def __bool__(self):
+        return len(self) > 0
+
+
+class SupervisedProcess:
+    """由ProcessSupervisor启动的子进程，在其他线程中按subprocess.Popen的方式使用
+
+    管道在事件循环中读取，每行输出回调给on_stdout/on_stderr（在事件循环线程中执行，
+    回调里不能阻塞）；错误输出中统计行以外的最后STDERR_TAIL_LINES行保存在stderr_tail中，
+    完整输出写入log（JobLog，可为None）。
+    """
+
+    def __init__(self, supervisor, cmd, policy, log=None):
+        self.supervisor = supervisor
+        self.args = cmd
+        self.policy = policy
+        self.log = log
+        self.pid = None
+        self.returncode = None
+        self.spawn_seconds = 0.0  # 启动耗时
+        self.stopped = False  # 由监管器逐级停止（按'q'退出时返回码也是0，但输出不完整）
+        self.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        self._proc = None
+        self._exited = threading.Event()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """等待进程结束（不轮询），超时抛出subprocess.TimeoutExpired"""
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def stderr_text(self):
+        return '\n'.join(self.stderr_tail)
+
+    def send_quit(self):
+        """向FFmpeg发送'q'，让它写完文件尾后退出"""
+        self.supervisor.call_soon(self._write_quit)
+
+    def terminate(self):
+        self.supervisor.call_soon(self._send_signal, False)
+
+    def kill(self):
+        self.supervisor.call_soon(self._send_signal, True)
+
+    # 以下方法只在事件循环线程中调用
+    def _write_quit(self):
+        if self._proc is not None and self.returncode is None and self._proc.stdin is not None:
+            try:
+                self._proc.stdin.write(b'q\n')
+            except (OSError, RuntimeError):
+                pass
+
+    def _send_signal(self, force):
+        if self._proc is not None and self.returncode is None:
+            try:
+                if force and sys.platform != 'win32':
+                    os.killpg(self.pid, signal.SIGKILL)  # 进程自己的进程组，连同其子进程
+                elif force:
+                    self._proc.kill()
+                else:
+                    self._proc.terminate()
+            except ProcessLookupError:
+                pass
+
+
+class ProcessSupervisor:
+    """所有FFmpeg子进程共用的监管线程（一个asyncio事件循环）
+
+    子进程的管道在事件循环中异步读取，不再为每个进程开一个轮询线程；
+    停止进程时按'q' -> SIGTERM -> SIGKILL逐级升级，多个进程同时进行。
+    running中登记所有未退出的进程（包括缩略图、预览、估算等不在界面进程列表中的），
+    程序关闭时一起停止。
+    """
+
+    def __init__(self):
+        self.running = ProcessRegistry()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='process-supervisor', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def call_soon(self, func, *args):
+        """在事件循环线程中执行func（可在任意线程调用）"""
+        self._loop.call_soon_threadsafe(func, *args)
+
+    def spawn(self, cmd, on_stdout=None, on_stderr=None, policy='foreground', log=None):
+        """按资源策略启动子进程并返回SupervisedProcess；启动失败时抛出异常（如FileNotFoundError）
+
+        log为JobLog时错误输出（统计行除外）完整写入任务日志。
+        不能在事件循环线程（即输出回调）中调用。
+        """
+        cpus = policy_cpus(policy)
+        process = SupervisedProcess(self, with_thread_limit(cmd, cpus), policy, log)
+        future = asyncio.run_coroutine_threadsafe(
+            self._start(process, on_stdout, on_stderr, cpus), self._loop)
+        future.result()
+        join_resource_cgroup(process.pid, policy)
+        process_log.debug(f"启动进程 PID {process.pid}（{RESOURCE_POLICY_NAMES[policy]}）: {' '.join(process.args)}")
+        if log is not None:
+            log.write(f"$ {' '.join(process.args)}")
+        return process
+
+    async def _start(self, process, on_stdout, on_stderr, cpus):
+        kwargs = {}
+        args = process.args
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = resource_creationflags(process.policy)
         else:
-            logger.error(f"FFmpeg 不可用，返回码: {result.returncode}")
+            kwargs['start_new_session'] = True  # 独立进程组，终端的Ctrl+C不会直接打断FFmpeg
+            args = resource_command(args, process.policy, cpus)
+        started = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE if on_stdout else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            **kwargs
+        )
+        process.spawn_seconds = time.perf_counter() - started
+        SPAWN_STATS.record(program_name(process.args), process.spawn_seconds)
+        process._proc = proc
+        process.pid = proc.pid
+        self.running.append(process)
+        readers = [self._pump(proc.stderr, on_stderr, process.stderr_tail, process.log)]
+        if on_stdout:
+            readers.append(self._pump(proc.stdout, on_stdout, None, None))
+        self._loop.create_task(self._reap(process, readers))
+
+    async def _pump(self, stream, callback, tail, log):
+        """按行读取管道（FFmpeg的进度行以\r结尾），逐行回调"""
+        buffer = b''
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            parts = LINE_SPLIT_RE.split(buffer + chunk)
+            buffer = parts.pop()
+            for part in parts:
+                self._emit(part, callback, tail, log)
+        self._emit(buffer, callback, tail, log)
+
+    @staticmethod
+    def _emit(raw, callback, tail, log):
+        """统计行只交给回调解析进度；其他行进入尾部缓冲、任务日志和ffmpeg调试日志"""
+        line = raw.decode('utf-8', errors='replace').strip()
+        if not line:
+            return
+        if tail is not None and not PROGRESS_LINE_RE.match(raw):
+            tail.append(line)
+            if log is not None:
+                log.write(line)
+            ffmpeg_log.debug(line)
+        if callback is not None:
+            try:
+                callback(line)
+            except Exception as e:
+                process_log.warning(f"处理输出行失败: {e}")
+
+    async def _reap(self, process, readers):
+        await asyncio.gather(*readers, return_exceptions=True)
+        process.returncode = await process._proc.wait()
+        self.running.remove(process)
+        process._exited.set()
+        process_log.debug(f"进程 PID {process.pid} 已退出，返回码: {process.returncode}")
+
+    async def _escalate(self, process, quit_timeout, term_timeout):
+        """'q' -> SIGTERM -> SIGKILL，每一级等待进程退出"""
+        if process.poll() is not None:
+            return
+        if isinstance(process, SupervisedProcess):
+            process.stopped = True
+        steps = [
+            ("'q'", process._write_quit if isinstance(process, SupervisedProcess) else None, quit_timeout),
+            ('SIGTERM', process.terminate, term_timeout),
+            ('SIGKILL', process.kill, 2.0),
+        ]
+        for name, action, timeout in steps:
+            if action is None:
+                continue
+            try:
+                action()
+            except (OSError, ValueError):
+                pass
+            process_log.debug(f"已向进程 PID {process.pid} 发送{name}")
+            if await self._wait_exit(process, timeout):
+                process_log.debug(f"进程 PID {process.pid} 已在{name}后退出")
+                return
+        process_log.warning(f"进程 PID {process.pid} 无法终止")
+
+    async def _wait_exit(self, process, timeout):
+        if isinstance(process, SupervisedProcess):
+            if process._proc is None:
+                return True
+            try:
+                await asyncio.wait_for(asyncio.shield(process._proc.wait()), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        # 其他地方启动的subprocess.Popen
+        try:
+            await asyncio.to_thread(process.wait, timeout)
+            return True
+        except subprocess.TimeoutExpired:
             return False
-    except FileNotFoundError:
-        logger.error(f"找不到 FFmpeg: {FFMPEG_PATH}")
+
+    def stop(self, process, quit_timeout=5.0, term_timeout=3.0):
+        """在后台逐级停止一个进程（不等待）"""
+        asyncio.run_coroutine_threadsafe(self._escalate(process, quit_timeout, term_timeout), self._loop)
+
+    def stop_all(self, processes, quit_timeout=5.0, term_timeout=3.0):
+        """同时停止多个进程并等待，总耗时不超过单个进程的最坏情况"""
+        processes = [p for p in processes if p.poll() is None]
+        if not processes:
+            return
+
+        async def stop_every():
+            await asyncio.gather(*(self._escalate(p, quit_timeout, term_timeout) for p in processes),
+                                 return_exceptions=True)
+
+        future = asyncio.run_coroutine_threadsafe(stop_every(), self._loop)
+        try:
+            future.result(timeout=quit_timeout + term_timeout + 5)
+        except Exception as e:
+            process_log.warning(f"停止进程时出错: {e}")
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    """进程监管器（第一次使用时启动事件循环线程）"""
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = ProcessSupervisor()
+        return _supervisor
+
+
+# 任务阶段，按执行顺序排列
+JOB_STAGES = ('queue_wait', 'probe', 'spawn', 'first_frame', 'encode', 'finalize')
+JOB_COUNTERS = ('bytes_read', 'bytes_written', 'frames_encoded')
+METRICS_FILE = os.path.join(APP_CACHE_DIR, 'metrics.jsonl')
+FRAME_RE = re.compile(r'frame=\s*(\d+)')
+JOB_LOG_DIR = os.path.join(APP_CACHE_DIR, 'logs')
+JOB_LOG_KEEP = 100  # 保留最近的任务日志数量
+JOB_LOG_QUEUE = 10000  # 等待写盘的行数上限，写盘跟不上时丢弃而不是阻塞编码
+
+
+class JobLog:
+    """一个任务的日志文件，write()只把行放入JobLogSpooler的队列"""
+
+    def __init__(self, spooler, path):
+        self.spooler = spooler
+        self.path = path
+        self.dropped = 0
+
+    def write(self, line):
+        if not self.spooler.put(self, line):
+            self.dropped += 1
+
+    def close(self):
+        self.spooler.put(self, None, block=True)
+
+
+class JobLogSpooler:
+    """把任务的完整FFmpeg输出写入gzip压缩的日志文件（~/.video_tool/logs/<类型>-<任务ID>.log.gz）
+
+    编码线程只把行放入队列，压缩和写盘都在一个后台线程中完成；队列满时丢弃并计数。
+    """
+
+    def __init__(self, directory=JOB_LOG_DIR, keep=JOB_LOG_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self._queue = queue.Queue(maxsize=JOB_LOG_QUEUE)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def open(self, name):
+        return JobLog(self, os.path.join(self.directory, f"{name}.log.gz"))
+
+    def put(self, log, line, block=False):
+        """放入一行（line为None表示关闭文件），队列已满且不等待时返回False"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='job-log-spooler', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put((log, line), block=block)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self):
+        """等待已放入的行全部写入"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def shutdown(self, timeout=2.0):
+        """关闭所有打开的日志文件（程序退出时调用，未关闭的gzip文件无法完整读取）"""
+        if self._thread is not None:
+            try:
+                self._queue.put((None, None), timeout=timeout)
+            except queue.Full:
+                return
+            self._thread.join(timeout)
+
+    def _run(self):
+        files = {}
+        while True:
+            log, line = self._queue.get()
+            try:
+                if log is None:
+                    for handle in files.values():
+                        handle.close()
+                    return
+                if line is None:
+                    handle = files.pop(log, None)
+                    if handle is not None:
+                        if log.dropped:
+                            handle.write(f"[写盘跟不上，丢弃了 {log.dropped} 行]\n")
+                        handle.close()
+                        self._prune()
+                    continue
+                handle = files.get(log)
+                if handle is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    handle = files[log] = gzip.open(log.path, 'at', encoding='utf-8', compresslevel=6)
+                handle.write(line + '\n')
+            except OSError as e:
+                metrics_log.warning(f"写入任务日志失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _prune(self):
+        """只保留最近keep个日志文件"""
+        try:
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                     if name.endswith('.log.gz')]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths[self.keep:]:
+                os.remove(path)
+        except OSError as e:
+            metrics_log.warning(f"清理任务日志失败: {e}")
+
+
+JOB_LOGS = JobLogSpooler()
+atexit.register(JOB_LOGS.shutdown)
+
+
+class JobMetrics:
+    """单个任务的阶段计时和计数器
+
+    阶段按顺序推进：mark()结束当前阶段并开始下一阶段，finish()结束最后一个阶段并上报。
+    在主线程创建（开始计时queue_wait），之后只由该任务的工作线程使用。
+    """
+
+    def __init__(self, registry, kind):
+        self.registry = registry
+        self.kind = kind
+        self.job_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.spans = {}
+        self.counters = dict.fromkeys(JOB_COUNTERS, 0)
+        self._stage = 'queue_wait'
+        self._stage_start = time.perf_counter()
+        self._finished = False
+        self.log = None
+
+    def job_log(self):
+        """该任务的日志文件（第一次调用时创建）"""
+        if self.log is None:
+            self.log = JOB_LOGS.open(f"{self.kind}-{self.job_id}")
+        return self.log
+
+    def mark(self, stage):
+        """结束当前阶段，开始stage阶段（stage为None时只结束当前阶段）"""
+        now = time.perf_counter()
+        if self._stage is not None:
+            self.spans[self._stage] = self.spans.get(self._stage, 0.0) + now - self._stage_start
+        self._stage = stage
+        self._stage_start = now
+
+    def add(self, counter, value):
+        """累加计数器"""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def add_input(self, *paths):
+        """按输入文件大小累计读取字节数（FFmpeg会完整读取输入文件）"""
+        for path in paths:
+            try:
+                self.add('bytes_read', os.path.getsize(path))
+            except (OSError, TypeError):
+                pass
+
+    def observe_line(self, line):
+        """解析一行FFmpeg输出：第一条进度行出现时进入encode阶段，并记录已编码帧数"""
+        if 'time=' not in line and 'frame=' not in line:
+            return
+        if self._stage == 'first_frame':
+            self.mark('encode')
+        match = FRAME_RE.search(line)
+        if match:
+            self.counters['frames_encoded'] = int(match.group(1))
+
+    def finish(self, returncode, output_path=None):
+        """结束计时并上报，returncode为0表示成功"""
+        if self._finished:
+            return
+        self._finished = True
+        self.mark(None)
+        if output_path and returncode == 0:
+            try:
+                self.counters['bytes_written'] = os.path.getsize(output_path)
+            except OSError:
+                pass
+        status = 'ok' if returncode == 0 else 'failed'
+        if self.log is not None:
+            self.log.close()
+        self.registry.record(self, status)
+
+    def to_dict(self, status):
+        """转换为写入JSON Lines的记录"""
+        return {
+            'ts': datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'status': status,
+            'spans': {stage: round(seconds, 6) for stage, seconds in self.spans.items()},
+            'counters': dict(self.counters),
+            'log': self.log.path if self.log is not None else None,
+        }
+
+
+class MetricsRegistry:
+    """汇总所有任务的指标
+
+    每个任务结束时写一行到滚动的JSON Lines文件；同时在内存中累计，
+    可通过本地HTTP端点以Prometheus文本格式读取。
+    """
+
+    def __init__(self, path=METRICS_FILE, max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        self._writer = None
+        self._server = None
+        self.jobs_total = {}  # (kind, status) -> 次数
+        self.stage_seconds = {}  # (kind, stage) -> [总耗时, 次数]
+        self.counter_totals = {}  # (kind, counter) -> 累计值
+
+    def new_job(self, kind):
+        """创建一个任务的指标对象（在提交任务的线程中调用，开始计时排队时间）"""
+        return JobMetrics(self, kind)
+
+    def _get_writer(self):
+        """第一次写入时才创建指标文件"""
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            writer = logging.getLogger('video_tool.metrics.jsonl')
+            writer.setLevel(logging.INFO)
+            writer.propagate = False
+            writer.addHandler(handler)
+            self._writer = writer
+        return self._writer
+
+    def record(self, job, status):
+        """记录一个已结束的任务"""
+        entry = job.to_dict(status)
+        with self._lock:
+            key = (job.kind, status)
+            self.jobs_total[key] = self.jobs_total.get(key, 0) + 1
+            for stage, seconds in job.spans.items():
+                total = self.stage_seconds.setdefault((job.kind, stage), [0.0, 0])
+                total[0] += seconds
+                total[1] += 1
+            for counter, value in job.counters.items():
+                key = (job.kind, counter)
+                self.counter_totals[key] = self.counter_totals.get(key, 0) + value
+            try:
+                self._get_writer().info(json.dumps(entry, ensure_ascii=False))
+            except OSError as e:
+                metrics_log.warning(f"写入指标文件失败: {e}")
+        metrics_log.debug(f"任务指标: {entry}")
+
+    def render_prometheus(self):
+        """按Prometheus文本格式输出累计指标"""
+        lines = [
+            '# HELP video_tool_jobs_total Finished jobs by kind and status.',
+            '# TYPE video_tool_jobs_total counter',
+        ]
+        with self._lock:
+            for (kind, status), count in sorted(self.jobs_total.items()):
+                lines.append(f'video_tool_jobs_total{{kind="{kind}",status="{status}"}} {count}')
+
+            lines.append('# HELP video_tool_stage_seconds Time spent in each job stage.')
+            lines.append('# TYPE video_tool_stage_seconds summary')
+            for (kind, stage), (seconds, count) in sorted(self.stage_seconds.items()):
+                labels = f'kind="{kind}",stage="{stage}"'
+                lines.append(f'video_tool_stage_seconds_sum{{{labels}}} {seconds:.6f}')
+                lines.append(f'video_tool_stage_seconds_count{{{labels}}} {count}')
+
+            for counter in JOB_COUNTERS:
+                name = f'video_tool_{counter}_total'
+                lines.append(f'# TYPE {name} counter')
+                for (kind, key), value in sorted(self.counter_totals.items()):
+                    if key == counter:
+                        lines.append(f'{name}{{kind="{kind}"}} {value}')
+
+        spawns = sorted(SPAWN_STATS.snapshot().items())
+        lines.append('# HELP video_tool_spawn_seconds Time to create each subprocess.')
+        lines.append('# TYPE video_tool_spawn_seconds summary')
+        for program, (seconds, count, _) in spawns:
+            lines.append(f'video_tool_spawn_seconds_sum{{program="{program}"}} {seconds:.6f}')
+            lines.append(f'video_tool_spawn_seconds_count{{program="{program}"}} {count}')
+        lines.append('# TYPE video_tool_spawn_seconds_max gauge')
+        for program, (_, _, longest) in spawns:
+            lines.append(f'video_tool_spawn_seconds_max{{program="{program}"}} {longest:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """在本机启动/metrics端点（后台线程）"""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                metrics_log.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"指标端点: http://{host}:{port}/metrics")
+
+    def shutdown(self):
+        """关闭HTTP端点"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+# 支持的视频扩展名
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.ts', '.wmv')
+
+PROBE_CACHE_FILE = os.path.join(APP_CACHE_DIR, 'probe_cache.json')
+
+
+class ProbeCache:
+    """按文件身份（绝对路径、大小、修改时间）缓存探测结果
+
+    同一文件的不同用途的结果放在不同命名空间下（如'integrity:sampled'），
+    文件被修改后身份改变，旧结果自动失效。
+    """
+
+    def __init__(self, path=PROBE_CACHE_FILE, max_entries=2000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = None  # 第一次使用时才读取磁盘
+        self._dirty = False
+
+    @staticmethod
+    def identity(file_path):
+        """文件身份标识，文件不存在时返回None"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def get(self, namespace, file_path):
+        """读取缓存结果，没有时返回None"""
+        key = self.identity(file_path)
+        if key is None:
+            return None
+        with self._lock:
+            self._load()
+            return self._entries.get(key, {}).get(namespace)
+
+    def put(self, namespace, file_path, value):
+        """写入缓存结果（只写内存，save()时落盘）"""
+        key = self.identity(file_path)
+        if key is None:
+            return
+        with self._lock:
+            self._load()
+            entry = self._entries.pop(key, {})
+            entry[namespace] = value
+            self._entries[key] = entry  # 重新插入到末尾，最久未更新的条目排在最前
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._dirty = True
+
+    def save(self):
+        """把缓存写回磁盘"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"保存探测缓存失败: {e}")
+
+
+# 进度条拖动预览：先显示预先生成的缩略图拼图，停止拖动后再精确解码当前帧
+SPRITE_CACHE_DIR = os.path.join(APP_CACHE_DIR, 'sprites')
+SPRITE_CACHE_MAX = 200  # 最多保留的拼图数量
+SPRITE_TILES = 100
+SPRITE_COLUMNS = 10
+SPRITE_TILE_WIDTH = 240
+PREVIEW_DEBOUNCE_MS = 250
+
+
+def read_image(path):
+    """读取图片为BGR数组（支持中文路径），失败时返回None"""
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def build_sprite_cmd(video_path, output_path, duration, tiles=SPRITE_TILES,
+                     columns=SPRITE_COLUMNS, tile_width=SPRITE_TILE_WIDTH):
+    """一次解码生成等间隔缩略图拼图（只解码关键帧）"""
+    rows = -(-tiles // columns)
+    return [
+        FFMPEG_PATH, '-hide_banner', '-y',
+        '-skip_frame', 'nokey',
+        '-i', video_path,
+        '-an', '-sn',
+        '-vf', f'fps={tiles / duration:.6f},scale={tile_width}:-2,tile={columns}x{rows}',
+        '-frames:v', '1',
+        '-q:v', '5',
+        output_path
+    ]
+
+
+def build_frame_grab_cmd(video_path, seconds, output_path):
+    """精确解码指定时间的一帧"""
+    return [
+        FFMPEG_PATH, '-hide_banner', '-y',
+        '-ss', f'{seconds:.3f}',
+        '-i', video_path,
+        '-an', '-sn',
+        '-frames:v', '1',
+        '-q:v', '2',
+        output_path
+    ]
+
+
+class SpriteSheet:
+    """缩略图拼图：第i格是第i * duration / tiles秒附近的画面"""
+
+    def __init__(self, image, tiles, columns, duration):
+        self.image = image
+        self.tiles = tiles
+        self.columns = columns
+        self.duration = duration
+        rows = -(-tiles // columns)
+        self.tile_height = image.shape[0] // rows
+        self.tile_width = image.shape[1] // columns
+
+    @staticmethod
+    def cache_paths(video_path):
+        """拼图和说明文件的缓存路径（按文件身份），文件不存在时返回None"""
+        key = ProbeCache.identity(video_path)
+        if key is None:
+            return None
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+        base = os.path.join(SPRITE_CACHE_DIR, digest)
+        return base + '.jpg', base + '.json'
+
+    @classmethod
+    def load(cls, video_path):
+        """读取缓存的拼图，没有时返回None"""
+        paths = cls.cache_paths(video_path)
+        if paths is None or not os.path.exists(paths[1]):
+            return None
+        try:
+            with open(paths[1], 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        image = read_image(paths[0])
+        if image is None:
+            return None
+        return cls(image, meta['tiles'], meta['columns'], meta['duration'])
+
+    @classmethod
+    def generate(cls, video_path, duration):
+        """读取缓存或生成拼图（阻塞，工作线程中调用），失败时返回None"""
+        sheet = cls.load(video_path)
+        if sheet is not None:
+            preview_log.debug(f"使用缓存的缩略图: {video_path}")
+            return sheet
+        paths = cls.cache_paths(video_path)
+        if paths is None or duration <= 0:
+            return None
+        os.makedirs(SPRITE_CACHE_DIR, exist_ok=True)
+        image_path, meta_path = paths
+        tmp_path = image_path + '.tmp.jpg'
+        started = time.monotonic()
+        process = get_supervisor().spawn(build_sprite_cmd(video_path, tmp_path, duration))
+        if process.wait() != 0 or not os.path.exists(tmp_path):
+            preview_log.warning(f"生成缩略图失败: {process.stderr_text()[-300:]}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, image_path)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'tiles': SPRITE_TILES, 'columns': SPRITE_COLUMNS, 'duration': duration}, f)
+        preview_log.debug(f"生成缩略图 {video_path}: {time.monotonic() - started:.1f}秒")
+        cls.prune_cache()
+        return cls.load(video_path)
+
+    @staticmethod
+    def prune_cache():
+        """只保留最近生成的SPRITE_CACHE_MAX个拼图"""
+        try:
+            names = [name for name in os.listdir(SPRITE_CACHE_DIR) if name.endswith('.json')]
+        except OSError:
+            return
+        if len(names) <= SPRITE_CACHE_MAX:
+            return
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(SPRITE_CACHE_DIR, name)))
+        for name in names[:len(names) - SPRITE_CACHE_MAX]:
+            base = os.path.join(SPRITE_CACHE_DIR, name[:-5])
+            for path in (base + '.json', base + '.jpg'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def frame_at(self, seconds):
+        """离指定时间最近的缩略图（BGR数组）"""
+        index = int(seconds / self.duration * self.tiles) if self.duration > 0 else 0
+        index = max(0, min(self.tiles - 1, index))
+        row, column = divmod(index, self.columns)
+        y, x = row * self.tile_height, column * self.tile_width
+        return self.image[y:y + self.tile_height, x:x + self.tile_width]
+
+
+# 完整性检查级别，由浅入深：容器/索引、数据包解复用、抽样解码、完整解码
+INTEGRITY_TIERS = ('container', 'packets', 'sampled', 'full')
+INTEGRITY_TIER_NAMES = {
+    'container': '容器检查',
+    'packets': '数据包检查',
+    'sampled': '抽样解码',
+    'full': '完整解码',
+}
+
+
+def _run_check(cmd, timeout=None):
+    """运行检查命令，返回(返回码, 标准输出, 错误输出)"""
+    result = run_command(cmd, timeout=timeout)
+    return result.returncode, result.stdout, result.stderr.strip()
+
+
+def _check_container(file_path, report):
+    """容器/索引检查：ffprobe能解析文件头、流信息和时长"""
+    cmd = [FFPROBE_PATH, '-v', 'error',
+           '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name',
+           '-of', 'json', file_path]
+    returncode, stdout, stderr = _run_check(cmd, timeout=30)
+    if returncode != 0 or stderr:
+        report['errors'].append(stderr or f"ffprobe返回码: {returncode}")
         return False
-    except subprocess.TimeoutExpired:
-        logger.error(f"FFmpeg 响应超时: {FFMPEG_PATH}")
+
+    info = json.loads(stdout or '{}')
+    streams = info.get('streams', [])
+    if not streams:
+        report['errors'].append("文件中没有可识别的音视频流")
         return False
-    except Exception as e:
-        logger.error(f"检查 FFmpeg 时出错: {e}")
+    try:
+        report['duration'] = float(info.get('format', {}).get('duration', 0))
+    except ValueError:
+        report['duration'] = 0.0
+    codecs = ', '.join(f"{s.get('codec_type')}:{s.get('codec_name')}" for s in streams)
+    report['verified'].append(
+        f"容器({info.get('format', {}).get('format_name', '未知')})和索引可解析，{len(streams)}路流[{codecs}]，"
+        f"时长{report['duration']:.1f}秒")
+    return True
+
+
+def _check_packets(file_path, report):
+    """数据包检查：解复用读取全部数据包（流复制到空输出），不解码"""
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    timeout = 60 + size_mb / 20  # 按至少20MB/s的读取速度估算
+    returncode, _, stderr = _run_check(
+        [FFMPEG_PATH, '-v', 'error', '-i', file_path, '-map', '0', '-c', 'copy', '-f', 'null', '-'],
+        timeout=timeout)
+    if returncode != 0 or stderr:
+        report['errors'].append(stderr or f"解复用失败，返回码: {returncode}")
         return False
+    report['verified'].append(f"全部数据包可读取（{size_mb:.1f}MB，未解码）")
+    return True
+
 
-# 在程序启动时检查 FFmpeg
-if not check_ffmpeg():
-    error_msg = f"找不到 FFmpeg！\n\n请确保：\n1. 已安装 FFmpeg 并添加到系统PATH\n2. 或者将 FFmpeg 放在程序目录下\n\n当前查找路径: {FFMPEG_PATH}"
+def _check_sampled(file_path, report, samples):
+    """抽样解码：在均匀分布的samples个位置各解码1秒，多个位置并行"""
+    duration = report.get('duration', 0)
+    if duration <= 0:
+        report['errors'].append("无法获取时长，不能抽样解码")
+        return False
+    count = max(1, samples)
+    positions = [duration * (i + 0.5) / count for i in range(count)]
+
+    def decode_at(position):
+        # 超时（磁盘繁忙、网络共享卡顿等）不代表文件损坏，TimeoutExpired交给调用者，不写缓存
+        cmd = [FFMPEG_PATH, '-v', 'error', '-ss', f"{position:.3f}", '-i', file_path,
+               '-t', '1', '-f', 'null', '-']
+        returncode, _, stderr = _run_check(cmd, timeout=60)
+        return position, (returncode, stderr)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(count, os.cpu_count() or 2)) as pool:
+        for position, (returncode, stderr) in pool.map(decode_at, positions):
+            if returncode != 0 or stderr:
+                failed.append(f"{position:.1f}秒: {stderr or returncode}")
+    if failed:
+        report['errors'].extend(failed)
+        return False
+    report['verified'].append(f"{count}个抽样位置解码正常")
+    return True
+
+
+def _check_full(file_path, report):
+    """完整解码：解码全部音视频帧"""
+    # 超时按时长计算（最低按0.25倍速解码），不再按文件大小，避免长视频被中途终止
+    duration = report.get('duration', 0)
+    timeout = 60 + duration * 4 if duration > 0 else None
+    returncode, _, stderr = _run_check(
+        [FFMPEG_PATH, '-v', 'error', '-i', file_path, '-f', 'null', '-'], timeout=timeout)
+    if returncode != 0 or stderr:
+        report['errors'].append(stderr or f"解码失败，返回码: {returncode}")
+        return False
+    report['verified'].append("全部帧解码正常")
+    return True
+
+
+def check_video_integrity(file_path, tier='sampled', samples=8, cache=None):
+    """按级别检查视频文件完整性，返回检查报告
+
+    每一级都会先执行更浅的级别；报告中的verified列出实际验证过的内容。
+    传入cache（ProbeCache）时，同一文件已有的同级或更深级别的成功结果、
+    或更浅级别的失败结果都会直接复用。
+    """
+    depth = INTEGRITY_TIERS.index(tier)
+    if cache is not None:
+        for cached_tier in INTEGRITY_TIERS:
+            cached = cache.get(f'integrity:{cached_tier}', file_path)
+            if not cached:
+                continue
+            cached_depth = INTEGRITY_TIERS.index(cached_tier)
+            if (cached['ok'] and cached_depth >= depth) or (not cached['ok'] and cached_depth <= depth):
+                return dict(cached, cached=True)
+
+    report = {'file': file_path, 'tier': tier, 'ok': False, 'verified': [], 'errors': [],
+              'duration': 0.0, 'elapsed': 0.0, 'cached': False}
+    start = time.perf_counter()
+    completed = False  # 超时或找不到FFmpeg等情况不是文件本身的结论，不写缓存
     try:
-        messagebox.showerror("错误", error_msg)
-    except:
-        print(f"错误: {error_msg}")
-    sys.exit(1)
+        ok = _check_container(file_path, report)
+        if ok and depth >= INTEGRITY_TIERS.index('packets'):
+            ok = _check_packets(file_path, report)
+        if ok and depth >= INTEGRITY_TIERS.index('sampled'):
+            ok = _check_sampled(file_path, report, samples)
+        if ok and depth >= INTEGRITY_TIERS.index('full'):
+            ok = _check_full(file_path, report)
+        report['ok'] = ok
+        completed = True
+    except subprocess.TimeoutExpired as e:
+        report['errors'].append(f"检查超时（{e.timeout:.0f}秒）")
+    except Exception as e:
+        report['errors'].append(str(e))
+    report['elapsed'] = round(time.perf_counter() - start, 3)
 
-class VideoTrimmerPro:
-    def __init__(self):
-        # 强制刷新标准输出
-        sys.stdout.flush()
+    if cache is not None and completed:
+        cache.put(f'integrity:{tier}', file_path, report)
+    return report
 
-        self.root = TkinterDnD.Tk()
-        self.root.title("专业视频剪辑工具")
-        self.root.geometry("1280x720")
-        self.root.configure(bg="#333333")
 
-        # 添加窗口最大化设置
-        self.root.state('zoomed')  # Windows系统
-        # self.root.attributes('-zoomed', True)  # Linux系统
+def preflight_videos(paths, tier='packets', cache=None, max_workers=None, on_result=None):
+    """批量预检多个文件，返回报告列表（顺序与paths一致）
 
-        # 初始化变量
-        self.video_path = ""
-        self.cap = None
-        self.total_frames = 0
-        self.fps = 30
-        self.duration = 0.0
-        self.is_processing = False
-        self.preview_scale = 1.0
-        self.last_position = 0
-        self.preview_timer = None
-        self.is_high_res = False  # 是否高分辨率视频
-        self.preview_enabled = True  # 控制预览功能的开关
-        self.progress_var = tk.DoubleVar()  # 进度条变量
-        self.preview_lock = threading.Lock()  # 添加互斥锁
-        self.current_preview_task = None  # 当前预览任务的标识
-        self.is_preview_loading = False  # 添加预览加载状态标志
+    on_result(index, report)在每个文件检查完成时调用（在工作线程中）。
+    """
+    workers = max_workers or min(4, os.cpu_count() or 2)
+    reports = [None] * len(paths)
+
+    def check(index):
+        report = check_video_integrity(paths[index], tier=tier, cache=cache)
+        reports[index] = report
+        if on_result:
+            on_result(index, report)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(check, range(len(paths))))
+    if cache is not None:
+        cache.save()
+    return reports
+
+
+# 多片段导出时并行提取的最大进程数
+SEGMENT_WORKERS = 4
+
+
+def save_edit_list(path, source, segments):
+    """保存片段列表：扩展名为.edl时写mpv EDL格式，否则写JSON"""
+    if path.lower().endswith('.edl'):
+        source_bytes = len(source.encode('utf-8'))
+        lines = ["# mpv EDL v0"]
+        for start, end in segments:
+            # %长度%路径 的写法允许路径中包含逗号
+            lines.append(f"%{source_bytes}%{source},{start:.3f},{end - start:.3f}")
+        content = "\n".join(lines) + "\n"
+    else:
+        content = json.dumps({
+            'version': 1,
+            'source': source,
+            'segments': [{'start': round(start, 3), 'end': round(end, 3)} for start, end in segments],
+        }, ensure_ascii=False, indent=2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def load_edit_list(path):
+    """读取片段列表，返回(源文件路径, [(开始, 结束), ...])，支持JSON和mpv EDL"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    if text.lstrip().startswith('{'):
+        data = json.loads(text)
+        segments = [(float(s['start']), float(s['end'])) for s in data.get('segments', [])]
+        return data.get('source'), segments
+
+    source = None
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('%'):
+            # %长度%路径：长度按UTF-8字节数计算
+            mark = line.index('%', 1)
+            raw = line[mark + 1:].encode('utf-8')
+            size = int(line[1:mark])
+            file_name = raw[:size].decode('utf-8')
+            rest = raw[size:].decode('utf-8').lstrip(',')
+        else:
+            file_name, _, rest = line.partition(',')
+
+        start, length, positional = 0.0, None, []
+        for param in filter(None, rest.split(',')):
+            if '=' in param:
+                key, value = param.split('=', 1)
+                if key == 'start':
+                    start = float(value)
+                elif key == 'length':
+                    length = float(value)
+            else:
+                positional.append(float(param))
+        if positional:
+            start = positional[0]
+            if len(positional) > 1:
+                length = positional[1]
+        if length is None:
+            raise ValueError(f"EDL条目缺少长度: {line}")
+
+        if not os.path.isabs(file_name):
+            file_name = os.path.join(os.path.dirname(os.path.abspath(path)), file_name)
+        if source is None:
+            source = file_name
+        elif os.path.abspath(file_name) != os.path.abspath(source):
+            raise ValueError("暂不支持包含多个源文件的EDL")
+        segments.append((start, start + length))
+    return source, segments
+
+
+def build_segment_copy_cmd(source, start, end, output_path):
+    """流复制提取一个片段的FFmpeg命令"""
+    return [
+        FFMPEG_PATH,
+        '-y',
+        '-v', 'error',
+        '-ss', f'{start:.3f}',
+        '-i', source,
+        '-t', f'{end - start:.3f}',
+        '-map', '0',
+        '-c', 'copy',  # 复制所有流而不重新编码
+        '-avoid_negative_ts', 'make_zero',
+        output_path
+    ]
+
+
+def build_concat_copy_cmd(list_path, output_path):
+    """用concat分离器无重编码拼接的FFmpeg命令"""
+    return [
+        FFMPEG_PATH,
+        '-y',
+        '-v', 'error',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_path,
+        '-map', '0',
+        '-c', 'copy',
+        output_path
+    ]
+
+
+def write_concat_list(list_path, files):
+    """写concat分离器的文件列表（单引号需要转义）"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for file_path in files:
+            escaped = os.path.abspath(file_path).replace('\\', '/').replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+# 按大小/时长无损分割
+SPLIT_MODES = {
+    'size': '按大小(MB)',
+    'duration': '按时长(分钟)',
+}
+SPLIT_SIZE_MARGIN = 0.02  # 按大小分割时为容器开销预留的比例
+SPLIT_TIME_DELTA = 0.01  # 切分点与关键帧时间戳的容差（秒）
+
+
+def build_packet_scan_cmd(file_path):
+    """列出所有数据包的类型、时间、大小和关键帧标记（不解码）"""
+    return [FFPROBE_PATH, '-v', 'error',
+            '-show_entries', 'packet=codec_type,stream_index,pts_time,dts_time,size,flags',
+            '-of', 'csv=p=0', file_path]
+
+
+def parse_packet_line(line, scan):
+    """解析一行包信息，累加到scan：'bytes'总字节，'keyframes'为[(时间, 此前的累计字节)]，'start'/'end'最小/最大时间
+
+    时间是文件中的原始时间戳（含容器的起始偏移），切分前用packet_scan_keyframes换算。
+
+    只取第一个视频流的关键帧作为切分点；音频等其他流只计入字节数。
+    """
+    fields = line.strip().split(',')
+    if len(fields) < 6:
+        return
+    codec_type, stream_index, pts_time, dts_time, size, flags = fields[:6]
+    try:
+        size = int(size)
+    except ValueError:
+        return
+    time_text = pts_time if pts_time not in ('', 'N/A') else dts_time
+    try:
+        seconds = float(time_text)
+    except ValueError:
+        seconds = None
+    if codec_type == 'video':
+        if scan.get('video') is None:
+            scan['video'] = stream_index
+        if stream_index == scan['video'] and 'K' in flags and seconds is not None:
+            scan['keyframes'].append((seconds, scan['bytes']))
+    scan['bytes'] += size
+    if seconds is not None:
+        scan['end'] = max(scan['end'], seconds)
+        scan['start'] = seconds if scan['start'] is None else min(scan['start'], seconds)
+
+
+def new_packet_scan():
+    """parse_packet_line的初始状态"""
+    return {'bytes': 0, 'keyframes': [], 'start': None, 'end': 0.0, 'video': None}
+
+
+def packet_scan_span(scan):
+    """已扫描部分的时长（最大时间戳减去起始时间戳）"""
+    return scan['end'] - (scan['start'] or 0.0)
+
+
+def packet_scan_keyframes(scan):
+    """关键帧[(从文件开头算起的时间, 此前的累计字节)]
+
+    FFmpeg输出时去掉了输入的起始偏移，segment复用器的切分时间从0秒算起；
+    MPEG-TS等起始时间戳不为0的文件要减去最早的时间戳，否则切分位置会错开。
+    """
+    offset = scan['start'] or 0.0
+    return [(seconds - offset, value) for seconds, value in scan['keyframes']]
+
+
+def plan_split_points(keyframes, total, limit, margin=0.0):
+    """在关键帧处切分，使每段的累计量（字节数或秒数）不超过limit，返回切分时间
+
+    keyframes为[(时间, 该关键帧之前的累计量)]，total为全片累计量。尽量在不超过限制的
+    最后一个关键帧切分；单个GOP就超过限制时只能在下一个关键帧切分，该段会超出。
+    """
+    budget = limit * (1 - margin)
+    cuts = []
+    start = 0
+    candidate = None
+    for seconds, value in sorted(keyframes):
+        while value - start > budget:
+            point = candidate or (seconds, value)
+            cuts.append(point[0])
+            start = point[1]
+            candidate = None
+            if point == (seconds, value):
+                break
+        if value > start:
+            candidate = (seconds, value)
+    if total - start > budget and candidate:
+        cuts.append(candidate[0])
+    return cuts
+
+
+def build_split_cmd(source, cut_times, output_pattern, list_path):
+    """用segment复用器流复制，一次读入切出全部分段，并写出各段时间范围（CSV）"""
+    return [
+        FFMPEG_PATH,
+        '-y',
+        '-i', source,
+        '-map', '0',
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_times', ','.join(f'{t:.6f}' for t in cut_times),
+        '-segment_time_delta', str(SPLIT_TIME_DELTA),
+        '-segment_start_number', '1',
+        '-reset_timestamps', '1',
+        '-segment_list', list_path,
+        '-segment_list_type', 'csv',
+        output_pattern
+    ]
+
+
+def write_split_manifest(path, source, mode, limit, list_path):
+    """由segment复用器的CSV列表生成分段清单（JSON），返回分段列表"""
+    directory = os.path.dirname(os.path.abspath(list_path))
+    parts = []
+    with open(list_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            file_path = os.path.join(directory, row[0])
+            start, end = float(row[1]), float(row[2])
+            parts.append({
+                'file': os.path.basename(file_path),
+                'start': round(start, 6),
+                'end': round(end, 6),
+                'duration': round(end - start, 6),
+                'size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+            })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'source': source, 'mode': mode, 'limit': limit, 'parts': parts},
+                  f, ensure_ascii=False, indent=2)
+    return parts
+
+
+# 场景/黑场/静音检测参数；参数变化时缓存命名空间随之变化
+SCENE_THRESHOLD = 0.4  # 场景变化阈值（0-1）
+BLACK_MIN_DURATION = 0.5  # 最短黑场（秒）
+SILENCE_NOISE_DB = -35  # 静音判定音量（dB）
+SILENCE_MIN_DURATION = 1.0  # 最短静音（秒）
+ANALYSIS_NAMESPACE = f"events:{SCENE_THRESHOLD}:{BLACK_MIN_DURATION}:{SILENCE_NOISE_DB}:{SILENCE_MIN_DURATION}"
+
+SCENE_RE = re.compile(r'Parsed_showinfo.*pts_time:\s*([\d.]+)')
+BLACK_RE = re.compile(r'black_start:\s*([\d.]+)\s+black_end:\s*([\d.]+)')
+SILENCE_START_RE = re.compile(r'silence_start:\s*(-?[\d.]+)')
+SILENCE_END_RE = re.compile(r'silence_end:\s*([\d.]+)')
+
+
+def has_audio_stream(file_path):
+    """判断文件是否包含音频流"""
+    returncode, stdout, _ = _run_check(
+        [FFPROBE_PATH, '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index',
+         '-of', 'csv=p=0', file_path], timeout=30)
+    return returncode == 0 and bool(stdout.strip())
+
+
+def build_analysis_cmd(file_path, with_audio=True):
+    """一次解码同时做场景、黑场和静音检测的FFmpeg命令
+
+    视频只解码关键帧（-skip_frame nokey）并缩小到320宽后再检测，远快于实时。
+    检测结果由showinfo/blackdetect/silencedetect输出到stderr。
+    """
+    video_chain = (f"[0:v:0]scale=320:-2,blackdetect=d={BLACK_MIN_DURATION}:pix_th=0.10,"
+                   f"select='gt(scene,{SCENE_THRESHOLD})',showinfo[v]")
+    cmd = [FFMPEG_PATH, '-hide_banner', '-skip_frame', 'nokey', '-i', file_path]
+    if with_audio:
+        audio_chain = f"[0:a:0]silencedetect=n={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION}[a]"
+        cmd += ['-filter_complex', f"{video_chain};{audio_chain}", '-map', '[v]', '-map', '[a]']
+    else:
+        cmd += ['-filter_complex', video_chain, '-map', '[v]']
+    cmd += ['-f', 'null', '-']
+    return cmd
+
+
+def parse_detection_line(line, events, pending):
+    """解析一行检测输出，追加到events；pending保存尚未结束的静音起点"""
+    match = SCENE_RE.search(line)
+    if match:
+        events.append({'type': 'scene', 'start': float(match.group(1)), 'end': float(match.group(1))})
+        return
+    match = BLACK_RE.search(line)
+    if match:
+        events.append({'type': 'black', 'start': float(match.group(1)), 'end': float(match.group(2))})
+        return
+    match = SILENCE_START_RE.search(line)
+    if match:
+        pending['silence'] = max(0.0, float(match.group(1)))
+        return
+    match = SILENCE_END_RE.search(line)
+    if match and 'silence' in pending:
+        events.append({'type': 'silence', 'start': pending.pop('silence'), 'end': float(match.group(1))})
+
+
+def event_boundaries(events, duration, min_gap=1.0):
+    """由检测事件得到切分点：场景变化取变化时刻，黑场和静音取中点
+
+    位于片头/片尾的黑场和静音取其内侧端点；相距不到min_gap秒的切分点合并，
+    靠近首尾的切分点丢弃。
+    """
+    points = []
+    for event in events:
+        if event['type'] == 'scene':
+            points.append(event['start'])
+        elif event['start'] < min_gap:
+            points.append(event['end'])
+        elif duration > 0 and event['end'] > duration - min_gap:
+            points.append(event['start'])
+        else:
+            points.append((event['start'] + event['end']) / 2)
+    points.sort()
+    boundaries = []
+    for point in points:
+        if point < min_gap or (duration > 0 and point > duration - min_gap):
+            continue
+        if boundaries and point - boundaries[-1] < min_gap:
+            continue
+        boundaries.append(point)
+    return boundaries
+
+
+def event_snap_points(events):
+    """滑块可吸附的时间点：场景变化时刻以及黑场、静音的起止点"""
+    points = set()
+    for event in events:
+        points.add(event['start'])
+        points.add(event['end'])
+    return sorted(points)
+
+
+# ASS字幕颜色（格式为&HAABBGGRR&，BGR顺序）
+ASS_COLORS = {
+    'white': '&H00FFFFFF&',    # 白色 (BGR: FFFFFF)
+    'black': '&H00000000&',    # 黑色 (BGR: 000000)
+    'red': '&H000000FF&',      # 红色 (BGR: 0000FF)
+    'green': '&H0000FF00&',    # 绿色 (BGR: 00FF00)
+    'blue': '&H00FF0000&',     # 蓝色 (BGR: FF0000)
+    'yellow': '&H0000FFFF&',   # 黄色 (BGR: 00FFFF)
+    'cyan': '&H00FFFF00&',     # 青色 (BGR: FFFF00)
+    'magenta': '&H00FF00FF&',  # 洋红色 (BGR: FF00FF)
+    'orange': '&H0000A5FF&',   # 橙色 (BGR: 00A5FF)
+    'pink': '&H00C0C0FF&',     # 粉色 (BGR: C0C0FF)
+    'purple': '&H00800080&',   # 紫色 (BGR: 800080)
+    'gray': '&H00808080&'      # 灰色 (BGR: 808080)
+}
+
+# 视频转换各编码器的专用参数（空字符串表示软件编码）
+CONVERT_ENCODER_ARGS = {
+    '': ['-c:v', 'libx264', '-preset', 'medium'],                             # 软件编码，平衡速度和质量
+    'h264_nvenc_fast': ['-c:v', 'h264_nvenc', '-preset', 'p0', '-tune', 'llhq'],  # NVIDIA高性能模式
+    'h264_nvenc': ['-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq'],     # NVIDIA标准模式
+    'hevc_qsv': ['-c:v', 'hevc_qsv', '-preset', 'faster'],                    # Intel QSV编码器
+    'av1_amf': ['-c:v', 'av1_amf', '-quality', 'balanced'],                   # AMD AMF编码器
+}
+
+
+SUBTITLE_STREAM_PATTERN = re.compile(r'Stream #\d+:\d+(?:\[\w+\])?(?:\((\w+)\))?: Subtitle: (\w+)')
+VIDEO_SIZE_PATTERN = re.compile(r',\s*(\d{2,5})x(\d{2,5})\b')
+# 视频流的旋转：新版FFmpeg为Side data中的displaymatrix，旧版为Metadata中的rotate
+VIDEO_ROTATION_PATTERN = re.compile(r'displaymatrix: rotation of (-?\d+(?:\.\d+)?) degrees|^\s*rotate\s*:\s*(-?\d+)')
+
+
+def parse_media_info(ffmpeg_stderr):
+    """解析`ffmpeg -i`输出的时长、分辨率、帧率、码率、旋转角度、音频采样率和字幕流
+
+    width/height是编码尺寸；带旋转信息时rotation为角度，显示尺寸用display_size()。
+    """
+    video_info = {}
+    subtitle = None  # 最近一个字幕流，紧随其后的Metadata中读取标题
+    first_video = False  # 正在读第一个视频流的Metadata/Side data
+    for line in ffmpeg_stderr.split('\n'):
+        if subtitle is not None and line.strip().startswith('title') and ':' in line:
+            subtitle['title'] = line.split(':', 1)[1].strip()
+            continue
+        if first_video and 'rotation' not in video_info:
+            rotation = VIDEO_ROTATION_PATTERN.search(line)
+            if rotation:
+                video_info['rotation'] = float(rotation.group(1) or rotation.group(2))
+                continue
+        if 'Stream' in line:
+            subtitle = None
+            first_video = 'Video:' in line and 'width' not in video_info
+        if 'Duration:' in line:
+            # 解析时长
+            try:
+                duration = line.split('Duration: ')[1].split(',')[0].strip()
+                h, m, s = map(float, duration.split(':'))
+                video_info['duration'] = h * 3600 + m * 60 + s
+            except ValueError:
+                pass
+        elif 'Stream' in line and 'Video:' in line:
+            # 解析视频流信息
+            size = VIDEO_SIZE_PATTERN.search(line)
+            if size and 'width' not in video_info:
+                video_info['width'], video_info['height'] = int(size.group(1)), int(size.group(2))
+            if 'fps' in line:
+                fps = float(line.split('fps')[0].split(',')[-1].strip())
+                video_info['fps'] = fps
+            if 'kb/s' in line:
+                bitrate = float(line.split('kb/s')[0].split(',')[-1].strip())
+                video_info['bitrate'] = bitrate * 1000  # 转换为b/s
+        elif 'Stream' in line and 'Subtitle:' in line:
+            # 字幕流：语言和编码，软字幕追加/替换轨道时使用
+            match = SUBTITLE_STREAM_PATTERN.search(line)
+            if match:
+                subtitle = {
+                    'language': match.group(1) or 'und',
+                    'codec': match.group(2),
+                    'default': '(default)' in line,
+                    'title': '',
+                }
+                video_info.setdefault('subtitles', []).append(subtitle)
+        elif 'Stream' in line and 'Audio:' in line:
+            # 解析音频流信息
+            if 'Hz' in line:
+                sample_rate = int(line.split('Hz')[0].split(',')[-1].strip())
+                video_info['sample_rate'] = sample_rate
+            if 'kb/s' in line:
+                audio_bitrate = float(line.split('kb/s')[0].split(',')[-1].strip())
+                video_info['audio_bitrate'] = audio_bitrate * 1000  # 转换为b/s
+    return video_info
+
+
+def probe_media_info(file_path):
+    """运行`ffmpeg -i`获取视频信息（见parse_media_info）"""
+    _, _, stderr = _run_check([FFMPEG_PATH, '-hide_banner', '-i', file_path], timeout=30)
+    return parse_media_info(stderr)
+
+
+DURATION_TOLERANCE = 1.0  # 输出与预期时长允许的差（秒），容器和音频填充会带来少量差异
+
+
+def duration_matches(output_path, expected):
+    """输出文件的时长与预期一致（预期时长未知时不检查），用于识别被中途停止的输出"""
+    if not expected:
+        return True
+    try:
+        actual = probe_media_info(output_path).get('duration')
+    except Exception:
+        return False
+    return actual is not None and abs(actual - expected) <= max(DURATION_TOLERANCE, expected * 0.01)
+
+
+def build_denoise_cmd(input_path, output_path, noise_reduction, volume_boost=0.0, preserve_voice=True):
+    """声音处理命令：降噪和音量放大，视频流直接复制"""
+    # 音频滤镜
+    audio_filters = []
+
+    # 降噪滤镜
+    if noise_reduction > 0:
+        if preserve_voice:
+            # 使用highpass和lowpass保留人声频率范围
+            audio_filters.append("highpass=f=80,lowpass=f=8000")
+        audio_filters.append(f"anlmdn=s={noise_reduction}")
+
+    # 音量放大
+    if volume_boost > 0:
+        # 将dB转换为线性增益
+        gain = 10 ** (volume_boost / 20)
+        audio_filters.append(f"volume={gain}")
+
+    # 构建FFmpeg命令
+    ffmpeg_cmd = [
+        FFMPEG_PATH,
+        '-y',
+        '-i', input_path,
+        '-c:v', 'copy',  # 复制视频流
+    ]
+
+    if audio_filters:
+        ffmpeg_cmd.extend(['-af', ','.join(audio_filters)])
+    else:
+        ffmpeg_cmd.extend(['-c:a', 'copy'])  # 如果没有滤镜，复制音频流
+
+    ffmpeg_cmd.append(output_path)
+    return ffmpeg_cmd
+
+
+# 码率控制方式
+RATE_MODES = {
+    'bitrate': '指定码率',
+    'quality': '恒定质量',
+    'two_pass': '两遍编码',
+}
+DEFAULT_QUALITY = 23  # CRF/CQ/QP值，越小质量越高、文件越大
+TWO_PASS_CODECS = ('libx264', 'libx265')  # 支持-pass 1/2（复用第一遍统计）的编码器
+RATE_CONTROL_OPTIONS = ('-b:v', '-maxrate', '-bufsize', '-rc', '-cq', '-crf', '-qp')
+ESTIMATE_SAMPLES = 4
+ESTIMATE_SAMPLE_SECONDS = 5.0
+
+
+def video_codec_of(encoder_args):
+    """编码参数中的视频编码器名称"""
+    for option in ('-c:v', '-vcodec'):
+        if option in encoder_args:
+            return encoder_args[encoder_args.index(option) + 1]
+    return 'libx264'
+
+
+def quality_args(codec, quality):
+    """恒定质量参数：libx264/libx265用CRF，NVENC用CQ，QSV用ICQ，AMF和VAAPI用固定QP"""
+    q = str(int(quality))
+    if codec.endswith('_nvenc'):
+        return ['-rc', 'vbr', '-cq', q, '-b:v', '0']
+    if codec.endswith('_qsv'):
+        return ['-global_quality', q]
+    if codec.endswith('_amf'):
+        return ['-rc', 'cqp', '-qp_i', q, '-qp_p', q]
+    if codec.endswith('_vaapi'):
+        return ['-rc_mode', 'CQP', '-qp', q]
+    return ['-crf', q]
+
+
+def with_rate_control(encoder_args, rate_args):
+    """把编码参数中的码率控制项（见RATE_CONTROL_OPTIONS）换成rate_args"""
+    args = []
+    skip = False
+    for arg in encoder_args:
+        if skip:
+            skip = False
+        elif arg in RATE_CONTROL_OPTIONS:
+            skip = True
+        else:
+            args.append(arg)
+    return args + rate_args
+
+
+def with_input_window(cmd, start, length):
+    """只处理输入的[start, start+length)一段（用于抽样预估）"""
+    index = cmd.index('-i')
+    return [*cmd[:index], '-ss', f'{start:.3f}', '-t', f'{length:.3f}', *cmd[index:]]
+
+
+def build_convert_cmd(input_path, output_path, bitrate, encoder='', mode='bitrate', quality=DEFAULT_QUALITY,
+                      pass_num=0, passlog=None):
+    """视频转换命令：按指定编码器转换为MP4
+
+    mode为'bitrate'时使用比特率bitrate(k)；'quality'时按quality恒定质量；
+    'two_pass'时pass_num为1/2分别生成两遍编码的命令（第一遍只写统计文件passlog），
+    pass_num为0时NVENC使用内置的多遍编码，其他编码器退化为指定码率。
+    """
+    encoder_args = CONVERT_ENCODER_ARGS.get(encoder, ['-c:v', encoder])
+    codec = video_codec_of(encoder_args)
+    if mode == 'quality':
+        rate_args = quality_args(codec, quality)
+    elif mode == 'two_pass' and pass_num:
+        rate_args = ['-b:v', f'{bitrate}k', '-pass', str(pass_num), '-passlogfile', passlog]
+    elif mode == 'two_pass' and codec.endswith('_nvenc'):
+        rate_args = ['-b:v', f'{bitrate}k', '-multipass', 'fullres']
+    else:
+        rate_args = ['-b:v', f'{bitrate}k']  # 使用用户指定的比特率
+
+    if pass_num == 1:
+        # 第一遍只分析画面，不需要音频和输出文件
+        return [FFMPEG_PATH, '-y', '-i', input_path, *encoder_args, *rate_args, '-an', '-f', 'null', '-']
+    return [
+        FFMPEG_PATH,
+        '-y',  # 覆盖已存在的文件
+        '-i', input_path,  # 输入文件
+        *encoder_args,
+        *rate_args,
+        '-c:a', 'aac',  # 音频编码器
+        '-b:a', '128k',  # 音频比特率
+        '-movflags', '+faststart',  # 优化MP4文件以支持流式播放
+        '-f', 'mp4',  # 输出格式
+        output_path  # 输出文件
+    ]
+
+
+def build_convert_cmds(input_path, output_path, bitrate, encoder='', mode='bitrate', quality=DEFAULT_QUALITY):
+    """视频转换需要依次执行的命令列表和两遍编码的统计文件前缀（没有时为None）"""
+    codec = video_codec_of(CONVERT_ENCODER_ARGS.get(encoder, ['-c:v', encoder]))
+    if mode == 'two_pass' and codec in TWO_PASS_CODECS:
+        passlog = os.path.join(tempfile.gettempdir(), f'video_tool_2pass_{uuid.uuid4().hex[:8]}')
+        return [build_convert_cmd(input_path, output_path, bitrate, encoder, mode, quality, 1, passlog),
+                build_convert_cmd(input_path, output_path, bitrate, encoder, mode, quality, 2, passlog)], passlog
+    return [build_convert_cmd(input_path, output_path, bitrate, encoder, mode, quality)], None
+
+
+def remove_passlog(passlog):
+    """删除两遍编码的统计文件（passlog-0.log、passlog-0.log.mbtree等）"""
+    if not passlog:
+        return
+    directory, prefix = os.path.split(passlog)
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def estimate_encode(cmd, duration, passes=1, samples=ESTIMATE_SAMPLES, sample_seconds=ESTIMATE_SAMPLE_SECONDS):
+    """抽样预估：按最终参数编码几段均匀分布的短片段，按比例推算完整输出的大小和耗时
+
+    cmd为完整的（单遍）转换命令，返回{'size': 字节, 'seconds': 预计耗时, 'bitrate': k}。
+    """
+    if duration <= 0:
+        raise ValueError("无法获取视频时长")
+    sample_seconds = min(sample_seconds, duration / samples)
+    work_dir = tempfile.mkdtemp(prefix='video_tool_estimate_')
+    encoded_seconds = total_bytes = elapsed = 0.0
+    try:
+        for i in range(samples):
+            start = max(0.0, duration * (i + 0.5) / samples - sample_seconds / 2)
+            output_path = os.path.join(work_dir, f'sample_{i}.mp4')
+            sample_cmd = with_input_window(cmd[:-1] + [output_path], start, sample_seconds)
+            started = time.monotonic()
+            process = get_supervisor().spawn(sample_cmd)
+            if process.wait() != 0:
+                raise RuntimeError(process.stderr_text()[-300:] or f"FFmpeg返回码: {process.returncode}")
+            elapsed += time.monotonic() - started
+            encoded_seconds += sample_seconds
+            total_bytes += os.path.getsize(output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    scale = duration / encoded_seconds
+    return {
+        'size': total_bytes * scale,
+        # 两遍编码的第一遍只分析不输出，大约是第二遍耗时的一半
+        'seconds': elapsed * scale * (1.5 if passes > 1 else 1.0),
+        'bitrate': total_bytes * 8 / encoded_seconds / 1000,
+    }
+
+
+# 自适应码率阶梯：(高度, 视频码率k)，从高到低
+ABR_LADDER = ((1080, 5000), (720, 2800), (480, 1400), (360, 800))
+ABR_AUDIO_BITRATE = 128  # k
+PACKAGE_SEGMENT_SECONDS = 4
+PACKAGE_FORMATS = {
+    'hls': 'HLS',
+    'dash': 'DASH',
+    'both': 'HLS + DASH',
+}
+# 码率阶梯使用H.264（浏览器兼容），界面的GPU选项对应到同一厂商的H.264编码器
+ABR_ENCODER_FOR_CHOICE = {
+    'h264_nvenc': 'h264_nvenc',
+    'h264_nvenc_fast': 'h264_nvenc',
+    'hevc_qsv': 'h264_qsv',
+    'av1_amf': 'h264_amf',
+}
+ABR_ENCODER_ARGS = {
+    'libx264': ['-preset', 'medium', '-pix_fmt', 'yuv420p', '-sc_threshold', '0'],
+    'h264_nvenc': ['-preset', 'p4', '-forced-idr', '1'],
+    'h264_qsv': ['-preset', 'faster'],
+    'h264_amf': ['-quality', 'balanced'],
+}
+
+_verified_encoders = {}
+_verified_encoders_lock = threading.Lock()
+
+
+def verify_encoder(encoder):
+    """用测试画面实际编码几帧，确认编码器在本机可用（驱动、显卡都正常），结果缓存在内存中"""
+    with _verified_encoders_lock:
+        if encoder in _verified_encoders:
+            return _verified_encoders[encoder]
+    ok = False
+    if encoder in FFMPEG_INFO.get('encoders', []):
+        cmd = [FFMPEG_PATH, '-hide_banner', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=640x360:rate=25',
+               '-frames:v', '5', '-c:v', encoder, '-f', 'null', '-']
+        try:
+            ok = _run_check(cmd, timeout=20)[0] == 0
+        except (OSError, subprocess.TimeoutExpired):
+            ok = False
+    logger.info(f"编码器 {encoder} {'可用' if ok else '不可用'}")
+    with _verified_encoders_lock:
+        _verified_encoders[encoder] = ok
+    return ok
+
+
+def ladder_encoder(choice):
+    """码率阶梯使用的编码器：所选硬件编码器验证通过时使用，否则用libx264"""
+    encoder = ABR_ENCODER_FOR_CHOICE.get(choice)
+    if encoder and verify_encoder(encoder):
+        return encoder
+    return 'libx264'
+
+
+def parse_ladder(text):
+    """解析"1080:5000,720:2800"形式的码率阶梯，返回从高到低的[(高度, 码率k)]"""
+    ladder = []
+    for part in text.replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        height, _, bitrate = part.partition(':')
+        height, bitrate = int(height), int(bitrate)
+        if height <= 0 or bitrate <= 0:
+            raise ValueError(f"码率阶梯格式不正确: {part}")
+        ladder.append((height - height % 2, bitrate))
+    if not ladder:
+        raise ValueError("码率阶梯为空")
+    return sorted(set(ladder), reverse=True)
+
+
+def fit_ladder(ladder, source_height):
+    """去掉高于原视频的档位（不放大）；全部高于原视频时保留一档原始高度"""
+    if not source_height:
+        return list(ladder)
+    fitted = [(height, bitrate) for height, bitrate in ladder if height <= source_height]
+    if not fitted:
+        fitted = [(source_height - source_height % 2, ladder[-1][1])]
+    return fitted
+
+
+def probe_video_height(file_path):
+    """视频流的高度，获取失败时返回None"""
+    returncode, stdout, _ = _run_check(
+        [FFPROBE_PATH, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=height',
+         '-of', 'csv=p=0', file_path], timeout=30)
+    try:
+        return int(stdout.strip().splitlines()[0]) if returncode == 0 else None
+    except (ValueError, IndexError):
+        return None
+
+
+def build_package_cmd(input_path, output_dir, ladder, fmt='both', encoder='libx264', has_audio=True,
+                      segment_seconds=PACKAGE_SEGMENT_SECONDS):
+    """一次解码编码整套码率阶梯，并打包为fMP4分片的HLS/DASH，返回(命令, 清单路径)
+
+    解码后的画面用split分给各档位缩放，各档位在同一进程中同时编码；
+    所有档位按segment_seconds强制关键帧，保证分片边界对齐、播放器可以无缝切换。
+    """
+    count = len(ladder)
+    chains = [f"[0:v:0]split={count}{''.join(f'[s{i}]' for i in range(count))}"]
+    chains += [f'[s{i}]scale=-2:{height}[v{i}]' for i, (height, _) in enumerate(ladder)]
+    cmd = [FFMPEG_PATH, '-hide_banner', '-y', '-i', input_path, '-filter_complex', ';'.join(chains)]
+    for i in range(count):
+        cmd += ['-map', f'[v{i}]']
+    if has_audio:
+        cmd += ['-map', '0:a:0']
+    cmd += ['-c:v', encoder, *ABR_ENCODER_ARGS.get(encoder, [])]
+    for i, (_, bitrate) in enumerate(ladder):
+        cmd += [f'-b:v:{i}', f'{bitrate}k', f'-maxrate:v:{i}', f'{int(bitrate * 1.07)}k',
+                f'-bufsize:v:{i}', f'{int(bitrate * 1.5)}k']
+    cmd += ['-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})']
+    if has_audio:
+        cmd += ['-c:a', 'aac', '-b:a', f'{ABR_AUDIO_BITRATE}k', '-ac', '2']
+
+    if fmt == 'hls':
+        if has_audio:
+            stream_map = ' '.join([f'v:{i},agroup:audio' for i in range(count)] + ['a:0,agroup:audio'])
+        else:
+            stream_map = ' '.join(f'v:{i}' for i in range(count))
+        manifest = os.path.join(output_dir, 'master.m3u8')
+        cmd += [
+            '-f', 'hls',
+            '-hls_time', str(segment_seconds),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_type', 'fmp4',
+            '-hls_flags', 'independent_segments',
+            '-hls_fmp4_init_filename', 'init_%v.mp4',
+            '-master_pl_name', 'master.m3u8',
+            '-var_stream_map', stream_map,
+            # 主播放列表写在变体播放列表所在目录，所以各档位不分子目录
+            '-hls_segment_filename', os.path.join(output_dir, 'stream_%v_%05d.m4s'),
+            os.path.join(output_dir, 'stream_%v.m3u8'),
+        ]
+        return cmd, manifest
+
+    # DASH（可同时写出共用同一套分片的HLS播放列表）
+    adaptation_sets = 'id=0,streams=v id=1,streams=a' if has_audio else 'id=0,streams=v'
+    cmd += [
+        '-f', 'dash',
+        '-seg_duration', str(segment_seconds),
+        '-use_template', '1',
+        '-use_timeline', '1',
+        '-init_seg_name', 'init_$RepresentationID$.m4s',
+        '-media_seg_name', 'chunk_$RepresentationID$_$Number%05d$.m4s',
+        '-adaptation_sets', adaptation_sets,
+    ]
+    if fmt == 'both':
+        cmd += ['-hls_playlist', '1', '-hls_master_name', 'master.m3u8']
+    manifest = os.path.join(output_dir, 'manifest.mpd')
+    cmd.append(manifest)
+    return cmd, manifest
+
+
+SUBTITLE_FONT = 'Microsoft YaHei'  # 微软雅黑，烧录和预览使用同一字体（Arial没有中文字形）
+SUBTITLE_OVERLAY_CACHE_MAX = 256  # 内存中保留的字幕叠加图数量
+
+
+def subtitle_burn_filter(subtitle_path, font_size, font_color, position):
+    """硬字幕滤镜：font_color/position为英文名称"""
+    # 构建字幕滤镜，使用force_style参数设置样式
+    primary_color = ASS_COLORS.get(font_color, '&H00FFFFFF&')
+
+    # ASS的Alignment按小键盘排列：1-3底部，4-6中间，7-9顶部
+    position_map = {
+        'top': 'Alignment=8',      # 顶部居中
+        'middle': 'Alignment=5',   # 中间居中
+        'bottom': 'Alignment=2'    # 底部居中（默认）
+    }
+    alignment = position_map.get(position, 'Alignment=2')
+
+    # 构建force_style字符串 - 包含位置信息
+    force_style = f"FontName={SUBTITLE_FONT},FontSize={font_size},PrimaryColour={primary_color},{alignment}"
+
+    # 使用单引号包围路径和样式（FFmpeg滤镜标准语法）
+    return f"subtitles='{escape_filter_path(subtitle_path)}':force_style='{force_style}'"
+
+
+def escape_filter_path(path):
+    """滤镜参数中的文件路径转义
+
+    1. 路径中的冒号需要转义为\\:（FFmpeg滤镜语法要求）
+    2. 统一使用正斜杠作为路径分隔符
+    3. 路径中的单引号需要转义为\\'（使用单引号包围路径）
+    """
+    return path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+
+def build_subtitle_overlay_cmd(subtitle_path, seconds, width, height, font_size, font_color, position, output_path):
+    """渲染某一时刻的字幕为透明PNG：在原视频分辨率的透明画面上使用与烧录完全相同的滤镜和样式"""
+    return [
+        FFMPEG_PATH, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'color=c=black@0.0:s={width}x{height}:r=25,format=rgba',
+        '-vf', f"setpts=PTS+{seconds:.3f}/TB,{subtitle_burn_filter(subtitle_path, font_size, font_color, position)}:alpha=1",
+        '-frames:v', '1',
+        '-c:v', 'png',
+        '-f', 'image2',
+        output_path
+    ]
+
+
+class SubtitleOverlayCache:
+    """libass渲染的字幕叠加图，按(字幕条目, 样式, 分辨率)缓存
+
+    每条字幕只渲染一次，只保留有像素的区域，预览时缩放后叠加到画面上。
+    渲染在单独的线程中排队进行，完成后回调通知界面重绘。
+    """
+
+    def __init__(self, max_entries=SUBTITLE_OVERLAY_CACHE_MAX):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (x, y, RGBA图像)，没有可见像素时图像为None
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='overlay')
+
+    @staticmethod
+    def key(subtitle_path, cue, style, size):
+        """缓存键：字幕文件身份、条目时间和文字、样式(字号, 颜色, 位置)、原视频分辨率"""
+        return (ProbeCache.identity(subtitle_path), cue['start'], cue['end'], cue['text'], tuple(style), tuple(size))
+
+    def get(self, key):
+        """已渲染的叠加图，没有时返回None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry  # 重新插入到末尾，最久未使用的排在最前
+            return entry
+
+    def request(self, key, subtitle_path, cue, style, size, on_ready):
+        """排队渲染（已缓存或正在渲染时忽略），完成后在渲染线程中调用on_ready()"""
+        with self._lock:
+            if key in self._entries or key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._render, key, subtitle_path, cue, style, size, on_ready)
+
+    def _render(self, key, subtitle_path, cue, style, size, on_ready):
+        output_path = os.path.join(tempfile.gettempdir(), f"video_tool_overlay_{os.getpid()}.png")
+        entry = (0, 0, None)
+        try:
+            seconds = (cue['start'] + cue['end']) / 2
+            process = get_supervisor().spawn(
+                build_subtitle_overlay_cmd(subtitle_path, seconds, *size, *style, output_path), policy='interactive')
+            if process.wait() == 0:
+                with Image.open(output_path) as image:
+                    image = image.convert('RGBA')
+                    bbox = image.getchannel('A').getbbox()
+                    if bbox:
+                        entry = (bbox[0], bbox[1], image.crop(bbox))
+            else:
+                preview_log.warning(f"字幕叠加图渲染失败: {process.stderr_text()[-300:]}")
+        except Exception as e:
+            preview_log.warning(f"字幕叠加图渲染失败: {e}")
+        with self._lock:
+            self._pending.discard(key)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        on_ready()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def subtitle_encoder_args(encoder, bitrate, video_info, mode='bitrate', quality=DEFAULT_QUALITY):
+    """硬字幕的视频编码参数，bitrate单位为k；mode为'quality'时改为恒定质量"""
+    args = _subtitle_bitrate_args(encoder, bitrate, video_info)
+    if mode == 'quality':
+        return with_rate_control(args, quality_args(video_codec_of(args), quality))
+    return args
+
+
+def _subtitle_bitrate_args(encoder, bitrate, video_info):
+    """按码率编码的硬字幕视频参数"""
+    fps_arg = f"{video_info.get('fps', 30):.0f}"
+    maxrate = f"{int(bitrate) * 1.5:.0f}k"
+    bufsize = f"{int(bitrate) * 2:.0f}k"
+
+    if not encoder:
+        return [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-b:v', f'{bitrate}k',
+            '-r', fps_arg,
+        ]
+    if encoder == "h264_nvenc_fast":
+        # NVIDIA高性能模式：使用用户指定的比特率
+        return [
+            '-b:v', f'{bitrate}k',
+            '-r', '30',       # 固定帧率
+            '-vcodec', 'h264_nvenc'
+        ]
+    if encoder == "h264_nvenc":
+        # NVIDIA标准模式：使用复杂的参数
+        return [
+            '-c:v', encoder,
+            '-preset', 'p4',  # 使用p4预设平衡性能和质量
+            '-rc', 'vbr',     # 使用可变比特率
+            '-cq', '19',      # 设置质量参数
+            '-b:v', f'{bitrate}k',
+            '-maxrate', maxrate,  # 设置最大比特率
+            '-bufsize', bufsize,  # 设置缓冲区大小
+            '-r', fps_arg,
+            '-spatial-aq', '1',  # 启用空间AQ
+            '-temporal-aq', '1', # 启用时间AQ
+            '-rc-lookahead', '32'  # 设置前瞻帧数
+        ]
+    if encoder in ["hevc_qsv", "h264_qsv", "h265_qsv"]:
+        # Intel QSV编码器：只使用基本的比特率控制参数（QSV不支持preset等参数）
+        return [
+            '-c:v', encoder,
+            '-b:v', f'{bitrate}k',
+            '-r', fps_arg,
+        ]
+    if encoder in ["h264_amf", "av1_amf"]:
+        # AMD AMF编码器
+        return [
+            '-c:v', encoder,
+            '-quality', 'balanced',  # AMF质量选项
+            '-rc', 'vbr_peak',  # AMF比特率控制
+            '-b:v', f'{bitrate}k',
+            '-maxrate', maxrate,
+            '-bufsize', bufsize,
+            '-r', fps_arg,
+        ]
+    # VAAPI及其他编码器：使用通用参数
+    return [
+        '-c:v', encoder,
+        '-b:v', f'{bitrate}k',
+        '-maxrate', maxrate,
+        '-bufsize', bufsize,
+        '-r', fps_arg,
+    ]
+
+
+def subtitle_audio_args(video_info):
+    """硬字幕的音频参数：重新编码为AAC以确保兼容性"""
+    return [
+        '-c:a', 'aac',
+        '-b:a', f"{video_info.get('audio_bitrate', 192*1000):.0f}",
+        '-ar', f"{video_info.get('sample_rate', 48000)}",
+        '-ac', '2'
+    ]
+
+
+def build_subtitle_burn_cmd(video_path, subtitle_path, output_path, font_size, font_color, position,
+                            encoder, bitrate, video_info, rate_mode='bitrate', quality=DEFAULT_QUALITY,
+                            overlay=None):
+    """硬字幕命令（一次完成）：font_color/position为英文名称，bitrate单位为k，video_info见parse_media_info
+
+    overlay为prerender_subtitle_overlay的结果时叠加预渲染的字幕，不再逐帧渲染。
+    """
+    if overlay is None:
+        subtitle_filter = subtitle_burn_filter(subtitle_path, font_size, font_color, position)
+        print(f"使用带样式的字幕滤镜: {subtitle_filter}")
+        video_args = ['-vf', subtitle_filter]
+    else:
+        video_args = [*overlay_input_args(overlay), '-filter_complex', overlay_burn_graph(overlay),
+                      '-map', '[v]', '-map', '0:a:0?']
+
+    # 构建FFmpeg命令列表（不使用额外引号，subprocess会自动处理）
+    return [
+        FFMPEG_PATH,
+        '-y',
+        '-i', video_path,
+        *video_args,
+        *subtitle_encoder_args(encoder, bitrate, video_info, rate_mode, quality),
+        *subtitle_audio_args(video_info),
+        '-avoid_negative_ts', '1',
+        '-threads', '4',
+        '-max_muxing_queue_size', '1024',
+        # 添加参数确保中途退出时文件可播放
+        '-movflags', '+faststart',  # 将元数据移到文件开头
+        '-f', 'mp4',               # 强制使用MP4格式
+        '-reset_timestamps', '1',  # 重置时间戳
+        '-fflags', '+genpts',      # 生成时间戳
+        output_path
+    ]
+
+
+# 可续传编码：按固定时长分段编码，每段完成后记入清单
+RESUME_SEGMENT_SECONDS = 60
+MANIFEST_NAME = 'manifest.json'
+
+
+def build_subtitle_chunk_cmd(video_path, subtitle_path, output_path, start, duration, font_size, font_color,
+                             position, encoder, bitrate, video_info, rate_mode='bitrate', quality=DEFAULT_QUALITY,
+                             overlay=None):
+    """只编码[start, start+duration)一段视频（不含音频）的硬字幕命令
+
+    输入端定位后时间戳从0开始，滤镜前先加回start，字幕才能与原视频对齐。
+    叠加轨道不定位，overlay按时间戳取到对应的叠加图。
+    """
+    if overlay is None:
+        subtitle_filter = subtitle_burn_filter(subtitle_path, font_size, font_color, position)
+        video_args = ['-vf', f"setpts=PTS+{start:.3f}/TB,{subtitle_filter},setpts=PTS-STARTPTS"]
+    else:
+        graph = overlay_burn_graph(overlay, [f"setpts=PTS+{start:.3f}/TB"], ["setpts=PTS-STARTPTS"])
+        video_args = [*overlay_input_args(overlay), '-filter_complex', graph, '-map', '[v]']
+    return [
+        FFMPEG_PATH,
+        '-y',
+        '-ss', f'{start:.3f}',
+        '-i', video_path,
+        *video_args,
+        '-t', f'{duration:.3f}',  # 输出选项：放在所有输入之后，不能作用到叠加轨道的输入上
+        *subtitle_encoder_args(encoder, bitrate, video_info, rate_mode, quality),
+        '-an',
+        '-threads', '4',
+        '-max_muxing_queue_size', '1024',
+        '-f', 'matroska',  # 中途中断的分段直接丢弃，不需要可播放
+        output_path
+    ]
+
+
+def build_stitch_cmd(list_path, source, output_path, video_info):
+    """把各段视频流复制拼接，音频从原视频一次编码，避免分段边界的音频间隙"""
+    return [
+        FFMPEG_PATH,
+        '-y',
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_path,
+        '-i', source,
+        '-map', '0:v:0',
+        '-map', '1:a:0?',
+        '-c:v', 'copy',
+        *subtitle_audio_args(video_info),
+        '-shortest',
+        '-movflags', '+faststart',
+        '-f', 'mp4',
+        output_path
+    ]
+
+
+# 预渲染字幕：每种画面内容只用libass渲染一次，编码时用overlay叠加，没有字幕的区间不做叠加
+OVERLAY_FILTER_NAME = 'overlay@subs'
+OVERLAY_MERGE_GAP = 0.1  # 间隔小于此值（秒）的字幕区间合并为一个开启区间
+SUBTITLE_TIME_RE = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})[.,](\d{1,3})')
+# 随时间变化的效果（移动、淡入淡出、渐变、卡拉OK）不能用一幅静态图表示
+ANIMATED_SUBTITLE_RE = re.compile(r'\\(?:move|fade?|t)\s*\(|\\[kK][fo]?\d')
+SubtitleEvent = namedtuple('SubtitleEvent', ['start', 'end', 'before', 'after'])
+SubtitleOverlayTrack = namedtuple('SubtitleOverlayTrack',
+                                  ['list_path', 'commands_path', 'x', 'y', 'width', 'height', 'states', 'images'])
+
+
+def parse_subtitle_time(text):
+    """SRT（00:01:02,500）或ASS（0:01:02.50）时间转换为秒"""
+    match = SUBTITLE_TIME_RE.search(text)
+    if not match:
+        raise ValueError(f"无效的时间: {text}")
+    h, m, s, fraction = match.groups()
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(fraction) / 10 ** len(fraction)
+
+
+def format_subtitle_time(seconds, ass=False):
+    """秒转换为SRT或ASS时间"""
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    if ass:
+        return f"{h}:{m:02d}:{s:02d}.{ms // 10:02d}"
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def read_subtitle_events(subtitle_path):
+    """读取字幕条目，只解析时间，文字和标签原样保留，返回(是否ASS, ASS文件头各行, [SubtitleEvent])
+
+    ASS的SubtitleEvent中before为Layer，after为Style及之后的字段；SRT的after为文字（可多行）。
+    ASS文件头中None的位置是[Events]的Format行之后，重写时条目插在这里。
+    """
+    with open(subtitle_path, 'r', encoding='utf-8-sig') as f:
+        content = f.read().replace('\r\n', '\n')
+    is_ass = os.path.splitext(subtitle_path)[1].lower() in ('.ass', '.ssa') or '[Events]' in content
+    events = []
+    if is_ass:
+        header, in_events = [], False
+        for line in content.split('\n'):
+            if line.startswith('Dialogue:'):
+                fields = line[len('Dialogue:'):].split(',', 3)
+                try:
+                    events.append(SubtitleEvent(parse_subtitle_time(fields[1]), parse_subtitle_time(fields[2]),
+                                                fields[0].strip(), fields[3]))
+                except (ValueError, IndexError):
+                    continue
+            elif not line.startswith('Comment:'):
+                header.append(line)
+                if line.strip().startswith('['):
+                    in_events = line.strip().lower() == '[events]'
+                elif in_events and line.startswith('Format:'):
+                    header.append(None)
+        if None not in header:
+            header += ['[Events]', 'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text',
+                       None]
+        return True, header, events
+
+    for block in re.split(r'\n\s*\n', content.strip()):
+        lines = block.strip().split('\n')
+        for index, line in enumerate(lines):  # 序号行可能缺失
+            if '-->' in line:
+                start, end = line.split('-->', 1)
+                try:
+                    events.append(SubtitleEvent(parse_subtitle_time(start), parse_subtitle_time(end),
+                                                '', '\n'.join(lines[index + 1:])))
+                except ValueError:
+                    pass
+                break
+    return False, [], events
+
+
+def is_animated_event(event, is_ass):
+    """条目是否带随时间变化的效果（ASS的Effect字段或移动、淡入淡出等标签）"""
+    if is_ass:
+        fields = event.after.split(',', 6)
+        if len(fields) == 7 and fields[5].strip():
+            return True
+    return bool(ANIMATED_SUBTITLE_RE.search(event.after))
+
+
+def subtitle_states(events):
+    """把字幕时间轴切成画面内容不变的区间，返回[(开始, 结束, 同时显示的条目序号)]，不含没有字幕的区间"""
+    boundaries = sorted({t for event in events if event.end > event.start for t in (event.start, event.end)})
+    order = sorted((i for i, event in enumerate(events) if event.end > event.start), key=lambda i: events[i].start)
+    active, states, position = set(), [], 0
+    for start, end in zip(boundaries, boundaries[1:]):
+        while position < len(order) and events[order[position]].start <= start:
+            active.add(order[position])
+            position += 1
+        active = {i for i in active if events[i].end > start}
+        if active:
+            states.append((start, end, tuple(sorted(active))))
+    return states
+
+
+def write_state_subtitles(path, is_ass, header, groups):
+    """第k种画面内容的条目改到[k, k+1)秒写出，一次渲染就能得到所有叠加图"""
+    with open(path, 'w', encoding='utf-8') as f:
+        if is_ass:
+            for line in header:
+                if line is not None:
+                    f.write(line + '\n')
+                    continue
+                for k, group in enumerate(groups):
+                    start, end = format_subtitle_time(k, ass=True), format_subtitle_time(k + 1, ass=True)
+                    for event in group:
+                        f.write(f"Dialogue: {event.before},{start},{end},{event.after}\n")
+            return
+        number = 1
+        for k, group in enumerate(groups):
+            for event in group:
+                f.write(f"{number}\n{format_subtitle_time(k)} --> {format_subtitle_time(k + 1)}\n{event.after}\n\n")
+                number += 1
+
+
+def build_overlay_render_cmd(subtitle_path, count, width, height, font_size, font_color, position, pattern):
+    """在透明画面上逐秒渲染count幅字幕图（取每秒的中点），样式与烧录相同"""
+    return [
+        FFMPEG_PATH, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'color=c=black@0.0:s={width}x{height}:r=1,format=rgba',
+        '-vf', f"settb=1/1000,setpts=PTS+500,{subtitle_burn_filter(subtitle_path, font_size, font_color, position)}"
+               f":alpha=1",
+        '-frames:v', str(count),
+        '-c:v', 'png', '-compression_level', '1',  # 中间文件，压缩快比压缩率重要
+        '-start_number', '0',
+        '-f', 'image2',
+        pattern
+    ]
+
+
+def display_size(video_info):
+    """视频的显示尺寸(宽, 高)：旋转±90度时交换编码尺寸的宽高（FFmpeg默认自动旋转），未知时返回(None, None)"""
+    width, height = video_info.get('width'), video_info.get('height')
+    if width and height and round(video_info.get('rotation', 0)) % 180 == 90:
+        return height, width
+    return width, height
+
+
+def prerender_subtitle_overlay(subtitle_path, width, height, font_size, font_color, position, work_dir):
+    """预渲染字幕叠加轨道，返回SubtitleOverlayTrack；含动画效果、没有可见字幕或分辨率未知时返回None
+
+    同时显示的条目组合相同的区间只按输出分辨率渲染一次，所有叠加图裁剪到字幕出现过的共同区域，
+    由concat列表按区间时长重复；编码时sendcmd只在有字幕的区间开启overlay。失败时抛出RuntimeError。
+    """
+    if not width or not height:
+        return None
+    is_ass, header, events = read_subtitle_events(subtitle_path)
+    if any(is_animated_event(event, is_ass) for event in events):
+        return None
+    states = subtitle_states(events)
+    if not states:
+        return None
+
+    # 画面内容相同（条目的样式和文字都相同）的区间共用一幅图
+    renders, groups, timeline = {}, [], []
+    for start, end, indices in states:
+        key = tuple(events[i][2:] for i in indices)
+        if key not in renders:
+            renders[key] = len(groups)
+            groups.append([events[i] for i in indices])
+        timeline.append((start, end, renders[key]))
+
+    os.makedirs(work_dir, exist_ok=True)
+    retimed_path = os.path.join(work_dir, 'states.ass' if is_ass else 'states.srt')
+    write_state_subtitles(retimed_path, is_ass, header, groups)
+    frame_pattern = os.path.join(work_dir, 'full_%05d.png')
+    result = run_command(build_overlay_render_cmd(retimed_path, len(groups), width, height,
+                                                  font_size, font_color, position, frame_pattern))
+    if result.returncode != 0:
+        raise RuntimeError(f"预渲染字幕失败: {result.stderr[-300:]}")
+
+    # 每幅图只保留有像素的部分，再放到共同区域中（x、y和尺寸取偶数，叠加到YUV420画面时不错位）
+    crops = []
+    for k in range(len(groups)):
+        path = frame_pattern % k
+        with Image.open(path) as image:
+            image = image.convert('RGBA')
+            bbox = image.getchannel('A').getbbox()
+            crops.append((bbox, image.crop(bbox)) if bbox else None)
+        os.remove(path)
+    boxes = [crop[0] for crop in crops if crop]
+    if not boxes:
+        return None
+    x = min(box[0] for box in boxes) // 2 * 2
+    y = min(box[1] for box in boxes) // 2 * 2
+    band_width = min(width - x, (max(box[2] for box in boxes) - x + 1) // 2 * 2)
+    band_height = min(height - y, (max(box[3] for box in boxes) - y + 1) // 2 * 2)
+    Image.new('RGBA', (band_width, band_height)).save(os.path.join(work_dir, 'blank.png'))
+    for k, crop in enumerate(crops):
+        band = Image.new('RGBA', (band_width, band_height))
+        if crop:
+            band.paste(crop[1], (crop[0][0] - x, crop[0][1] - y))
+        band.save(os.path.join(work_dir, f'cue_{k:05d}.png'))
+
+    # 时间取整到毫秒后再求时长，长片中不会累积误差
+    list_path = os.path.join(work_dir, 'overlay.ffconcat')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        cursor = 0
+        for start, end, k in timeline:
+            start_ms, end_ms = int(round(start * 1000)), int(round(end * 1000))
+            if start_ms > cursor:
+                f.write(f"file blank.png\nduration {(start_ms - cursor) / 1000:.3f}\n")
+            f.write(f"file cue_{k:05d}.png\nduration {(end_ms - start_ms) / 1000:.3f}\n")
+            cursor = end_ms
+        f.write("file blank.png\nduration 1.000\nfile blank.png\n")  # 最后一项的时长会被忽略
+
+    windows = []
+    for start, end, _ in timeline:
+        if windows and start - windows[-1][1] < OVERLAY_MERGE_GAP:
+            windows[-1][1] = end
+        else:
+            windows.append([start, end])
+    commands_path = os.path.join(work_dir, 'overlay.cmd')
+    with open(commands_path, 'w', encoding='utf-8') as f:
+        for start, end in windows:
+            f.write(f"{start:.3f}-{end:.3f} [enter] {OVERLAY_FILTER_NAME} enable 1, "
+                    f"[leave] {OVERLAY_FILTER_NAME} enable 0;\n")
+
+    return SubtitleOverlayTrack(list_path, commands_path, x, y, band_width, band_height, len(timeline), len(groups))
+
+
+def overlay_input_args(overlay):
+    """预渲染叠加轨道的输入参数（作为第二个输入）"""
+    return ['-f', 'concat', '-safe', '0', '-i', overlay.list_path]
+
+
+def overlay_burn_graph(overlay, main_filters=(), post_filters=()):
+    """叠加预渲染字幕的滤镜图：[0:v]为视频，[1:v]为叠加轨道，输出[v]
+
+    overlay初始关闭，由sendcmd按字幕区间开关；关闭时直接输出原画面，不做混合。
+    """
+    main = ','.join([*main_filters, f"sendcmd=f='{escape_filter_path(overlay.commands_path)}'"])
+    post = ''.join(f',{name}' for name in post_filters)
+    return (f"[0:v]{main}[main];[main][1:v]{OVERLAY_FILTER_NAME}=x={overlay.x}:y={overlay.y}"
+            f":eof_action=pass:enable=0{post}[v]")
+
+
+# 软字幕轨道语言（ISO 639-2代码: 显示名称）
+SUBTITLE_LANGUAGES = {
+    'chi': '中文',
+    'eng': '英文',
+    'jpn': '日文',
+    'kor': '韩文',
+    'fre': '法文',
+    'ger': '德文',
+    'spa': '西班牙文',
+    'rus': '俄文',
+    'und': '未指定',
+}
+# 字幕文件名中的语言后缀（如 EP01.en.srt）
+SUBTITLE_LANGUAGE_SUFFIXES = {
+    'zh': 'chi', 'chs': 'chi', 'cht': 'chi', 'sc': 'chi', 'tc': 'chi', 'chi': 'chi', 'zho': 'chi',
+    'en': 'eng', 'eng': 'eng',
+    'ja': 'jpn', 'jp': 'jpn', 'jpn': 'jpn',
+    'ko': 'kor', 'kor': 'kor',
+    'fr': 'fre', 'fre': 'fre', 'fra': 'fre',
+    'de': 'ger', 'ger': 'ger', 'deu': 'ger',
+    'es': 'spa', 'spa': 'spa',
+    'ru': 'rus', 'rus': 'rus',
+}
+# 输出文件中已有字幕轨道的处理方式
+EXISTING_SUBTITLE_MODES = {
+    'keep': '保留',
+    'replace': '替换同语言',
+    'drop': '全部移除',
+}
+
+# path为字幕文件（原视频中的轨道为None，stream是其在原视频字幕流中的序号），style为(字号, 颜色, 位置)
+SubtitleTrack = namedtuple('SubtitleTrack', ['path', 'language', 'title', 'default', 'style', 'stream'],
+                           defaults=(None,))
+EDIT_SNAPSHOT_BYTES = 4 * 1024 * 1024  # 原地修改前后比较的文件头部大小
+
+
+def guess_subtitle_language(subtitle_path):
+    """从文件名后缀猜测字幕语言，猜不到时按中文处理"""
+    stem = os.path.splitext(os.path.basename(subtitle_path))[0]
+    suffix = stem.rsplit('.', 1)[-1].casefold() if '.' in stem else ''
+    return SUBTITLE_LANGUAGE_SUFFIXES.get(suffix, 'chi')
+
+
+def soft_output_tracks(tracks, existing_mode='keep'):
+    """按existing_mode筛选原视频中的轨道，返回写入输出的轨道（原有轨道在前）"""
+    added = [track for track in tracks if track.stream is None]
+    languages = {track.language for track in added}
+    if existing_mode == 'drop':
+        kept = []
+    elif existing_mode == 'replace':
+        kept = [track for track in tracks if track.stream is not None and track.language not in languages]
+    else:
+        kept = [track for track in tracks if track.stream is not None]
+    return kept + added
+
+
+def build_soft_subtitle_cmd(video_path, tracks, output_path, existing_mode='keep'):
+    """软字幕封装命令：所有字幕轨道一次流复制写入，视频和音频只读一遍
+
+    tracks为[SubtitleTrack]：新轨道的path是已生成的带样式ASS文件，原视频中的
+    轨道（stream不为None）按existing_mode保留、替换同语言或移除，语言、标题和
+    默认标记按轨道设置重写。
+    """
+    is_mp4 = os.path.splitext(output_path)[1].lower() == '.mp4'
+    output_tracks = soft_output_tracks(tracks, existing_mode)
+    added = [track for track in output_tracks if track.stream is None]
+
+    cmd = [FFMPEG_PATH, '-y', '-i', video_path]
+    for track in added:
+        cmd.extend(['-i', track.path])
+    cmd.extend(['-map', '0:v', '-map', '0:a?'])
+    for track in output_tracks:
+        if track.stream is not None:
+            cmd.extend(['-map', f'0:s:{track.stream}'])
+    for n in range(len(added)):
+        cmd.extend(['-map', f'{n + 1}:0'])
+    if not is_mp4:
+        cmd.extend(['-map', '0:t?'])  # MKV附件（字体等）
+
+    # 视频、音频和保留的字幕原样复制；MP4只能放mov_text（不保留样式）
+    cmd.extend(['-c', 'copy'])
+    if is_mp4:
+        cmd.extend(['-c:s', 'mov_text'])
+
+    for out_index, track in enumerate(output_tracks):
+        cmd.extend([f'-metadata:s:s:{out_index}', f'language={track.language}'])
+        if track.title:
+            cmd.extend([f'-metadata:s:s:{out_index}', f'title={track.title}'])
+        cmd.extend([f'-disposition:s:{out_index}', 'default' if track.default else '0'])
+
+    cmd.extend(['-f', 'mp4' if is_mp4 else 'matroska', output_path])
+    return cmd
+
+
+def soft_subtitle_edit_mode(video_path, output_path, tracks, existing, existing_mode='keep'):
+    """选择修改方式：'inplace'用mkvpropedit只改MKV的轨道信息，'remux'流复制重新封装
+
+    只有输出到原MKV文件、没有新增或移除轨道、且找到mkvpropedit时才能原地修改；
+    增删轨道需要重写Tracks之后的全部数据，MP4的轨道信息在moov中，都走重新封装。
+    """
+    if not MKVPROPEDIT_PATH or os.path.splitext(video_path)[1].lower() != '.mkv':
+        return 'remux'
+    if os.path.normcase(os.path.abspath(output_path)) != os.path.normcase(os.path.abspath(video_path)):
+        return 'remux'
+    output_tracks = soft_output_tracks(tracks, existing_mode)
+    if [track.stream for track in output_tracks] != list(range(len(existing))):
+        return 'remux'
+    return 'inplace'
+
+
+def build_mkvpropedit_cmd(video_path, tracks):
+    """原地修改MKV字幕轨道的语言、标题和默认标记（只重写Tracks元素）"""
+    cmd = [MKVPROPEDIT_PATH, video_path]
+    for track in tracks:
+        cmd.extend(['--edit', f'track:s{track.stream + 1}',
+                    '--set', f'language={track.language}',
+                    '--set', f'flag-default={int(bool(track.default))}'])
+        if track.title:
+            cmd.extend(['--set', f'name={track.title}'])
+        else:
+            cmd.extend(['--delete', 'name'])
+    return cmd
+
+
+def read_file_head(file_path, size=EDIT_SNAPSHOT_BYTES):
+    """读取文件头部，用于原地修改前后比较"""
+    with open(file_path, 'rb') as f:
+        return f.read(size)
+
+
+def edited_bytes(file_path, head_before, size_before):
+    """原地修改写入的字节数：文件头部变化的字节加上末尾追加的部分
+
+    mkvpropedit改写的元素放得下时原位覆盖，放不下时旧位置改为Void、新元素写到文件末尾。
+    """
+    head_after = read_file_head(file_path, len(head_before))
+    changed = 0
+    block = 4096
+    for offset in range(0, len(head_before), block):
+        before, after = head_before[offset:offset + block], head_after[offset:offset + block]
+        if before != after:
+            changed += sum(a != b for a, b in zip(before, after)) + abs(len(before) - len(after))
+    return changed + max(0, os.path.getsize(file_path) - size_before)
+
+
+class EncodeManifest:
+    """分段编码清单，保存在输出文件旁的"<输出文件>.parts"目录中
+
+    记录源文件身份、编码设置和每一段是否完成；程序崩溃或暂停后，
+    源文件和设置都没变时从第一个未完成的段继续。
+    """
+
+    def __init__(self, output_path, data):
+        self.output_path = output_path
+        self.parts_dir = output_path + '.parts'
+        self.data = data
+
+    @classmethod
+    def create(cls, output_path, source, settings, duration, segment_seconds=RESUME_SEGMENT_SECONDS):
+        """新建清单（会清除同一输出文件的旧分段）"""
+        manifest = cls(output_path, {
+            'version': 1,
+            'source': os.path.abspath(source),
+            'source_identity': ProbeCache.identity(source),
+            'settings': settings,
+            'duration': duration,
+            'segments': [],
+        })
+        shutil.rmtree(manifest.parts_dir, ignore_errors=True)
+        os.makedirs(manifest.parts_dir)
+        start, index = 0.0, 0
+        while start < duration - 0.001:
+            length = min(segment_seconds, duration - start)
+            manifest.data['segments'].append({
+                'index': index,
+                'start': round(start, 3),
+                'duration': round(length, 3),
+                'file': f"seg_{index:05d}.mkv",
+                'done': False,
+            })
+            start += segment_seconds
+            index += 1
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, output_path):
+        """读取已有清单，没有或已损坏时返回None"""
+        try:
+            with open(os.path.join(output_path + '.parts', MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != 1 or not data.get('segments'):
+            return None
+        return cls(output_path, data)
+
+    def matches(self, source, settings):
+        """源文件和编码设置都与清单一致时才能续传"""
+        return (self.data['source_identity'] == ProbeCache.identity(source)
+                and self.data['settings'] == settings)
+
+    def segment_path(self, segment):
+        return os.path.join(self.parts_dir, segment['file'])
+
+    def pending(self):
+        """未完成的段（已标记完成但文件丢失的也算未完成）"""
+        result = []
+        for segment in self.data['segments']:
+            path = self.segment_path(segment)
+            if not (segment['done'] and os.path.exists(path) and os.path.getsize(path) > 0):
+                result.append(segment)
+        return result
+
+    def done_count(self):
+        return len(self.data['segments']) - len(self.pending())
+
+    def done_duration(self):
+        """已完成段的总时长（秒）"""
+        pending = {segment['index'] for segment in self.pending()}
+        return sum(segment['duration'] for segment in self.data['segments'] if segment['index'] not in pending)
+
+    def mark_done(self, segment):
+        segment['done'] = True
+        self.save()
+
+    def save(self):
+        """先写临时文件再替换，崩溃时清单不会写坏"""
+        path = os.path.join(self.parts_dir, MANIFEST_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def write_concat_list(self):
+        """写出所有段的concat列表，返回列表路径"""
+        list_path = os.path.join(self.parts_dir, 'concat.txt')
+        write_concat_list(list_path, [self.segment_path(segment) for segment in self.data['segments']])
+        return list_path
+
+    def discard(self):
+        """删除分段目录"""
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+
+
+# 流水线步骤，按此顺序执行；预设中没有的步骤跳过
+PIPELINE_STEPS = ('trim', 'denoise', 'subtitle', 'convert')
+PIPELINE_STEP_NAMES = {
+    'trim': '剪切',
+    'denoise': '声音处理',
+    'subtitle': '硬字幕',
+    'convert': '视频转换',
+}
+SUBTITLE_EXTENSIONS = ('.srt', '.ass')
+WATCH_STATE_FILE = os.path.join(APP_CACHE_DIR, 'watch_state.db')
+FINGERPRINT_CHUNK = 1024 * 1024  # 指纹取样块大小（1MB）
+
+
+def save_pipeline_preset(path, preset):
+    """保存流水线预设（JSON）
+
+    预设格式：{"steps": {步骤名: 参数}, "output_suffix": "_processed", "piped": false}，
+    颜色、位置、编码器等使用英文值，与各命令构建函数的参数一致；piped为true时
+    各步骤经管道连接，不写中间文件。
+    """
+    steps = {name: preset['steps'][name] for name in PIPELINE_STEPS if name in preset.get('steps', {})}
+    data = {
+        'version': 1,
+        'steps': steps,
+        'output_suffix': preset.get('output_suffix', '_processed'),
+        'piped': bool(preset.get('piped', False)),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_pipeline_preset(path):
+    """读取流水线预设，格式错误时抛出ValueError"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    steps = data.get('steps')
+    if not isinstance(steps, dict) or not steps:
+        raise ValueError("预设中没有任何处理步骤")
+    unknown = set(steps) - set(PIPELINE_STEPS)
+    if unknown:
+        raise ValueError(f"未知的处理步骤: {', '.join(sorted(unknown))}")
+    return {'steps': steps, 'output_suffix': data.get('output_suffix', '_processed'),
+            'piped': bool(data.get('piped', False))}
+
+
+def find_sidecar_subtitle(source):
+    """查找与视频同名的字幕文件（.srt/.ass），没有时返回None"""
+    base = os.path.splitext(source)[0]
+    for ext in SUBTITLE_EXTENSIONS:
+        if os.path.isfile(base + ext):
+            return base + ext
+    return None
+
+
+_worker_cpus = None  # 流水线工作进程被限制到的CPU
+
+
+def _init_pipeline_worker():
+    """流水线进程池的初始化：工作进程按后台策略运行，启动的FFmpeg继承其优先级
+
+    终端的Ctrl+C只交给主进程：工作进程忽略SIGINT，并脱离终端的前台进程组（FFmpeg会自己
+    重新设置SIGINT处理，只忽略还不够），正在处理的文件由主进程等待其正常完成。
+    """
+    global _worker_cpus
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if sys.platform != 'win32':
+        os.setsid()
+    _worker_cpus = policy_cpus('background')
+    apply_resource_policy(os.getpid(), 'background', _worker_cpus)
+
+
+def _run_pipeline_step(cmd):
+    """静默运行一个流水线步骤，失败时抛出RuntimeError"""
+    cmd = with_thread_limit([cmd[0], '-nostats', '-loglevel', 'error', *cmd[1:]], _worker_cpus)
+    returncode, _, stderr = _run_check(cmd)
+    if returncode != 0:
+        raise RuntimeError(stderr[-500:] or f"FFmpeg返回码: {returncode}")
+
+
+# 管道连接的步骤之间使用的容器：可流式写入，不需要回写文件头
+PIPE_INPUT = 'pipe:0'
+PIPE_STAGE_FORMAT = 'matroska'
+PIPE_OUTPUT_ONLY_OPTIONS = ('-f', '-movflags', '-reset_timestamps')  # 只对最终文件有意义的输出选项
+PIPE_BROKEN_RE = re.compile(r'Broken pipe|\bEPIPE\b|Error number -32\b', re.IGNORECASE)  # 下游退出后上游写管道的错误
+PIPE_PROGRESS_INTERVAL = 5.0  # 管道模式下每个步骤记录进度的间隔（秒）
+
+
+def pipe_stage_cmd(cmd):
+    """把步骤命令的输出改为向标准输出写PIPE_STAGE_FORMAT（只传音视频，去掉字幕和数据流）"""
+    args = []
+    skip = False
+    for arg in cmd[:-1]:
+        if skip:
+            skip = False
+        elif arg in PIPE_OUTPUT_ONLY_OPTIONS:
+            skip = True
+        else:
+            args.append(arg)
+    return [*args, '-sn', '-dn', '-f', PIPE_STAGE_FORMAT, 'pipe:1']
+
+
+def _read_stage_stderr(stream, name, errors, on_progress):
+    """读取一个步骤的错误输出：统计行（以\r分隔）回调进度，其余保留为错误信息"""
+    buffer = b''
+    while True:
+        chunk = stream.read(4096)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = re.split(rb'[\r\n]', buffer)
+        for raw in lines:
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            seconds = parse_ffmpeg_time(line)
+            if seconds is not None:
+                if on_progress:
+                    on_progress(name, seconds)
+            else:
+                errors.append(line)
+    if buffer.strip():
+        errors.append(buffer.decode('utf-8', errors='replace').strip())
+
+
+def run_piped_stages(stages, on_progress=None):
+    """用管道把各步骤的FFmpeg串起来同时运行，只有最后一步写文件
+
+    stages为[(步骤名, 命令)]，除最后一步外的命令已由pipe_stage_cmd改写，后一步从PIPE_INPUT读取。
+    on_progress(步骤名, 秒)在读取线程中回调。失败时抛出RuntimeError并指出最先出错的步骤：
+    下游出错时上游只会报管道断开，上游出错时下游可能正常结束，所以要检查每一步的返回码。
+    只报管道断开、且后面还有步骤失败的步骤不是原因；报告的是出错步骤自己的错误输出。
+    """
+    processes, readers, errors = [], [], []
+    upstream = subprocess.DEVNULL
+    try:
+        for index, (name, cmd) in enumerate(stages):
+            cmd = with_thread_limit([cmd[0], '-nostdin', '-loglevel', 'error', '-stats', *cmd[1:]], _worker_cpus)
+            last = index == len(stages) - 1
+            process, _ = spawn_process(cmd, stdin=upstream,
+                                       stdout=subprocess.DEVNULL if last else subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+            if upstream is not subprocess.DEVNULL:
+                upstream.close()  # 读端只留给下游，下游退出时上游才能收到管道断开
+            upstream = process.stdout
+            stage_errors = deque(maxlen=STDERR_TAIL_LINES)
+            reader = threading.Thread(target=_read_stage_stderr, daemon=True,
+                                      args=(process.stderr, name, stage_errors, on_progress))
+            reader.start()
+            processes.append(process)
+            readers.append(reader)
+            errors.append(stage_errors)
+        for process in processes:
+            process.wait()
+        for reader in readers:
+            reader.join()
+    except BaseException:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        raise
+
+    failures = [(name, process.returncode, list(stage_errors))
+                for (name, _), process, stage_errors in zip(stages, processes, errors)
+                if process.returncode != 0]
+    for index, (name, returncode, lines) in enumerate(failures):
+        own_lines = [line for line in lines if not PIPE_BROKEN_RE.search(line)]
+        if own_lines == lines or index == len(failures) - 1:
+            break
+    if failures:
+        message = "\n".join(own_lines or lines)[-500:] or f"FFmpeg返回码: {returncode}"
+        raise RuntimeError(f"{PIPELINE_STEP_NAMES[name]}失败: {message}")
+
+
+def run_pipeline(source, preset, output_dir):
+    """对一个文件依次执行预设中的步骤，返回输出文件路径
+
+    在进程池中运行：不访问界面，失败时抛出异常。中间文件写在输出目录下的
+    临时目录中，全部完成后才移动到最终位置，中途失败不会留下半成品。
+    预设的piped为true时各步骤经管道同时运行，只有最后一步写文件。
+    """
+    if not toolchain_ready.is_set():
+        discover_toolchain()  # 子进程（spawn方式）需要重新查找FFmpeg
+
+    steps = preset['steps']
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='.pipeline_', dir=output_dir)
+    source_ext = os.path.splitext(source)[1] or '.mp4'
+    piped = preset.get('piped', False)
+    stages = []  # 管道模式下收集的(步骤名, 命令)
+    current = source
+    try:
+        for index, name in enumerate(PIPELINE_STEPS):
+            if name not in steps:
+                continue
+            params = steps[name] or {}
+            # 剪切和声音处理复制视频流，保留原容器；重新编码的步骤输出MP4
+            ext = source_ext if name in ('trim', 'denoise') else '.mp4'
+            step_output = os.path.join(work_dir, f"{index}_{name}{ext}")
+
+            if name == 'trim':
+                start = float(params.get('start', 0))
+                end = params.get('end')
+                if end is None:
+                    end = probe_media_info(source).get('duration')
+                    if end is None:
+                        raise RuntimeError("无法获取视频时长")
+                cmd = build_segment_copy_cmd(current, start, float(end), step_output)
+            elif name == 'denoise':
+                cmd = build_denoise_cmd(current, step_output,
+                                        float(params.get('noise_reduction', 0)),
+                                        float(params.get('volume_boost', 0)),
+                                        bool(params.get('preserve_voice', True)))
+            elif name == 'subtitle':
+                subtitle_path = find_sidecar_subtitle(source)
+                if subtitle_path is None:
+                    watch_log.info(f"{os.path.basename(source)} 没有同名字幕文件，跳过硬字幕")
+                    continue
+                # 前面的步骤不改变视频码率和音频参数，直接读源文件（管道模式下也能读）
+                video_info = probe_media_info(source)
+                bitrate = params.get('bitrate') or f"{video_info.get('bitrate', 3000 * 1000) / 1000:.0f}"
+                cmd = build_subtitle_burn_cmd(current, subtitle_path, step_output,
+                                              font_size=params.get('font_size', 12),
+                                              font_color=params.get('font_color', 'white'),
+                                              position=params.get('position', 'bottom'),
+                                              encoder=params.get('encoder', ''),
+                                              bitrate=bitrate,
+                                              video_info=video_info,
+                                              rate_mode=params.get('rate_mode', 'bitrate'),
+                                              quality=params.get('quality', DEFAULT_QUALITY))
+            else:
+                bitrate = params.get('bitrate')
+                if not bitrate:
+                    bitrate = f"{probe_media_info(source).get('bitrate', 3000 * 1000) / 1000:.0f}"
+                cmd = build_convert_cmd(current, step_output, bitrate, params.get('encoder', ''),
+                                        params.get('rate_mode', 'bitrate'), params.get('quality', DEFAULT_QUALITY))
+
+            if piped:
+                stages.append((name, cmd))
+                current = PIPE_INPUT
+                final_output = step_output
+                continue
+            watch_log.debug(f"{PIPELINE_STEP_NAMES[name]}: {' '.join(cmd)}")
+            try:
+                _run_pipeline_step(cmd)
+            except RuntimeError as e:
+                raise RuntimeError(f"{PIPELINE_STEP_NAMES[name]}失败: {e}")
+            current = step_output
+
+        if stages:
+            stages = [(name, pipe_stage_cmd(cmd)) for name, cmd in stages[:-1]] + stages[-1:]
+            for name, cmd in stages:
+                watch_log.debug(f"{PIPELINE_STEP_NAMES[name]}（管道）: {' '.join(cmd)}")
+            reported = {}
+
+            def on_progress(name, seconds):
+                now = time.monotonic()
+                if now - reported.get(name, 0) >= PIPE_PROGRESS_INTERVAL:
+                    reported[name] = now
+                    watch_log.debug(f"{os.path.basename(source)} {PIPELINE_STEP_NAMES[name]}: {seconds:.1f}s")
+
+            run_piped_stages(stages, on_progress)
+            current = final_output
+
+        if current == source:
+            raise RuntimeError("没有执行任何处理步骤")
+        base = os.path.splitext(os.path.basename(source))[0]
+        output_path = os.path.join(output_dir, base + preset.get('output_suffix', '_processed')
+                                   + os.path.splitext(current)[1])
+        os.replace(current, output_path)
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def content_fingerprint(file_path):
+    """文件内容指纹：大小加首、中、尾各1MB的SHA-256
+
+    只读取固定的3MB，大文件也能很快算完；改名或移动后指纹不变。
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha256(str(size).encode('ascii'))
+    with open(file_path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - FINGERPRINT_CHUNK // 2), max(0, size - FINGERPRINT_CHUNK)}):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
+
+
+class WatchState:
+    """监视文件夹的处理记录（SQLite），按内容指纹记录每个源文件的状态
+
+    状态：running（处理中）、done（完成）、failed（失败）。done和failed的
+    文件不再处理；启动时残留的running记录说明上次被中断，会被清除以便重新处理。
+    """
+
+    def __init__(self, path=WATCH_STATE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed ("
+                "fingerprint TEXT PRIMARY KEY, source TEXT, status TEXT, "
+                "output TEXT, error TEXT, started_at REAL, finished_at REAL)"
+            )
+            interrupted = self._conn.execute("DELETE FROM processed WHERE status = 'running'").rowcount
+        if interrupted:
+            watch_log.info(f"清除 {interrupted} 条上次中断的处理记录")
+
+    def status(self, fingerprint):
+        """返回指纹对应的状态，没有记录时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM processed WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return row[0] if row else None
+
+    def begin(self, fingerprint, source):
+        """登记开始处理；已有记录时返回False"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO processed (fingerprint, source, status, started_at) "
+                "VALUES (?, ?, 'running', ?)", (fingerprint, source, time.time()))
+        return cursor.rowcount == 1
+
+    def finish(self, fingerprint, output=None, error=None):
+        """登记处理结果"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE processed SET status = ?, output = ?, error = ?, finished_at = ? WHERE fingerprint = ?",
+                ('failed' if error else 'done', output, error, time.time(), fingerprint))
+
+    def forget(self, fingerprint):
+        """删除记录（任务被取消时调用，下次启动重新处理）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM processed WHERE fingerprint = ?", (fingerprint,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 结果缓存：相同输入、相同命令、相同FFmpeg版本的任务直接复用上次的输出
+RESULT_CACHE_DIR = os.path.join(APP_CACHE_DIR, 'results')
+RESULT_CACHE_ENV = 'VIDEO_TOOL_RESULT_CACHE_MB'  # 缓存容量（MB），0表示不使用缓存
+RESULT_CACHE_MAX_MB = 20 * 1024
+FICLONE = 0x40049409  # Linux写时复制ioctl（Btrfs、XFS等支持）
+
+
+def result_cache_limit():
+    """结果缓存容量（字节），可用环境变量覆盖"""
+    value = os.getenv(RESULT_CACHE_ENV, '').strip()
+    try:
+        return max(0, int(value)) * 1024 * 1024 if value else RESULT_CACHE_MAX_MB * 1024 * 1024
+    except ValueError:
+        logger.warning(f"{RESULT_CACHE_ENV}不是整数: {value}")
+        return RESULT_CACHE_MAX_MB * 1024 * 1024
+
+
+def clone_file(src, dst):
+    """把src放到dst，依次尝试写时复制(reflink)、硬链接、复制，返回使用的方式
+
+    先写到临时文件再替换，dst要么是完整的文件，要么保持原样。
+    """
+    tmp_path = f"{dst}.{uuid.uuid4().hex[:8]}.tmp"
+    method = None
+    if sys.platform.startswith('linux'):
+        try:
+            import fcntl
+            with open(src, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            method = 'reflink'
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    if method is None:
+        try:
+            os.link(src, tmp_path)
+            method = 'hardlink'
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+            method = 'copy'
+    os.replace(tmp_path, dst)
+    return method
+
+
+class ResultCache:
+    """按内容寻址的任务结果缓存（SQLite索引+文件），超出容量时按最近使用时间淘汰
+
+    键由输入文件的内容指纹、规范化后的命令和FFmpeg版本计算，只有成功完成的输出才会
+    写入。硬链接的输出被就地覆盖时缓存文件也会改变，因此取出前核对大小和指纹，
+    不一致的条目直接丢弃。
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = result_cache_limit() if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        if self.max_bytes <= 0:
+            return
+        os.makedirs(directory, exist_ok=True)
+        # 上次写到一半的临时文件
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, path TEXT, size INTEGER, fingerprint TEXT, "
+                "created_at REAL, last_used REAL)"
+            )
+
+    @property
+    def enabled(self):
+        return self._conn is not None
+
+    def job_key(self, cmd, inputs, output_path, volatile=(), namespace=''):
+        """任务的缓存键；cmd可以是命令列表（两遍编码），volatile为每次都会变化的临时路径
+
+        输入和输出路径替换为占位符，输入按内容指纹和修改时间参与计算，因此改名或移动后仍能命中；
+        指纹只取样部分内容，同样大小的文件被修改后靠修改时间区分。
+        FFmpeg尚未检测完成或输入不可读时返回None（不使用缓存）。
+        """
+        if not self.enabled or not toolchain_ready.is_set():
+            return None
+        try:
+            fingerprints = [[content_fingerprint(path), os.stat(path).st_mtime_ns] for path in inputs]
+        except OSError:
+            return None
+        placeholders = {path: f'<input{i}>' for i, path in enumerate(inputs)}
+        placeholders[output_path] = '<output>'
+        normalized = []
+        for args in (cmd if cmd and isinstance(cmd[0], list) else [cmd]):
+            current = []
+            for arg in args[1:]:
+                if arg in ('-y', '-nostats'):
+                    continue
+                arg = placeholders.get(arg, arg)
+                for path in volatile:
+                    if path:
+                        arg = arg.replace(path, '<tmp>')
+                current.append(arg)
+            normalized.append(current)
+        payload = {
+            'namespace': namespace,
+            'ffmpeg': FFMPEG_INFO.get('version', ''),
+            'inputs': fingerprints,
+            'commands': normalized,
+            'ext': os.path.splitext(output_path)[1].lower(),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def fetch(self, key, output_path):
+        """命中时把缓存结果放到output_path，返回使用的方式（reflink/hardlink/copy），否则返回None"""
+        if key is None or not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT path, size, fingerprint FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path, size, fingerprint = row
+        try:
+            valid = os.path.getsize(path) == size and content_fingerprint(path) == fingerprint
+        except OSError:
+            valid = False
+        if not valid:
+            logger.info(f"缓存结果已损坏或丢失，丢弃: {key[:12]}")
+            self._discard(key, path)
+            return None
+        if os.path.abspath(path) == os.path.abspath(output_path):
+            return None
+        method = clone_file(path, output_path)
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        logger.info(f"命中结果缓存（{method}）: {output_path}")
+        return method
+
+    def store(self, key, output_path):
+        """登记成功完成的输出，超出容量时淘汰最久未使用的结果"""
+        if key is None or not self.enabled:
+            return
+        try:
+            size = os.path.getsize(output_path)
+            if size <= 0 or size > self.max_bytes:
+                return
+            path = os.path.join(self.directory, key + os.path.splitext(output_path)[1].lower())
+            clone_file(output_path, path)
+            fingerprint = content_fingerprint(path)
+        except OSError as e:
+            logger.warning(f"写入结果缓存失败: {e}")
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, path, size, fingerprint, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, path, size, fingerprint, now, now))
+        self._evict()
+
+    def _evict(self):
+        """按最近使用时间从旧到新删除，直到总大小不超过容量"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, path, size FROM results ORDER BY last_used").fetchall()
+        total = sum(row[2] for row in rows)
+        for key, path, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._discard(key, path)
+            total -= size
+
+    def _discard(self, key, path):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.enabled:
+            with self._lock:
+                self._conn.close()
+
+
+class WatchFolderService:
+    """监视文件夹：发现新视频，等它不再增长后交给进程池按预设处理
+
+    只扫描监视目录的第一层；文件大小和修改时间在settle_time秒内不变才认为
+    写入完成。每个源文件按内容指纹只处理一次，记录保存在WatchState中。
+    """
+
+    def __init__(self, watch_dir, preset, output_dir=None, workers=2,
+                 poll_interval=2.0, settle_time=5.0, state_path=WATCH_STATE_FILE):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.preset = preset
+        self.output_dir = os.path.abspath(output_dir or os.path.join(self.watch_dir, 'processed'))
+        if self.output_dir == self.watch_dir:
+            raise ValueError("输出目录不能与监视目录相同")
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.state = WatchState(state_path)
+        self._stop_event = threading.Event()
+        self._pending = {}  # 路径 -> (大小, 修改时间, 开始稳定的时间)
+        self._handled = set()  # 本次运行已判断过的文件身份，避免重复计算指纹
+        self._executor = None
+
+    def scan(self):
+        """扫描一次监视目录，返回已经稳定、尚未判断过的文件"""
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        try:
+            entries = list(os.scandir(self.watch_dir))
+        except OSError as e:
+            watch_log.warning(f"无法读取监视目录: {e}")
+            return ready
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            path = entry.path
+            seen.add(path)
+            if ProbeCache.identity(path) in self._handled:
+                continue
+            previous = self._pending.get(path)
+            if previous is None or previous[:2] != (st.st_size, st.st_mtime_ns):
+                # 新文件或仍在写入，重新计时
+                self._pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif st.st_size > 0 and now - previous[2] >= self.settle_time:
+                del self._pending[path]
+                ready.append(path)
+        # 已被移走的文件不再跟踪
+        for path in set(self._pending) - seen:
+            del self._pending[path]
+        return ready
+
+    def submit(self, path):
+        """按指纹判断是否需要处理，需要时提交到进程池"""
+        identity = ProbeCache.identity(path)
+        try:
+            fingerprint = content_fingerprint(path)
+        except OSError as e:
+            watch_log.warning(f"读取文件失败，稍后重试: {path}: {e}")
+            return
+        self._handled.add(identity)
+        if not self.state.begin(fingerprint, path):
+            watch_log.debug(f"已处理过，跳过: {path} ({self.state.status(fingerprint)})")
+            return
+        watch_log.info(f"开始处理: {path}")
+        future = self._executor.submit(run_pipeline, path, self.preset, self.output_dir)
+        future.add_done_callback(lambda f: self._on_done(f, fingerprint, path))
+
+    def _on_done(self, future, fingerprint, path):
+        """进程池任务结束（在进程池的管理线程中调用）"""
+        if future.cancelled():
+            self.state.forget(fingerprint)
+            return
+        error = future.exception()
+        if error is not None and self._stop_event.is_set():
+            # 停止时被中断的文件不记为失败，下次启动重新处理
+            watch_log.warning(f"处理被中断，下次启动重新处理: {path}: {error}")
+            self.state.forget(fingerprint)
+        elif error is not None:
+            watch_log.error(f"处理失败: {path}: {error}")
+            self.state.finish(fingerprint, error=str(error))
+        else:
+            output_path = future.result()
+            watch_log.info(f"处理完成: {path} -> {output_path}")
+            self.state.finish(fingerprint, output=output_path)
+
+    def run_forever(self):
+        """轮询监视目录直到stop()被调用"""
+        discover_toolchain()
+        os.makedirs(self.output_dir, exist_ok=True)
+        steps = '、'.join(PIPELINE_STEP_NAMES[name] for name in PIPELINE_STEPS if name in self.preset['steps'])
+        watch_log.info(f"监视目录: {self.watch_dir}，输出目录: {self.output_dir}，步骤: {steps}")
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_pipeline_worker)
+        try:
+            while not self._stop_event.is_set():
+                for path in self.scan():
+                    self.submit(path)
+                self._stop_event.wait(self.poll_interval)
+        finally:
+            # 未开始的任务取消（记录删除，下次启动重新处理），正在处理的等待完成
+            self._stop_event.set()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self.state.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+
+# 任务队列支持的任务类型及必填参数
+JOB_KINDS = {
+    'trim': ('source', 'start', 'end'),
+    'merge': ('inputs',),
+    'convert': ('source',),
+    'subtitle': ('source', 'subtitle'),
+    'denoise': ('source',),
+}
+JOB_KIND_NAMES = {
+    'trim': '剪切',
+    'merge': '合并',
+    'convert': '视频转换',
+    'subtitle': '硬字幕',
+    'denoise': '声音处理',
+}
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+JOB_STATE_NAMES = {
+    'queued': '排队中',
+    'running': '处理中',
+    'done': '完成',
+    'failed': '失败',
+    'cancelled': '已取消',
+}
+JOB_FINAL_STATES = ('done', 'failed', 'cancelled')
+JOB_WORKERS = 2  # 默认同时运行的任务数（可在界面中调整）
+JOB_MAX_WORKERS = 16  # 同时运行任务数的上限
+JOB_HISTORY = 200  # 保留的已结束任务数
+PROGRESS_TIME_RE = re.compile(r'out_time_(?:us|ms)=(\d+)')
+
+# 硬件编码器的并发会话上限（消费级NVIDIA显卡驱动限制同时编码的会话数），可用环境变量覆盖，如"nvenc=5,qsv=2"
+ENCODER_SESSION_LIMITS = {'nvenc': 3, 'qsv': 4, 'amf': 4, 'vaapi': 4}
+ENCODER_LIMITS_ENV = 'VIDEO_TOOL_ENCODER_LIMITS'
+
+# 批量硬字幕：视频和字幕的配对方式
+BATCH_PAIR_RULES = {
+    'name': '同名文件',
+    'episode': '按集数',
+    'manifest': '清单文件',
+}
+EPISODE_PATTERNS = (
+    re.compile(r'[Ss](\d{1,2})[ ._-]*[Ee](\d{1,4})'),  # S01E02
+    re.compile(r'(?:^|[^A-Za-z])(?:EP?|第)[ ._-]*(\d{1,4})', re.IGNORECASE),  # E02、EP02、第2集
+    re.compile(r'(\d{1,4})(?=\D*$)'),  # 文件名中最后一组数字
+)
+
+
+def encoder_session_limits():
+    """各类硬件编码器的并发会话上限"""
+    limits = dict(ENCODER_SESSION_LIMITS)
+    for item in os.getenv(ENCODER_LIMITS_ENV, '').split(','):
+        name, _, value = item.partition('=')
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            if item.strip():
+                logger.warning(f"{ENCODER_LIMITS_ENV}格式不正确: {item}")
+    return limits
+
+
+def encoder_group(encoder):
+    """编码器所属的硬件类别（nvenc/qsv/amf/vaapi），软件编码返回None"""
+    for group in ENCODER_SESSION_LIMITS:
+        if group in (encoder or ''):
+            return group
+    return None
+
+
+def episode_key(file_path):
+    """从文件名中提取(季, 集)，没有季号时季为None，提取不到时返回None"""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    for pattern in EPISODE_PATTERNS:
+        match = pattern.search(stem)
+        if match:
+            groups = match.groups()
+            if len(groups) == 2:
+                return int(groups[0]), int(groups[1])
+            return None, int(groups[0])
+    return None
+
+
+def _subtitle_matches_name(video, subtitle):
+    """字幕与视频同名，或带语言后缀（如 EP01.zh.srt 对应 EP01.mp4）"""
+    video_stem = os.path.splitext(os.path.basename(video))[0].casefold()
+    subtitle_stem = os.path.splitext(os.path.basename(subtitle))[0].casefold()
+    return subtitle_stem == video_stem or subtitle_stem.startswith(video_stem + '.')
+
+
+def _episode_matches(video, subtitle):
+    video_key, subtitle_key = episode_key(video), episode_key(subtitle)
+    if video_key is None or subtitle_key is None or video_key[1] != subtitle_key[1]:
+        return False
+    return video_key[0] is None or subtitle_key[0] is None or video_key[0] == subtitle_key[0]
+
+
+def pair_batch_subtitles(videos, subtitles, rule='name'):
+    """按规则为每个视频配对字幕，返回[(视频, 字幕或None, 错误或None), ...]
+
+    rule为'name'时按文件名配对（同名优先，其次是带语言后缀的），为'episode'时按集数配对。
+    """
+    match = _subtitle_matches_name if rule == 'name' else _episode_matches
+    pairs = []
+    for video in videos:
+        candidates = [subtitle for subtitle in subtitles if match(video, subtitle)]
+        if rule == 'name' and len(candidates) > 1:
+            exact = [s for s in candidates if os.path.splitext(os.path.basename(s))[0].casefold()
+                     == os.path.splitext(os.path.basename(video))[0].casefold()]
+            candidates = exact or candidates
+        if len(candidates) == 1:
+            pairs.append((video, candidates[0], None))
+        elif candidates:
+            names = ', '.join(os.path.basename(s) for s in candidates[:3])
+            pairs.append((video, None, f"匹配到多个字幕: {names}"))
+        else:
+            pairs.append((video, None, "没有匹配的字幕"))
+    return pairs
+
+
+def load_batch_manifest(path):
+    """读取批量配对清单（JSON）：[{"video": ..., "subtitle": ...}, ...] 或 {视频: 字幕}
+
+    相对路径相对于清单所在目录；格式不正确时抛出ValueError。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        items = list(data.items())
+    elif isinstance(data, list):
+        try:
+            items = [(item['video'], item['subtitle']) for item in data]
+        except (TypeError, KeyError):
+            raise ValueError("清单中的每一项都需要video和subtitle")
+    else:
+        raise ValueError("清单必须是JSON数组或对象")
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return [(os.path.join(base_dir, video), os.path.join(base_dir, subtitle)) for video, subtitle in items]
+
+
+def batch_stats(jobs):
+    """一批任务的汇总：完成数、按媒体时长计的处理速度（倍速）和预计剩余时间（秒，未知时为None）"""
+    total = sum(job['duration'] for job in jobs)
+    processed = sum(job['duration'] * (100.0 if job['state'] == 'done' else job['progress']) / 100
+                    for job in jobs if job['state'] != 'cancelled')
+    remaining = sum(job['duration'] * (100 - job['progress']) / 100
+                    for job in jobs if job['state'] not in JOB_FINAL_STATES)
+    started = [job['started_at'] for job in jobs if job['started_at']]
+    elapsed = time.time() - min(started) if started else 0
+    if all(job['state'] in JOB_FINAL_STATES for job in jobs):
+        elapsed = max((job['finished_at'] or 0 for job in jobs), default=0) - min(started, default=0)
+    speed = processed / elapsed if elapsed > 0 else 0
+    return {
+        'count': len(jobs),
+        'done': sum(job['state'] == 'done' for job in jobs),
+        'failed': sum(job['state'] == 'failed' for job in jobs),
+        'running': sum(job['state'] == 'running' for job in jobs),
+        'duration': total,
+        'speed': speed,
+        'eta': remaining / speed if speed > 0 and remaining > 0 else None,
+    }
+
+
+def default_job_output(source, kind, ext=None):
+    """任务默认输出路径：源文件同目录下加任务类型后缀，已存在时追加序号"""
+    base, source_ext = os.path.splitext(source)
+    ext = ext or source_ext or '.mp4'
+    output_path = f"{base}_{kind}{ext}"
+    counter = 1
+    while os.path.exists(output_path):
+        output_path = f"{base}_{kind}_{counter}{ext}"
+        counter += 1
+    return output_path
+
+
+def build_job_cmd(kind, params, work_dir):
+    """把任务参数转换为FFmpeg命令，返回(命令, 输出路径, 输入文件列表, 总时长)
+
+    参数不合法时抛出ValueError。颜色、位置、编码器使用英文值（与流水线预设一致）。
+    """
+    inputs = list(params['inputs']) if kind == 'merge' else [params['source']]
+    for path in inputs:
+        if not os.path.isfile(path):
+            raise ValueError(f"文件不存在: {path}")
+
+    if kind == 'trim':
+        start, end = float(params['start']), float(params['end'])
+        if end - start < 0.1:
+            raise ValueError("剪切区间太短，至少需要0.1秒")
+        output_path = params.get('output') or default_job_output(params['source'], 'trim')
+        return build_segment_copy_cmd(params['source'], start, end, output_path), output_path, inputs, end - start
+
+    if kind == 'merge':
+        if len(inputs) < 2:
+            raise ValueError("至少需要两个视频才能合并")
+        output_path = params.get('output') or default_job_output(inputs[0], 'merge')
+        list_path = os.path.join(work_dir, 'concat.txt')
+        write_concat_list(list_path, inputs)
+        duration = sum(probe_media_info(path).get('duration', 0) for path in inputs)
+        return build_concat_copy_cmd(list_path, output_path), output_path, inputs, duration
+
+    source = params['source']
+    video_info = probe_media_info(source)
+    duration = video_info.get('duration', 0)
+    bitrate = params.get('bitrate') or f"{video_info.get('bitrate', 3000 * 1000) / 1000:.0f}"
+
+    if kind == 'convert':
+        output_path = params.get('output') or default_job_output(source, 'converted', '.mp4')
+        cmd = build_convert_cmd(source, output_path, bitrate, params.get('encoder', ''),
+                                params.get('rate_mode', 'bitrate'), params.get('quality', DEFAULT_QUALITY))
+    elif kind == 'subtitle':
+        if not os.path.isfile(params['subtitle']):
+            raise ValueError(f"字幕文件不存在: {params['subtitle']}")
+        output_path = params.get('output') or default_job_output(source, 'subtitled', '.mp4')
+        overlay = None
+        if params.get('prerender'):
+            overlay = prerender_subtitle_overlay(params['subtitle'], *display_size(video_info),
+                                                 params.get('font_size', 12), params.get('font_color', 'white'),
+                                                 params.get('position', 'bottom'), os.path.join(work_dir, 'overlay'))
+        cmd = build_subtitle_burn_cmd(source, params['subtitle'], output_path,
+                                      font_size=params.get('font_size', 12),
+                                      font_color=params.get('font_color', 'white'),
+                                      position=params.get('position', 'bottom'),
+                                      encoder=params.get('encoder', ''),
+                                      bitrate=bitrate,
+                                      video_info=video_info,
+                                      rate_mode=params.get('rate_mode', 'bitrate'),
+                                      quality=params.get('quality', DEFAULT_QUALITY),
+                                      overlay=overlay)
+    else:
+        output_path = params.get('output') or default_job_output(source, 'denoised')
+        cmd = build_denoise_cmd(source, output_path,
+                                float(params.get('noise_reduction', 10.0)),
+                                float(params.get('volume_boost', 0)),
+                                bool(params.get('preserve_voice', True)))
+    return cmd, output_path, inputs, duration
+
+
+class Job:
+    """任务队列中的一个任务（字段只在JobScheduler的锁内修改）"""
+
+    def __init__(self, kind, params, origin):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.origin = origin  # 'gui'或'api'
+        self.state = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.output = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self.duration = 0.0  # 媒体时长（秒），用于批量任务的速度和剩余时间
+        self.process = None
+        self.future = None
+        self.cancel_requested = False
+
+    def snapshot(self):
+        """可JSON序列化的任务状态"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'origin': self.origin,
+            'state': self.state,
+            'progress': round(self.progress, 1),
+            'message': self.message,
+            'output': self.output,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration': self.duration,
+            'version': self.version,
+        }
+
+
+class JobScheduler:
+    """界面和HTTP接口共用的任务队列
+
+    任务在线程池中运行FFmpeg，进度通过-progress输出解析。每次状态变化递增版本号
+    并唤醒等待者，查询方只读取快照，不会阻塞正在运行的任务。同时运行的任务数可以
+    随时调整，使用同一类硬件编码器的任务数不超过该类编码器的会话上限。
+    """
+
+    def __init__(self, workers=JOB_WORKERS, metrics=None, result_cache=None):
+        self.metrics = metrics
+        self.result_cache = result_cache
+        self.workers = workers
+        self.encoder_limits = encoder_session_limits()
+        self._executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix='job')
+        self._jobs = {}  # id -> Job，按提交顺序
+        self._changed = threading.Condition()
+        self._running = 0
+        self._running_by_encoder = {}  # 硬件编码器类别 -> 运行中的任务数
+        self.version = 0
+
+    def set_workers(self, workers):
+        """调整同时运行的任务数（1到JOB_MAX_WORKERS），排队中的任务立即按新值开始"""
+        with self._changed:
+            self.workers = max(1, min(JOB_MAX_WORKERS, int(workers)))
+            self._changed.notify_all()
+
+    def submit(self, kind, params, origin='api', check=None):
+        """提交任务，返回任务快照；参数不合法时抛出ValueError
+
+        check(kind, params)在基本参数检查通过后调用，可抛出ValueError拒绝任务（如接口的输出路径检查）。
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        if not isinstance(params, dict):
+            raise ValueError("params必须是JSON对象")
+        missing = [name for name in JOB_KINDS[kind] if params.get(name) in (None, '', [])]
+        if missing:
+            raise ValueError(f"缺少参数: {', '.join(missing)}")
+        if params.get('policy', 'background') not in RESOURCE_POLICIES:
+            raise ValueError(f"不支持的资源策略: {params['policy']}")
+        if params.get('rate_mode', 'bitrate') not in RATE_MODES:
+            raise ValueError(f"不支持的码率控制方式: {params['rate_mode']}")
+        if check is not None:
+            check(kind, params)
+        job = Job(kind, params, origin)
+        metrics = self.metrics.new_job(kind) if self.metrics else None
+        with self._changed:
+            self._jobs[job.id] = job
+            self._trim_history()
+            self._touch(job)
+            job.future = self._executor.submit(self._run, job, metrics)
+            snapshot = job.snapshot()
+        api_log.info(f"提交任务 {job.id}: {kind} ({origin})")
+        return snapshot
+
+    def get(self, job_id):
+        """任务快照，不存在时返回None"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return job.snapshot() if job else None
+
+    def list_jobs(self):
+        """所有任务的快照（按提交顺序）"""
+        with self._changed:
+            return [job.snapshot() for job in self._jobs.values()]
+
+    def wait(self, job_id, since_version, timeout=30.0):
+        """等待任务版本号超过since_version（长轮询），超时返回当前快照"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job.version > since_version or job.state in JOB_FINAL_STATES:
+                    return job.snapshot() if job else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job.snapshot()
+                self._changed.wait(remaining)
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接取消，运行中的由进程监管器发'q'并逐级终止"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in JOB_FINAL_STATES:
+                return False
+            job.cancel_requested = True
+            if job.state == 'queued' and job.future.cancel():
+                job.state = 'cancelled'
+                job.finished_at = time.time()
+                self._touch(job)
+                return True
+            self._changed.notify_all()  # 正在等待运行名额的任务
+            process = job.process
+        if process is not None and process.poll() is None:
+            get_supervisor().stop(process)
+        return True
+
+    def clear_finished(self):
+        """从列表中移除已结束的任务"""
+        with self._changed:
+            for job_id in [job.id for job in self._jobs.values() if job.state in JOB_FINAL_STATES]:
+                del self._jobs[job_id]
+            self.version += 1
+            self._changed.notify_all()
+
+    def shutdown(self, stop_processes=True):
+        """取消所有任务并停止线程池，返回仍在运行的进程
+
+        运行中的进程同时逐级停止并等待退出；stop_processes为False时交给调用方停止。
+        """
+        processes = []
+        with self._changed:
+            for job in self._jobs.values():
+                if job.state in JOB_FINAL_STATES:
+                    continue
+                job.cancel_requested = True
+                if job.state == 'queued' and job.future.cancel():
+                    job.state = 'cancelled'
+                    job.finished_at = time.time()
+                    self._touch(job)
+                elif job.process is not None:
+                    processes.append(job.process)
+            self._changed.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if stop_processes:
+            get_supervisor().stop_all(processes)
+        return processes
+
+    def _trim_history(self):
+        """只保留最近JOB_HISTORY个已结束的任务（在锁内调用）"""
+        finished = [job.id for job in self._jobs.values() if job.state in JOB_FINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _touch(self, job):
+        """递增版本号并唤醒等待者（在锁内调用）"""
+        self.version += 1
+        job.version = self.version
+        self._changed.notify_all()
+
+    def _update(self, job, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            self._touch(job)
+
+    def _acquire_slot(self, job, group):
+        """等待运行名额（总数和该类硬件编码器的会话数都未满），任务被取消时返回False"""
+        with self._changed:
+            while True:
+                if self._running < self.workers and (
+                        group is None or self._running_by_encoder.get(group, 0) < self.encoder_limits.get(group, 1)):
+                    self._running += 1
+                    if group is not None:
+                        self._running_by_encoder[group] = self._running_by_encoder.get(group, 0) + 1
+                    return True
+                if job.cancel_requested:
+                    return False
+                self._changed.wait()
+
+    def _release_slot(self, group):
+        with self._changed:
+            self._running -= 1
+            if group is not None:
+                self._running_by_encoder[group] -= 1
+            self._changed.notify_all()
+
+    def _run(self, job, metrics):
+        """在线程池中执行一个任务"""
+        group = encoder_group(job.params.get('encoder')) if job.kind in ('convert', 'subtitle') else None
+        if not self._acquire_slot(job, group):
+            self._update(job, state='cancelled', message='已取消', finished_at=time.time())
+            if metrics:
+                metrics.finish(-1)
+            return
+        try:
+            self._run_job(job, metrics)
+        finally:
+            self._release_slot(group)
+
+    def _run_job(self, job, metrics):
+        """执行一个已获得运行名额的任务"""
+        work_dir = tempfile.mkdtemp(prefix='video_tool_job_')
+        returncode = -1
+        output_path = None
+        try:
+            if metrics:
+                metrics.mark('probe')
+            self._update(job, state='running', started_at=time.time(), message='准备中')
+            cmd, output_path, inputs, duration = build_job_cmd(job.kind, job.params, work_dir)
+            self._update(job, duration=duration)
+            cache_key = None
+            if self.result_cache is not None and job.params.get('cache', True):
+                cache_inputs = inputs + ([job.params['subtitle']] if job.kind == 'subtitle' else [])
+                cache_key = self.result_cache.job_key(cmd, cache_inputs, output_path,
+                                                      volatile=(work_dir,), namespace=job.kind)
+                method = self.result_cache.fetch(cache_key, output_path)
+                if method:
+                    returncode = 0
+                    self._update(job, state='done', progress=100.0, output=output_path,
+                                 message=f'完成（缓存，{method}）', finished_at=time.time())
+                    return
+            cmd = [cmd[0], '-nostats', '-progress', 'pipe:1', *cmd[1:]]
+            api_log.debug(f"任务 {job.id}: {' '.join(cmd)}")
+            if metrics:
+                metrics.add_input(*inputs)
+                metrics.mark('spawn')
+
+            last_progress = [0.0]
+
+            def on_progress(line):
+                # 在进程监管线程中执行
+                if metrics:
+                    metrics.observe_line(line)
+                match = PROGRESS_TIME_RE.match(line)
+                if match and duration > 0:
+                    progress = min(99.9, int(match.group(1)) / 1000000 / duration * 100)
+                    if progress - last_progress[0] >= 0.5:
+                        last_progress[0] = progress
+                        self._update(job, progress=progress)
+
+            # 队列中的任务默认按后台策略运行，不影响界面和预览
+            process = get_supervisor().spawn(cmd, on_stdout=on_progress,
+                                             policy=job.params.get('policy', 'background'),
+                                             log=metrics.job_log() if metrics else None)
+            with self._changed:
+                job.process = process
+                cancel_requested = job.cancel_requested
+            if cancel_requested:
+                process.terminate()
+            if metrics:
+                metrics.mark('first_frame')
+
+            self._update(job, message='处理中')
+            returncode = process.wait()
+
+            if metrics:
+                metrics.mark('finalize')
+            if job.cancel_requested:
+                if output_path and os.path.exists(output_path):
+                    os.remove(output_path)
+                self._update(job, state='cancelled', message='已取消', finished_at=time.time())
+            elif returncode == 0 and process.stopped:
+                # 关闭程序时按'q'停止，返回码也是0，但输出不完整
+                self._update(job, state='failed', error='处理被中断', message='失败', finished_at=time.time())
+            elif returncode == 0:
+                if self.result_cache is not None:
+                    self.result_cache.store(cache_key, output_path)
+                self._update(job, state='done', progress=100.0, output=output_path,
+                             message='完成', finished_at=time.time())
+            else:
+                error = process.stderr_text()[-500:] or f"FFmpeg返回码: {returncode}"
+                self._update(job, state='failed', error=error, message='失败', finished_at=time.time())
+        except Exception as e:
+            api_log.error(f"任务 {job.id} 失败: {e}")
+            self._update(job, state='failed', error=str(e), message='失败', finished_at=time.time())
+        finally:
+            with self._changed:
+                job.process = None
+            if metrics:
+                metrics.finish(returncode, output_path)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+API_TOKEN_FILE = os.path.join(APP_CACHE_DIR, 'api_token')
+
+
+def load_api_token():
+    """任务接口的token：优先用环境变量VIDEO_TOOL_API_TOKEN，没有时读取或生成~/.video_tool/api_token"""
+    token = os.getenv('VIDEO_TOOL_API_TOKEN')
+    if token:
+        return token
+    try:
+        with open(API_TOKEN_FILE, 'r', encoding='utf-8') as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except OSError:
+        pass
+    token = secrets.token_urlsafe(32)
+    os.makedirs(APP_CACHE_DIR, exist_ok=True)
+    fd = os.open(API_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token)
+    api_log.info(f"已生成任务接口token: {API_TOKEN_FILE}")
+    return token
+
+
+def check_api_output(kind, params, output_dirs=None):
+    """检查接口任务指定的输出路径，不合法时抛出ValueError
+
+    输出必须位于允许的目录中（设置了VIDEO_TOOL_API_OUTPUT_DIR时为其中列出的目录，
+    否则为源文件所在目录），且不能覆盖已有文件。未指定输出时使用默认路径，不需要检查。
+    """
+    output = params.get('output')
+    if not output:
+        return
+    if not isinstance(output, str):
+        raise ValueError("output必须是字符串")
+    if not output_dirs:
+        source = params['inputs'][0] if kind == 'merge' else params['source']
+        output_dirs = [os.path.dirname(os.path.abspath(source))]
+    output_path = os.path.normcase(os.path.realpath(output))
+    for directory in output_dirs:
+        directory = os.path.normcase(os.path.realpath(directory))
+        try:
+            inside = os.path.commonpath([output_path, directory]) == directory
+        except ValueError:
+            inside = False  # 不同驱动器
+        if inside and output_path != directory:
+            break
+    else:
+        raise ValueError(f"输出路径不在允许的目录中: {output}")
+    if os.path.lexists(output):
+        raise ValueError(f"输出文件已存在: {output}")
+
+
+class JobAPIServer:
+    """任务队列的本地HTTP/JSON接口
+
+    POST /jobs                 提交任务 {"kind": ..., "params": {...}}
+    GET  /jobs                 任务列表
+    GET  /jobs/<id>            任务状态；带?since=<版本号>时长轮询直到有变化
+    GET  /jobs/<id>/events     以SSE推送任务状态，任务结束后关闭
+    POST /jobs/<id>/cancel     取消任务（也可用DELETE /jobs/<id>）
+    所有请求需要带"Authorization: Bearer <token>"，没有指定token时使用load_api_token()；
+    Host/Origin不是本机接口地址的请求被拒绝（防止网页通过DNS重绑定或跨站请求访问），
+    提交任务必须使用Content-Type: application/json。
+    """
+
+    def __init__(self, scheduler, token=None, output_dirs=None):
+        self.scheduler = scheduler
+        self.token = token or load_api_token()
+        if output_dirs is None:
+            output_dirs = [path for path in os.getenv('VIDEO_TOOL_API_OUTPUT_DIR', '').split(os.pathsep) if path]
+        self.output_dirs = output_dirs
+        self._server = None
+
+    def serve(self, port, host='127.0.0.1'):
+        """启动HTTP服务（后台线程）；每个连接一个线程，长连接不会阻塞其他请求"""
+        scheduler = self.scheduler
+        token = self.token
+        output_dirs = self.output_dirs
+        local_hosts = {f'{host}:{port}', f'127.0.0.1:{port}', f'localhost:{port}'}
+
+        class JobHandler(BaseHTTPRequestHandler):
+            def _send_json(self, code, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _route(self):
+                """鉴权并拆分路径，返回(路径片段, 查询参数)，鉴权失败返回None"""
+                origin = self.headers.get('Origin')
+                if (self.headers.get('Host', '').lower() not in local_hosts
+                        or (origin is not None and urlsplit(origin).netloc.lower() not in local_hosts)):
+                    self._send_json(403, {'error': 'forbidden host or origin'})
+                    return None
+                if not secrets.compare_digest(self.headers.get('Authorization', ''), f'Bearer {token}'):
+                    self._send_json(401, {'error': 'unauthorized'})
+                    return None
+                url = urlsplit(self.path)
+                return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+            def do_GET(self):
+                route = self._route()
+                if route is None:
+                    return
+                parts, query = route
+                if parts == ['jobs']:
+                    self._send_json(200, {'jobs': scheduler.list_jobs()})
+                elif len(parts) == 2 and parts[0] == 'jobs':
+                    since = query.get('since')
+                    if since:
+                        try:
+                            timeout = min(60.0, float(query.get('timeout', ['30'])[0]))
+                            job = scheduler.wait(parts[1], int(since[0]), timeout)
+                        except ValueError:
+                            self._send_json(400, {'error': 'invalid since/timeout'})
+                            return
+                    else:
+                        job = scheduler.get(parts[1])
+                    if job is None:
+                        self._send_json(404, {'error': 'job not found'})
+                    else:
+                        self._send_json(200, job)
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+                    self._stream_events(parts[1])
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def _stream_events(self, job_id):
+                job = scheduler.get(job_id)
+                if job is None:
+                    self._send_json(404, {'error': 'job not found'})
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                version = -1
+                try:
+                    while True:
+                        if job['version'] != version:
+                            version = job['version']
+                            data = json.dumps(job, ensure_ascii=False)
+                            self.wfile.write(f"event: job\ndata: {data}\n\n".encode('utf-8'))
+                        else:
+                            self.wfile.write(b": keepalive\n\n")
+                        self.wfile.flush()
+                        if job['state'] in JOB_FINAL_STATES:
+                            break
+                        job = scheduler.wait(job_id, version, timeout=15.0)
+                        if job is None:
+                            break
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端断开
+
+            def do_POST(self):
+                route = self._route()
+                if route is None:
+                    return
+                parts, _ = route
+                if parts == ['jobs']:
+                    content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                    if content_type != 'application/json':
+                        self._send_json(415, {'error': 'Content-Type must be application/json'})
+                        return
+                    try:
+                        length = int(self.headers.get('Content-Length', 0))
+                        request = json.loads(self.rfile.read(length) or b'{}')
+                        job = scheduler.submit(request.get('kind'), request.get('params', {}), origin='api',
+                                               check=lambda kind, params: check_api_output(kind, params, output_dirs))
+                    except (ValueError, AttributeError, TypeError) as e:
+                        self._send_json(400, {'error': str(e)})
+                        return
+                    self._send_json(201, job)
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+                    self._cancel(parts[1])
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def do_DELETE(self):
+                route = self._route()
+                if route is None:
+                    return
+                parts, _ = route
+                if len(parts) == 2 and parts[0] == 'jobs':
+                    self._cancel(parts[1])
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def _cancel(self, job_id):
+                if scheduler.get(job_id) is None:
+                    self._send_json(404, {'error': 'job not found'})
+                elif scheduler.cancel(job_id):
+                    self._send_json(202, scheduler.get(job_id))
+                else:
+                    self._send_json(409, {'error': 'job already finished'})
+
+            def log_message(self, format, *args):
+                api_log.debug(format % args)
+
+        class JobHTTPServer(ThreadingHTTPServer):
+            request_queue_size = 256  # 大量客户端同时轮询时不拒绝连接
+
+        self._server = JobHTTPServer((host, port), JobHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"任务接口: http://{host}:{port}/jobs")
+
+    def shutdown(self):
+        """关闭HTTP服务"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+# 合并列表的列：(标题, 排序键)
+MERGE_COLUMNS = (("文件名", 'name'), ("格式", 'format'), ("大小", 'size'),
+                 ("时长", 'duration'), ("码率", 'bitrate'), ("帧率", 'fps'))
+MergeRow = namedtuple('MergeRow', ['id', 'path', 'values', 'keys'])
+
+
+class MergeList:
+    """合并列表的数据模型：行按稳定的id标识，path到id有索引，排序使用原始数值
+
+    界面只显示这里的数据，不从显示文字反查文件，同名文件（如不同存储卡的C0001.MP4）互不影响。
+    """
+
+    def __init__(self):
+        self._rows = {}  # id -> MergeRow
+        self._order = []  # 当前顺序的id
+        self._by_path = {}  # 规范化路径 -> id
+        self._next_id = 0
+
+    @staticmethod
+    def _path_key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, path):
+        return self._path_key(path) in self._by_path
+
+    def add(self, path, values, keys):
+        """追加一行，values为各列显示文字，keys为各列排序值（未知为None）；已存在时返回None"""
+        path_key = self._path_key(path)
+        if path_key in self._by_path:
+            return None
+        self._next_id += 1
+        row = MergeRow(self._next_id, os.path.abspath(path), tuple(values), dict(keys))
+        self._rows[row.id] = row
+        self._order.append(row.id)
+        self._by_path[path_key] = row.id
+        return row.id
+
+    def remove(self, ids):
+        """删除一组行"""
+        ids = {row_id for row_id in ids if row_id in self._rows}
+        if not ids:
+            return
+        self._order = [row_id for row_id in self._order if row_id not in ids]
+        for row_id in ids:
+            row = self._rows.pop(row_id)
+            del self._by_path[self._path_key(row.path)]
+
+    def clear(self):
+        self._rows.clear()
+        self._order.clear()
+        self._by_path.clear()
+
+    def row(self, row_id):
+        return self._rows[row_id]
+
+    def row_at(self, index):
+        return self._rows[self._order[index]]
+
+    def index_of(self, row_id):
+        return self._order.index(row_id)
+
+    def ids(self):
+        return list(self._order)
+
+    def paths(self):
+        """按当前顺序的文件路径列表（副本）"""
+        return [self._rows[row_id].path for row_id in self._order]
+
+    def move(self, ids, direction):
+        """把选中的行整体上移（-1）或下移（1）一位，已到边界时不动；返回是否移动"""
+        selected = set(ids)
+        positions = [i for i, row_id in enumerate(self._order) if row_id in selected]
+        if not positions:
+            return False
+        if direction < 0 and positions[0] == 0 or direction > 0 and positions[-1] == len(self._order) - 1:
+            return False
+        order = self._order
+        for i in (positions if direction < 0 else reversed(positions)):
+            order[i], order[i + direction] = order[i + direction], order[i]
+        return True
+
+    def sort(self, key, reverse=False):
+        """按列的排序值排序，未知值始终排在最后；相同值保持原有顺序"""
+        known = [row_id for row_id in self._order if self._rows[row_id].keys.get(key) is not None]
+        unknown = [row_id for row_id in self._order if self._rows[row_id].keys.get(key) is None]
+        known.sort(key=lambda row_id: self._rows[row_id].keys[key], reverse=reverse)
+        self._order = known + unknown
+
+
+class VirtualTreeview:
+    """只渲染可见行的Treeview：数据在MergeList中，滚动时复用固定数量的行控件
+
+    选中状态按行id保存在这里，滚出可见范围后仍然保留。
+    """
+
+    def __init__(self, tree, scrollbar, model):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.model = model
+        self.offset = 0
+        self.selected = set()
+        self._items = []  # 复用的行控件iid
+        self._visible = {}  # iid -> 行id
+        self._row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        scrollbar.configure(command=self.yview)
+        tree.bind('<Configure>', lambda e: self.refresh())
+        tree.bind('<<TreeviewSelect>>', self._on_select)
+        tree.bind('<MouseWheel>', lambda e: self.scroll(-1 if e.delta > 0 else 1, 'units', 3))
+        tree.bind('<Button-4>', lambda e: self.scroll(-1, 'units', 3))
+        tree.bind('<Button-5>', lambda e: self.scroll(1, 'units', 3))
+
+    def _page_size(self):
+        return max(1, self.tree.winfo_height() // self._row_height - 1)  # 去掉标题行
+
+    def refresh(self):
+        """按当前偏移重新填充可见行"""
+        page = self._page_size()
+        total = len(self.model)
+        self.offset = max(0, min(self.offset, total - page))
+        while len(self._items) < page:
+            self._items.append(self.tree.insert('', 'end', values=()))
+        while len(self._items) > page:
+            self.tree.delete(self._items.pop())
+        self._visible = {}
+        selection = []
+        for i, iid in enumerate(self._items):
+            index = self.offset + i
+            if index >= total:
+                self.tree.detach(iid)
+                continue
+            row = self.model.row_at(index)
+            self._visible[iid] = row.id
+            self.tree.item(iid, values=row.values)
+            self.tree.move(iid, '', i)
+            if row.id in self.selected:
+                selection.append(iid)
+        self.tree.selection_set(selection)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + page) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_select(self, event=None):
+        """把可见范围内的选中状态同步到行id（不可见行的选中状态不变）"""
+        current = {self._visible[iid] for iid in self.tree.selection() if iid in self._visible}
+        self.selected = (self.selected - set(self._visible.values())) | current
+
+    def scroll(self, amount, what='units', step=1):
+        page = self._page_size()
+        self.offset += amount * (page if what == 'pages' else step)
+        self.refresh()
+
+    def yview(self, *args):
+        """滚动条回调：('moveto', 比例) 或 ('scroll', 数量, 'units'/'pages')"""
+        if args and args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.model))
+            self.refresh()
+        elif args and args[0] == 'scroll':
+            self.scroll(int(args[1]), args[2])
+
+    def selection(self):
+        """选中的行id（按列表顺序）"""
+        self.selected &= set(self.model.ids())
+        return [row_id for row_id in self.model.ids() if row_id in self.selected]
+
+    def see(self, row_id):
+        """滚动到能看到指定行"""
+        index = self.model.index_of(row_id)
+        page = self._page_size()
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + page:
+            self.offset = index - page + 1
+        self.refresh()
+
+    def clear_selection(self):
+        self.selected.clear()
+        self.refresh()
+
+
+class VideoTrimmerPro:
+    def __init__(self):
+        # 强制刷新标准输出
+        sys.stdout.flush()
+
+        self.root = tkinterdnd2.TkinterDnD.Tk()
+        self.root.title("专业视频剪辑工具")
+        self.root.geometry("1280x720")
+        self.root.configure(bg="#333333")
+
+        # 添加窗口最大化设置
+        self.root.state('zoomed')  # Windows系统
+        # self.root.attributes('-zoomed', True)  # Linux系统
+
+        # 初始化变量
+        self.video_path = ""
+        self.cap = None
+        self.total_frames = 0
+        self.fps = 30
+        self.duration = 0.0
+        self.is_processing = False
+        self.preview_scale = 1.0
+        self.last_position = 0
+        self.preview_timer = None
+        self.is_high_res = False  # 是否高分辨率视频
+        self.preview_enabled = True  # 控制预览功能的开关
+        self.progress_var = tk.DoubleVar()  # 进度条变量
+        self.preview_lock = threading.Lock()  # 添加互斥锁
+        self.current_preview_task = None  # 当前预览任务的标识
+        self.is_preview_loading = False  # 添加预览加载状态标志
         self._update_timer = None  # 初始化_update_timer属性
 
-        # 新增：视频列表相关变量
-        self.video_list = []  # 存储视频文件路径列表
+        # 新增：视频列表相关变量
+        self.merge_list = MergeList()  # 合并列表（路径、显示文字和排序值）
+
+        # 多片段剪辑：[(开始秒, 结束秒), ...]
+        self.segments = []
+
+        # 场景/黑场/静音检测结果（当前剪切视频）
+        self.scene_events = []
+        self.snap_points = []
+        self.is_analyzing = False
         self.is_merging = False  # 视频合并状态标志
+        self.subtitle_pause_requested = False  # 硬字幕分段生成的暂停请求
+        self.subtitle_process = None  # 硬字幕当前段（或拼接）的FFmpeg进程，暂停时只停止它
 
         # 软字幕相关变量
         self.soft_subtitle_cap = None
         self.soft_subtitle_timer = None
         self.soft_current_subtitle = ""
         self.soft_subtitles = []
+        self.soft_tracks = []  # [SubtitleTrack]，一次封装进输出文件
+        self.soft_existing_subtitles = []  # 当前视频中已有的字幕流（parse_media_info）
         self.soft_is_previewing = False
         self.soft_is_generating = False
 
@@ -292,11 +4954,40 @@ class VideoTrimmerPro:
         }
 
         # 进程管理
-        self.active_processes = []  # 跟踪所有活跃的FFmpeg进程
+        self.active_processes = ProcessRegistry()  # 跟踪所有活跃的FFmpeg进程（线程安全）
+        self.supervisor = get_supervisor()  # 所有子进程的管道读取和终止都在这个事件循环中进行
+
+        # 任务指标
+        self.metrics = MetricsRegistry()
+
+        # 按文件身份缓存的探测结果（完整性检查等）
+        self.probe_cache = ProbeCache()
+
+        # 进度条拖动预览（按标签页区分：'convert'、'subtitle'）
+        self.preview_sources = {}  # 当前视频路径
+        self.preview_sprites = {}  # 缩略图拼图
+        self.preview_after_ids = {}  # 等待中的精确解码
+        self.preview_processes = {}  # 正在进行的精确解码进程
+        self.preview_generation = {}  # 每次拖动递增，旧的解码结果直接丢弃
+
+        # 界面和HTTP接口共用的任务队列
+        self.result_cache = ResultCache()
+        self.job_scheduler = JobScheduler(metrics=self.metrics, result_cache=self.result_cache)
+        self.api_server = None
 
         # 创建界面组件
         self.create_widgets()
 
+        # 界面更新总线：工作线程通过它更新进度，不直接访问Tk对象
+        self.ui_bus = UIUpdateBus(self.root)
+        self.ui_bus.register('trim', self.progress_var)
+        self.ui_bus.register('merge', self.progress_var)
+        self.ui_bus.register('subtitle', self.subtitle_progress_var)
+        self.ui_bus.register('soft_subtitle', self.soft_subtitle_progress_var)
+        self.ui_bus.register('denoise', self.audio_progress_var, self.video_audio_status_label)
+        self.ui_bus.register('convert', self.video_convert_progress_var, self.video_convert_status_label)
+        self.ui_bus.start()
+
         # 绑定窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
@@ -308,10 +4999,45 @@ class VideoTrimmerPro:
             signal.signal(signal.SIGINT, self.signal_handler)
             signal.signal(signal.SIGTERM, self.signal_handler)
 
+        # 窗口显示后在后台清理残留进程并检测FFmpeg，不阻塞启动
+        threading.Thread(target=self.startup_checks, daemon=True).start()
+
+        self.root.mainloop()
+
+    def startup_checks(self):
+        """启动后的后台检查（工作线程中运行，不访问Tk对象）"""
         # 启动时清理可能残留的FFmpeg进程
         self.cleanup_orphaned_processes()
 
-        self.root.mainloop()
+        # 设置了VIDEO_TOOL_METRICS_PORT时启动本地指标端点
+        metrics_port = os.getenv('VIDEO_TOOL_METRICS_PORT')
+        if metrics_port:
+            try:
+                self.metrics.serve(int(metrics_port))
+            except (OSError, ValueError) as e:
+                logger.warning(f"启动指标端点失败: {e}")
+
+        try:
+            discover_toolchain()
+        except Exception as e:
+            logger.error(f"检查 FFmpeg 时出错: {e}")
+            error_msg = f"找不到 FFmpeg！\n\n请确保：\n1. 已安装 FFmpeg 并添加到系统PATH\n2. 或者将 FFmpeg 放在程序目录下\n\n当前查找路径: {find_ffmpeg_path()}"
+            self.ui_bus.call(self.on_ffmpeg_missing, error_msg)
+            return
+
+        # 设置了VIDEO_TOOL_API_PORT时启动本地任务接口（需要FFmpeg可用）
+        api_port = os.getenv('VIDEO_TOOL_API_PORT')
+        if api_port:
+            try:
+                self.api_server = JobAPIServer(self.job_scheduler, token=os.getenv('VIDEO_TOOL_API_TOKEN'))
+                self.api_server.serve(int(api_port))
+            except (OSError, ValueError) as e:
+                logger.warning(f"启动任务接口失败: {e}")
+
+    def on_ffmpeg_missing(self, error_msg):
+        """FFmpeg不可用时提示并退出"""
+        messagebox.showerror("错误", error_msg)
+        self.on_closing()
 
     def create_widgets(self):
         """创建界面组件"""
@@ -362,16 +5088,11 @@ class VideoTrimmerPro:
         self.subtitle_preview_canvas = tk.Canvas(preview_frame, bg="#1e1e1e", bd=0, highlightthickness=0)
         self.subtitle_preview_canvas.pack(fill=tk.BOTH, expand=True)
 
-        # 字幕显示标签
-        self.subtitle_label = tk.Label(
-            preview_frame,
-            text="",
-            bg="#1e1e1e",
-            fg="white",
-            font=("微软雅黑", 24),
-            wraplength=1200
-        )
-        self.subtitle_label.pack(side=tk.BOTTOM, pady=20)
+        # 字幕由libass按烧录时的滤镜和样式渲染后叠加到画面上（所见即所得）
+        self.subtitle_overlays = SubtitleOverlayCache()
+        self.subtitle_preview_time = 0.0
+        self.subtitle_last_frame = None
+        self.subtitle_frame_size = None  # 原视频分辨率(宽, 高)
 
         # 控制区域 - 底部
         control_frame = tk.Frame(main_frame, bg="#333333")
@@ -478,7 +5199,26 @@ class VideoTrimmerPro:
         self.output_bitrate_var = tk.StringVar()
         self.output_bitrate_entry = ttk.Entry(style_frame, textvariable=self.output_bitrate_var, width=8)
         self.output_bitrate_entry.pack(side=tk.LEFT, padx=(0, 5))
-        ttk.Label(style_frame, text="k").pack(side=tk.LEFT)
+        ttk.Label(style_frame, text="k").pack(side=tk.LEFT, padx=(0, 15))
+
+        # 码率控制：硬字幕分段编码不支持两遍编码
+        self.subtitle_rate_mode_labels = {RATE_MODES[mode]: mode for mode in ('bitrate', 'quality')}
+        self.subtitle_rate_mode_var = tk.StringVar(value=RATE_MODES['bitrate'])
+        ttk.Combobox(
+            style_frame,
+            textvariable=self.subtitle_rate_mode_var,
+            values=list(self.subtitle_rate_mode_labels),
+            state="readonly",
+            width=8
+        ).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(style_frame, text="质量：").pack(side=tk.LEFT)
+        self.subtitle_quality_var = tk.IntVar(value=DEFAULT_QUALITY)
+        ttk.Spinbox(style_frame, from_=0, to=51, textvariable=self.subtitle_quality_var, width=4).pack(side=tk.LEFT)
+
+        # 预渲染字幕：每条字幕只渲染一次再叠加，含动画效果的字幕自动改为逐帧渲染
+        self.subtitle_prerender_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(style_frame, text="预渲染字幕", variable=self.subtitle_prerender_var).pack(
+            side=tk.LEFT, padx=(15, 0))
 
         # 进度条区域
         progress_slider_frame = tk.Frame(main_frame, bg="#333333")
@@ -507,9 +5247,12 @@ class VideoTrimmerPro:
         self.generate_btn.pack(side=tk.LEFT, padx=5)
 
         # 保存当前进度按钮
-        self.save_progress_btn = ttk.Button(button_frame, text="保存当前进度", command=self.save_current_progress, width=12, state="disabled")
+        self.save_progress_btn = ttk.Button(button_frame, text="暂停（可续传）", command=self.pause_subtitle_generation, width=14, state="disabled")
         self.save_progress_btn.pack(side=tk.LEFT, padx=5)
 
+        # 批量生成：视频和字幕配对后加入任务队列并行处理
+        ttk.Button(button_frame, text="批量生成...", command=self.batch_subtitle_dialog, width=10).pack(side=tk.LEFT, padx=5)
+
         # 进度条 - 最底部
         progress_frame = tk.Frame(main_frame, bg="#333333")
         progress_frame.pack(fill=tk.X)
@@ -545,6 +5288,11 @@ class VideoTrimmerPro:
         self.tab_control.add(self.video_convert_tab, text="视频转换")
         self.create_video_convert_tab()
 
+        # 任务队列标签页（界面和HTTP接口提交的任务）
+        self.job_queue_tab = ttk.Frame(self.tab_control)
+        self.tab_control.add(self.job_queue_tab, text="任务队列")
+        self.create_job_queue_tab()
+
         # 在合并标签页中创建视频列表区域
         merge_frame = tk.Frame(self.merge_tab, bg="#333333")
         merge_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -553,28 +5301,27 @@ class VideoTrimmerPro:
         list_frame = tk.Frame(merge_frame, bg="#1e1e1e")
         list_frame.pack(fill=tk.BOTH, expand=True)
 
-        # 创建树形视图显示视频列表
-        columns = ("文件名", "格式", "大小", "时长", "码率", "帧率")
+        # 创建树形视图显示视频列表（只渲染可见行，上万个文件也能流畅滚动和排序）
+        columns = tuple(title for title, _ in MERGE_COLUMNS)
         self.video_tree = ttk.Treeview(list_frame, columns=columns, show="headings", selectmode="extended")
 
         # 设置列标题和左对齐
-        for col in columns:
-            self.video_tree.heading(col, text=col, anchor='w', command=lambda c=col: self.sort_tree_column(c))
+        for col, key in MERGE_COLUMNS:
+            self.video_tree.heading(col, text=col, anchor='w', command=lambda k=key: self.sort_tree_column(k))
             self.video_tree.column(col, width=100, anchor='w')
 
         # 添加排序状态变量
         self.sort_column = None
         self.sort_reverse = False
 
-        self.video_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-
         # 添加滚动条
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.video_tree.yview)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical")
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.video_tree.configure(yscrollcommand=scrollbar.set)
+        self.video_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.merge_view = VirtualTreeview(self.video_tree, scrollbar, self.merge_list)
 
         # 绑定拖放事件
-        self.video_tree.drop_target_register(DND_FILES)
+        self.video_tree.drop_target_register(tkinterdnd2.DND_FILES)
         self.video_tree.dnd_bind('<<Drop>>', self.handle_drop)
 
         # 按钮区域
@@ -605,6 +5352,15 @@ class VideoTrimmerPro:
         clear_btn = ttk.Button(btn_frame, text="清空", command=self.clear_video_list)
         clear_btn.pack(side=tk.RIGHT, padx=5)
 
+        # 完整性预检：列表为空时检查整个文件夹
+        self.preflight_btn = ttk.Button(btn_frame, text="完整性检查", command=self.preflight_merge_list)
+        self.preflight_btn.pack(side=tk.RIGHT, padx=5)
+
+        self.integrity_tier_var = tk.StringVar(value=INTEGRITY_TIER_NAMES['packets'])
+        integrity_combo = ttk.Combobox(btn_frame, textvariable=self.integrity_tier_var, state="readonly", width=10,
+                                       values=[INTEGRITY_TIER_NAMES[t] for t in INTEGRITY_TIERS])
+        integrity_combo.pack(side=tk.RIGHT, padx=5)
+
         # 合并标签页进度条
         self.merge_progress_bar = ttk.Progressbar(merge_frame, variable=self.progress_var, maximum=100)
         self.merge_progress_bar.pack(fill=tk.X, padx=20, pady=5)
@@ -625,7 +5381,7 @@ class VideoTrimmerPro:
         self.drop_canvas.bind("<Configure>", self.redraw_drop_area)
         self.drop_canvas.bind("<Button-1>", self.open_file_dialog)
         # 注册拖放目标
-        self.drop_canvas.drop_target_register(DND_FILES)
+        self.drop_canvas.drop_target_register(tkinterdnd2.DND_FILES)
         self.drop_canvas.dnd_bind('<<Drop>>', self.handle_drop)
 
         # 双滑块控件
@@ -649,9 +5405,13 @@ class VideoTrimmerPro:
         self.end_label = tk.Label(self.time_frame, text="结束时间：00:00:00.000", bg="#333333", fg="white")
         self.end_label.pack(side=tk.RIGHT, padx=20)
 
+        # 片段列表
+        self.create_segment_panel(preview_frame)
+
         # 控制按钮
         self.control_btn = ttk.Button(preview_frame, text="开始剪辑", command=self.toggle_process)
         self.control_btn.pack(pady=5)
+        ttk.Button(preview_frame, text="加入任务队列", command=self.enqueue_trim).pack(pady=(0, 5))
 
         # 进度条
         self.progress_bar = ttk.Progressbar(preview_frame, variable=self.progress_var, maximum=100)
@@ -751,7 +5511,7 @@ class VideoTrimmerPro:
         for f in file_list:
             # 清理路径，移除可能的引号
             clean_path = f.strip().strip('"').strip("'")
-            if clean_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv', '.ts', '.wmv')):
+            if clean_path.lower().endswith(VIDEO_EXTENSIONS):
                 video_files.append(clean_path)
 
         print(f"[DEBUG] 过滤后的视频文件: {video_files}")
@@ -772,88 +5532,65 @@ class VideoTrimmerPro:
         else:  # 合并标签页
             print(f"[DEBUG] 在合并标签页，开始处理 {len(video_files)} 个文件到合并列表")
             for file_path in video_files:
+                # 验证文件是否存在
+                if not os.path.exists(file_path):
+                    print(f"[DEBUG] 文件不存在: {file_path}")
+                    continue
+                if file_path in self.merge_list:
+                    print(f"[DEBUG] 文件已在列表中，跳过: {file_path}")
+                    continue
                 try:
-                    print(f"[DEBUG] 处理文件: {file_path}")
-
-                    # 验证文件是否存在
-                    if not os.path.exists(file_path):
-                        print(f"[DEBUG] 文件不存在: {file_path}")
-                        continue
-
-                    # 获取绝对路径
-                    abs_path = os.path.abspath(file_path)
-                    print(f"[DEBUG] 绝对路径: {abs_path}")
-
-                    if abs_path not in self.video_list:
-                        print(f"[DEBUG] 文件不在列表中，开始添加: {abs_path}")
-                        try:
-                            # 获取基本文件信息
-                            filename = os.path.basename(abs_path)
-                            format_type = os.path.splitext(filename)[1][1:].upper()
-
-                            # 获取文件大小，处理特殊字符路径
-                            try:
-                                file_size = os.path.getsize(abs_path)
-                                size_str = self.format_file_size(file_size)
-                                print(f"[DEBUG] 文件大小获取成功: {size_str}")
-                            except Exception as e:
-                                print(f"[DEBUG] 获取文件大小失败: {e}")
-                                file_size = 0
-                                size_str = "未知"
-
-                            # 使用快速方法获取视频信息，处理特殊字符路径
-                            try:
-                                # 对于包含特殊字符的路径，使用原始字符串
-                                cap = cv2.VideoCapture(abs_path)
-                                if cap.isOpened():
-                                    # 获取视频属性
-                                    fps = cap.get(cv2.CAP_PROP_FPS)
-                                    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                                    duration = frame_count / fps if fps > 0 else 0
-                                    duration_str = self.format_duration(duration)
-                                    bitrate = file_size * 8 / (duration * 1000) if duration > 0 else 0
-                                    bitrate_str = f"{bitrate:.2f} Mbps"
-                                    fps_str = f"{fps:.2f} fps"
-                                    self.video_list.append(abs_path)
-
-                                    # 将信息添加到树形视图
-                                    print(f"[DEBUG] 添加到树形视图: {filename}")
-                                    self.video_tree.insert("", "end", values=(filename, format_type, size_str, duration_str, bitrate_str, fps_str))
-                                    cap.release()
-                                    print(f"[DEBUG] 文件添加成功: {filename}")
-                                else:
-                                    print(f"[DEBUG] 无法打开视频文件: {abs_path}")
-                                    # 即使无法打开视频，也添加到列表中，使用默认值
-                                    duration_str = "未知"
-                                    bitrate_str = "未知"
-                                    fps_str = "未知"
-                                    self.video_list.append(abs_path)
-                                    self.video_tree.insert("", "end", values=(filename, format_type, size_str, duration_str, bitrate_str, fps_str))
-                                    print(f"[DEBUG] 文件添加成功（使用默认值）: {filename}")
-                            except Exception as e:
-                                print(f"[DEBUG] 打开视频文件失败: {e}")
-                                # 即使失败，也添加到列表中，使用默认值
-                                duration_str = "未知"
-                                bitrate_str = "未知"
-                                fps_str = "未知"
-                                self.video_list.append(abs_path)
-                                self.video_tree.insert("", "end", values=(filename, format_type, size_str, duration_str, bitrate_str, fps_str))
-                                print(f"[DEBUG] 文件添加成功（使用默认值）: {filename}")
-                        except Exception as e:
-                            print(f"[DEBUG] 处理文件信息失败: {e}")
-                            # 使用最基本的默认值
-                            filename = os.path.basename(abs_path)
-                            format_type = os.path.splitext(filename)[1][1:].upper()
-                            self.video_list.append(abs_path)
-                            self.video_tree.insert("", "end", values=(filename, format_type, "未知", "未知", "未知", "未知"))
-                            print(f"[DEBUG] 文件添加成功（使用基本默认值）: {filename}")
-                    else:
-                        print(f"[DEBUG] 文件已在列表中，跳过: {abs_path}")
+                    values, keys = self.probe_merge_row(os.path.abspath(file_path))
+                    self.merge_list.add(file_path, values, keys)
                 except Exception as e:
                     print(f"[DEBUG] 处理文件出错: {file_path}, 错误: {str(e)}")
                     messagebox.showerror("错误", f"无法读取视频文件：{os.path.basename(file_path)}\n错误信息：{str(e)}")
 
-            print(f"[DEBUG] 处理完成，当前列表中有 {len(self.video_list)} 个文件")
+            self.merge_view.refresh()
+            print(f"[DEBUG] 处理完成，当前列表中有 {len(self.merge_list)} 个文件")
+
+    def probe_merge_row(self, abs_path):
+        """读取合并列表一行的显示文字和排序值，读不到的信息显示为“未知”"""
+        filename = os.path.basename(abs_path)
+        format_type = os.path.splitext(filename)[1][1:].upper()
+        keys = {'name': filename.casefold(), 'format': format_type,
+                'size': None, 'duration': None, 'bitrate': None, 'fps': None}
+
+        # 获取文件大小，处理特殊字符路径
+        try:
+            keys['size'] = os.path.getsize(abs_path)
+        except OSError as e:
+            print(f"[DEBUG] 获取文件大小失败: {e}")
+
+        # 使用快速方法获取视频信息，处理特殊字符路径
+        try:
+            cap = cv2.VideoCapture(abs_path)
+            try:
+                if cap.isOpened():
+                    fps = cap.get(cv2.CAP_PROP_FPS)
+                    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                    if fps > 0:
+                        keys['fps'] = fps
+                        keys['duration'] = frame_count / fps
+                else:
+                    print(f"[DEBUG] 无法打开视频文件: {abs_path}")
+            finally:
+                cap.release()
+        except Exception as e:
+            print(f"[DEBUG] 打开视频文件失败: {e}")
+
+        if keys['size'] is not None and keys['duration']:
+            keys['bitrate'] = keys['size'] * 8 / keys['duration'] / 1000000  # Mbps
+
+        values = (
+            filename,
+            format_type,
+            self.format_file_size(keys['size']) if keys['size'] is not None else "未知",
+            self.format_duration(keys['duration']) if keys['duration'] is not None else "未知",
+            f"{keys['bitrate']:.2f} Mbps" if keys['bitrate'] is not None else "未知",
+            f"{keys['fps']:.2f} fps" if keys['fps'] is not None else "未知",
+        )
+        return values, keys
 
     def format_file_size(self, size):
         """格式化文件大小"""
@@ -870,37 +5607,17 @@ class VideoTrimmerPro:
         seconds = seconds % 60
         return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
 
-    def sort_tree_column(self, col):
-        """对树形视图的列进行排序"""
-        if self.sort_column == col:
+    def sort_tree_column(self, key):
+        """按列的原始数值排序（大小按字节、时长按秒），再次点击同一列时倒序"""
+        if self.sort_column == key:
             self.sort_reverse = not self.sort_reverse
         else:
-            self.sort_column = col
+            self.sort_column = key
             self.sort_reverse = False
 
-        items = [(self.video_tree.set(item, col), item) for item in self.video_tree.get_children('')]
-        items.sort(reverse=self.sort_reverse)
-
-        for index, (_, item) in enumerate(items):
-            self.video_tree.move(item, '', index)
-
-        # 更新video_list的顺序以匹配UI排序
-        self.update_video_list_order()
-
-    def update_video_list_order(self):
-        """根据树形视图的显示顺序更新video_list"""
-        new_video_list = []
-        for item in self.video_tree.get_children(''):
-            filename = self.video_tree.item(item)['values'][0]
-            # 根据文件名找到对应的完整路径
-            for video_path in self.video_list:
-                if os.path.basename(video_path) == filename:
-                    new_video_list.append(video_path)
-                    break
-
-        # 更新video_list
-        self.video_list = new_video_list
-        print(f"[DEBUG] 排序后视频列表顺序: {[os.path.basename(v) for v in self.video_list]}")
+        self.merge_list.sort(key, self.sort_reverse)
+        self.merge_view.refresh()
+        print(f"[DEBUG] 按 {key} 排序，共 {len(self.merge_list)} 个文件")
 
     def add_video(self):
         """添加视频文件"""
@@ -920,88 +5637,38 @@ class VideoTrimmerPro:
                 self.handle_drop(DummyEvent(file_path))
 
     def remove_video(self):
-        """删除选中的视频"""
-        selected = self.video_tree.selection()
+        """删除选中的视频（支持多选）"""
+        selected = self.merge_view.selection()
         if selected:
-            item = selected[0]
-            filename = self.video_tree.item(item)['values'][0]
-            # 从列表和树形视图中删除
-            for file_path in self.video_list[:]:  # 使用切片创建副本进行迭代
-                if os.path.basename(file_path) == filename:
-                    self.video_list.remove(file_path)
-                    break
-            self.video_tree.delete(item)
+            self.merge_list.remove(selected)
+            self.merge_view.clear_selection()
 
     def move_video(self, direction):
         """移动视频位置 - 支持多选（Ctrl+点击、Shift+点击）"""
-        selected = self.video_tree.selection()
+        selected = self.merge_view.selection()
         if not selected:
             return
-
-        # 获取所有选中项的索引，按顺序排序
-        selected_indices = []
-        for item in selected:
-            index = self.video_tree.index(item)
-            selected_indices.append((index, item))
-
-        # 按索引排序，确保移动时保持相对顺序
-        selected_indices.sort(key=lambda x: x[0])
-
-        if direction == -1:  # 上移
-            # 检查是否可以上移（第一个选中项不能是第一个）
-            if selected_indices[0][0] == 0:
-                return
-
-            # 从前往后移动，避免索引冲突
-            for index, item in selected_indices:
-                self.video_tree.move(item, '', index - 1)
-
-            # 更新视频列表
-            self._update_video_list_from_tree()
-
-        elif direction == 1:  # 下移
-            # 检查是否可以下移（最后一个选中项不能是最后一个）
-            if selected_indices[-1][0] == len(self.video_list) - 1:
-                return
-
-            # 从后往前移动，避免索引冲突
-            for index, item in reversed(selected_indices):
-                self.video_tree.move(item, '', index + 1)
-
-            # 更新视频列表
-            self._update_video_list_from_tree()
-
-    def _update_video_list_from_tree(self):
-        """根据树形视图的当前顺序更新video_list"""
-        new_video_list = []
-        for item in self.video_tree.get_children(''):
-            filename = self.video_tree.item(item)['values'][0]
-            # 根据文件名找到对应的完整路径
-            for video_path in self.video_list:
-                if os.path.basename(video_path) == filename:
-                    new_video_list.append(video_path)
-                    break
-
-        # 更新video_list
-        self.video_list = new_video_list
-        print(f"[DEBUG] 更新后的视频列表顺序: {[os.path.basename(v) for v in self.video_list]}")
+        if self.merge_list.move(selected, direction):
+            # 手动调整顺序后，列标题的排序状态不再有效
+            self.sort_column = None
+            self.merge_view.see(selected[0] if direction < 0 else selected[-1])
 
     def clear_video_list(self):
         """清空视频列表"""
-        self.video_list.clear()
-        for item in self.video_tree.get_children():
-            self.video_tree.delete(item)
+        self.merge_list.clear()
+        self.merge_view.clear_selection()
 
     def detect_output_format(self):
         """检测输出格式：如果所有输入文件都是同一格式，则使用该格式；否则使用MP4"""
-        if not self.video_list:
+        videos = self.merge_list.paths()
+        if not videos:
             return ".mp4"
 
         # 获取第一个文件的格式
-        first_format = os.path.splitext(self.video_list[0])[1].lower()
+        first_format = os.path.splitext(videos[0])[1].lower()
 
         # 检查所有文件是否都是同一格式
-        for video in self.video_list:
+        for video in videos:
             current_format = os.path.splitext(video)[1].lower()
             if current_format != first_format:
                 # 如果格式不一致，默认使用MP4
@@ -1012,7 +5679,7 @@ class VideoTrimmerPro:
 
     def merge_videos(self):
         """合并视频文件"""
-        if len(self.video_list) < 2:
+        if len(self.merge_list) < 2:
             messagebox.showwarning("警告", "请至少添加两个视频文件")
             return
 
@@ -1022,7 +5689,7 @@ class VideoTrimmerPro:
 
         print("[DEBUG] 准备合并视频")
         print("[DEBUG] 待合并视频列表:")
-        for video in self.video_list:
+        for video in self.merge_list.paths():
             print(f"[DEBUG] - {video}")
 
         # 自动检测输出格式
@@ -1085,7 +5752,8 @@ class VideoTrimmerPro:
         self.disable_merge_buttons()
 
         # 创建合并线程
-        merge_thread = threading.Thread(target=self._merge_videos_thread, args=(save_path,))
+        merge_thread = threading.Thread(target=self._merge_videos_thread, args=(save_path, self.merge_list.paths()),
+                                        kwargs={'metrics': self.metrics.new_job('merge')})
         merge_thread.start()
 
     def disable_merge_buttons(self):
@@ -1098,10 +5766,13 @@ class VideoTrimmerPro:
         if hasattr(self, 'merge_btn'):
             self.merge_btn.config(text="合并选中视频", state="normal")
 
-    def _merge_videos_thread(self, output_path):
-        """视频合并线程"""
-        process = None
+    def _merge_videos_thread(self, output_path, videos, metrics=None):
+        """视频合并线程（videos为开始合并时列表的快照）"""
+        metrics = metrics or self.metrics.new_job('merge')
+        returncode = -1
         try:
+            metrics.mark('probe')
+            metrics.add_input(*videos)
             print("开始合并视频")
             print(f"输出路径: {output_path}")
 
@@ -1109,7 +5780,7 @@ class VideoTrimmerPro:
             temp_list = os.path.join(os.path.dirname(output_path), "temp_list.txt")
             print(f"[DEBUG] 临时文件列表路径: {temp_list}")
             with open(temp_list, "w", encoding="utf-8") as f:
-                for video in self.video_list:
+                for video in videos:
                     # 使用绝对路径，确保路径格式正确
                     abs_video_path = os.path.abspath(video)
                     # 在Windows上使用正斜杠，并转义特殊字符
@@ -1138,138 +5809,42 @@ class VideoTrimmerPro:
 
             print("执行命令:", " ".join(cmd))
 
-            # 使用subprocess.Popen执行命令，支持进度条更新
-            if sys.platform == 'win32':
-                creation_flags = subprocess.CREATE_NO_WINDOW  # 合并视频不需要控制台窗口
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in cmd)
-
-                process = subprocess.Popen(
-                    cmd_str,
-                    shell=True,
-                    stdin=subprocess.PIPE,  # 添加stdin管道
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,  # 合并stderr到stdout
-                    universal_newlines=True,
-                    encoding='utf-8',
-                    creationflags=creation_flags
-                )
-            else:
-                creation_flags = 0
-
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,  # 添加stdin管道
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,  # 合并stderr到stdout
-                    universal_newlines=True,
-                    encoding='utf-8',
-                    creationflags=creation_flags
-                )
-
-            # 将进程添加到跟踪列表
-            self.active_processes.append(process)
-            print(f"[DEBUG] 启动FFmpeg进程 PID: {process.pid}")
-
-            # 优化的进度更新逻辑 - 针对流复制模式
-            import time
-
             # 计算总文件大小
             total_size = 0
-            for video in self.video_list:
+            for video in videos:
                 if os.path.exists(video):
                     total_size += os.path.getsize(video)
 
             print(f"[DEBUG] 总文件大小: {total_size / (1024*1024):.1f} MB")
 
-            # 进度更新变量
-            last_size = 0
+            # 流复制模式下按输出文件大小估算进度
+            last_size = [0]
             start_time = time.time()
 
-            # 初始进度
-            self.root.after(0, lambda: self.progress_var.set(5))
-
-            # 处理FFmpeg输出
-            timeout_count = 0
-            max_timeout = 30  # 30秒超时
-
-            while True:
-                # 检查进程是否结束
-                if process.poll() is not None:
-                    print(f"[DEBUG] FFmpeg进程已结束，返回码: {process.returncode}")
-                    break
-
-                # 读取输出
-                try:
-                    # 使用非阻塞方式读取
-                    import select
-                    if sys.platform != 'win32':
-                        # Linux/Mac使用select
-                        ready, _, _ = select.select([process.stdout], [], [], 0.1)
-                        if ready:
-                            line = process.stdout.readline()
-                            if line:
-                                print(f"[FFmpeg] {line.strip()}")
-                                timeout_count = 0
-                    else:
-                        # Windows使用简单的readline
-                        line = process.stdout.readline()
-                        if line:
-                            print(f"[FFmpeg] {line.strip()}")
-                            timeout_count = 0
-                        else:
-                            timeout_count += 1
-                except Exception as e:
-                    print(f"[DEBUG] 读取输出错误: {e}")
-                    timeout_count += 1
-
-                # 基于输出文件大小更新进度
-                if os.path.exists(output_path):
-                    current_size = os.path.getsize(output_path)
-                    if current_size > last_size and total_size > 0:
-                        # 计算进度百分比，留10%给最终处理
-                        progress = min(90, (current_size / total_size) * 90)
-                        self.root.after(0, lambda p=progress: self.progress_var.set(p))
-
-                        # 计算速度
-                        elapsed_time = time.time() - start_time
-                        if elapsed_time > 0:
-                            speed_mbps = (current_size / (1024*1024)) / elapsed_time
-                            print(f"[DEBUG] 进度: {progress:.1f}% ({current_size / (1024*1024):.1f}MB / {total_size / (1024*1024):.1f}MB) 速度: {speed_mbps:.1f}MB/s")
-
-                        last_size = current_size
-                        timeout_count = 0
-
-                # 检查超时
-                if timeout_count > max_timeout:
-                    print(f"[DEBUG] FFmpeg进程超时，强制终止")
-                    process.terminate()
-                    break
-
-                # 短暂休眠
-                time.sleep(0.1)
+            def on_line(line):
+                metrics.observe_line(line)
+                if total_size <= 0 or not os.path.exists(output_path):
+                    return
+                current_size = os.path.getsize(output_path)
+                if current_size > last_size[0]:
+                    # 计算进度百分比，留10%给最终处理
+                    progress = min(90, (current_size / total_size) * 90)
+                    self.ui_bus.progress('merge', progress)
+
+                    # 计算速度
+                    elapsed_time = time.time() - start_time
+                    if elapsed_time > 0:
+                        speed_mbps = (current_size / (1024*1024)) / elapsed_time
+                        progress_log.debug(f"进度: {progress:.1f}% ({current_size / (1024*1024):.1f}MB / {total_size / (1024*1024):.1f}MB) 速度: {speed_mbps:.1f}MB/s")
+                    last_size[0] = current_size
 
-            # 安全关闭输出流
-            try:
-                if process.stdout:
-                    process.stdout.close()
-                if process.stderr:
-                    process.stderr.close()
-            except AttributeError:
-                pass
+            # 初始进度
+            self.ui_bus.progress('merge', 5)
 
-            # 等待进程完全结束并获取返回值
-            try:
-                returncode = process.wait(timeout=300)  # 5分钟超时
-                print(f"[DEBUG] FFmpeg进程正常结束，返回码: {returncode}")
-            except subprocess.TimeoutExpired:
-                print("[DEBUG] FFmpeg进程超时，强制终止")
-                process.terminate()
-                try:
-                    returncode = process.wait(timeout=10)
-                except subprocess.TimeoutExpired:
-                    process.kill()
-                    returncode = -1
+            metrics.mark('spawn')
+            returncode, stderr = self._run_tracked_ffmpeg(cmd, on_line=on_line, metrics=metrics)
+            print(f"[DEBUG] FFmpeg进程已结束，返回码: {returncode}")
+            metrics.mark('finalize')
 
             # 清理临时文件
             try:
@@ -1280,53 +5855,24 @@ class VideoTrimmerPro:
             # 检查结果
             if returncode == 0 and os.path.exists(output_path):
                 # 合并成功，设置进度条为100%
-                self.root.after(0, lambda: self.progress_var.set(100))
-                self.root.after(0, self.handle_merge_completion, returncode, output_path)
+                self.ui_bus.progress('merge', 100)
+                self.ui_bus.call(self.handle_merge_completion, returncode, output_path)
             else:
                 error_msg = f"合并失败：FFmpeg返回错误代码 {returncode}"
                 print(error_msg)
-                self.root.after(0, messagebox.showerror, "错误", error_msg)
+                print(f"错误输出:\n{stderr[-2000:]}")
+                self.ui_bus.call(messagebox.showerror, "错误", error_msg)
 
         except Exception as e:
             print(f"合并失败：{str(e)}")
-            self.root.after(0, messagebox.showerror, "错误", str(e))
+            self.ui_bus.call(messagebox.showerror, "错误", str(e))
         finally:
-            # 清理进程资源
-            if process is not None:
-                try:
-                    # 从活跃进程列表中移除
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                        print(f"[DEBUG] 从活跃进程列表中移除合并进程 PID: {process.pid}")
-
-                    # 确保进程已完全结束
-                    if process.poll() is None:
-                        print(f"[DEBUG] 合并进程 {process.pid} 仍在运行，等待其结束...")
-                        try:
-                            process.wait(timeout=5)
-                        except subprocess.TimeoutExpired:
-                            print(f"[DEBUG] 合并进程 {process.pid} 超时，强制终止")
-                            process.terminate()
-                            try:
-                                process.wait(timeout=2)
-                            except subprocess.TimeoutExpired:
-                                process.kill()
-
-                    # 关闭进程的stdin管道
-                    if hasattr(process, 'stdin') and process.stdin and not process.stdin.closed:
-                        try:
-                            process.stdin.close()
-                        except:
-                            pass
-
-                    print(f"[DEBUG] 合并进程 {process.pid} 清理完成")
-                except Exception as e:
-                    print(f"[DEBUG] 清理合并进程时出错: {e}")
+            metrics.finish(returncode, output_path)
 
             self.is_merging = False
             # 延迟重置进度条，让用户看到100%完成状态
-            self.root.after(2000, lambda: self.progress_var.set(0))  # 2秒后重置
-            self.root.after(0, self.enable_merge_buttons)
+            self.ui_bus.call(self.progress_var.set, 0, delay=2000)  # 2秒后重置
+            self.ui_bus.call(self.enable_merge_buttons)
 
     def handle_merge_completion(self, returncode, output_path):
         """处理合并完成回调"""
@@ -1341,9 +5887,9 @@ class VideoTrimmerPro:
                 try:
                     # 确保路径格式正确
                     if sys.platform == 'win32':
-                        subprocess.run(['explorer', output_dir], creationflags=subprocess.CREATE_NO_WINDOW)
+                        launch_detached(['explorer', output_dir])
                     else:
-                        subprocess.run(['xdg-open', output_dir])
+                        launch_detached(['xdg-open', output_dir])
                 except Exception as e:
                     logger.error(f"打开目录失败: {str(e)}")
                     print(f"[DEBUG] 打开目录失败: {str(e)}")
@@ -1404,6 +5950,11 @@ class VideoTrimmerPro:
             self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
             self.duration = self.total_frames / self.fps
             self.video_path = abs_path
+            self.segments = []
+            self.refresh_segment_list()
+
+            # 已分析过的文件直接使用缓存的检测结果
+            self.set_scene_events(self.probe_cache.get(ANALYSIS_NAMESPACE, abs_path) or [])
 
             # 分辨率检测
             width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -1470,13 +6021,8 @@ class VideoTrimmerPro:
                         output_path
                     ]
 
-                    # 执行ffmpeg命令 - 修复中文路径编码问题
-                    if sys.platform == 'win32':
-                        # 将命令列表转换为字符串，确保路径编码正确
-                        cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in ffmpeg_cmd)
-                        subprocess.run(cmd_str, shell=True, capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                    else:
-                        subprocess.run(ffmpeg_cmd, capture_output=True)
+                    # 执行ffmpeg命令（参数列表直接传递，中文路径无需转换）
+                    run_command(ffmpeg_cmd, timeout=30)
 
                     # 再次检查是否是最新的预览任务
                     if self.current_preview_task != new_task_id:
@@ -1588,6 +6134,9 @@ class VideoTrimmerPro:
             # 如果无法获取结束按钮位置，使用默认限制
             x = max(margin, min(event.x, width - margin))
         x = min(x, width - margin)
+        snapped_x = self.snap_slider_x(x, event)
+        if end_pos is None or snapped_x < end_pos:
+            x = snapped_x
 
         # 更新开始按钮位置 - 倒水滴形状
         height = self.track_canvas.winfo_height()
@@ -1650,6 +6199,9 @@ class VideoTrimmerPro:
             # 如果无法获取开始按钮位置，使用默认限制
             x = min(width - margin, max(event.x, margin))
         x = max(x, margin)
+        snapped_x = self.snap_slider_x(x, event)
+        if start_pos is None or snapped_x > start_pos:
+            x = snapped_x
 
         # 更新结束按钮位置 - 倒水滴形状
         height = self.track_canvas.winfo_height()
@@ -1674,58 +6226,616 @@ class VideoTrimmerPro:
         end_time = position_ratio * self.duration
         self.update_time_labels(end=end_time)
 
-        # 立即取消当前预览任务
-        if self.current_preview_task:
-            self.current_preview_task = None
-        if self.preview_timer:
-            self.root.after_cancel(self.preview_timer)
-            self.preview_timer = None
+        # 立即取消当前预览任务
+        if self.current_preview_task:
+            self.current_preview_task = None
+        if self.preview_timer:
+            self.root.after_cancel(self.preview_timer)
+            self.preview_timer = None
+
+        # 延迟显示帧，避免频繁更新
+        if hasattr(self, '_update_timer') and self._update_timer is not None:
+            self.root.after_cancel(self._update_timer)
+
+        # 在拖动结束后恢复预览并更新帧
+        def on_drag_end(e=None):
+            self.preview_enabled = True
+            self._update_timer = self.root.after(100, lambda: self.show_frame(end_time))
+            self.track_canvas.unbind('<ButtonRelease-1>')
+
+        # 绑定鼠标释放事件
+        self.track_canvas.bind('<ButtonRelease-1>', on_drag_end)
+
+    def position_to_time(self, x):
+        """将滑块位置转换为时间"""
+        width = self.track_canvas.winfo_width()
+        margin = 20
+        track_width = width - (2 * margin)
+        position_ratio = (x - margin) / track_width
+        return position_ratio * self.duration
+
+    def get_slider_position(self, slider):
+        """获取滑块当前位置"""
+        coords = self.track_canvas.coords(slider)
+        if not coords or len(coords) < 6:
+            return None
+        # 对于倒水滴形状，取中间点的x坐标（底部尖点的x坐标）
+        return coords[2]
+
+    def update_time_labels(self, start=None, end=None):
+        """更新时间显示"""
+        if start is not None:
+            self.start_label.config(text=f"开始时间：{self.format_time(start)}")
+        if end is not None:
+            self.end_label.config(text=f"结束时间：{self.format_time(end)}")
+
+    def format_time(self, seconds):
+        """优化后的时间格式化"""
+        total_seconds = int(seconds)
+        milliseconds = int((seconds - total_seconds) * 1000)
+        hours = total_seconds // 3600
+        remainder = total_seconds % 3600
+        minutes = remainder // 60
+        seconds = remainder % 60
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+    def create_segment_panel(self, parent):
+        """创建多片段列表区域"""
+        segment_frame = tk.Frame(parent, bg="#333333")
+        segment_frame.pack(fill=tk.X, padx=20, pady=5)
+
+        columns = ("序号", "开始", "结束", "时长")
+        self.segment_tree = ttk.Treeview(segment_frame, columns=columns, show="headings", height=4, selectmode="browse")
+        for col in columns:
+            self.segment_tree.heading(col, text=col, anchor='w')
+            self.segment_tree.column(col, width=60 if col == "序号" else 120, anchor='w')
+        self.segment_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.segment_tree.bind('<Double-1>', self.on_segment_double_click)
+
+        btn_frame = tk.Frame(segment_frame, bg="#333333")
+        btn_frame.pack(side=tk.LEFT, padx=10)
+
+        ttk.Button(btn_frame, text="添加当前区间", command=self.add_segment).grid(row=0, column=0, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="删除片段", command=self.remove_segment).grid(row=0, column=1, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="上移", command=lambda: self.move_segment(-1)).grid(row=1, column=0, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="下移", command=lambda: self.move_segment(1)).grid(row=1, column=1, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="保存列表", command=self.save_segment_list).grid(row=2, column=0, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="载入列表", command=self.load_segment_list).grid(row=2, column=1, padx=2, pady=2, sticky='ew')
+
+        self.segment_mode_var = tk.StringVar(value="合并为一个文件")
+        ttk.Combobox(btn_frame, textvariable=self.segment_mode_var, state="readonly", width=12,
+                     values=["合并为一个文件", "分别导出"]).grid(row=3, column=0, padx=2, pady=2)
+        self.segment_export_btn = ttk.Button(btn_frame, text="导出片段", command=self.export_segments)
+        self.segment_export_btn.grid(row=3, column=1, padx=2, pady=2, sticky='ew')
+
+        # 场景/黑场/静音检测
+        self.analyze_btn = ttk.Button(btn_frame, text="检测切分点", command=self.analyze_scenes)
+        self.analyze_btn.grid(row=4, column=0, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="按切分点分段", command=self.split_at_events).grid(row=4, column=1, padx=2, pady=2, sticky='ew')
+
+        # 按大小/时长无损分割整个视频（在关键帧处切分）
+        self.split_mode_var = tk.StringVar(value=SPLIT_MODES['size'])
+        ttk.Combobox(btn_frame, textvariable=self.split_mode_var, state="readonly", width=12,
+                     values=list(SPLIT_MODES.values())).grid(row=5, column=0, padx=2, pady=2)
+        self.split_limit_var = tk.StringVar(value="2000")
+        ttk.Entry(btn_frame, textvariable=self.split_limit_var, width=8).grid(row=5, column=1, padx=2, pady=2, sticky='ew')
+        self.split_btn = ttk.Button(btn_frame, text="无损分割", command=self.split_by_limit)
+        self.split_btn.grid(row=6, column=0, columnspan=2, padx=2, pady=2, sticky='ew')
+
+    def refresh_segment_list(self):
+        """按self.segments刷新片段列表和轨道标记"""
+        if not hasattr(self, 'segment_tree'):
+            return
+        self.segment_tree.delete(*self.segment_tree.get_children())
+        for index, (start, end) in enumerate(self.segments):
+            self.segment_tree.insert("", "end", iid=str(index), values=(
+                index + 1, self.format_time(start), self.format_time(end), self.format_time(end - start)))
+        self.draw_segment_markers()
+
+    def draw_segment_markers(self):
+        """在轨道上画出已添加的片段"""
+        if not hasattr(self, 'track_canvas'):
+            return
+        self.track_canvas.delete("segment")
+        if self.duration <= 0:
+            return
+        width = self.track_canvas.winfo_width()
+        height = self.track_canvas.winfo_height()
+        margin = 20
+        track_width = width - (2 * margin)
+        for start, end in self.segments:
+            x1 = margin + track_width * start / self.duration
+            x2 = margin + track_width * end / self.duration
+            self.track_canvas.create_rectangle(x1, height/2 - 4, x2, height/2 + 4,
+                                               fill="#3399FF", outline="", tags="segment")
+        # 滑块保持在片段标记之上
+        self.track_canvas.tag_raise("start")
+        self.track_canvas.tag_raise("end")
+
+    def set_scene_events(self, events):
+        """设置当前视频的检测事件并刷新轨道标记"""
+        self.scene_events = events
+        self.snap_points = event_snap_points(events)
+        self.draw_event_markers()
+
+    def draw_event_markers(self):
+        """在轨道上画出检测到的场景变化（黄）、黑场（白）和静音（青）"""
+        if not hasattr(self, 'track_canvas'):
+            return
+        self.track_canvas.delete("event")
+        if self.duration <= 0 or not self.scene_events:
+            return
+        width = self.track_canvas.winfo_width()
+        height = self.track_canvas.winfo_height()
+        margin = 20
+        track_width = width - (2 * margin)
+        colors = {'scene': "#FFCC00", 'black': "#FFFFFF", 'silence': "#00CCCC"}
+        for event in self.scene_events:
+            x1 = margin + track_width * event['start'] / self.duration
+            x2 = margin + track_width * event['end'] / self.duration
+            if event['type'] == 'scene':
+                self.track_canvas.create_line(x1, height/2 + 6, x1, height/2 + 14,
+                                              fill=colors['scene'], width=1, tags="event")
+            else:
+                y = height/2 + 8 if event['type'] == 'black' else height/2 + 12
+                self.track_canvas.create_line(x1, y, max(x2, x1 + 1), y,
+                                              fill=colors[event['type']], width=2, tags="event")
+        self.track_canvas.tag_raise("start")
+        self.track_canvas.tag_raise("end")
+
+    def snap_slider_x(self, x, event=None, threshold=8):
+        """把滑块位置吸附到附近的检测点（按住Shift拖动时不吸附）"""
+        if not self.snap_points or self.duration <= 0:
+            return x
+        if event is not None and getattr(event, 'state', 0) & 0x0001:
+            return x
+        width = self.track_canvas.winfo_width()
+        margin = 20
+        track_width = width - (2 * margin)
+        time_at_x = (x - margin) / track_width * self.duration
+        nearest = min(self.snap_points, key=lambda t: abs(t - time_at_x))
+        snapped_x = margin + track_width * nearest / self.duration
+        return snapped_x if abs(snapped_x - x) <= threshold else x
+
+    def analyze_scenes(self):
+        """后台检测当前视频的场景变化、黑场和静音"""
+        if not self.video_path:
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        if self.is_analyzing:
+            messagebox.showinfo("提示", "正在检测中，请等待...")
+            return
+        self.is_analyzing = True
+        self.analyze_btn.config(text="检测中...", state="disabled")
+        threading.Thread(
+            target=self._analyze_scenes_thread,
+            args=(self.video_path, self.duration),
+            kwargs={'metrics': self.metrics.new_job('analyze')},
+            daemon=True
+        ).start()
+
+    def _analyze_scenes_thread(self, video_path, duration, metrics=None):
+        """检测线程（工作线程中运行，不访问Tk对象）"""
+        metrics = metrics or self.metrics.new_job('analyze')
+        events = []
+        returncode = -1
+        try:
+            metrics.mark('probe')
+            metrics.add_input(video_path)
+            cached = self.probe_cache.get(ANALYSIS_NAMESPACE, video_path)
+            if cached is not None:
+                events = cached
+                returncode = 0
+                return
+
+            cmd = build_analysis_cmd(video_path, with_audio=has_audio_stream(video_path))
+            print("[DEBUG] 检测命令：", ' '.join(cmd))
+
+            pending = {}
+
+            def on_line(line):
+                metrics.observe_line(line)
+                parse_detection_line(line, events, pending)
+                current = parse_ffmpeg_time(line)
+                if current is not None and duration > 0:
+                    self.ui_bus.progress('trim', min(99, current * 100 / duration))
+
+            metrics.mark('spawn')
+            returncode, _ = self._run_tracked_ffmpeg(cmd, on_line=on_line, metrics=metrics)
+            metrics.mark('finalize')
+            if returncode != 0:
+                raise Exception(f"检测失败，FFmpeg返回错误代码 {returncode}")
+
+            # 到文件末尾仍未结束的静音
+            if 'silence' in pending and duration > 0:
+                events.append({'type': 'silence', 'start': pending['silence'], 'end': duration})
+            events.sort(key=lambda e: e['start'])
+            self.probe_cache.put(ANALYSIS_NAMESPACE, video_path, events)
+            self.probe_cache.save()
+        except Exception as e:
+            print(f"检测切分点失败: {e}")
+            self.ui_bus.call(messagebox.showerror, "错误", f"检测切分点失败: {e}")
+        finally:
+            metrics.finish(returncode)
+            if returncode == 0:
+                self.ui_bus.call(self.on_scene_analysis_done, video_path, events)
+            self.ui_bus.call(self.progress_var.set, 0)
+            self.ui_bus.call(self.analyze_btn.config, text="检测切分点", state="normal")
+            self.is_analyzing = False
+
+    def on_scene_analysis_done(self, video_path, events):
+        """检测完成回调"""
+        if video_path != self.video_path:
+            return
+        self.set_scene_events(events)
+        counts = {kind: sum(1 for e in events if e['type'] == kind) for kind in ('scene', 'black', 'silence')}
+        messagebox.showinfo("检测完成",
+                            f"场景变化 {counts['scene']} 处，黑场 {counts['black']} 段，静音 {counts['silence']} 段\n"
+                            f"拖动滑块时会自动吸附到检测点（按住Shift不吸附）")
+
+    def split_by_limit(self):
+        """按大小或时长上限把整个视频无损分割成多个文件（用于上传限制）"""
+        if not self.video_path:
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        if self.is_processing:
+            messagebox.showinfo("提示", "正在处理中，请等待...")
+            return
+        modes = {name: mode for mode, name in SPLIT_MODES.items()}
+        mode = modes.get(self.split_mode_var.get(), 'size')
+        try:
+            limit = float(self.split_limit_var.get())
+            if limit <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("错误", "请输入大于0的分割上限")
+            return
+        # 内部统一用字节和秒
+        limit = limit * 1024 * 1024 if mode == 'size' else limit * 60
+
+        base, ext = os.path.splitext(self.video_path)
+        output_path = filedialog.asksaveasfilename(
+            title="选择分段文件名（自动添加序号）",
+            initialfile=os.path.basename(base) + "_part" + ext,
+            initialdir=os.path.dirname(self.video_path),
+            defaultextension=ext,
+            filetypes=[("视频文件", f"*{ext}")]
+        )
+        if not output_path:
+            return
+
+        self.is_processing = True
+        self.preview_enabled = False
+        self.progress_var.set(0)
+        self.split_btn.config(text="分割中...", state="disabled")
+        threading.Thread(
+            target=self._split_by_limit_thread,
+            args=(self.video_path, mode, limit, output_path),
+            kwargs={'metrics': self.metrics.new_job('split')},
+            daemon=True
+        ).start()
+
+    def _split_by_limit_thread(self, source, mode, limit, output_path, metrics=None):
+        """无损分割线程（工作线程中运行，不访问Tk对象）
+
+        先用ffprobe读出全部数据包的大小和关键帧位置（不解码）规划切分点，
+        再用segment复用器流复制一次写出所有分段，最后生成分段清单。
+        """
+        metrics = metrics or self.metrics.new_job('split')
+        base, ext = os.path.splitext(output_path)
+        list_path = f"{base}.csv"
+        manifest_path = f"{base}.json"
+        returncode = -1
+        try:
+            metrics.mark('probe')
+            metrics.add_input(source)
+            duration = probe_media_info(source).get('duration', 0)
+            scan = new_packet_scan()
+
+            def on_packet(line):
+                parse_packet_line(line, scan)
+
+            process = self.supervisor.spawn(build_packet_scan_cmd(source), on_stdout=on_packet)
+            self.active_processes.append(process)
+            try:
+                while True:
+                    try:
+                        process.wait(0.5)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if duration > 0:
+                            self.ui_bus.progress('trim', min(30, packet_scan_span(scan) * 30 / duration))
+            finally:
+                self.active_processes.remove(process)
+            if process.returncode != 0 or not scan['keyframes']:
+                raise Exception(f"读取关键帧失败: {process.stderr_text()[-300:]}")
+
+            duration = duration or packet_scan_span(scan)
+            keyframes = packet_scan_keyframes(scan)
+            if mode == 'size':
+                total = scan['bytes']
+                cuts = plan_split_points(keyframes, total, limit, SPLIT_SIZE_MARGIN)
+            else:
+                keyframes, total = [(t, t) for t, _ in keyframes], duration
+                cuts = plan_split_points(keyframes, total, limit)
+            print(f"[DEBUG] {len(scan['keyframes'])} 个关键帧，共 {scan['bytes']} 字节，切分点: {cuts}")
+            if not cuts:
+                returncode = 0
+                self.ui_bus.call(messagebox.showinfo, "提示", "视频没有超过分割上限，无需分割")
+                return
+
+            metrics.mark('spawn')
+            output_pattern = base.replace('%', '%%') + '%03d' + ext
+
+            def on_line(line):
+                metrics.observe_line(line)
+                current = parse_ffmpeg_time(line)
+                if current is not None and duration > 0:
+                    self.ui_bus.progress('trim', 30 + min(69, current * 70 / duration))
+
+            returncode, stderr = self._run_tracked_ffmpeg(
+                build_split_cmd(source, cuts, output_pattern, list_path), on_line=on_line, metrics=metrics)
+            metrics.mark('finalize')
+            if returncode != 0:
+                raise Exception(f"分割失败: {stderr[-300:]}")
+
+            parts = write_split_manifest(manifest_path, source, mode, limit, list_path)
+            os.remove(list_path)
+            metrics.add('bytes_written', sum(part['size'] for part in parts))
+            self.ui_bus.progress('trim', 100)
+            message = f"已分割为 {len(parts)} 个文件！\n保存目录：{os.path.dirname(output_path)}\n分段清单：{manifest_path}"
+            if mode == 'size':
+                over = [part['file'] for part in parts if part['size'] > limit]
+                if over:
+                    message += "\n\n以下分段的单个关键帧间隔就超过了上限，无法再切小：\n" + "\n".join(over)
+            self.ui_bus.call(messagebox.showinfo, "完成", message)
+        except Exception as e:
+            returncode = returncode or -1
+            print(f"无损分割失败: {e}")
+            self.ui_bus.call(messagebox.showerror, "错误", f"无损分割失败：\n{e}")
+        finally:
+            metrics.finish(returncode)
+            self.is_processing = False
+            self.preview_enabled = True
+            self.ui_bus.call(self.split_btn.config, text="无损分割", state="normal")
+            self.ui_bus.call(self.progress_var.set, 0, delay=2000)
+
+    def split_at_events(self):
+        """按检测到的切分点把整段视频拆成片段列表"""
+        if not self.scene_events:
+            messagebox.showwarning("警告", "请先检测切分点")
+            return
+        boundaries = event_boundaries(self.scene_events, self.duration)
+        points = [0.0] + boundaries + [self.duration]
+        self.segments = [(start, end) for start, end in zip(points, points[1:]) if end - start >= 0.1]
+        self.refresh_segment_list()
+
+    def add_segment(self):
+        """把当前开始/结束滑块之间的区间加入片段列表"""
+        if not self.video_path:
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        start_pos = self.get_slider_position("start")
+        end_pos = self.get_slider_position("end")
+        if start_pos is None or end_pos is None:
+            messagebox.showerror("错误", "无法获取滑块位置")
+            return
+        start_time = max(0.0, self.position_to_time(start_pos))
+        end_time = min(self.duration, self.position_to_time(end_pos))
+        if end_time - start_time < 0.1:
+            messagebox.showerror("错误", "剪切区间太短，至少需要0.1秒")
+            return
+        self.segments.append((start_time, end_time))
+        self.refresh_segment_list()
+
+    def remove_segment(self):
+        """删除选中的片段"""
+        selected = self.segment_tree.selection()
+        if selected:
+            del self.segments[int(selected[0])]
+            self.refresh_segment_list()
+
+    def move_segment(self, direction):
+        """上移/下移选中的片段（导出顺序即列表顺序）"""
+        selected = self.segment_tree.selection()
+        if not selected:
+            return
+        index = int(selected[0])
+        target = index + direction
+        if 0 <= target < len(self.segments):
+            self.segments[index], self.segments[target] = self.segments[target], self.segments[index]
+            self.refresh_segment_list()
+            self.segment_tree.selection_set(str(target))
+
+    def on_segment_double_click(self, event=None):
+        """双击片段时预览片段起点"""
+        selected = self.segment_tree.selection()
+        if selected:
+            start, end = self.segments[int(selected[0])]
+            self.update_time_labels(start, end)
+            self.show_frame(start)
+
+    def save_segment_list(self):
+        """保存片段列表为JSON或mpv EDL"""
+        if not self.segments:
+            messagebox.showwarning("警告", "片段列表为空")
+            return
+        base = os.path.splitext(self.video_path)[0]
+        path = filedialog.asksaveasfilename(
+            title="保存片段列表",
+            initialfile=os.path.basename(base) + ".json",
+            initialdir=os.path.dirname(self.video_path),
+            defaultextension=".json",
+            filetypes=[("JSON片段列表", "*.json"), ("mpv EDL", "*.edl")]
+        )
+        if path:
+            try:
+                save_edit_list(path, self.video_path, self.segments)
+            except Exception as e:
+                messagebox.showerror("错误", f"保存片段列表失败: {e}")
+
+    def load_segment_list(self):
+        """载入JSON或mpv EDL片段列表，源文件不同时自动加载源视频"""
+        path = filedialog.askopenfilename(
+            title="载入片段列表",
+            filetypes=[("片段列表", "*.json *.edl"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            source, segments = load_edit_list(path)
+        except Exception as e:
+            messagebox.showerror("错误", f"读取片段列表失败: {e}")
+            return
+        if source and os.path.abspath(source) != os.path.abspath(self.video_path or ""):
+            if not os.path.exists(source):
+                messagebox.showerror("错误", f"源视频不存在: {source}")
+                return
+            self.load_video(source)
+        self.segments = segments
+        self.refresh_segment_list()
 
-        # 延迟显示帧，避免频繁更新
-        if hasattr(self, '_update_timer') and self._update_timer is not None:
-            self.root.after_cancel(self._update_timer)
+    def export_segments(self):
+        """导出全部片段：分别保存或拼接为一个文件，均不重新编码"""
+        if not self.video_path:
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        if not self.segments:
+            messagebox.showwarning("警告", "请先添加片段")
+            return
+        if self.is_processing:
+            messagebox.showinfo("提示", "正在处理中，请等待...")
+            return
 
-        # 在拖动结束后恢复预览并更新帧
-        def on_drag_end(e=None):
-            self.preview_enabled = True
-            self._update_timer = self.root.after(100, lambda: self.show_frame(end_time))
-            self.track_canvas.unbind('<ButtonRelease-1>')
+        joined = self.segment_mode_var.get() == "合并为一个文件"
+        base, ext = os.path.splitext(self.video_path)
+        output_path = filedialog.asksaveasfilename(
+            title="保存导出文件" if joined else "选择导出文件名（自动添加序号）",
+            initialfile=os.path.basename(base) + ("_edited" if joined else "_segment") + ext,
+            initialdir=os.path.dirname(self.video_path),
+            defaultextension=ext,
+            filetypes=[("视频文件", f"*{ext}")]
+        )
+        if not output_path:
+            return
 
-        # 绑定鼠标释放事件
-        self.track_canvas.bind('<ButtonRelease-1>', on_drag_end)
+        self.is_processing = True
+        self.preview_enabled = False
+        self.progress_var.set(0)
+        self.segment_export_btn.config(text="导出中...", state="disabled")
+        threading.Thread(
+            target=self._export_segments_thread,
+            args=(self.video_path, list(self.segments), output_path, joined),
+            kwargs={'metrics': self.metrics.new_job('segments')},
+            daemon=True
+        ).start()
+
+    def _run_tracked_ffmpeg(self, cmd, on_line=None, should_stop=None, metrics=None, policy='foreground',
+                            log=None, on_spawn=None):
+        """由进程监管器运行一个FFmpeg进程并纳入活跃进程跟踪，返回(返回码, 错误输出)
+
+        on_line逐行回调错误输出（进度行），在监管线程中执行，只能做轻量的解析和投递；
+        should_stop返回True时逐级停止进程。返回的错误输出是统计行以外的最后几行，
+        完整输出写入任务日志（log，默认为metrics的任务日志）。
+        on_spawn(process)在进程启动后调用，调用方可以单独停止它或之后检查process.stopped。
+        界面中发起的处理默认按前台策略运行（优先级低于预览截帧）。
+        """
+        if log is None and metrics is not None:
+            log = metrics.job_log()
+        process = self.supervisor.spawn(cmd, on_stderr=on_line, policy=policy, log=log)
+        self.active_processes.append(process)
+        if on_spawn is not None:
+            on_spawn(process)
+        print(f"[DEBUG] 启动FFmpeg进程 PID: {process.pid}")
+        if metrics:
+            metrics.mark('first_frame')
+        try:
+            if should_stop is None:
+                process.wait()
+            else:
+                stopping = False
+                while True:
+                    try:
+                        process.wait(0.5)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if not stopping and should_stop():
+                            print(f"[DEBUG] 停止进程 PID {process.pid}")
+                            stopping = True
+                            self.supervisor.stop(process)
+            return process.returncode, process.stderr_text()
+        finally:
+            self.active_processes.remove(process)
 
-    def position_to_time(self, x):
-        """将滑块位置转换为时间"""
-        width = self.track_canvas.winfo_width()
-        margin = 20
-        track_width = width - (2 * margin)
-        position_ratio = (x - margin) / track_width
-        return position_ratio * self.duration
+    def _export_segments_thread(self, source, segments, output_path, joined, metrics=None):
+        """多片段导出线程（工作线程中运行，不访问Tk对象）
 
-    def get_slider_position(self, slider):
-        """获取滑块当前位置"""
-        coords = self.track_canvas.coords(slider)
-        if not coords or len(coords) < 6:
-            return None
-        # 对于倒水滴形状，取中间点的x坐标（底部尖点的x坐标）
-        return coords[2]
+        各片段用流复制并行提取；拼接模式下再用concat分离器无重编码合并。
+        """
+        metrics = metrics or self.metrics.new_job('segments')
+        base, ext = os.path.splitext(output_path)
+        work_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(output_path)) if joined else None
+        if joined:
+            outputs = [os.path.join(work_dir, f"part_{i:03d}{ext}") for i in range(len(segments))]
+        else:
+            outputs = [f"{base}_{i + 1:02d}{ext}" for i in range(len(segments))]
+        total_steps = len(segments) + (1 if joined else 0)
+        done = [0]
+        lock = threading.Lock()
+        returncode = -1
+
+        def extract(index):
+            start, end = segments[index]
+            result = self._run_tracked_ffmpeg(build_segment_copy_cmd(source, start, end, outputs[index]),
+                                              log=metrics.job_log())
+            with lock:
+                done[0] += 1
+                self.ui_bus.progress('trim', done[0] * 100 / total_steps)
+            return result
 
-    def update_time_labels(self, start=None, end=None):
-        """更新时间显示"""
-        if start is not None:
-            self.start_label.config(text=f"开始时间：{self.format_time(start)}")
-        if end is not None:
-            self.end_label.config(text=f"结束时间：{self.format_time(end)}")
+        try:
+            metrics.mark('probe')
+            metrics.add_input(source)
+            print(f"[DEBUG] 开始导出 {len(segments)} 个片段，{'拼接' if joined else '分别保存'}")
+
+            metrics.mark('encode')
+            with ThreadPoolExecutor(max_workers=min(len(segments), SEGMENT_WORKERS)) as pool:
+                results = list(pool.map(extract, range(len(segments))))
+            failed = [(i + 1, err) for i, (rc, err) in enumerate(results) if rc != 0]
+            if failed:
+                raise Exception("\n".join(f"片段{i}: {err[-200:]}" for i, err in failed[:5]))
+
+            metrics.mark('finalize')
+            if joined:
+                list_path = os.path.join(work_dir, "list.txt")
+                write_concat_list(list_path, outputs)
+                rc, err = self._run_tracked_ffmpeg(build_concat_copy_cmd(list_path, output_path),
+                                                   log=metrics.job_log())
+                if rc != 0:
+                    raise Exception(f"拼接失败: {err[-300:]}")
+                written = [output_path]
+            else:
+                written = outputs
 
-    def format_time(self, seconds):
-        """优化后的时间格式化"""
-        total_seconds = int(seconds)
-        milliseconds = int((seconds - total_seconds) * 1000)
-        hours = total_seconds // 3600
-        remainder = total_seconds % 3600
-        minutes = remainder // 60
-        seconds = remainder % 60
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+            metrics.add('bytes_written', sum(os.path.getsize(p) for p in written if os.path.exists(p)))
+            returncode = 0
+            self.ui_bus.progress('trim', 100)
+            if joined:
+                message = f"片段已拼接导出！\n保存路径：{output_path}"
+            else:
+                message = f"已导出 {len(written)} 个片段！\n保存目录：{os.path.dirname(output_path)}"
+            self.ui_bus.call(messagebox.showinfo, "完成", message)
+        except Exception as e:
+            print(f"导出片段失败: {e}")
+            self.ui_bus.call(messagebox.showerror, "错误", f"导出片段失败：\n{e}")
+        finally:
+            metrics.finish(returncode)
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            self.is_processing = False
+            self.preview_enabled = True
+            self.ui_bus.call(self.segment_export_btn.config, text="导出片段", state="normal")
+            self.ui_bus.call(self.progress_var.set, 0, delay=2000)
 
     def toggle_process(self):
         """切换处理状态"""
@@ -1786,7 +6896,8 @@ class VideoTrimmerPro:
             # 启动处理线程
             self.process_thread = threading.Thread(
                 target=self.run_ffmpeg,
-                args=(ffmpeg_cmd, output_path)
+                args=(ffmpeg_cmd, output_path),
+                kwargs={'metrics': self.metrics.new_job('trim')}
             )
             self.process_thread.start()
             self.is_processing = True
@@ -1797,131 +6908,50 @@ class VideoTrimmerPro:
             self.preview_enabled = True  # 确保预览功能被重新启用
             messagebox.showerror("错误", f"启动失败: {str(e)}")
 
-    def run_ffmpeg(self, cmd, output_path):
+    def run_ffmpeg(self, cmd, output_path, metrics=None):
         """执行FFmpeg命令"""
-        process = None
+        metrics = metrics or self.metrics.new_job('trim')
+        returncode = -1
         try:
-            # Windows系统特殊处理 - 修复中文路径编码问题
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in cmd)
-                creation_flags = subprocess.CREATE_NO_WINDOW  # 剪切功能不需要控制台窗口
-                encoding = 'utf-8'
-
-                # 使用shell=True来正确处理中文路径
-                process = subprocess.Popen(
-                    cmd_str,
-                    shell=True,
-                    stdin=subprocess.PIPE,  # 添加stdin管道
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True,
-                    encoding=encoding,
-                    creationflags=creation_flags
-                )
-            else:
-                creation_flags = 0
-                encoding = 'utf-8'
-
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,  # 添加stdin管道
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True,
-                    encoding=encoding,
-                    creationflags=creation_flags
-                )
-
-            # 将进程添加到跟踪列表
-            self.active_processes.append(process)
-            print(f"[DEBUG] 启动FFmpeg剪切进程 PID: {process.pid}")
-
+            metrics.add_input(self.video_path)
+            metrics.mark('spawn')
             # 实时输出处理日志并更新进度条
-            duration = None
-            time = 0
-            if process.stdout:
-                for line in iter(process.stdout.readline, ''):
-                    print(line.strip())
-
-                    # 解析FFmpeg输出以更新进度
-                    if 'Duration' in line:
-                        try:
-                            duration_str = line.split('Duration: ')[1].split(',')[0].strip()
-                            h, m, s = map(float, duration_str.split(':'))
-                            duration = h * 3600 + m * 60 + s
-                        except:
-                            pass
-                    elif 'time=' in line:
-                        try:
-                            time_str = line.split('time=')[1].split(' ')[0].strip()
-                            h, m, s = map(float, time_str.split(':'))
-                            time = h * 3600 + m * 60 + s
-                            if duration:
-                                progress = (time / duration) * 100
-                                self.root.after(0, lambda p=progress: self.progress_var.set(min(p, 100)))
-                        except:
-                            pass
+            duration = [None]
 
-                    if process.poll() is not None:
-                        break
+            def on_line(line):
+                metrics.observe_line(line)
 
-            # 安全关闭输出流
-            try:
-                if process.stdout:
-                    process.stdout.close()
-            except AttributeError:
-                pass
+                # 解析FFmpeg输出以更新进度
+                if 'Duration' in line:
+                    try:
+                        duration_str = line.split('Duration: ')[1].split(',')[0].strip()
+                        h, m, s = map(float, duration_str.split(':'))
+                        duration[0] = h * 3600 + m * 60 + s
+                    except (IndexError, ValueError):
+                        pass
+                else:
+                    current = parse_ffmpeg_time(line)
+                    if current is not None and duration[0]:
+                        self.ui_bus.progress('trim', min(current / duration[0] * 100, 100))
 
-            # 等待进程完全结束并获取返回值
-            process.wait()
-            returncode = process.returncode
+            returncode, _ = self._run_tracked_ffmpeg(cmd, on_line=on_line, metrics=metrics)
+            metrics.mark('finalize')
 
             # 处理完成回调
             if self.is_merging:
-                self.root.after(0, self.handle_merge_completion, returncode, output_path)
+                self.ui_bus.call(self.handle_merge_completion, returncode, output_path)
             else:
-                self.root.after(0, self.handle_completion, returncode, output_path)
+                self.ui_bus.call(self.handle_completion, returncode, output_path)
 
         except Exception as e:
-            self.root.after(0, messagebox.showerror, "错误", f"执行失败: {str(e)}")
+            self.ui_bus.call(messagebox.showerror, "错误", f"执行失败: {str(e)}")
         finally:
-            # 清理进程资源
-            if process is not None:
-                try:
-                    # 从活跃进程列表中移除
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                        print(f"[DEBUG] 从活跃进程列表中移除剪切进程 PID: {process.pid}")
-
-                    # 确保进程已完全结束
-                    if process.poll() is None:
-                        print(f"[DEBUG] 进程 {process.pid} 仍在运行，等待其结束...")
-                        try:
-                            process.wait(timeout=5)
-                        except subprocess.TimeoutExpired:
-                            print(f"[DEBUG] 进程 {process.pid} 超时，强制终止")
-                            process.terminate()
-                            try:
-                                process.wait(timeout=2)
-                            except subprocess.TimeoutExpired:
-                                process.kill()
-
-                    # 关闭进程的stdin管道
-                    if hasattr(process, 'stdin') and process.stdin and not process.stdin.closed:
-                        try:
-                            process.stdin.close()
-                        except:
-                            pass
-
-                    print(f"[DEBUG] 剪切进程 {process.pid} 清理完成")
-                except Exception as e:
-                    print(f"[DEBUG] 清理剪切进程时出错: {e}")
+            metrics.finish(returncode, output_path)
 
             self.is_processing = False
             self.preview_enabled = True  # 重新启用预览功能
-            self.root.after(0, lambda: self.control_btn.config(text="开始剪辑"))
-            self.root.after(0, lambda: self.progress_var.set(0))  # 重置进度条
+            self.ui_bus.call(self.control_btn.config, text="开始剪辑")
+            self.ui_bus.progress('trim', 0)  # 重置进度条
 
     def handle_completion(self, returncode, output_path):
         """处理完成回调"""
@@ -1929,7 +6959,7 @@ class VideoTrimmerPro:
         if returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             # 立即打开输出文件所在目录
             output_dir = os.path.dirname(output_path)
-            subprocess.run(['explorer', output_dir], creationflags=subprocess.CREATE_NO_WINDOW)
+            launch_detached(['explorer', output_dir])
             messagebox.showinfo("完成", f"视频处理成功！\n保存路径：{output_path}")
         else:
             error_msg = "处理失败：\n"
@@ -2003,14 +7033,16 @@ class VideoTrimmerPro:
             self.load_soft_subtitle_video(file_path)
 
     def select_soft_subtitle(self):
-        """选择软字幕文件"""
-        file_path = filedialog.askopenfilename(
+        """选择软字幕文件（可多选），每个文件添加为一条轨道"""
+        file_paths = filedialog.askopenfilenames(
             title="选择字幕文件",
             filetypes=[("字幕文件", "*.srt *.ass")]
         )
-        if file_path:
-            self.soft_subtitle_path_var.set(file_path)
-            self.load_soft_subtitles(file_path)
+        for file_path in file_paths:
+            self.add_soft_track(file_path)
+        if file_paths:
+            self.soft_subtitle_path_var.set(os.path.abspath(file_paths[-1]))
+            self.load_soft_subtitles(file_paths[-1])
 
     def select_video_for_audio_denoise(self):
         """选择用于音频降噪的视频文件"""
@@ -2077,6 +7109,7 @@ class VideoTrimmerPro:
                     
                     # 自动显示预览
                     self.show_video_convert_preview_first_frame()
+                    self.load_preview_sprites('convert', video_path, duration)
                     
                     # 启用进度条
                     self.video_convert_progress_slider.config(state='normal')
@@ -2185,16 +7218,7 @@ class VideoTrimmerPro:
         duration = total_frames / fps if fps > 0 else 0
         
         if duration > 0:
-            target_time = (progress / 100.0) * duration
-            try:
-                # 更新视频帧位置
-                self.video_convert_cap.set(cv2.CAP_PROP_POS_FRAMES, int(target_time * fps))
-                ret, frame = self.video_convert_cap.read()
-                if ret:
-                    # 显示帧
-                    self.show_video_convert_frame(frame)
-            except Exception as e:
-                print(f"预览更新失败: {str(e)}")
+            self.scrub_preview('convert', (progress / 100.0) * duration, self.show_video_convert_frame)
 
     def preview_video_audio(self):
         """预览视频"""
@@ -2286,36 +7310,7 @@ class VideoTrimmerPro:
             # 构建FFmpeg命令
             video_path_clean = os.path.abspath(video_path)
 
-            # 音频滤镜
-            audio_filters = []
-
-            # 降噪滤镜
-            if noise_reduction > 0:
-                if preserve_voice:
-                    # 使用highpass和lowpass保留人声频率范围
-                    audio_filters.append(f"highpass=f=80,lowpass=f=8000")
-                audio_filters.append(f"anlmdn=s={noise_reduction}")
-
-            # 音量放大
-            if volume_boost > 0:
-                # 将dB转换为线性增益
-                gain = 10 ** (volume_boost / 20)
-                audio_filters.append(f"volume={gain}")
-
-            # 构建FFmpeg命令
-            ffmpeg_cmd = [
-                FFMPEG_PATH,
-                '-y',
-                '-i', video_path_clean,
-                '-c:v', 'copy',  # 复制视频流
-            ]
-
-            if audio_filters:
-                ffmpeg_cmd.extend(['-af', ','.join(audio_filters)])
-            else:
-                ffmpeg_cmd.extend(['-c:a', 'copy'])  # 如果没有滤镜，复制音频流
-
-            ffmpeg_cmd.append(save_path)
+            ffmpeg_cmd = build_denoise_cmd(video_path_clean, save_path, noise_reduction, volume_boost, preserve_voice)
 
             print("FFmpeg命令:", " ".join(ffmpeg_cmd))
 
@@ -2329,7 +7324,8 @@ class VideoTrimmerPro:
             # 启动处理线程
             process_thread = threading.Thread(
                 target=self.run_video_audio_denoise,
-                args=(ffmpeg_cmd, save_path)
+                args=(ffmpeg_cmd, save_path, video_path_clean),
+                kwargs={'metrics': self.metrics.new_job('denoise')}
             )
             process_thread.start()
 
@@ -2340,6 +7336,95 @@ class VideoTrimmerPro:
             self.video_audio_denoise_btn.config(state='normal')
             self.video_audio_stop_btn.config(state='disabled')
 
+    def current_pipeline_steps(self):
+        """把各标签页的当前设置转换为流水线步骤参数（英文值）"""
+        trim = {'start': 0.0, 'end': None}
+        if self.video_path and self.duration > 0:
+            # 剪切页已加载视频时使用当前选区
+            start_pos = self.get_slider_position("start")
+            end_pos = self.get_slider_position("end")
+            if start_pos is not None and end_pos is not None:
+                trim = {'start': round(self.position_to_time(start_pos), 3),
+                        'end': round(self.position_to_time(end_pos), 3)}
+        return {
+            'trim': trim,
+            'denoise': {
+                'noise_reduction': round(self.noise_reduction_var.get(), 2),
+                'volume_boost': round(self.volume_boost_var.get(), 1),
+                'preserve_voice': self.preserve_voice_var.get(),
+            },
+            'subtitle': {
+                'font_size': self.font_size_var.get(),
+                'font_color': self.color_mapping.get(self.font_color_var.get(), 'white'),
+                'position': self.position_mapping.get(self.position_var.get(), 'bottom'),
+                'encoder': self.gpu_mapping.get(self.gpu_var.get(), ""),
+                'bitrate': self.output_bitrate_var.get().strip() or None,
+                'rate_mode': self.subtitle_rate_mode_labels.get(self.subtitle_rate_mode_var.get(), 'bitrate'),
+                'quality': self.subtitle_quality_var.get(),
+            },
+            'convert': {
+                'encoder': self.video_convert_gpu_mapping.get(self.video_convert_gpu_var.get(), ""),
+                'bitrate': self.new_bitrate_var.get().strip() or None,
+                # 流水线逐个文件单遍处理，两遍编码按指定码率执行
+                'rate_mode': self.convert_rate_mode_labels.get(self.convert_rate_mode_var.get(), 'bitrate'),
+                'quality': self.convert_quality_var.get(),
+            },
+        }
+
+    def save_pipeline_preset_dialog(self):
+        """选择要包含的步骤，把当前设置保存为流水线预设"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("保存流水线预设")
+        dialog.configure(bg="#333333")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
+
+        step_vars = {}
+        for name in PIPELINE_STEPS:
+            step_vars[name] = tk.BooleanVar(value=name != 'trim')
+            ttk.Checkbutton(dialog, text=PIPELINE_STEP_NAMES[name], variable=step_vars[name]).pack(
+                anchor=tk.W, padx=15, pady=(8, 0))
+        tk.Label(dialog, text="硬字幕使用与视频同名的 .srt/.ass 文件，没有时跳过",
+                 bg="#333333", fg="#aaaaaa").pack(anchor=tk.W, padx=15, pady=(4, 0))
+
+        piped_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dialog, text="管道连接各步骤（不写中间文件，只输出最终文件）", variable=piped_var).pack(
+            anchor=tk.W, padx=15, pady=(8, 0))
+
+        suffix_frame = tk.Frame(dialog, bg="#333333")
+        suffix_frame.pack(fill=tk.X, padx=15, pady=10)
+        ttk.Label(suffix_frame, text="输出文件后缀：").pack(side=tk.LEFT)
+        suffix_var = tk.StringVar(value="_processed")
+        ttk.Entry(suffix_frame, textvariable=suffix_var, width=15).pack(side=tk.LEFT)
+
+        def on_save():
+            all_steps = self.current_pipeline_steps()
+            steps = {name: all_steps[name] for name in PIPELINE_STEPS if step_vars[name].get()}
+            if not steps:
+                messagebox.showwarning("警告", "请至少选择一个处理步骤", parent=dialog)
+                return
+            path = filedialog.asksaveasfilename(
+                parent=dialog,
+                title="保存流水线预设",
+                initialfile="pipeline.json",
+                defaultextension=".json",
+                filetypes=[("流水线预设", "*.json")]
+            )
+            if not path:
+                return
+            try:
+                save_pipeline_preset(path, {'steps': steps, 'output_suffix': suffix_var.get(),
+                                            'piped': piped_var.get()})
+            except Exception as e:
+                messagebox.showerror("错误", f"保存预设失败: {e}", parent=dialog)
+                return
+            dialog.destroy()
+
+        button_frame = tk.Frame(dialog, bg="#333333")
+        button_frame.pack(fill=tk.X, padx=15, pady=(0, 10))
+        ttk.Button(button_frame, text="保存", command=on_save).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="取消", command=dialog.destroy).pack(side=tk.LEFT)
+
     def start_video_convert(self):
         """开始视频转换"""
         video_path = self.video_convert_path_var.get()
@@ -2351,6 +7436,11 @@ class VideoTrimmerPro:
             messagebox.showinfo("提示", "正在转换中，请等待...")
             return
 
+        package_format = self.package_format_labels.get(self.package_format_var.get(), "")
+        if package_format:
+            self.start_video_package(video_path, package_format)
+            return
+
         # 选择保存路径
         video_dir = os.path.dirname(video_path)
         video_name = os.path.splitext(os.path.basename(video_path))[0]
@@ -2368,119 +7458,13 @@ class VideoTrimmerPro:
             return
 
         try:
-            # 获取新比特率
-            new_bitrate = self.new_bitrate_var.get()
-            if not new_bitrate:
-                # 如果用户没有输入新比特率，使用原视频比特率
-                original_bitrate_text = self.original_bitrate_convert_var.get()
-                if original_bitrate_text and original_bitrate_text != "未选择视频" and original_bitrate_text != "未知" and original_bitrate_text != "获取失败":
-                    new_bitrate = original_bitrate_text.replace('k', '')
-                else:
-                    new_bitrate = "3000"  # 默认值
-
             # 构建FFmpeg命令
             video_path_clean = os.path.abspath(video_path)
 
-            # 根据用户选择设置编码器参数
-            gpu_option = self.video_convert_gpu_var.get()
-            encoder = self.video_convert_gpu_mapping.get(gpu_option, "")
-            
-            # 构建FFmpeg命令 - 转换为MP4并设置新比特率
-            ffmpeg_cmd = [
-                FFMPEG_PATH,
-                '-y',  # 覆盖已存在的文件
-                '-i', video_path_clean,  # 输入文件
-            ]
-            
-            # 根据选择的GPU加速类型设置编码器参数
-            if encoder:
-                if encoder == "h264_nvenc_fast":
-                    # NVIDIA高性能模式
-                    ffmpeg_cmd.extend([
-                        '-c:v', 'h264_nvenc',
-                        '-preset', 'p0',  # 最高性能模式
-                        '-tune', 'llhq',   # 低延迟高质量
-                        '-b:v', f'{new_bitrate}k',  # 使用用户指定的比特率
-                        '-c:a', 'aac',
-                        '-b:a', '128k',
-                        '-movflags', '+faststart',
-                        '-f', 'mp4',
-                        save_path
-                    ])
-                elif encoder == "h264_nvenc":
-                    # NVIDIA标准模式
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-preset', 'p4',  # 平衡性能和质量
-                        '-tune', 'hq',    # 高质量
-                        '-b:v', f'{new_bitrate}k',  # 使用用户指定的比特率
-                        '-c:a', 'aac',
-                        '-b:a', '128k',
-                        '-movflags', '+faststart',
-                        '-f', 'mp4',
-                        save_path
-                    ])
-                elif encoder == "hevc_qsv":
-                    # Intel QSV编码器
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-preset', 'faster',
-                        '-b:v', f'{new_bitrate}k',
-                        '-c:a', 'aac',
-                        '-b:a', '128k',
-                        '-movflags', '+faststart',
-                        '-f', 'mp4',
-                        save_path
-                    ])
-                elif encoder == "av1_amf":
-                    # AMD AMF编码器
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-quality', 'balanced',
-                        '-b:v', f'{new_bitrate}k',
-                        '-c:a', 'aac',
-                        '-b:a', '128k',
-                        '-movflags', '+faststart',
-                        '-f', 'mp4',
-                        save_path
-                    ])
-                elif encoder == "h264_vaapi":
-                    # VAAPI编码器
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-b:v', f'{new_bitrate}k',
-                        '-c:a', 'aac',
-                        '-b:a', '128k',
-                        '-movflags', '+faststart',
-                        '-f', 'mp4',
-                        save_path
-                    ])
-                else:
-                    # 其他编码器
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-b:v', f'{new_bitrate}k',
-                        '-c:a', 'aac',
-                        '-b:a', '128k',
-                        '-movflags', '+faststart',
-                        '-f', 'mp4',
-                        save_path
-                    ])
-            else:
-                # 默认使用软件编码
-                ffmpeg_cmd.extend([
-                    '-c:v', 'libx264',  # 视频编码器
-                    '-preset', 'medium',  # 平衡速度和质量
-                    '-b:v', f'{new_bitrate}k',  # 设置视频比特率
-                    '-c:a', 'aac',  # 音频编码器
-                    '-b:a', '128k',  # 音频比特率
-                    '-movflags', '+faststart',  # 优化MP4文件以支持流式播放
-                    '-f', 'mp4',  # 输出格式
-                    save_path  # 输出文件
-                ])
-
-
-            print("FFmpeg转换命令:", " ".join(ffmpeg_cmd))
+            # 构建FFmpeg命令 - 转换为MP4，两遍编码时依次执行两条命令
+            ffmpeg_cmds, passlog = build_convert_cmds(video_path_clean, save_path, **self.convert_rate_settings())
+            for ffmpeg_cmd in ffmpeg_cmds:
+                print("FFmpeg转换命令:", " ".join(ffmpeg_cmd))
 
             # 开始转换
             self.is_video_convert_processing = True
@@ -2491,7 +7475,8 @@ class VideoTrimmerPro:
             # 启动处理线程
             process_thread = threading.Thread(
                 target=self.run_video_convert,
-                args=(ffmpeg_cmd, save_path)
+                args=(ffmpeg_cmds, save_path, video_path_clean),
+                kwargs={'metrics': self.metrics.new_job('convert'), 'passlog': passlog}
             )
             process_thread.start()
 
@@ -2502,6 +7487,107 @@ class VideoTrimmerPro:
             self.video_convert_btn.config(state='normal')
             self.video_convert_status_label.config(text="转换失败")
 
+    def convert_rate_settings(self):
+        """转换页当前的码率、编码器和码率控制设置（build_convert_cmd的参数）"""
+        # 获取新比特率
+        new_bitrate = self.new_bitrate_var.get().strip()
+        if not new_bitrate:
+            # 如果用户没有输入新比特率，使用原视频比特率
+            original_bitrate_text = self.original_bitrate_convert_var.get()
+            if original_bitrate_text and original_bitrate_text != "未选择视频" and original_bitrate_text != "未知" and original_bitrate_text != "获取失败":
+                new_bitrate = original_bitrate_text.replace('k', '')
+            else:
+                new_bitrate = "3000"  # 默认值
+        try:
+            quality = self.convert_quality_var.get()
+        except tk.TclError:
+            quality = DEFAULT_QUALITY
+        return {
+            'bitrate': new_bitrate,
+            'encoder': self.video_convert_gpu_mapping.get(self.video_convert_gpu_var.get(), ""),
+            'mode': self.convert_rate_mode_labels.get(self.convert_rate_mode_var.get(), 'bitrate'),
+            'quality': quality,
+        }
+
+    def estimate_video_convert(self):
+        """抽样编码几段短片段，预估按当前设置转换后的文件大小和耗时"""
+        video_path = self.video_convert_path_var.get()
+        if not video_path or not os.path.exists(video_path):
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        settings = self.convert_rate_settings()
+        codec = video_codec_of(CONVERT_ENCODER_ARGS.get(settings['encoder'], ['-c:v', settings['encoder']]))
+        passes = 2 if settings['mode'] == 'two_pass' and codec in TWO_PASS_CODECS else 1
+        # 抽样只编码最终输出那一遍
+        cmd = build_convert_cmd(os.path.abspath(video_path), 'estimate.mp4', settings['bitrate'], settings['encoder'],
+                                'bitrate' if settings['mode'] == 'two_pass' else settings['mode'], settings['quality'])
+        self.convert_estimate_btn.config(state='disabled')
+        self.convert_estimate_var.set("正在抽样预估...")
+
+        def worker():
+            try:
+                duration = probe_media_info(os.path.abspath(video_path)).get('duration') or 0
+                result = estimate_encode(cmd, duration, passes=passes)
+                text = (f"预计 {result['size'] / 1024 / 1024:.1f}MB，"
+                        f"平均 {result['bitrate']:.0f}k，耗时约 {result['seconds']:.0f}秒")
+                print(f"[DEBUG] 转换预估: {text}")
+            except Exception as e:
+                text = f"预估失败: {e}"
+                print(f"[DEBUG] {text}")
+            self.ui_bus.call(self.convert_estimate_var.set, text)
+            self.ui_bus.call(self.convert_estimate_btn.config, state='normal')
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def start_video_package(self, video_path, package_format):
+        """按码率阶梯编码并打包为HLS/DASH"""
+        try:
+            ladder = parse_ladder(self.package_ladder_var.get())
+        except ValueError as e:
+            messagebox.showerror("错误", f"码率阶梯格式不正确：{e}\n示例：1080:5000,720:2800,480:1400")
+            return
+
+        parent_dir = filedialog.askdirectory(title="选择输出目录", initialdir=os.path.dirname(video_path))
+        if not parent_dir:
+            return
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        output_dir = os.path.join(parent_dir, f"{video_name}-{package_format}")
+        if os.path.isdir(output_dir) and os.listdir(output_dir):
+            if not messagebox.askyesno("确认", f"目录已存在且不为空，是否覆盖？\n{output_dir}"):
+                return
+
+        encoder_choice = self.video_convert_gpu_mapping.get(self.video_convert_gpu_var.get(), "")
+        self.is_video_convert_processing = True
+        self.video_convert_progress_var.set(0)
+        self.video_convert_btn.config(state='disabled')
+        self.video_convert_status_label.config(text="正在准备打包...")
+        threading.Thread(
+            target=self._package_video_thread,
+            args=(os.path.abspath(video_path), output_dir, ladder, package_format, encoder_choice),
+            daemon=True
+        ).start()
+
+    def _package_video_thread(self, video_path, output_dir, ladder, package_format, encoder_choice):
+        """探测原视频、验证编码器后执行打包（工作线程中运行，不访问Tk对象）"""
+        metrics = self.metrics.new_job('package')
+        try:
+            ladder = fit_ladder(ladder, probe_video_height(video_path))
+            encoder = ladder_encoder(encoder_choice)
+            os.makedirs(output_dir, exist_ok=True)
+            cmd, manifest = build_package_cmd(video_path, output_dir, ladder, package_format, encoder,
+                                              has_audio=has_audio_stream(video_path))
+            rungs = ', '.join(f"{height}p@{bitrate}k" for height, bitrate in ladder)
+            print(f"[DEBUG] 打包为{PACKAGE_FORMATS[package_format]}，编码器 {encoder}，档位: {rungs}")
+        except Exception as e:
+            self.is_video_convert_processing = False
+            self.ui_bus.call(messagebox.showerror, "错误", f"打包失败: {e}")
+            self.ui_bus.call(self.video_convert_btn.config, state='normal')
+            self.ui_bus.status('convert', "打包失败")
+            metrics.finish(-1)
+            return
+        self.ui_bus.status('convert', f"正在打包（{rungs}）...")
+        self.run_video_convert(cmd, manifest, video_path, metrics=metrics, use_cache=False)
+
     def stop_video_audio_denoise(self):
         """停止声音处理"""
         self.is_video_audio_processing = False
@@ -2509,11 +7595,18 @@ class VideoTrimmerPro:
         self.video_audio_denoise_btn.config(state='normal')
         self.video_audio_stop_btn.config(state='disabled')
 
-    def run_video_convert(self, cmd, output_path):
-        """执行视频转换"""
-        process = None
+    def run_video_convert(self, cmd, output_path, video_path, metrics=None, passlog=None, use_cache=True):
+        """执行视频转换（工作线程中运行，不访问Tk对象）
+
+        cmd可以是命令列表（两遍编码），依次执行，进度按遍数平分；passlog为两遍编码的统计文件前缀。
+        use_cache为False时（如HLS/DASH多文件输出）不使用结果缓存。
+        """
+        metrics = metrics or self.metrics.new_job('convert')
+        cmds = cmd if cmd and isinstance(cmd[0], list) else [cmd]
         final_returncode = -1
         try:
+            metrics.mark('probe')
+            metrics.add_input(video_path)
             print("\n=== 开始执行视频转换FFmpeg命令 ===")
             print("1. 检查FFmpeg路径...")
             if not os.path.exists(FFMPEG_PATH):
@@ -2521,7 +7614,6 @@ class VideoTrimmerPro:
             print(f"FFmpeg路径: {FFMPEG_PATH}")
 
             print("2. 检查输入文件...")
-            video_path = self.video_convert_path_var.get()
             if not os.path.exists(video_path):
                 raise Exception(f"输入视频不存在: {video_path}")
             print(f"输入视频: {video_path}")
@@ -2529,174 +7621,58 @@ class VideoTrimmerPro:
             # 获取视频时长用于进度计算
             video_duration = 0
             try:
-                info_cmd = [FFMPEG_PATH, '-i', video_path]
-                if sys.platform == 'win32':
-                    cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in info_cmd)
-                    info_result = subprocess.run(
-                        cmd_str,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8',
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    )
-                else:
-                    info_result = subprocess.run(
-                        info_cmd,
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8'
-                    )
-
-                for line in info_result.stderr.split('\n'):
-                    if 'Duration:' in line:
-                        duration = line.split('Duration: ')[1].split(',')[0].strip()
-                        h, m, s = map(float, duration.split(':'))
-                        video_duration = h * 3600 + m * 60 + s
-                        break
+                video_duration = probe_media_info(video_path).get('duration', 0)
             except Exception as e:
                 print(f"获取视频时长失败: {e}，将无法显示准确进度")
 
             print(f"视频时长: {video_duration:.2f}秒")
 
-            print("3. 执行FFmpeg命令...")
-            print("命令:", " ".join(cmd))
-
-            # 使用subprocess.Popen执行命令
-            if sys.platform == 'win32':
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    preexec_fn=os.setsid
-                )
-
-            # 将进程添加到跟踪列表
-            self.active_processes.append(process)
-            print(f"[DEBUG] 启动视频转换进程 PID: {process.pid}")
-
-            # 实时读取输出并更新进度
-            import time
-            last_progress = 0
-            last_file_size = 0
-            file_size_stable_count = 0
-            last_output_time = time.time()
-
-            while True:
-                # 检查进程是否已退出
-                if process.poll() is not None:
-                    print("[DEBUG] 视频转换FFmpeg进程已退出")
-                    break
-
-                # 检查是否应该停止处理
-                if not self.is_video_convert_processing:
-                    print("[DEBUG] 收到停止信号，终止视频转换进程...")
-                    process.terminate()
-                    break
-
-                try:
-                    # 读取一行输出（非阻塞）
-                    import select
-                    if sys.platform != 'win32':
-                        ready, _, _ = select.select([process.stderr], [], [], 0.1)
-                        if ready:
-                            line = process.stderr.readline()
-                        else:
-                            line = None
-                    else:
-                        line = process.stderr.readline()
-
-                    if line:
-                        line = line.strip()
-                        print(line)
-                        last_output_time = time.time()
-
-                        # 解析进度信息
-                        if 'time=' in line:
-                            try:
-                                time_str = line.split('time=')[1].split(' ')[0].strip()
-                                h, m, s = map(float, time_str.split(':'))
-                                current_time = h * 3600 + m * 60 + s
-
-                                # 计算进度百分比
-                                if video_duration > 0:
-                                    progress = (current_time / video_duration) * 100
-                                    progress = min(progress, 98)
-
-                                    if progress > last_progress:
-                                        last_progress = progress
-                                        self.root.after(0, lambda p=progress: self.video_convert_progress_var.set(p))
-                                        self.root.after(0, lambda p=progress: self.video_convert_status_label.config(text=f"转换中... {p:.1f}%"))
-                                        print(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
-                            except Exception as e:
-                                print(f"进度解析错误: {e}")
-                except Exception as e:
-                    if "readline" not in str(e).lower():
-                        print(f"读取输出错误: {e}")
+            cache_key = None
+            if use_cache:
+                cache_key = self.result_cache.job_key(cmds, [video_path], output_path,
+                                                      volatile=(passlog,), namespace='convert')
+                method = self.result_cache.fetch(cache_key, output_path)
+                if method:
+                    final_returncode = 0
+                    print(f"[DEBUG] 相同的转换已完成过，直接使用缓存结果（{method}）")
+                    self.ui_bus.progress('convert', 100)
+                    self.ui_bus.status('convert', "转换完成（使用缓存结果）")
+                    self.ui_bus.call(messagebox.showinfo, "成功", f"转换完成（使用缓存结果）:\n{output_path}")
+                    return
 
-                # 监控输出文件大小变化
-                if os.path.exists(output_path):
-                    try:
-                        current_file_size = os.path.getsize(output_path)
-                        if current_file_size > last_file_size:
-                            last_file_size = current_file_size
-                            file_size_stable_count = 0
-                        elif current_file_size == last_file_size and current_file_size > 0:
-                            file_size_stable_count += 1
+            print("3. 执行FFmpeg命令...")
+            last_progress = [0]
+            pass_index = [0]
+
+            def on_line(line):
+                metrics.observe_line(line)
+
+                # 解析进度信息
+                current_time = parse_ffmpeg_time(line)
+                if current_time is not None and video_duration > 0:
+                    fraction = (pass_index[0] + min(current_time / video_duration, 1.0)) / len(cmds)
+                    progress = min(fraction * 100, 98)
+                    if progress > last_progress[0]:
+                        last_progress[0] = progress
+                        self.ui_bus.progress('convert', progress)
+                        if len(cmds) > 1:
+                            self.ui_bus.status('convert', f"第{pass_index[0] + 1}/{len(cmds)}遍... {progress:.1f}%")
                         else:
-                            file_size_stable_count = 0
-
-                        if file_size_stable_count > 50:
-                            print(f"[DEBUG] 文件大小已稳定 {file_size_stable_count * 0.1:.1f}秒")
-                    except:
-                        pass
-
-                # 检查长时间无输出
-                elapsed_since_output = time.time() - last_output_time
-                if elapsed_since_output > 30:
-                    if process.poll() is None:
-                        print(f"[DEBUG] 超过30秒无输出，但进程仍在运行")
-                        if os.path.exists(output_path):
-                            file_size = os.path.getsize(output_path)
-                            if file_size > 0 and last_progress < 95:
-                                self.root.after(0, lambda: self.video_convert_progress_var.set(95))
-                                self.root.after(0, lambda: self.video_convert_status_label.config(text="转换中... 95%"))
-                                print(f"[DEBUG] 设置进度为95%")
-
-                time.sleep(0.1)
-
-            # 获取最终返回码
-            returncode = process.poll()
-            if returncode is None:
-                try:
-                    returncode = process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    returncode = process.returncode if process.returncode is not None else -1
-
-            # 读取剩余输出
-            try:
-                if process.stdin and not process.stdin.closed:
-                    process.stdin.close()
-                stdout, stderr = process.communicate(timeout=2)
-            except:
-                stdout, stderr = "", ""
-
-            final_returncode = returncode
+                            self.ui_bus.status('convert', f"转换中... {progress:.1f}%")
+                        progress_log.debug(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
+
+            metrics.mark('spawn')
+            stderr = ''
+            started = []
+            for pass_index[0], pass_cmd in enumerate(cmds):
+                print("命令:", " ".join(pass_cmd))
+                final_returncode, stderr = self._run_tracked_ffmpeg(
+                    pass_cmd, on_line=on_line, metrics=metrics,
+                    should_stop=lambda: not self.is_video_convert_processing, on_spawn=started.append)
+                if final_returncode != 0 or not self.is_video_convert_processing:
+                    break
+            print("[DEBUG] 视频转换FFmpeg进程已退出")
+            metrics.mark('finalize')
 
             print("4. 检查执行结果...")
             print(f"返回码: {final_returncode}")
@@ -2704,275 +7680,111 @@ class VideoTrimmerPro:
             # 处理结果
             if final_returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                 print("视频转换完成！")
-                self.root.after(0, lambda: self.video_convert_progress_var.set(100))
-                self.root.after(0, lambda: self.video_convert_status_label.config(text="转换完成"))
-                self.root.after(0, lambda: messagebox.showinfo("成功", f"转换完成:\n{output_path}"))
+                # 中途停止（本页停止、暂停或关闭程序）时返回码也是0，输出不完整，不能写入缓存
+                if (self.is_video_convert_processing and not any(process.stopped for process in started)
+                        and duration_matches(output_path, video_duration)):
+                    self.result_cache.store(cache_key, output_path)
+                self.ui_bus.progress('convert', 100)
+                self.ui_bus.status('convert', "转换完成")
+                self.ui_bus.call(messagebox.showinfo, "成功", f"转换完成:\n{output_path}")
             else:
                 error_msg = f"转换失败（返回码: {final_returncode}）"
                 if stderr:
                     error_msg += f"\n{stderr[-500:]}"
                 print(error_msg)
-                self.root.after(0, lambda msg=error_msg: messagebox.showerror("错误", msg))
-                self.root.after(0, lambda: self.video_convert_progress_var.set(0))
-                self.root.after(0, lambda: self.video_convert_status_label.config(text="转换失败"))
+                self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+                self.ui_bus.progress('convert', 0)
+                self.ui_bus.status('convert', "转换失败")
 
         except Exception as e:
             error_msg = f"执行失败: {str(e)}"
             print(error_msg)
             logger.error(error_msg)
-            self.root.after(0, lambda msg=error_msg: messagebox.showerror("错误", msg))
-            self.root.after(0, lambda: self.video_convert_progress_var.set(0))
-            self.root.after(0, lambda: self.video_convert_status_label.config(text="转换失败"))
+            self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+            self.ui_bus.progress('convert', 0)
+            self.ui_bus.status('convert', "转换失败")
         finally:
-            print("5. 清理状态和进程资源...")
-
-            # 清理进程资源
-            if process is not None:
-                try:
-                    process_pid = process.pid if hasattr(process, 'pid') else 'unknown'
-                    print(f"[DEBUG] 开始清理视频转换进程 PID: {process_pid}")
-
-                    # 关闭所有管道
-                    for pipe_name in ['stdin', 'stdout', 'stderr']:
-                        pipe = getattr(process, pipe_name, None)
-                        if pipe and not pipe.closed:
-                            try:
-                                pipe.close()
-                                print(f"[DEBUG] 已关闭 {pipe_name} 管道")
-                            except Exception as e:
-                                print(f"[DEBUG] 关闭 {pipe_name} 管道时出错: {e}")
-
-                    # 确保进程已完全结束
-                    if process.poll() is None:
-                        print(f"[DEBUG] 视频转换进程 {process_pid} 仍在运行，尝试终止...")
-                        try:
-                            process.terminate()
-                            try:
-                                process.wait(timeout=2)
-                                print(f"[DEBUG] 进程 {process_pid} 已通过terminate结束")
-                            except subprocess.TimeoutExpired:
-                                print(f"[DEBUG] 进程 {process_pid} terminate后仍运行，强制kill")
-                                try:
-                                    process.kill()
-                                    process.wait(timeout=1)
-                                    print(f"[DEBUG] 进程 {process_pid} 已通过kill结束")
-                                except:
-                                    print(f"[DEBUG] 警告：进程 {process_pid} kill后仍可能运行")
-                        except Exception as e:
-                            print(f"[DEBUG] 终止进程时出错: {e}")
+            metrics.finish(final_returncode, output_path)
 
-                    # 从活跃进程列表中移除
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                        print(f"[DEBUG] 从活跃进程列表中移除视频转换进程 PID: {process_pid}")
-
-                    print(f"[DEBUG] 视频转换进程 {process_pid} 清理完成")
-                except Exception as e:
-                    print(f"[DEBUG] 清理视频转换进程时出错: {e}")
+            print("5. 清理状态...")
+            remove_passlog(passlog)
 
             # 更新状态标志
             self.is_video_convert_processing = False
 
             # 重新启用按钮
-            self.root.after(0, lambda: self.video_convert_btn.config(state='normal'))
-            self.root.after(0, lambda: self.video_convert_preview_btn.config(state='normal'))
+            self.ui_bus.call(self.video_convert_btn.config, state='normal')
+            self.ui_bus.call(self.video_convert_preview_btn.config, state='normal')
 
             # 根据最终返回码处理进度条
-            final_rc = final_returncode if 'final_returncode' in locals() else (process.returncode if process and process.returncode is not None else -1)
-            if final_rc != 0:
-                self.root.after(0, lambda: self.video_convert_progress_var.set(0))
-                print(f"[DEBUG] 处理失败（返回码: {final_rc}），重置进度条")
+            if final_returncode != 0:
+                self.ui_bus.progress('convert', 0)
+                print(f"[DEBUG] 处理失败（返回码: {final_returncode}），重置进度条")
 
             print("=== 视频转换FFmpeg命令执行完成 ===\n")
 
-    def run_video_audio_denoise(self, cmd, output_path):
-        """执行声音处理"""
-        process = None
+    def run_video_audio_denoise(self, cmd, output_path, video_path, metrics=None):
+        """执行声音处理（工作线程中运行，不访问Tk对象）"""
+        metrics = metrics or self.metrics.new_job('denoise')
         final_returncode = -1
         try:
+            metrics.mark('probe')
+            metrics.add_input(video_path)
             print("\n=== 开始执行声音处理FFmpeg命令 ===")
             print("1. 检查FFmpeg路径...")
-            if not os.path.exists(FFMPEG_PATH):
-                raise Exception(f"FFmpeg不存在: {FFMPEG_PATH}")
-            print(f"FFmpeg路径: {FFMPEG_PATH}")
-
-            print("2. 检查输入文件...")
-            video_path = self.video_audio_file_var.get()
-            if not os.path.exists(video_path):
-                raise Exception(f"输入视频不存在: {video_path}")
-            print(f"输入视频: {video_path}")
-
-            # 获取视频时长用于进度计算
-            video_duration = 0
-            try:
-                info_cmd = [FFMPEG_PATH, '-i', video_path]
-                if sys.platform == 'win32':
-                    cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in info_cmd)
-                    info_result = subprocess.run(
-                        cmd_str,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8',
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    )
-                else:
-                    info_result = subprocess.run(
-                        info_cmd,
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8'
-                    )
-
-                for line in info_result.stderr.split('\n'):
-                    if 'Duration:' in line:
-                        duration = line.split('Duration: ')[1].split(',')[0].strip()
-                        h, m, s = map(float, duration.split(':'))
-                        video_duration = h * 3600 + m * 60 + s
-                        break
-            except Exception as e:
-                print(f"获取视频时长失败: {e}，将无法显示准确进度")
-
-            print(f"视频时长: {video_duration:.2f}秒")
-
-            print("3. 执行FFmpeg命令...")
-            print("命令:", " ".join(cmd))
-
-            # 使用subprocess.Popen执行命令
-            if sys.platform == 'win32':
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    preexec_fn=os.setsid
-                )
-
-            # 将进程添加到跟踪列表
-            self.active_processes.append(process)
-            print(f"[DEBUG] 启动声音处理进程 PID: {process.pid}")
-
-            # 实时读取输出并更新进度
-            import time
-            last_progress = 0
-            last_file_size = 0
-            file_size_stable_count = 0
-            last_output_time = time.time()
-
-            while True:
-                # 检查进程是否已退出
-                if process.poll() is not None:
-                    print("[DEBUG] 声音处理FFmpeg进程已退出")
-                    break
-
-                # 检查是否应该停止处理
-                if not self.is_video_audio_processing:
-                    print("[DEBUG] 收到停止信号，终止声音处理进程...")
-                    process.terminate()
-                    break
+            if not os.path.exists(FFMPEG_PATH):
+                raise Exception(f"FFmpeg不存在: {FFMPEG_PATH}")
+            print(f"FFmpeg路径: {FFMPEG_PATH}")
 
-                try:
-                    # 读取一行输出（非阻塞）
-                    import select
-                    if sys.platform != 'win32':
-                        ready, _, _ = select.select([process.stderr], [], [], 0.1)
-                        if ready:
-                            line = process.stderr.readline()
-                        else:
-                            line = None
-                    else:
-                        line = process.stderr.readline()
-
-                    if line:
-                        line = line.strip()
-                        print(line)
-                        last_output_time = time.time()
-
-                        # 解析进度信息
-                        if 'time=' in line:
-                            try:
-                                time_str = line.split('time=')[1].split(' ')[0].strip()
-                                h, m, s = map(float, time_str.split(':'))
-                                current_time = h * 3600 + m * 60 + s
-
-                                # 计算进度百分比
-                                if video_duration > 0:
-                                    progress = (current_time / video_duration) * 100
-                                    progress = min(progress, 98)
-
-                                    if progress > last_progress:
-                                        last_progress = progress
-                                        self.root.after(0, lambda p=progress: self.audio_progress_var.set(p))
-                                        self.root.after(0, lambda p=progress: self.video_audio_status_label.config(text=f"处理中... {p:.1f}%"))
-                                        print(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
-                            except Exception as e:
-                                print(f"进度解析错误: {e}")
-                except Exception as e:
-                    if "readline" not in str(e).lower():
-                        print(f"读取输出错误: {e}")
+            print("2. 检查输入文件...")
+            if not os.path.exists(video_path):
+                raise Exception(f"输入视频不存在: {video_path}")
+            print(f"输入视频: {video_path}")
 
-                # 监控输出文件大小变化
-                if os.path.exists(output_path):
-                    try:
-                        current_file_size = os.path.getsize(output_path)
-                        if current_file_size > last_file_size:
-                            last_file_size = current_file_size
-                            file_size_stable_count = 0
-                        elif current_file_size == last_file_size and current_file_size > 0:
-                            file_size_stable_count += 1
-                        else:
-                            file_size_stable_count = 0
+            # 获取视频时长用于进度计算
+            video_duration = 0
+            try:
+                video_duration = probe_media_info(video_path).get('duration', 0)
+            except Exception as e:
+                print(f"获取视频时长失败: {e}，将无法显示准确进度")
 
-                        if file_size_stable_count > 50:
-                            print(f"[DEBUG] 文件大小已稳定 {file_size_stable_count * 0.1:.1f}秒")
-                    except:
-                        pass
+            print(f"视频时长: {video_duration:.2f}秒")
 
-                # 检查长时间无输出
-                elapsed_since_output = time.time() - last_output_time
-                if elapsed_since_output > 30:
-                    if process.poll() is None:
-                        print(f"[DEBUG] 超过30秒无输出，但进程仍在运行")
-                        if os.path.exists(output_path):
-                            file_size = os.path.getsize(output_path)
-                            if file_size > 0 and last_progress < 95:
-                                self.root.after(0, lambda: self.audio_progress_var.set(95))
-                                self.root.after(0, lambda: self.video_audio_status_label.config(text="处理中... 95%"))
-                                print(f"[DEBUG] 设置进度为95%")
-
-                time.sleep(0.1)
-
-            # 获取最终返回码
-            returncode = process.poll()
-            if returncode is None:
-                try:
-                    returncode = process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    returncode = process.returncode if process.returncode is not None else -1
+            cache_key = self.result_cache.job_key(cmd, [video_path], output_path, namespace='denoise')
+            method = self.result_cache.fetch(cache_key, output_path)
+            if method:
+                final_returncode = 0
+                print(f"[DEBUG] 相同的处理已完成过，直接使用缓存结果（{method}）")
+                self.ui_bus.progress('denoise', 100)
+                self.ui_bus.status('denoise', "处理完成（使用缓存结果）")
+                self.ui_bus.call(messagebox.showinfo, "成功", f"处理完成（使用缓存结果）:\n{output_path}")
+                return
 
-            # 读取剩余输出
-            try:
-                if process.stdin and not process.stdin.closed:
-                    process.stdin.close()
-                stdout, stderr = process.communicate(timeout=2)
-            except:
-                stdout, stderr = "", ""
+            print("3. 执行FFmpeg命令...")
+            print("命令:", " ".join(cmd))
 
-            final_returncode = returncode
+            last_progress = [0]
+
+            def on_line(line):
+                metrics.observe_line(line)
+
+                # 解析进度信息
+                current_time = parse_ffmpeg_time(line)
+                if current_time is not None and video_duration > 0:
+                    progress = min(current_time / video_duration * 100, 98)
+                    if progress > last_progress[0]:
+                        last_progress[0] = progress
+                        self.ui_bus.progress('denoise', progress)
+                        self.ui_bus.status('denoise', f"处理中... {progress:.1f}%")
+                        progress_log.debug(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
+
+            metrics.mark('spawn')
+            started = []
+            final_returncode, stderr = self._run_tracked_ffmpeg(
+                cmd, on_line=on_line, metrics=metrics,
+                should_stop=lambda: not self.is_video_audio_processing, on_spawn=started.append)
+            print("[DEBUG] 声音处理FFmpeg进程已退出")
+            metrics.mark('finalize')
 
             print("4. 检查执行结果...")
             print(f"返回码: {final_returncode}")
@@ -2980,85 +7792,46 @@ class VideoTrimmerPro:
             # 处理结果
             if final_returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                 print("声音处理完成！")
-                self.root.after(0, lambda: self.audio_progress_var.set(100))
-                self.root.after(0, lambda: self.video_audio_status_label.config(text="处理完成"))
-                self.root.after(0, lambda: messagebox.showinfo("成功", f"处理完成:\n{output_path}"))
+                # 中途停止（本页停止、暂停或关闭程序）时返回码也是0，输出不完整，不能写入缓存
+                if (self.is_video_audio_processing and not any(process.stopped for process in started)
+                        and duration_matches(output_path, video_duration)):
+                    self.result_cache.store(cache_key, output_path)
+                self.ui_bus.progress('denoise', 100)
+                self.ui_bus.status('denoise', "处理完成")
+                self.ui_bus.call(messagebox.showinfo, "成功", f"处理完成:\n{output_path}")
             else:
                 error_msg = f"处理失败（返回码: {final_returncode}）"
                 if stderr:
                     error_msg += f"\n{stderr[-500:]}"
                 print(error_msg)
-                self.root.after(0, lambda msg=error_msg: messagebox.showerror("错误", msg))
-                self.root.after(0, lambda: self.audio_progress_var.set(0))
-                self.root.after(0, lambda: self.video_audio_status_label.config(text="处理失败"))
+                self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+                self.ui_bus.progress('denoise', 0)
+                self.ui_bus.status('denoise', "处理失败")
 
         except Exception as e:
             error_msg = f"执行失败: {str(e)}"
             print(error_msg)
             logger.error(error_msg)
-            self.root.after(0, lambda msg=error_msg: messagebox.showerror("错误", msg))
-            self.root.after(0, lambda: self.audio_progress_var.set(0))
-            self.root.after(0, lambda: self.video_audio_status_label.config(text="处理失败"))
+            self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+            self.ui_bus.progress('denoise', 0)
+            self.ui_bus.status('denoise', "处理失败")
         finally:
-            print("5. 清理状态和进程资源...")
-
-            # 清理进程资源
-            if process is not None:
-                try:
-                    process_pid = process.pid if hasattr(process, 'pid') else 'unknown'
-                    print(f"[DEBUG] 开始清理声音处理进程 PID: {process_pid}")
-
-                    # 关闭所有管道
-                    for pipe_name in ['stdin', 'stdout', 'stderr']:
-                        pipe = getattr(process, pipe_name, None)
-                        if pipe and not pipe.closed:
-                            try:
-                                pipe.close()
-                                print(f"[DEBUG] 已关闭 {pipe_name} 管道")
-                            except Exception as e:
-                                print(f"[DEBUG] 关闭 {pipe_name} 管道时出错: {e}")
-
-                    # 确保进程已完全结束
-                    if process.poll() is None:
-                        print(f"[DEBUG] 声音处理进程 {process_pid} 仍在运行，尝试终止...")
-                        try:
-                            process.terminate()
-                            try:
-                                process.wait(timeout=2)
-                                print(f"[DEBUG] 进程 {process_pid} 已通过terminate结束")
-                            except subprocess.TimeoutExpired:
-                                print(f"[DEBUG] 进程 {process_pid} terminate后仍运行，强制kill")
-                                try:
-                                    process.kill()
-                                    process.wait(timeout=1)
-                                    print(f"[DEBUG] 进程 {process_pid} 已通过kill结束")
-                                except:
-                                    print(f"[DEBUG] 警告：进程 {process_pid} kill后仍可能运行")
-                        except Exception as e:
-                            print(f"[DEBUG] 终止进程时出错: {e}")
+            metrics.finish(final_returncode, output_path)
 
-                    # 从活跃进程列表中移除
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                        print(f"[DEBUG] 从活跃进程列表中移除声音处理进程 PID: {process_pid}")
-
-                    print(f"[DEBUG] 声音处理进程 {process_pid} 清理完成")
-                except Exception as e:
-                    print(f"[DEBUG] 清理声音处理进程时出错: {e}")
+            print("5. 清理状态...")
 
             # 更新状态标志
             self.is_video_audio_processing = False
 
             # 重新启用按钮
-            self.root.after(0, lambda: self.video_audio_denoise_btn.config(state='normal'))
-            self.root.after(0, lambda: self.video_audio_stop_btn.config(state='disabled'))
-            self.root.after(0, lambda: self.video_audio_preview_btn.config(state='normal'))
+            self.ui_bus.call(self.video_audio_denoise_btn.config, state='normal')
+            self.ui_bus.call(self.video_audio_stop_btn.config, state='disabled')
+            self.ui_bus.call(self.video_audio_preview_btn.config, state='normal')
 
             # 根据最终返回码处理进度条
-            final_rc = final_returncode if 'final_returncode' in locals() else (process.returncode if process and process.returncode is not None else -1)
-            if final_rc != 0:
-                self.root.after(0, lambda: self.audio_progress_var.set(0))
-                print(f"[DEBUG] 处理失败（返回码: {final_rc}），重置进度条")
+            if final_returncode != 0:
+                self.ui_bus.progress('denoise', 0)
+                print(f"[DEBUG] 处理失败（返回码: {final_returncode}），重置进度条")
 
             print("=== 声音处理FFmpeg命令执行完成 ===\n")
 
@@ -3075,6 +7848,10 @@ class VideoTrimmerPro:
             self.subtitle_fps = self.subtitle_cap.get(cv2.CAP_PROP_FPS)
             self.subtitle_total_frames = int(self.subtitle_cap.get(cv2.CAP_PROP_FRAME_COUNT))
             self.subtitle_duration = self.subtitle_total_frames / self.subtitle_fps
+            self.subtitle_frame_size = (int(self.subtitle_cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                        int(self.subtitle_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            self.subtitle_preview_time = 0.0
+            self.load_preview_sprites('subtitle', video_path, self.subtitle_duration)
 
             # 使用ffprobe获取视频比特率
             self.get_video_bitrate(video_path)
@@ -3105,9 +7882,23 @@ class VideoTrimmerPro:
             if ret:
                 # 显示视频帧到预览画布
                 self.show_soft_subtitle_frame(frame)
+            self.load_existing_soft_tracks(video_path)
         except Exception as e:
             messagebox.showerror("错误", f"加载视频失败: {str(e)}")
 
+    def load_existing_soft_tracks(self, video_path):
+        """把视频中已有的字幕轨道列入轨道列表，可以修改语言、标题、默认标记或移除"""
+        try:
+            self.soft_existing_subtitles = probe_media_info(video_path).get('subtitles', [])
+        except Exception as e:
+            print(f"[DEBUG] 读取原有字幕轨道失败: {e}")
+            self.soft_existing_subtitles = []
+        existing = [SubtitleTrack(None, stream['language'], stream['title'], stream['default'], None, index)
+                    for index, stream in enumerate(self.soft_existing_subtitles)]
+        self.soft_tracks = existing + [track for track in self.soft_tracks if track.stream is None]
+        self.refresh_soft_tracks()
+        print(f"[DEBUG] 原有字幕轨道: {len(existing)} 条")
+
     def create_styled_ass_file(self, input_subtitle_path, output_ass_path, font_size, font_color_chinese, font_position):
         """创建带样式的ASS字幕文件"""
         # 读取原始字幕文件
@@ -3203,7 +7994,7 @@ ScaledBorderAndShadow: yes
 
 [V4+ Styles]
 Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Default,Microsoft YaHei,{font_size},{primary_color},&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,2,0,{alignment},10,10,10,1
+Style: Default,{SUBTITLE_FONT},{font_size},{primary_color},&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,2,0,{alignment},10,10,10,1
 
 [Events]
 Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
@@ -3259,35 +8050,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             if not video_path:
                 raise Exception("请先选择视频文件")
 
-            # 使用ffmpeg获取视频信息 - 修复中文路径编码问题
-            info_cmd = [FFMPEG_PATH, '-i', video_path]
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in info_cmd)
-                info_result = subprocess.run(
-                    cmd_str,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                info_result = subprocess.run(
-                    info_cmd,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
-
-            # 解析视频时长
-            video_duration = None
-            for line in info_result.stderr.split('\n'):
-                if 'Duration:' in line:
-                    duration = line.split('Duration: ')[1].split(',')[0].strip()
-                    h, m, s = map(float, duration.split(':'))
-                    video_duration = h * 3600 + m * 60 + s
-                    break
+            video_duration = probe_media_info(video_path).get('duration')
 
             if video_duration is None:
                 raise Exception("无法获取视频时长")
@@ -3398,7 +8161,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         try:
             # 使用ffprobe获取视频比特率 - 修复中文路径编码问题
             ffprobe_cmd = [
-                find_ffprobe_path(),
+                FFPROBE_PATH,
                 '-v', 'error',
                 '-select_streams', 'v:0',
                 '-show_entries', 'stream=bit_rate',
@@ -3406,24 +8169,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                 video_path
             ]
 
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in ffprobe_cmd)
-                result = subprocess.run(
-                    cmd_str,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                result = subprocess.run(
-                    ffprobe_cmd,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
+            result = run_command(ffprobe_cmd, timeout=30)
 
             if result.returncode == 0 and result.stdout.strip():
                 # 获取比特率（单位：bps），转换为kbps
@@ -3452,7 +8198,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         try:
             # 使用ffprobe获取视频比特率 - 修复中文路径编码问题
             ffprobe_cmd = [
-                find_ffprobe_path(),
+                FFPROBE_PATH,
                 '-v', 'error',
                 '-select_streams', 'v:0',
                 '-show_entries', 'stream=bit_rate',
@@ -3460,24 +8206,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                 video_path
             ]
 
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in ffprobe_cmd)
-                result = subprocess.run(
-                    cmd_str,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                result = subprocess.run(
-                    ffprobe_cmd,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
+            result = run_command(ffprobe_cmd, timeout=30)
 
             if result.returncode == 0 and result.stdout.strip():
                 # 获取比特率（单位：bps），转换为kbps
@@ -3658,35 +8387,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             if not video_path:
                 raise Exception("请先选择视频文件")
 
-            # 使用ffmpeg获取视频信息 - 修复中文路径编码问题
-            info_cmd = [FFMPEG_PATH, '-i', video_path]
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in info_cmd)
-                info_result = subprocess.run(
-                    cmd_str,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                info_result = subprocess.run(
-                    info_cmd,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
-
-            # 解析视频时长
-            video_duration = None
-            for line in info_result.stderr.split('\n'):
-                if 'Duration:' in line:
-                    duration = line.split('Duration: ')[1].split(',')[0].strip()
-                    h, m, s = map(float, duration.split(':'))
-                    video_duration = h * 3600 + m * 60 + s
-                    break
+            video_duration = probe_media_info(video_path).get('duration')
 
             if video_duration is None:
                 raise Exception("无法获取视频时长")
@@ -3765,14 +8466,16 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             print(f"截断的字幕数量: {truncated_count}")
             if self.subtitles:
                 print(f"字幕时间范围: {self.subtitles[0]['start']:.2f}秒 - {self.subtitles[-1]['end']:.2f}秒")
+            self.redraw_subtitle_preview()
 
         except Exception as e:
             messagebox.showerror("错误", f"加载字幕失败: {str(e)}")
 
     def show_subtitle_frame(self, frame):
-        """显示视频帧和字幕"""
+        """显示视频帧和字幕（字幕按subtitle_preview_time查找）"""
         if frame is None:
             return
+        self.subtitle_last_frame = frame
 
         # 获取画布尺寸
         canvas_width = self.subtitle_preview_canvas.winfo_width()
@@ -3799,6 +8502,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 
         # 缩放图片
         img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        img = self.composite_subtitle_overlay(img)
         self.subtitle_preview_photo = ImageTk.PhotoImage(img)
 
         # 更新画布，确保图像居中显示
@@ -3812,6 +8516,55 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             anchor=tk.NW
         )
 
+    def find_subtitle_cue(self, seconds):
+        """当前时间对应的字幕条目，没有时返回None"""
+        for subtitle in self.subtitles:
+            if subtitle['start'] <= seconds <= subtitle['end']:
+                return subtitle
+        return None
+
+    def subtitle_overlay_request(self, cue):
+        """字幕条目叠加图的缓存键和渲染参数，缺少视频或字幕信息时返回None"""
+        subtitle_path = self.subtitle_path_var.get()
+        if cue is None or not subtitle_path or not self.subtitle_frame_size:
+            return None
+        style = (self.font_size_var.get(),
+                 self.color_mapping.get(self.font_color_var.get(), 'white'),
+                 self.position_mapping.get(self.position_var.get(), 'bottom'))
+        key = SubtitleOverlayCache.key(subtitle_path, cue, style, self.subtitle_frame_size)
+        return key, (subtitle_path, cue, style, self.subtitle_frame_size)
+
+    def composite_subtitle_overlay(self, img):
+        """把当前字幕的叠加图缩放到预览尺寸后合成到画面上；尚未渲染时先排队渲染，完成后重绘"""
+        cue = self.find_subtitle_cue(self.subtitle_preview_time)
+        request = self.subtitle_overlay_request(cue)
+        if request is None:
+            return img
+        key, args = request
+        entry = self.subtitle_overlays.get(key)
+        # 预先渲染下一条，连续播放时不出现空白
+        index = self.subtitles.index(cue)
+        if index + 1 < len(self.subtitles):
+            next_key, next_args = self.subtitle_overlay_request(self.subtitles[index + 1])
+            self.subtitle_overlays.request(next_key, *next_args, on_ready=lambda: None)
+        if entry is None:
+            self.subtitle_overlays.request(key, *args, on_ready=lambda: self.ui_bus.call(self.redraw_subtitle_preview))
+            return img
+        x, y, overlay = entry
+        if overlay is None:
+            return img
+        scale = img.width / self.subtitle_frame_size[0]
+        overlay = overlay.resize((max(1, round(overlay.width * scale)), max(1, round(overlay.height * scale))),
+                                 Image.Resampling.LANCZOS)
+        img = img.convert('RGBA')
+        img.alpha_composite(overlay, (round(x * scale), round(y * scale)))
+        return img
+
+    def redraw_subtitle_preview(self):
+        """样式变化或叠加图渲染完成后，用最后一帧重绘预览"""
+        if self.subtitle_last_frame is not None:
+            self.show_subtitle_frame(self.subtitle_last_frame)
+
     def preview_subtitle(self):
         """预览字幕效果"""
         if not self.subtitle_cap or not self.subtitles:
@@ -3857,26 +8610,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             # 读取当前帧
             ret, frame = self.subtitle_cap.read()
             if ret:
-                # 查找当前时间对应的字幕
-                current_subtitle = ""
-                for subtitle in self.subtitles:
-                    if subtitle['start'] <= current_time <= subtitle['end']:
-                        current_subtitle = subtitle['text']
-                        break
-
-                # 应用当前样式设置
-                font_size = self.font_size_var.get()
-                color_name = self.font_color_var.get()
-                color = self.color_mapping.get(color_name, "white")
-
-                # 更新字幕显示（应用样式）
-                self.subtitle_label.config(
-                    text=current_subtitle,
-                    font=("微软雅黑", int(font_size)),
-                    fg=color
-                )
-
-                # 显示帧
+                # 显示帧和当前时间对应的字幕
+                self.subtitle_preview_time = current_time
                 self.show_subtitle_frame(frame)
 
             # 继续更新
@@ -3896,31 +8631,13 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         available_encoders = []
 
         try:
-            # 检测可用的硬件加速方法
-            hwaccel_cmd = [FFMPEG_PATH, '-hwaccels']
-            hwaccel_result = subprocess.run(
-                hwaccel_cmd,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-            )
-
-            hwaccel_output = hwaccel_result.stdout
+            # 使用启动时检测（或磁盘缓存）的结果，不再每次启动FFmpeg子进程
+            info = FFMPEG_INFO if toolchain_ready.is_set() else discover_toolchain()
             print("可用的硬件加速方法:")
-            print(hwaccel_output)
+            print(", ".join(info.get('hwaccels', [])))
 
             # 检测可用的H.264编码器
-            encoders_cmd = [FFMPEG_PATH, '-encoders']
-            encoders_result = subprocess.run(
-                encoders_cmd,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-            )
-
-            encoders_output = encoders_result.stdout
+            encoders_output = info.get('encoders', [])
 
             # 检查NVIDIA GPU编码器
             if 'h264_nvenc' in encoders_output:
@@ -4015,50 +8732,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                 return
 
             # 使用ffmpeg获取视频信息 - 修复中文路径编码问题
-            info_cmd = [FFMPEG_PATH, '-i', video_path]
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in info_cmd)
-                info_result = subprocess.run(
-                    cmd_str,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                info_result = subprocess.run(
-                    info_cmd,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
-
             # 解析视频信息
-            video_info = {}
-            for line in info_result.stderr.split('\n'):
-                if 'Duration:' in line:
-                    # 解析时长
-                    duration = line.split('Duration: ')[1].split(',')[0].strip()
-                    h, m, s = map(float, duration.split(':'))
-                    video_info['duration'] = h * 3600 + m * 60 + s
-                elif 'Stream' in line and 'Video:' in line:
-                    # 解析视频流信息
-                    if 'fps' in line:
-                        fps = float(line.split('fps')[0].split(',')[-1].strip())
-                        video_info['fps'] = fps
-                    if 'kb/s' in line:
-                        bitrate = float(line.split('kb/s')[0].split(',')[-1].strip())
-                        video_info['bitrate'] = bitrate * 1000  # 转换为b/s
-                elif 'Stream' in line and 'Audio:' in line:
-                    # 解析音频流信息
-                    if 'Hz' in line:
-                        sample_rate = int(line.split('Hz')[0].split(',')[-1].strip())
-                        video_info['sample_rate'] = sample_rate
-                    if 'kb/s' in line:
-                        audio_bitrate = float(line.split('kb/s')[0].split(',')[-1].strip())
-                        video_info['audio_bitrate'] = audio_bitrate * 1000  # 转换为b/s
+            video_info = probe_media_info(video_path)
 
             print("视频信息:", video_info)
 
@@ -4071,83 +8746,6 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             subtitle_path_clean = os.path.abspath(subtitle_path)
             video_path_clean = os.path.abspath(video_path)
 
-            # 构建字幕滤镜，使用force_style参数设置样式
-            try:
-                # 确保路径使用正斜杠，并转义冒号和反斜杠
-                subtitle_path_normalized = subtitle_path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
-
-                # 获取字幕样式设置
-                font_size = self.font_size_var.get()
-                font_color_chinese = self.font_color_var.get()  # 获取中文颜色名称
-                font_position = self.position_var.get()
-
-                # 将中文颜色名称转换为英文颜色名称
-                font_color_english = self.color_mapping.get(font_color_chinese, 'white')
-
-                # 转换颜色格式（从英文颜色名转换为BGR十六进制）
-                # ASS字幕格式使用BGR颜色值，格式为&HAABBGGRR&
-                color_map = {
-                    'white': '&H00FFFFFF&',    # 白色 (BGR: FFFFFF)
-                    'black': '&H00000000&',    # 黑色 (BGR: 000000)
-                    'red': '&H000000FF&',      # 红色 (BGR: 0000FF)
-                    'green': '&H0000FF00&',    # 绿色 (BGR: 00FF00)
-                    'blue': '&H00FF0000&',     # 蓝色 (BGR: FF0000)
-                    'yellow': '&H0000FFFF&',   # 黄色 (BGR: 00FFFF)
-                    'cyan': '&H00FFFF00&',     # 青色 (BGR: FFFF00)
-                    'magenta': '&H00FF00FF&',  # 洋红色 (BGR: FF00FF)
-                    'orange': '&H0000A5FF&',   # 橙色 (BGR: 00A5FF)
-                    'pink': '&H00C0C0FF&',     # 粉色 (BGR: C0C0FF)
-                    'purple': '&H00800080&',   # 紫色 (BGR: 800080)
-                    'gray': '&H00808080&'      # 灰色 (BGR: 808080)
-                }
-                primary_color = color_map.get(font_color_english, '&H00FFFFFF&')
-                print(f"颜色映射: {font_color_chinese} -> {font_color_english} -> {primary_color}")
-
-                # 设置字体位置
-                # 将中文位置名称转换为英文位置名称
-                font_position_english = self.position_mapping.get(font_position, 'bottom')
-
-                position_map = {
-                    'top': 'Alignment=2',      # 顶部居中
-                    'middle': 'Alignment=5',   # 中间居中
-                    'bottom': 'Alignment=2'    # 底部居中（默认）
-                }
-                alignment = position_map.get(font_position_english, 'Alignment=2')
-                print(f"位置映射: {font_position} -> {font_position_english} -> {alignment}")
-
-                # 构建force_style字符串 - 包含位置信息
-                force_style = f"FontName=Arial,FontSize={font_size},PrimaryColour={primary_color},{alignment}"
-
-                # FFmpeg字幕滤镜路径转义规则：
-                # 1. 路径中的冒号需要转义为\:（FFmpeg滤镜语法要求）
-                # 2. 路径中的反斜杠需要转义为\\或统一使用正斜杠
-                # 3. 路径中的单引号需要转义为\'（如果使用单引号包围路径）
-                # 4. 统一使用正斜杠作为路径分隔符
-                subtitle_path_for_filter = subtitle_path.replace('\\', '/')  # 统一使用正斜杠
-                # 转义冒号（FFmpeg滤镜语法要求）
-                subtitle_path_escaped = subtitle_path_for_filter.replace(':', '\\:')
-                # 转义单引号（如果路径中包含单引号）
-                subtitle_path_escaped = subtitle_path_escaped.replace("'", "\\'")
-
-                # 使用单引号包围路径和样式（FFmpeg滤镜标准语法）
-                subtitle_filter = f"subtitles='{subtitle_path_escaped}':force_style='{force_style}'"
-
-                print(f"使用带样式的字幕滤镜: {subtitle_filter}")
-                print(f"样式设置: 字体大小={font_size}, 颜色={font_color_chinese}->{font_color_english}({primary_color}), 位置={font_position}->{font_position_english}({alignment})")
-            except Exception as e:
-                print(f"构建字幕滤镜失败: {str(e)}")
-                # 备用方法：使用最基本的滤镜
-                subtitle_filter = 'format=yuv420p'
-                print(f"使用无字幕滤镜: {subtitle_filter}")
-
-            # 构建FFmpeg命令列表（不使用额外引号，subprocess会自动处理）
-            ffmpeg_cmd = [
-                FFMPEG_PATH,
-                '-y',
-                '-i', video_path_clean,  # 直接使用路径，不加引号
-                '-vf', subtitle_filter   # 直接使用滤镜字符串
-            ]
-
             # 获取用户指定的比特率
             output_bitrate = self.output_bitrate_var.get()
             if not output_bitrate:
@@ -4164,119 +8762,58 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 
             print(f"使用比特率: {output_bitrate}k")
 
-            # 添加编码器参数
-            if encoder:
-                if encoder == "h264_nvenc_fast":
-                    # NVIDIA高性能模式：使用用户指定的比特率
-                    ffmpeg_cmd.extend([
-                        '-b:v', f'{output_bitrate}k',  # 使用用户指定的比特率
-                        '-r', '30',       # 固定帧率
-                        '-vcodec', 'h264_nvenc'  # 使用vcodec参数，与您的命令一致
-                    ])
-                elif encoder == "h264_nvenc":
-                    # NVIDIA标准模式：使用复杂的参数
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-preset', 'p4',  # 使用p4预设平衡性能和质量
-                        '-rc', 'vbr',     # 使用可变比特率
-                        '-cq', '19',      # 设置质量参数
-                        '-b:v', f'{output_bitrate}k',  # 使用用户指定的比特率
-                        '-maxrate', f"{int(output_bitrate) * 1.5:.0f}k",  # 设置最大比特率
-                        '-bufsize', f"{int(output_bitrate) * 2:.0f}k",    # 设置缓冲区大小
-                        '-r', f"{video_info.get('fps', 30):.0f}",
-                        '-spatial-aq', '1',  # 启用空间AQ
-                        '-temporal-aq', '1', # 启用时间AQ
-                        '-rc-lookahead', '32'  # 设置前瞻帧数
-                    ])
-                elif encoder == "hevc_qsv":
-                    # Intel QSV编码器：使用简化的参数（QSV不支持preset等参数）
-                    # 只使用基本的比特率控制参数
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-b:v', f'{output_bitrate}k',  # 使用用户指定的比特率
-                        '-r', f"{video_info.get('fps', 30):.0f}",
-                    ])
-                elif encoder in ["h264_qsv", "h265_qsv"]:
-                    # Intel QSV的其他编码器：使用简化参数
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-b:v', f'{output_bitrate}k',
-                        '-r', f"{video_info.get('fps', 30):.0f}",
-                    ])
-                elif encoder in ["h264_amf", "av1_amf"]:
-                    # AMD AMF编码器
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-quality', 'balanced',  # AMF质量选项
-                        '-rc', 'vbr_peak',  # AMF比特率控制
-                        '-b:v', f'{output_bitrate}k',
-                        '-maxrate', f"{int(output_bitrate) * 1.5:.0f}k",
-                        '-bufsize', f"{int(output_bitrate) * 2:.0f}k",
-                        '-r', f"{video_info.get('fps', 30):.0f}",
-                    ])
-                elif encoder == "h264_vaapi":
-                    # VAAPI编码器（Linux）
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-b:v', f'{output_bitrate}k',
-                        '-maxrate', f"{int(output_bitrate) * 1.5:.0f}k",
-                        '-bufsize', f"{int(output_bitrate) * 2:.0f}k",
-                        '-r', f"{video_info.get('fps', 30):.0f}",
-                    ])
-                else:
-                    # 其他编码器：使用通用参数
-                    ffmpeg_cmd.extend([
-                        '-c:v', encoder,
-                        '-b:v', f'{output_bitrate}k',
-                        '-maxrate', f"{int(output_bitrate) * 1.5:.0f}k",
-                        '-bufsize', f"{int(output_bitrate) * 2:.0f}k",
-                        '-r', f"{video_info.get('fps', 30):.0f}",
-                    ])
-
-                # 对于硬件编码，重新编码音频以确保兼容性
-                ffmpeg_cmd.extend([
-                    '-c:a', 'aac',
-                    '-b:a', f"{video_info.get('audio_bitrate', 192*1000):.0f}",
-                    '-ar', f"{video_info.get('sample_rate', 48000)}",
-                    '-ac', '2'
-                ])
-            else:
-                ffmpeg_cmd.extend([
-                    '-c:v', 'libx264',
-                    '-preset', 'medium',
-                    '-b:v', f'{output_bitrate}k',  # 使用用户指定的比特率
-                    '-r', f"{video_info.get('fps', 30):.0f}",
-                    '-c:a', 'aac',
-                    '-b:a', f"{video_info.get('audio_bitrate', 192*1000):.0f}",
-                    '-ar', f"{video_info.get('sample_rate', 48000)}",
-                    '-ac', '2'
-                ])
-
-            # 添加其他参数
-            ffmpeg_cmd.extend([
-                '-avoid_negative_ts', '1',
-                '-threads', '4',
-                '-max_muxing_queue_size', '1024',
-                # 添加参数确保中途退出时文件可播放
-                '-movflags', '+faststart',  # 将元数据移到文件开头
-                '-f', 'mp4',               # 强制使用MP4格式
-                '-reset_timestamps', '1',  # 重置时间戳
-                '-fflags', '+genpts',      # 生成时间戳
-                save_path  # 直接使用路径，不加引号
-            ])
+            # 将中文颜色/位置名称转换为英文名称
+            font_color_english = self.color_mapping.get(self.font_color_var.get(), 'white')
+            font_position_english = self.position_mapping.get(self.position_var.get(), 'bottom')
 
-            print("FFmpeg命令:")
-            print(" ".join(ffmpeg_cmd))
+            duration = video_info.get('duration')
+            if not duration:
+                messagebox.showerror("错误", "无法获取视频时长")
+                return
 
-            # 打印可复制的命令（用于手动测试）
-            print("\n=== 可复制的FFmpeg命令（用于手动测试）===")
-            copyable_cmd = " ".join(ffmpeg_cmd)
-            print(copyable_cmd)
+            # 编码设置变化时不能续用旧的分段
+            settings = {
+                'subtitle': subtitle_path_clean,
+                'subtitle_identity': ProbeCache.identity(subtitle_path_clean),
+                'font_size': self.font_size_var.get(),
+                'font_color': font_color_english,
+                'position': font_position_english,
+                'encoder': encoder,
+                'bitrate': output_bitrate,
+                'rate_mode': self.subtitle_rate_mode_labels.get(self.subtitle_rate_mode_var.get(), 'bitrate'),
+                'quality': self.subtitle_quality_var.get(),
+                'segment_seconds': RESUME_SEGMENT_SECONDS,
+                'prerender': self.subtitle_prerender_var.get(),
+            }
+            manifest = EncodeManifest.load(save_path)
+            if manifest is not None and manifest.matches(video_path_clean, settings) and manifest.done_count() > 0:
+                total = len(manifest.data['segments'])
+                if not messagebox.askyesno(
+                        "继续生成",
+                        f"发现未完成的生成任务（已完成 {manifest.done_count()}/{total} 段），是否从中断处继续？\n"
+                        f"选择\"否\"将重新开始。"):
+                    manifest = None
+            else:
+                manifest = None
+            if manifest is None:
+                manifest = EncodeManifest.create(save_path, video_path_clean, settings, duration)
+            print(f"分段编码: 共 {len(manifest.data['segments'])} 段，已完成 {manifest.done_count()} 段")
+
+            # 打印第一段的命令（用于手动测试）
+            first = manifest.pending()[0] if manifest.pending() else manifest.data['segments'][0]
+            ffmpeg_cmd = build_subtitle_chunk_cmd(
+                video_path_clean, subtitle_path_clean, manifest.segment_path(first), first['start'],
+                first['duration'], settings['font_size'], font_color_english, font_position_english,
+                encoder, output_bitrate, video_info, settings['rate_mode'], settings['quality']
+            )
+            print("\n=== 可复制的FFmpeg命令（第一段，用于手动测试）===")
+            print(" ".join(ffmpeg_cmd))
             print("=== 复制上面的命令到控制台执行测试 ===\n")
 
             # 开始生成
             print("6. 开始生成字幕视频...")
             self.is_generating = True
+            self.subtitle_pause_requested = False
             self.subtitle_progress_var.set(0)
 
             # 禁用相关按钮
@@ -4285,8 +8822,9 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             # 启动处理线程
             print("7. 启动处理线程...")
             generate_thread = threading.Thread(
-                target=self.run_subtitle_ffmpeg,
-                args=(ffmpeg_cmd, save_path, video_info.get('duration', 7730.76))
+                target=self.run_subtitle_segments,
+                args=(manifest, video_info),
+                kwargs={'metrics': self.metrics.new_job('subtitle')}
             )
             generate_thread.start()
 
@@ -4321,12 +8859,19 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             self.root.after_cancel(self.soft_subtitle_timer)
 
     def update_soft_subtitle_style(self):
-        """更新软字幕样式"""
+        """更新软字幕样式（同时应用到选中的轨道）"""
         # 获取当前样式设置
         font_size = self.soft_font_size_var.get()
         color_name = self.soft_font_color_var.get()
         position_name = self.soft_position_var.get()
 
+        selected = [index for index in self.selected_soft_tracks() if self.soft_tracks[index].stream is None]
+        style = (font_size, color_name, position_name)
+        if any(self.soft_tracks[index].style != style for index in selected):
+            for index in selected:
+                self.soft_tracks[index] = self.soft_tracks[index]._replace(style=style)
+            self.refresh_soft_tracks(selected)
+
         # 转换为实际值
         color = self.color_mapping.get(color_name, "white")
 
@@ -4459,11 +9004,11 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             self.stop_soft_preview()
 
     def generate_soft_subtitle_video(self):
-        """生成软字幕视频（将字幕作为独立轨道）"""
+        """生成软字幕视频（所有字幕轨道一次流复制封装）"""
         print("\n=== 开始生成软字幕视频 ===")
-        if not self.soft_subtitle_cap or not self.soft_subtitles:
+        if not self.soft_subtitle_cap or not self.soft_tracks:
             print("错误：未选择视频或字幕文件")
-            messagebox.showerror("错误", "请先选择视频和字幕文件")
+            messagebox.showerror("错误", "请先选择视频并添加字幕轨道")
             return
 
         if self.soft_is_generating:
@@ -4472,20 +9017,18 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             return
 
         print("1. 选择保存路径...")
-        # 生成默认输出文件名：视频名称-soft.mp4
+        # 生成默认输出文件名：视频名称-soft.mkv（MKV支持所有字幕格式和样式）
         video_path = self.soft_video_path_var.get()
         if video_path:
             video_dir = os.path.dirname(video_path)
             video_name = os.path.splitext(os.path.basename(video_path))[0]
-            default_filename = f"{video_name}-soft.mp4"
-            default_path = os.path.join(video_dir, default_filename)
+            default_path = os.path.join(video_dir, f"{video_name}-soft.mkv")
         else:
             default_path = ""
 
-        # 选择保存路径 - 默认使用MKV格式（支持所有字幕格式）
         save_path = filedialog.asksaveasfilename(
-            title="选择保存位置",
-            initialfile=default_path.replace('.mp4', '.mkv'),
+            title="选择保存位置（可直接选原MKV文件，只重写容器）",
+            initialfile=default_path,
             defaultextension=".mkv",
             filetypes=[("MKV文件", "*.mkv"), ("MP4文件", "*.mp4")]
         )
@@ -4496,93 +9039,75 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 
         print(f"2. 保存路径: {save_path}")
 
+        temp_files = []
         try:
-            # 获取视频和字幕路径
-            video_path = self.soft_video_path_var.get()
-            subtitle_path = self.soft_subtitle_path_var.get()
-
             # 验证路径
             if not os.path.exists(video_path):
                 messagebox.showerror("错误", f"视频文件不存在: {video_path}")
                 return
-            if not os.path.exists(subtitle_path):
-                messagebox.showerror("错误", f"字幕文件不存在: {subtitle_path}")
-                return
-
-            # 检测输出格式
-            output_ext = os.path.splitext(save_path)[1].lower()
-            is_mp4 = output_ext == '.mp4'
-
-            # 检测字幕格式
-            subtitle_ext = os.path.splitext(subtitle_path)[1].lower()
-            is_srt = subtitle_ext in ['.srt']
-            is_ass = subtitle_ext in ['.ass', '.ssa']
-
-            # 获取用户选择的样式设置
-            font_size = self.soft_font_size_var.get()
-            font_color_chinese = self.soft_font_color_var.get()
-            font_position = self.soft_position_var.get()
+            for track in self.soft_tracks:
+                if track.stream is None and not os.path.exists(track.path):
+                    messagebox.showerror("错误", f"字幕文件不存在: {track.path}")
+                    return
 
-            print(f"3. 应用字幕样式 - 字号: {font_size}, 颜色: {font_color_chinese}, 位置: {font_position}")
+            video_path_clean = os.path.abspath(video_path)
+            save_path = os.path.abspath(save_path)
+
+            modes = {name: mode for mode, name in EXISTING_SUBTITLE_MODES.items()}
+            existing_mode = modes.get(self.soft_existing_mode_var.get(), 'keep')
+            print(f"[DEBUG] 原有字幕轨道: {self.soft_existing_subtitles}，处理方式: {existing_mode}")
+
+            # 只改原MKV的轨道信息时原地修改，不重写音视频数据
+            edit_mode = soft_subtitle_edit_mode(video_path_clean, save_path, self.soft_tracks,
+                                                self.soft_existing_subtitles, existing_mode)
+            print(f"[DEBUG] 修改方式: {edit_mode}")
+            if edit_mode == 'inplace':
+                cmd = build_mkvpropedit_cmd(video_path_clean, soft_output_tracks(self.soft_tracks, existing_mode))
+                print("mkvpropedit命令:")
+                print(" ".join(cmd))
+                self.release_soft_video()
+                self.soft_is_generating = True
+                self.soft_generate_btn.config(state='disabled')
+                self.soft_preview_btn.config(state='disabled')
+                threading.Thread(
+                    target=self.run_soft_subtitle_propedit,
+                    args=(cmd, video_path_clean),
+                    kwargs={'metrics': self.metrics.new_job('soft_subtitle')}
+                ).start()
+                return
 
-            # 对于软字幕，需要将样式嵌入到ASS文件中
-            # 无论输入是SRT还是ASS，都转换为带样式的ASS文件
+            # 每条新轨道按各自的样式转换为带样式的ASS文件
             import tempfile
-            temp_ass = tempfile.NamedTemporaryFile(suffix='.ass', delete=False)
-            temp_ass_path = temp_ass.name
-            temp_ass.close()
-
-            # 创建带样式的ASS文件
-            try:
-                self.create_styled_ass_file(subtitle_path, temp_ass_path, font_size, font_color_chinese, font_position)
-                print(f"[DEBUG] 已创建带样式的ASS文件: {temp_ass_path} (大小: {os.path.getsize(temp_ass_path)} 字节)")
-                subtitle_path_clean = os.path.abspath(temp_ass_path)
-                subtitle_codec = 'ass'
-                use_temp_file = True
-            except Exception as e:
-                error_msg = f"创建带样式ASS文件失败: {str(e)}"
-                print(error_msg)
-                messagebox.showerror("错误", error_msg)
+            styled_tracks = []
+            for track in self.soft_tracks:
+                if track.stream is not None:
+                    styled_tracks.append(track)
+                    continue
+                font_size, font_color_chinese, font_position = track.style
+                print(f"3. 轨道 {os.path.basename(track.path)} ({track.language}) - 字号: {font_size}, 颜色: {font_color_chinese}, 位置: {font_position}")
+                temp_ass = tempfile.NamedTemporaryFile(suffix='.ass', delete=False)
+                temp_ass.close()
+                temp_files.append(temp_ass.name)
                 try:
-                    os.unlink(temp_ass_path)
-                except:
-                    pass
-                return
+                    self.create_styled_ass_file(track.path, temp_ass.name, font_size, font_color_chinese, font_position)
+                except Exception as e:
+                    error_msg = f"创建带样式ASS文件失败（{os.path.basename(track.path)}）: {str(e)}"
+                    print(error_msg)
+                    messagebox.showerror("错误", error_msg)
+                    self._remove_soft_temp_files(temp_files)
+                    return
+                print(f"[DEBUG] 已创建带样式的ASS文件: {temp_ass.name} (大小: {os.path.getsize(temp_ass.name)} 字节)")
+                styled_tracks.append(track._replace(path=temp_ass.name))
 
-            video_path_clean = os.path.abspath(video_path)
+            # 输出到原文件时先写到同目录的临时文件，完成后替换
+            output_path = save_path
+            if os.path.normcase(save_path) == os.path.normcase(video_path_clean):
+                base, ext = os.path.splitext(save_path)
+                output_path = f"{base}.muxing{ext}"
+                self.release_soft_video()
 
             print("4. 构建FFmpeg命令...")
-            # 构建FFmpeg命令 - 软字幕不需要重新编码视频，只需要添加字幕轨道
-            # 参考硬字幕的实现，使用subprocess.Popen直接传递参数列表
-            ffmpeg_cmd = [
-                FFMPEG_PATH,
-                '-y',
-                '-i', video_path_clean,
-                '-i', subtitle_path_clean,
-                '-c:v', 'copy',  # 复制视频流，不重新编码
-                '-c:a', 'copy',  # 复制音频流，不重新编码
-                '-map', '0:v',  # 映射第一个输入的视频流
-                '-map', '0:a',  # 映射第一个输入的音频流
-                '-map', '1:s',  # 映射第二个输入的字幕流
-            ]
-
-            # 根据输出格式设置字幕编解码器和容器格式
-            # 由于我们已经统一转换为带样式的ASS格式，所以总是使用ASS
-            if is_mp4:
-                # MP4容器：ASS格式需要转换为mov_text（MP4标准字幕格式）
-                # 但mov_text不支持样式，所以先尝试使用ass，如果失败再转换
-                # 实际上MP4对ASS支持有限，建议使用MKV格式以保留完整样式
-                ffmpeg_cmd.extend(['-c:s', 'mov_text'])
-                ffmpeg_cmd.extend(['-f', 'mp4'])
-            else:
-                # MKV容器：使用ass编解码器以确保样式被正确编码
-                ffmpeg_cmd.extend(['-c:s', 'ass'])  # 使用ass编解码器以保留样式
-                ffmpeg_cmd.extend(['-f', 'matroska'])
-
-            # 设置字幕语言元数据
-            ffmpeg_cmd.extend(['-metadata:s:s:0', 'language=chi'])
-
-            ffmpeg_cmd.append(save_path)
+            ffmpeg_cmd = build_soft_subtitle_cmd(video_path_clean, styled_tracks, output_path, existing_mode)
 
             print("FFmpeg命令:")
             print(" ".join(ffmpeg_cmd))
@@ -4600,7 +9125,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             print("6. 启动处理线程...")
             generate_thread = threading.Thread(
                 target=self.run_soft_subtitle_ffmpeg,
-                args=(ffmpeg_cmd, save_path, use_temp_file, subtitle_path_clean if use_temp_file else None)
+                args=(ffmpeg_cmd, output_path, video_path_clean, temp_files, save_path),
+                kwargs={'metrics': self.metrics.new_job('soft_subtitle')}
             )
             generate_thread.start()
 
@@ -4610,190 +9136,105 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             messagebox.showerror("错误", f"生成失败: {str(e)}")
             self.soft_generate_btn.config(state='normal')
             self.soft_preview_btn.config(state='normal')
-            if 'use_temp_file' in locals() and use_temp_file and os.path.exists(subtitle_path_clean):
+            self._remove_soft_temp_files(temp_files)
+
+    def run_soft_subtitle_propedit(self, cmd, video_path, metrics=None):
+        """用mkvpropedit原地修改MKV字幕轨道信息（工作线程中运行，不访问Tk对象）"""
+        metrics = metrics or self.metrics.new_job('soft_subtitle')
+        returncode = -1
+        try:
+            metrics.add_input(video_path)
+            size_before = os.path.getsize(video_path)
+            head_before = read_file_head(video_path)
+            metrics.mark('spawn')
+            returncode, stdout, stderr = _run_check(cmd, timeout=300)
+            metrics.mark('finalize')
+            print(stdout)
+            if returncode == 0:
+                written = edited_bytes(video_path, head_before, size_before)
+                print(f"[DEBUG] 原地修改完成，写入约 {written} 字节")
+                self.ui_bus.progress('soft_subtitle', 100)
+                self.ui_bus.call(messagebox.showinfo, "成功", f"字幕轨道信息已修改:\n{video_path}\n"
+                                 f"方式: 原地修改（mkvpropedit），写入约 {written / 1024:.1f} KB")
+            else:
+                error_msg = f"原地修改失败（返回码: {returncode}）\n{(stderr or stdout)[-1000:]}"
+                print(error_msg)
+                self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+                self.ui_bus.progress('soft_subtitle', 0)
+        except Exception as e:
+            error_msg = f"执行失败: {str(e)}"
+            print(error_msg)
+            self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+            self.ui_bus.progress('soft_subtitle', 0)
+        finally:
+            metrics.finish(returncode, video_path)
+            self.soft_is_generating = False
+            self.ui_bus.call(self.enable_soft_subtitle_buttons)
+            self.ui_bus.call(self.load_soft_subtitle_video, video_path)
+
+    def release_soft_video(self):
+        """修改原文件前关闭预览占用的视频文件（Windows下打开的文件不能被替换）"""
+        if self.soft_is_previewing:
+            self.stop_soft_preview()
+        if self.soft_subtitle_cap:
+            self.soft_subtitle_cap.release()
+            self.soft_subtitle_cap = None
+
+    def _remove_soft_temp_files(self, temp_files):
+        """删除软字幕生成的临时ASS文件"""
+        for temp_file_path in temp_files:
+            if os.path.exists(temp_file_path):
                 try:
-                    os.unlink(subtitle_path_clean)
-                except:
-                    pass
+                    os.unlink(temp_file_path)
+                    print(f"[DEBUG] 已删除临时字幕文件: {temp_file_path}")
+                except Exception as e:
+                    print(f"[DEBUG] 删除临时文件失败: {e}")
+
+    def run_soft_subtitle_ffmpeg(self, cmd, output_path, video_path, temp_files=(), final_path=None, metrics=None):
+        """执行FFmpeg命令生成软字幕视频（工作线程中运行，不访问Tk对象）
 
-    def run_soft_subtitle_ffmpeg(self, cmd, output_path, use_temp_file=False, temp_file_path=None):
-        """执行FFmpeg命令生成软字幕视频"""
-        process = None
+        final_path与output_path不同时（输出到原文件），成功后用输出替换final_path。
+        """
+        metrics = metrics or self.metrics.new_job('soft_subtitle')
         final_returncode = -1
         try:
+            metrics.mark('probe')
+            metrics.add_input(video_path)
             print("\n=== 开始执行FFmpeg命令 ===")
 
             # 获取视频时长用于进度计算
-            video_path = self.soft_video_path_var.get()
             video_duration = 0.0
             try:
-                info_cmd = [FFMPEG_PATH, '-i', video_path]
-                if sys.platform == 'win32':
-                    cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in info_cmd)
-                    info_result = subprocess.run(
-                        cmd_str,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8',
-                        creationflags=subprocess.CREATE_NO_WINDOW
-                    )
-                else:
-                    info_result = subprocess.run(
-                        info_cmd,
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8'
-                    )
-
-                for line in info_result.stderr.split('\n'):
-                    if 'Duration:' in line:
-                        duration = line.split('Duration: ')[1].split(',')[0].strip()
-                        h, m, s = map(float, duration.split(':'))
-                        video_duration = h * 3600 + m * 60 + s
-                        break
+                video_duration = probe_media_info(video_path).get('duration', 0)
             except Exception as e:
                 print(f"获取视频时长失败: {e}，将无法显示准确进度")
 
             print(f"视频时长: {video_duration:.2f}秒")
 
-            # 执行FFmpeg命令
-            if sys.platform == 'win32':
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    preexec_fn=os.setsid
-                )
-
-            # 将进程添加到跟踪列表
-            self.active_processes.append(process)
-            print(f"[DEBUG] 启动软字幕进程 PID: {process.pid}")
-
-            # 实时读取输出并更新进度
-            import time
-            last_progress = 0
-            last_file_size = 0
-            file_size_stable_count = 0
-            last_output_time = time.time()
-
-            while True:
-                # 检查进程是否已退出
-                if process.poll() is not None:
-                    print("[DEBUG] 软字幕FFmpeg进程已退出")
-                    break
-
-                # 检查是否应该停止处理
-                if not self.soft_is_generating:
-                    print("[DEBUG] 收到停止信号，终止软字幕进程...")
-                    process.terminate()
-                    break
-
-                try:
-                    # 读取一行输出（非阻塞）
-                    import select
-                    if sys.platform != 'win32':
-                        ready, _, _ = select.select([process.stderr], [], [], 0.1)
-                        if ready:
-                            line = process.stderr.readline()
-                        else:
-                            line = None
-                    else:
-                        line = process.stderr.readline()
-
-                    if line:
-                        line = line.strip()
-                        print(line)
-                        last_output_time = time.time()
-
-                        # 解析进度信息
-                        if 'time=' in line:
-                            try:
-                                time_str = line.split('time=')[1].split(' ')[0].strip()
-                                h, m, s = map(float, time_str.split(':'))
-                                current_time = h * 3600 + m * 60 + s
-
-                                # 计算进度百分比
-                                if video_duration > 0:
-                                    progress = (current_time / video_duration) * 100
-                                    progress = min(progress, 98)
-
-                                    if progress > last_progress:
-                                        last_progress = progress
-                                        self.root.after(0, lambda p=progress: self.soft_subtitle_progress_var.set(p))
-                                        print(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
-                            except Exception as e:
-                                print(f"进度解析错误: {e}")
-                except Exception as e:
-                    if "readline" not in str(e).lower():
-                        print(f"读取输出错误: {e}")
-
-                # 监控输出文件大小变化
-                if os.path.exists(output_path):
-                    try:
-                        current_file_size = os.path.getsize(output_path)
-                        if current_file_size > last_file_size:
-                            last_file_size = current_file_size
-                            file_size_stable_count = 0
-                        elif current_file_size == last_file_size and current_file_size > 0:
-                            file_size_stable_count += 1
-                        else:
-                            file_size_stable_count = 0
-
-                        if file_size_stable_count > 50:
-                            print(f"[DEBUG] 文件大小已稳定 {file_size_stable_count * 0.1:.1f}秒")
-                    except:
-                        pass
+            last_progress = [0]
 
-                # 检查长时间无输出
-                elapsed_since_output = time.time() - last_output_time
-                if elapsed_since_output > 30:
-                    if process.poll() is None:
-                        print(f"[DEBUG] 超过30秒无输出，但进程仍在运行")
-                        if os.path.exists(output_path):
-                            file_size = os.path.getsize(output_path)
-                            if file_size > 0 and last_progress < 95:
-                                self.root.after(0, lambda: self.soft_subtitle_progress_var.set(95))
-                                print(f"[DEBUG] 设置进度为95%")
-
-                time.sleep(0.1)
-
-            # 获取最终返回码
-            returncode = process.poll()
-            if returncode is None:
-                try:
-                    returncode = process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    returncode = process.returncode if process.returncode is not None else -1
+            def on_line(line):
+                metrics.observe_line(line)
 
-            # 读取剩余输出
-            try:
-                if process.stdin and not process.stdin.closed:
-                    process.stdin.close()
-                stdout, stderr = process.communicate(timeout=5)
-            except subprocess.TimeoutExpired:
-                print("[DEBUG] 读取输出超时")
-                stdout, stderr = "", ""
-            except Exception as e:
-                print(f"[DEBUG] 读取输出时出错: {e}")
-                stdout, stderr = "", ""
+                # 解析进度信息
+                current_time = parse_ffmpeg_time(line)
+                if current_time is not None and video_duration > 0:
+                    progress = min(current_time / video_duration * 100, 98)
+                    if progress > last_progress[0]:
+                        last_progress[0] = progress
+                        self.ui_bus.progress('soft_subtitle', progress)
+                        progress_log.debug(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
 
-            final_returncode = returncode
+            # 执行FFmpeg命令
+            metrics.mark('spawn')
+            started = []
+            final_returncode, stderr = self._run_tracked_ffmpeg(
+                cmd, on_line=on_line, metrics=metrics,
+                should_stop=lambda: not self.soft_is_generating, on_spawn=started.append)
+            # 停止、暂停或关闭程序时FFmpeg按'q'退出，返回码也是0，但输出不完整
+            stopped = not self.soft_is_generating or any(process.stopped for process in started)
+            print("[DEBUG] 软字幕FFmpeg进程已退出")
+            metrics.mark('finalize')
 
             # 打印完整的错误输出用于调试
             if stderr:
@@ -4814,14 +9255,33 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             print(f"[DEBUG] 最终返回码: {final_returncode}")
             print(f"[DEBUG] 文件存在: {file_exists}, 文件大小: {file_size}")
 
-            # 处理结果
-            if final_returncode == 0 and file_exists and file_size > 0:
+            # 处理结果：只有完整的输出才能替换原文件（否则在finally中删除临时文件，原文件不动）
+            if stopped and final_returncode == 0:
+                final_returncode = -1
+            duration_mismatch = False
+            if final_returncode == 0 and file_exists and file_size > 0 and final_path and final_path != output_path:
+                if duration_matches(output_path, video_duration):
+                    os.replace(output_path, final_path)
+                    print(f"[DEBUG] 已替换原文件: {final_path}")
+                    output_path = final_path
+                else:
+                    print("[DEBUG] 输出时长与原视频不一致，保留原文件")
+                    final_returncode = -1
+                    duration_mismatch = True
+
+            if stopped:
+                print("[DEBUG] 软字幕生成已停止，输出不完整，已丢弃")
+                self.ui_bus.progress('soft_subtitle', 0)
+            elif final_returncode == 0 and file_exists and file_size > 0:
                 print("软字幕视频生成成功！")
-                self.root.after(0, lambda: self.soft_subtitle_progress_var.set(100))
-                self.root.after(0, lambda: messagebox.showinfo("成功", f"软字幕视频已生成:\n{output_path}\n文件大小: {file_size / (1024*1024):.2f} MB"))
+                self.ui_bus.progress('soft_subtitle', 100)
+                self.ui_bus.call(messagebox.showinfo, "成功", f"软字幕视频已生成:\n{output_path}\n"
+                                 f"方式: 流复制重新封装，写入 {file_size / (1024*1024):.2f} MB")
             else:
                 error_msg = f"生成失败"
-                if final_returncode != 0:
+                if duration_mismatch:
+                    error_msg += "\n输出时长与原视频不一致，原文件未改动"
+                elif final_returncode != 0:
                     error_msg += f"（返回码: {final_returncode}）"
                 if file_exists and file_size == 0:
                     error_msg += "\n输出文件大小为0，可能是编码参数错误"
@@ -4839,415 +9299,208 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
                     error_lines = stderr.split('\n')
                     key_errors = []
                     for line in error_lines:
-                        if any(keyword in line.lower() for keyword in ['error', 'failed', 'invalid', 'cannot', 'unable']):
-                            key_errors.append(line.strip())
-                    if key_errors:
-                        error_msg += "\n\n关键错误信息:\n" + "\n".join(key_errors[-5:])  # 只显示最后5条关键错误
-                    else:
-                        error_msg += f"\n\n完整错误输出:\n{stderr[-1000:]}"  # 显示最后1000字符
-
-                print(error_msg)
-                self.root.after(0, lambda msg=error_msg: messagebox.showerror("错误", msg))
-                self.root.after(0, lambda: self.soft_subtitle_progress_var.set(0))
-
-        except Exception as e:
-            error_msg = f"执行失败: {str(e)}"
-            print(error_msg)
-            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
-            self.root.after(0, lambda: self.soft_subtitle_progress_var.set(0))
-        finally:
-            # 清理进程资源
-            if process is not None:
-                try:
-                    if process.poll() is None:
-                        process.terminate()
-                        try:
-                            process.wait(timeout=2)
-                        except subprocess.TimeoutExpired:
-                            process.kill()
-                            process.wait(timeout=1)
-
-                    # 关闭管道
-                    for pipe_name in ['stdin', 'stdout', 'stderr']:
-                        pipe = getattr(process, pipe_name, None)
-                        if pipe and not pipe.closed:
-                            try:
-                                pipe.close()
-                            except:
-                                pass
-
-                    # 从活跃进程列表中移除
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                except Exception as e:
-                    print(f"清理软字幕进程时出错: {e}")
-
-            # 更新状态标志
-            self.soft_is_generating = False
-
-            # 重新启用按钮
-            self.root.after(0, self.enable_soft_subtitle_buttons)
-
-            # 根据最终返回码处理进度条
-            final_rc = final_returncode if 'final_returncode' in locals() else (process.returncode if process and process.returncode is not None else -1)
-            if final_rc != 0:
-                self.root.after(0, lambda: self.soft_subtitle_progress_var.set(0))
-                print(f"[DEBUG] 处理失败（返回码: {final_rc}），重置进度条")
-
-            # 清理临时文件
-            if use_temp_file and temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    print(f"[DEBUG] 已删除临时字幕文件: {temp_file_path}")
-                except Exception as e:
-                    print(f"[DEBUG] 删除临时文件失败: {e}")
-
-            print("=== 软字幕FFmpeg命令执行完成 ===\n")
-
-    def run_subtitle_ffmpeg(self, cmd, output_path, video_duration=7730.76):
-        """执行FFmpeg命令生成字幕视频"""
-        process = None
-        final_returncode = -1  # 初始化返回码，默认失败
-        try:
-            print("\n=== 开始执行FFmpeg命令 ===")
-            print("1. 检查FFmpeg路径...")
-            if not os.path.exists(FFMPEG_PATH):
-                raise Exception(f"FFmpeg不存在: {FFMPEG_PATH}")
-            print(f"FFmpeg路径: {FFMPEG_PATH}")
-
-            print("2. 检查输入文件...")
-            if not os.path.exists(self.video_path_var.get()):
-                raise Exception(f"输入视频不存在: {self.video_path_var.get()}")
-            print(f"输入视频: {self.video_path_var.get()}")
-
-            print("3. 检查字幕文件...")
-            if not os.path.exists(self.subtitle_path_var.get()):
-                raise Exception(f"字幕文件不存在: {self.subtitle_path_var.get()}")
-            print(f"字幕文件: {self.subtitle_path_var.get()}")
-
-            print("4. 执行FFmpeg命令...")
-            print("命令:", " ".join(cmd))
-
-            # 添加详细的路径调试信息
-            print("4.1. 路径调试信息:")
-            print(f"   - FFmpeg路径: {FFMPEG_PATH}")
-            print(f"   - 输入视频: {self.video_path_var.get()}")
-            print(f"   - 字幕文件: {self.subtitle_path_var.get()}")
-            print(f"   - 输出文件: {output_path}")
-            print(f"   - 输入视频存在: {os.path.exists(self.video_path_var.get())}")
-            print(f"   - 字幕文件存在: {os.path.exists(self.subtitle_path_var.get())}")
-
-            # 检查FFmpeg是否可执行
-            try:
-                ffmpeg_test = subprocess.run([FFMPEG_PATH, '-version'],
-                                             capture_output=True,
-                                             timeout=10,
-                                             creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0)
-                if ffmpeg_test.returncode != 0:
-                    raise Exception(f"FFmpeg测试失败，返回码: {ffmpeg_test.returncode}")
-                print("   - FFmpeg可执行: 是")
-            except Exception as e:
-                raise Exception(f"FFmpeg不可执行: {str(e)}")
-
-            # 使用subprocess.Popen执行命令，直接传递参数列表（不使用shell=True）
-            # 这样可以避免Windows shell解析问题，并且Python的subprocess会自动处理路径编码
-            if sys.platform == 'win32':
-                process = subprocess.Popen(
-                    cmd,  # 直接传递参数列表
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',  # 处理编码错误，用替换字符代替
-                    creationflags=subprocess.CREATE_NO_WINDOW,  # 不显示控制台窗口
-                    preexec_fn=None  # Windows上不需要
-                )
-            else:
-                # Linux/Mac系统
-                process = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',  # 处理编码错误，用替换字符代替
-                    preexec_fn=os.setsid  # 创建新的进程组
-                )
+                        if any(keyword in line.lower() for keyword in ['error', 'failed', 'invalid', 'cannot', 'unable']):
+                            key_errors.append(line.strip())
+                    if key_errors:
+                        error_msg += "\n\n关键错误信息:\n" + "\n".join(key_errors[-5:])  # 只显示最后5条关键错误
+                    else:
+                        error_msg += f"\n\n完整错误输出:\n{stderr[-1000:]}"  # 显示最后1000字符
 
-            # 保存进程引用到实例变量（用于其他地方访问）
-            self.process = process
+                print(error_msg)
+                self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+                self.ui_bus.progress('soft_subtitle', 0)
 
-            # 将进程添加到跟踪列表
-            self.active_processes.append(process)
-            print(f"[DEBUG] 启动FFmpeg字幕进程 PID: {process.pid}")
+        except Exception as e:
+            error_msg = f"执行失败: {str(e)}"
+            print(error_msg)
+            self.ui_bus.call(messagebox.showerror, "错误", error_msg)
+            self.ui_bus.progress('soft_subtitle', 0)
+        finally:
+            metrics.finish(final_returncode, output_path)
 
-            # 设置进程为守护进程，确保主程序退出时子进程也会退出
-            if hasattr(process, 'daemon'):
-                process.daemon = True
+            # 更新状态标志
+            self.soft_is_generating = False
 
-            # 实时读取输出并更新进度
-            print("5. 开始实时读取FFmpeg输出...")
-            import time
+            # 重新启用按钮
+            self.ui_bus.call(self.enable_soft_subtitle_buttons)
 
-            # 使用传入的视频时长
-            print(f"视频时长: {video_duration:.2f}秒")
+            # 根据最终返回码处理进度条
+            if final_returncode != 0:
+                self.ui_bus.progress('soft_subtitle', 0)
+                print(f"[DEBUG] 处理失败（返回码: {final_returncode}），重置进度条")
 
-            # 实时读取stderr输出
-            last_progress = 0
-            last_file_size = 0
-            file_size_stable_count = 0  # 文件大小稳定计数器
-            last_output_time = time.time()  # 最后输出时间
+            # 清理临时文件（包括输出到原文件时失败留下的中间文件）
+            self._remove_soft_temp_files(temp_files)
+            if final_path and final_path != output_path and os.path.exists(output_path):
+                try:
+                    os.remove(output_path)
+                except OSError:
+                    pass
+            # 输出到原文件时预览已关闭，重新打开（成功时同时刷新轨道列表）
+            if final_path and os.path.normcase(final_path) == os.path.normcase(video_path):
+                self.ui_bus.call(self.load_soft_subtitle_video, final_path)
 
-            while True:
-                # 检查进程是否已退出
-                if process.poll() is not None:
-                    print("[DEBUG] FFmpeg进程已退出")
-                    break
+            print("=== 软字幕FFmpeg命令执行完成 ===\n")
 
-                # 检查是否应该停止处理
-                if not self.is_generating:
-                    print("[DEBUG] 收到停止信号，终止FFmpeg进程...")
-                    process.terminate()
-                    break
+    def run_subtitle_segments(self, manifest, video_info, metrics=None):
+        """分段生成字幕视频（工作线程中运行，不访问Tk对象）
 
+        每段完成后写入清单；暂停、关闭或出错时当前段丢弃，已完成的段保留，
+        下次生成到同一文件时从未完成的段继续。全部完成后流复制拼接。
+        """
+        metrics = metrics or self.metrics.new_job('subtitle')
+        settings = manifest.data['settings']
+        source = manifest.data['source']
+        output_path = manifest.output_path
+        duration = manifest.data['duration']
+        final_returncode = -1
+        paused = False
+        try:
+            metrics.mark('probe')
+            metrics.add_input(source)
+            print("\n=== 开始分段生成字幕视频 ===")
+            if not os.path.exists(source):
+                raise Exception(f"输入视频不存在: {source}")
+            if not os.path.exists(settings['subtitle']):
+                raise Exception(f"字幕文件不存在: {settings['subtitle']}")
+
+            # 检查FFmpeg是否可执行（启动时已检测通过则不再重复启动进程）
+            if not toolchain_ready.is_set():
                 try:
-                    # 读取一行输出（非阻塞）
-                    import select
-                    if sys.platform != 'win32':
-                        # Linux/Mac使用select
-                        ready, _, _ = select.select([process.stderr], [], [], 0.1)
-                        if ready:
-                            line = process.stderr.readline()
-                        else:
-                            line = None
-                    else:
-                        # Windows使用简单的readline（可能阻塞，但设置了超时）
-                        line = process.stderr.readline()
-
-                    if line:
-                        line = line.strip()
-                        print(line)
-                        last_output_time = time.time()  # 更新最后输出时间
-
-                        # 解析进度信息
-                        if 'time=' in line:
-                            try:
-                                time_str = line.split('time=')[1].split(' ')[0].strip()
-                                h, m, s = map(float, time_str.split(':'))
-                                current_time = h * 3600 + m * 60 + s
-
-                                # 计算进度百分比
-                                progress = (current_time / video_duration) * 100
-                                progress = min(progress, 98)  # 限制最大进度为98%，保留2%给最终处理
-
-                                if progress > last_progress:
-                                    last_progress = progress
-                                    # 更新进度条
-                                    self.root.after(0, lambda p=progress: self.subtitle_progress_var.set(p))
-                                    print(f"进度: {progress:.1f}% ({current_time:.1f}s / {video_duration:.1f}s)")
-
-                            except Exception as e:
-                                print(f"进度解析错误: {e}")
+                    discover_toolchain()
                 except Exception as e:
-                    # 读取错误，可能是流已关闭
-                    if "readline" not in str(e).lower():
-                        print(f"读取输出错误: {e}")
-
-                # 监控输出文件大小变化（用于大文件处理）
-                if os.path.exists(output_path):
-                    try:
-                        current_file_size = os.path.getsize(output_path)
-
-                        # 如果文件大小在增长，重置稳定计数器
-                        if current_file_size > last_file_size:
-                            last_file_size = current_file_size
-                            file_size_stable_count = 0
-                        elif current_file_size == last_file_size and current_file_size > 0:
-                            # 文件大小稳定，增加计数器
-                            file_size_stable_count += 1
-                        else:
-                            file_size_stable_count = 0
-
-                        # 如果文件大小稳定超过5秒，且进程仍在运行，可能是缓冲写入阶段
-                        # 这种情况下，进度可能接近完成，但FFmpeg还在写入元数据
-                        if file_size_stable_count > 50:  # 5秒（50 * 0.1秒）
-                            print(f"[DEBUG] 文件大小已稳定 {file_size_stable_count * 0.1:.1f}秒，可能处于最终写入阶段")
-                    except Exception as e:
-                        pass  # 忽略文件访问错误
-
-                # 检查是否有长时间无输出（大文件可能在最后阶段）
-                elapsed_since_output = time.time() - last_output_time
-                if elapsed_since_output > 30:  # 30秒无输出
-                    # 检查进程是否还在运行
-                    if process.poll() is None:
-                        print(f"[DEBUG] 超过30秒无输出，但进程仍在运行，可能是大文件最终处理阶段")
-                        # 可以尝试检查文件大小来判断是否完成
-                        if os.path.exists(output_path):
-                            file_size = os.path.getsize(output_path)
-                            if file_size > 0:
-                                # 文件存在且有大小，可能是写入阶段，设置一个高进度
-                                if last_progress < 95:
-                                    self.root.after(0, lambda: self.subtitle_progress_var.set(95))
-                                    print(f"[DEBUG] 设置进度为95%（等待最终完成）")
-
-                time.sleep(0.1)  # 短暂休眠
-
-            # 进程已退出，快速获取返回码和输出
-            print("[DEBUG] 开始读取最终输出...")
-            returncode = None
-            stdout = ""
-            stderr = ""
-
-            # 进程已经退出，直接获取返回码
-            returncode = process.poll()
-            if returncode is not None:
-                print(f"[DEBUG] 进程已退出，返回码: {returncode}")
-            else:
-                # 如果还没退出，等待一下（最多5秒）
-                try:
-                    returncode = process.wait(timeout=5)
-                    print(f"[DEBUG] 等待进程结束，返回码: {returncode}")
-                except subprocess.TimeoutExpired:
-                    print("[DEBUG] 等待进程超时，强制获取返回码")
-                    returncode = process.returncode if process.returncode is not None else -1
+                    raise Exception(f"FFmpeg不可执行: {str(e)}")
+
+            # 分段编码的结果与一次编码不完全相同，使用单独的命名空间（预渲染叠加的结果也单独缓存）
+            prerender = settings.get('prerender', False)
+            cache_key = self.result_cache.job_key(
+                build_subtitle_burn_cmd(source, settings['subtitle'], output_path, settings['font_size'],
+                                        settings['font_color'], settings['position'], settings['encoder'],
+                                        settings['bitrate'], video_info, settings.get('rate_mode', 'bitrate'),
+                                        settings.get('quality', DEFAULT_QUALITY)),
+                [source, settings['subtitle']], output_path,
+                namespace='subtitle_segments_overlay' if prerender else 'subtitle_segments')
+            method = self.result_cache.fetch(cache_key, output_path)
+            if method:
+                print(f"[DEBUG] 相同的字幕视频已生成过，直接使用缓存结果（{method}）")
+                manifest.discard()
+                final_returncode = 0
+                self.ui_bus.progress('subtitle', 100)
+                self.ui_bus.call(self.handle_subtitle_completion, final_returncode, output_path)
+                return
 
-            # 快速读取剩余输出（不阻塞，设置短超时）
-            try:
-                if process.stdin and not process.stdin.closed:
-                    try:
-                        process.stdin.close()
-                    except:
-                        pass
+            overlay = None
+            if prerender:
+                print("[DEBUG] 预渲染字幕叠加图...")
+                overlay = prerender_subtitle_overlay(
+                    settings['subtitle'], *display_size(video_info), settings['font_size'],
+                    settings['font_color'], settings['position'], os.path.join(manifest.parts_dir, 'overlay'))
+                if overlay is None:
+                    print("[DEBUG] 字幕含动画效果或无法预渲染，改为逐帧渲染")
+                else:
+                    print(f"[DEBUG] 预渲染完成: {overlay.images} 幅叠加图，{overlay.states} 个字幕区间，"
+                          f"叠加区域 {overlay.width}x{overlay.height}+{overlay.x}+{overlay.y}")
 
-                # 使用短超时快速读取输出，避免长时间阻塞
-                stdout, stderr = process.communicate(timeout=2)
-            except subprocess.TimeoutExpired:
-                # 超时就忽略，我们已经有了返回码
-                print("[DEBUG] 读取输出超时，使用已有返回码继续")
-                stdout, stderr = "", ""
-            except Exception as e:
-                print(f"[DEBUG] 读取输出时出错: {e}")
-                stdout, stderr = "", ""
-
-            # 确保返回码有效
-            if returncode is None:
-                returncode = process.returncode if process.returncode is not None else -1
-
-            print("6. 检查执行结果...")
-            print(f"返回码: {returncode}")
-            if stdout:
-                stdout_preview = stdout[-2000:] if len(stdout) > 2000 else stdout
-                print("标准输出:")
-                print(stdout_preview)
-            if stderr:
-                stderr_preview = stderr[-2000:] if len(stderr) > 2000 else stderr
-                print("错误输出:")
-                print(stderr_preview)
+            metrics.mark('spawn')
+            first_line = [True]
 
-            # 保存returncode供后续使用
-            final_returncode = returncode
+            for segment in manifest.pending():
+                if self.subtitle_pause_requested or not self.is_generating:
+                    paused = True
+                    break
+                base_time = manifest.done_duration()
+                segment_path = manifest.segment_path(segment)
+                print(f"[DEBUG] 编码第 {segment['index'] + 1}/{len(manifest.data['segments'])} 段 "
+                      f"({segment['start']:.1f}s, {segment['duration']:.1f}s)")
+
+                def on_line(line):
+                    if first_line[0]:
+                        first_line[0] = False
+                        metrics.mark('first_frame')
+                    metrics.observe_line(line)
+                    if 'time=' in line:
+                        try:
+                            time_str = line.split('time=')[1].split(' ')[0].strip()
+                            h, m, sec = map(float, time_str.split(':'))
+                            current_time = base_time + h * 3600 + m * 60 + sec
+                            # 限制最大进度为98%，保留2%给拼接
+                            progress = min(current_time / duration * 100, 98)
+                            self.ui_bus.progress('subtitle', progress)
+                            progress_log.debug(f"进度: {progress:.1f}% ({current_time:.1f}s / {duration:.1f}s)")
+                        except ValueError:
+                            pass
 
-            # 检查输出文件（快速检查，不进行完整性验证）
-            print("6. 检查输出文件...")
-            file_exists = False
-            file_size = 0
-            if os.path.exists(output_path):
-                try:
-                    file_size = os.path.getsize(output_path)
-                    file_exists = True
-                    print(f"输出文件存在: {output_path}")
-                    print(f"文件大小: {file_size} 字节 ({file_size / (1024*1024):.2f} MB)")
-                except Exception as e:
-                    print(f"获取文件大小失败: {e}")
-            else:
-                print("输出文件不存在")
+                cmd = build_subtitle_chunk_cmd(
+                    source, settings['subtitle'], segment_path, segment['start'], segment['duration'],
+                    settings['font_size'], settings['font_color'], settings['position'],
+                    settings['encoder'], settings['bitrate'], video_info,
+                    settings.get('rate_mode', 'bitrate'), settings.get('quality', DEFAULT_QUALITY), overlay
+                )
+                returncode, stderr = self._run_tracked_ffmpeg(cmd, on_line=on_line, log=metrics.job_log(),
+                                                              on_spawn=self._set_subtitle_process)
+
+                # 按'q'退出时返回码也是0，但这一段并不完整
+                if self.subtitle_pause_requested or not self.is_generating:
+                    if os.path.exists(segment_path):
+                        os.remove(segment_path)
+                    paused = True
+                    break
+                if returncode != 0:
+                    print(f"错误输出:\n{stderr[-2000:]}")
+                    final_returncode = returncode
+                    break
+                manifest.mark_done(segment)
+
+            if paused:
+                done, total = manifest.done_count(), len(manifest.data['segments'])
+                print(f"[DEBUG] 已暂停，已完成 {done}/{total} 段")
+                self.ui_bus.call(messagebox.showinfo, "已暂停",
+                                 f"已完成 {done}/{total} 段。\n再次生成到同一文件时可从中断处继续。")
+            elif not manifest.pending():
+                metrics.mark('finalize')
+                print("[DEBUG] 所有分段已完成，开始拼接...")
+                list_path = manifest.write_concat_list()
+                final_returncode, stderr = self._run_tracked_ffmpeg(
+                    build_stitch_cmd(list_path, source, output_path, video_info), log=metrics.job_log(),
+                    on_spawn=self._set_subtitle_process)
+                if self.subtitle_process.stopped:
+                    # 拼接被停止：输出不完整，分段保留，下次可以直接重新拼接
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                    final_returncode = -1
+                    paused = True
+                    print("[DEBUG] 拼接已停止，分段已保留")
+                    self.ui_bus.call(messagebox.showinfo, "已暂停", "拼接已停止，已完成的分段保留。\n"
+                                     "再次生成到同一文件时会直接重新拼接。")
+                elif final_returncode == 0:
+                    manifest.discard()
+                    self.result_cache.store(cache_key, output_path)
+                else:
+                    print(f"拼接失败:\n{stderr[-2000:]}")
 
-            # 如果返回码为0且文件存在，立即设置进度为100%并调用完成回调
-            # 完整性检查对于大文件太慢，FFmpeg返回码0已经说明文件生成成功
-            if final_returncode == 0 and file_exists and file_size > 0:
-                print("[DEBUG] FFmpeg返回码0且文件存在，立即设置进度为100%并调用完成回调")
-                # 立即设置进度条和调用完成回调
-                self.root.after(0, lambda: self.subtitle_progress_var.set(100))
-                self.root.after(0, self.handle_subtitle_completion, final_returncode, output_path)
-            else:
-                # 失败情况，也调用完成回调
-                print("7. 调用完成回调...")
-                self.root.after(0, self.handle_subtitle_completion, final_returncode, output_path)
+            if not paused:
+                if final_returncode == 0:
+                    self.ui_bus.progress('subtitle', 100)
+                self.ui_bus.call(self.handle_subtitle_completion, final_returncode, output_path)
 
         except Exception as e:
             error_msg = f"生成失败: {str(e)}"
             print(f"发生异常: {error_msg}")
             logger.error(error_msg)
-            self.root.after(0, messagebox.showerror, "错误", error_msg)
+            self.ui_bus.call(messagebox.showerror, "错误", error_msg)
         finally:
-            print("8. 清理状态和进程资源...")
-
-            # 清理进程资源
-            if process is not None:
-                try:
-                    process_pid = process.pid if hasattr(process, 'pid') else 'unknown'
-                    print(f"[DEBUG] 开始清理字幕进程 PID: {process_pid}")
-
-                    # 关闭所有管道
-                    for pipe_name in ['stdin', 'stdout', 'stderr']:
-                        pipe = getattr(process, pipe_name, None)
-                        if pipe and not pipe.closed:
-                            try:
-                                pipe.close()
-                                print(f"[DEBUG] 已关闭 {pipe_name} 管道")
-                            except Exception as e:
-                                print(f"[DEBUG] 关闭 {pipe_name} 管道时出错: {e}")
-
-                    # 确保进程已完全结束（快速检查，不阻塞）
-                    if process.poll() is None:
-                        print(f"[DEBUG] 字幕进程 {process_pid} 仍在运行，尝试快速终止...")
-                        # 快速终止，不长时间等待
-                        try:
-                            process.terminate()
-                            try:
-                                process.wait(timeout=2)  # 只等待2秒
-                                print(f"[DEBUG] 进程 {process_pid} 已通过terminate结束")
-                            except subprocess.TimeoutExpired:
-                                print(f"[DEBUG] 进程 {process_pid} terminate后仍运行，强制kill")
-                                try:
-                                    process.kill()
-                                    process.wait(timeout=1)  # 只等待1秒
-                                    print(f"[DEBUG] 进程 {process_pid} 已通过kill结束")
-                                except:
-                                    print(f"[DEBUG] 警告：进程 {process_pid} kill后仍可能运行，继续清理资源")
-                        except Exception as e:
-                            print(f"[DEBUG] 终止进程时出错: {e}，继续清理资源")
-                    else:
-                        print(f"[DEBUG] 进程 {process_pid} 已退出，快速清理资源")
-
-                    # 从活跃进程列表中移除
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                        print(f"[DEBUG] 从活跃进程列表中移除字幕进程 PID: {process_pid}")
-
-                    print(f"[DEBUG] 字幕进程 {process_pid} 清理完成")
-                except Exception as e:
-                    print(f"[DEBUG] 清理字幕进程时出错: {e}")
-                    import traceback
-                    traceback.print_exc()
+            metrics.finish(final_returncode, output_path)
 
             # 更新状态标志
             self.is_generating = False
+            self.subtitle_pause_requested = False
+            self.subtitle_process = None
 
             # 重新启用按钮
-            self.root.after(0, self.enable_subtitle_buttons)
-
-            # 根据最终返回码处理进度条
-            final_rc = final_returncode if 'final_returncode' in locals() else (process.returncode if process and process.returncode is not None else -1)
-            if final_rc != 0:
-                # 失败时重置进度条
-                self.root.after(0, lambda: self.subtitle_progress_var.set(0))
-                print(f"[DEBUG] 处理失败（返回码: {final_rc}），重置进度条")
-            # 成功时进度条已在前面设置为100%，这里不需要再设置
-
-            print("=== FFmpeg命令执行完成 ===\n")
+            self.ui_bus.call(self.enable_subtitle_buttons)
+            if final_returncode != 0:
+                self.ui_bus.progress('subtitle', 0)
+            print("=== 分段生成结束 ===\n")
 
     def handle_subtitle_completion(self, returncode, output_path):
         """处理字幕视频生成完成"""
@@ -5271,9 +9524,9 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             output_dir = os.path.dirname(output_path)
             try:
                 if sys.platform == 'win32':
-                    subprocess.run(['explorer', output_dir], creationflags=subprocess.CREATE_NO_WINDOW)
+                    launch_detached(['explorer', output_dir])
                 else:
-                    subprocess.run(['xdg-open', output_dir])
+                    launch_detached(['xdg-open', output_dir])
                 print(f"已打开目录: {output_dir}")
             except Exception as e:
                 print(f"打开目录失败: {e}")
@@ -5308,47 +9561,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         print("=== 处理完成 ===\n")
 
     def update_subtitle_style(self):
-        """更新字幕样式"""
-        # 获取当前样式设置
-        font_size = self.font_size_var.get()
-        color_name = self.font_color_var.get()
-        position_name = self.position_var.get()
-
-        # 转换为实际值
-        color = self.color_mapping.get(color_name, "white")
-
-        # 更新字幕标签样式
-        self.subtitle_label.config(
-            font=("微软雅黑", int(font_size)),
-            fg=color
-        )
-
-        # 更新字幕位置
-        if position_name == "顶部":
-            self.subtitle_label.pack_forget()
-            self.subtitle_label.pack(side=tk.TOP, pady=20)
-        elif position_name == "中间":
-            self.subtitle_label.pack_forget()
-            # 使用place方法精确定位到中间
-            self.subtitle_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
-        else:  # 底部
-            self.subtitle_label.pack_forget()
-            self.subtitle_label.pack(side=tk.BOTTOM, pady=20)
-
-        # 如果正在预览，立即更新当前帧的字幕显示
-        if self.is_previewing and hasattr(self, 'subtitle_cap'):
-            current_frame = self.subtitle_cap.get(cv2.CAP_PROP_POS_FRAMES)
-            current_time = current_frame / self.subtitle_fps
-
-            # 查找当前时间对应的字幕
-            current_subtitle = ""
-            for subtitle in self.subtitles:
-                if subtitle['start'] <= current_time <= subtitle['end']:
-                    current_subtitle = subtitle['text']
-                    break
-
-            # 更新字幕显示
-            self.subtitle_label.config(text=current_subtitle)
+        """更新字幕样式：按新样式重新渲染当前字幕（每种样式各自缓存）"""
+        self.redraw_subtitle_preview()
 
     def on_progress_change(self, value):
         """处理进度条拖动"""
@@ -5361,35 +9575,95 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             target_time = (progress / 100.0) * self.subtitle_duration
 
             try:
-                # 更新视频帧位置
-                if hasattr(self, 'subtitle_fps') and self.subtitle_fps > 0:
-                    self.subtitle_cap.set(cv2.CAP_PROP_POS_FRAMES, int(target_time * self.subtitle_fps))
-                    ret, frame = self.subtitle_cap.read()
-                    if ret:
-                        # 查找当前时间对应的字幕
-                        current_subtitle = ""
-                        for subtitle in self.subtitles:
-                            if subtitle['start'] <= target_time <= subtitle['end']:
-                                current_subtitle = subtitle['text']
-                                break
+                # 显示帧和该时间对应的字幕
+                self.subtitle_preview_time = target_time
+                self.scrub_preview('subtitle', target_time, self.show_subtitle_frame)
 
-                        # 应用当前样式设置
-                        font_size = self.font_size_var.get()
-                        color_name = self.font_color_var.get()
-                        color = self.color_mapping.get(color_name, "white")
-
-                        # 更新字幕显示（应用样式）
-                        self.subtitle_label.config(
-                            text=current_subtitle,
-                            font=("微软雅黑", int(font_size)),
-                            fg=color
-                        )
+            except Exception as e:
+                print(f"预览更新失败: {str(e)}")
 
-                        # 显示帧
-                        self.show_subtitle_frame(frame)
+    def load_preview_sprites(self, channel, video_path, duration):
+        """后台生成（或从缓存读取）进度条拖动用的缩略图拼图"""
+        self.cancel_exact_preview(channel)
+        self.preview_sources[channel] = video_path
+        self.preview_sprites[channel] = None
+        if duration <= 0:
+            return
 
+        def worker():
+            try:
+                sheet = SpriteSheet.generate(video_path, duration)
             except Exception as e:
-                print(f"预览更新失败: {str(e)}")
+                preview_log.warning(f"生成缩略图失败: {e}")
+                return
+            self.ui_bus.call(self._set_preview_sprites, channel, video_path, sheet)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _set_preview_sprites(self, channel, video_path, sheet):
+        # 生成期间可能已经换了视频
+        if self.preview_sources.get(channel) == video_path:
+            self.preview_sprites[channel] = sheet
+
+    def scrub_preview(self, channel, target_time, show_frame):
+        """拖动进度条：立即显示缩略图，停止拖动PREVIEW_DEBOUNCE_MS毫秒后再精确解码该帧
+
+        再次拖动时取消尚未开始和正在进行的精确解码。
+        """
+        sheet = self.preview_sprites.get(channel)
+        if sheet is not None:
+            show_frame(sheet.frame_at(target_time))
+        self.cancel_exact_preview(channel)
+        self.preview_after_ids[channel] = self.root.after(
+            PREVIEW_DEBOUNCE_MS, self.start_exact_preview, channel, target_time, show_frame)
+
+    def cancel_exact_preview(self, channel):
+        """取消等待中和正在进行的精确解码"""
+        self.preview_generation[channel] = self.preview_generation.get(channel, 0) + 1
+        after_id = self.preview_after_ids.pop(channel, None)
+        if after_id is not None:
+            self.root.after_cancel(after_id)
+        process = self.preview_processes.pop(channel, None)
+        if process is not None and process.poll() is None:
+            process.kill()  # 预览帧不需要优雅退出
+
+    def start_exact_preview(self, channel, target_time, show_frame):
+        """在工作线程中用FFmpeg精确解码一帧，完成时仍是最新请求才显示"""
+        self.preview_after_ids.pop(channel, None)
+        video_path = self.preview_sources.get(channel)
+        if not video_path:
+            return
+        generation = self.preview_generation.get(channel, 0)
+        output_path = os.path.join(tempfile.gettempdir(), f"video_tool_preview_{channel}_{os.getpid()}.jpg")
+
+        def worker():
+            started = time.monotonic()
+            try:
+                process = get_supervisor().spawn(build_frame_grab_cmd(video_path, target_time, output_path),
+                                                 policy='interactive')
+            except OSError as e:
+                preview_log.warning(f"精确解码失败: {e}")
+                return
+            self.ui_bus.call(self._track_exact_preview, channel, generation, process)
+            if process.wait() != 0 or self.preview_generation.get(channel) != generation:
+                return
+            frame = read_image(output_path)
+            if frame is not None:
+                preview_log.debug(f"精确解码 {target_time:.2f}s: {time.monotonic() - started:.2f}秒")
+                self.ui_bus.call(self._show_exact_preview, channel, generation, frame, show_frame)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _track_exact_preview(self, channel, generation, process):
+        if self.preview_generation.get(channel) == generation:
+            self.preview_processes[channel] = process
+        elif process.poll() is None:
+            process.kill()
+
+    def _show_exact_preview(self, channel, generation, frame, show_frame):
+        if self.preview_generation.get(channel) == generation:
+            self.preview_processes.pop(channel, None)
+            show_frame(frame)
 
     def convert_color_to_ass(self, color_name):
         """将颜色名称转换为ASS格式的颜色代码"""
@@ -5559,6 +9833,10 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         self.track_canvas.tag_bind("start", "<B1-Motion>", self.move_start)
         self.track_canvas.tag_bind("end", "<B1-Motion>", self.move_end)
 
+        # 绘制片段标记和检测点
+        self.draw_segment_markers()
+        self.draw_event_markers()
+
     def redraw_drop_area(self, event=None):
         """重绘拖放区域，使其在窗口最大化时能够自适应居中显示"""
         width = self.drop_canvas.winfo_width()
@@ -5578,8 +9856,17 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         # 设置退出标志
         self.is_generating = False
 
+        # 停止界面更新总线
+        if hasattr(self, 'ui_bus'):
+            self.ui_bus.stop()
+
+        # 取消任务队列中的任务，运行中的任务进程和其他进程一起终止
+        job_processes = []
+        if hasattr(self, 'job_scheduler'):
+            job_processes = self.job_scheduler.shutdown(stop_processes=False)
+
         # 终止所有活跃的FFmpeg进程
-        self.terminate_all_processes()
+        self.terminate_all_processes(job_processes)
 
         # 强制退出程序
         try:
@@ -5592,63 +9879,24 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         import os
         import time
         time.sleep(2)  # 给进程一些时间完成清理
+        # os._exit不执行atexit，任务日志在这里关闭
+        JOB_LOGS.shutdown()
         os._exit(0)  # 强制退出
 
-    def terminate_all_processes(self):
-        """终止所有活跃的FFmpeg进程"""
-        print(f"[DEBUG] 发现 {len(self.active_processes)} 个活跃进程")
-
-        for process in self.active_processes:
-            try:
-                if process.poll() is None:  # 进程还在运行
-                    print(f"[DEBUG] 尝试优雅终止FFmpeg进程 PID: {process.pid}")
-
-                    # 方法1：向FFmpeg的stdin发送'q'命令（最可靠的方式）
-                    try:
-                        if process.stdin and not process.stdin.closed:
-                            process.stdin.write('q\n')
-                            process.stdin.flush()
-                            print(f"[DEBUG] 已向进程 {process.pid} 发送'q'命令")
-
-                            # 等待FFmpeg优雅退出
-                            try:
-                                process.wait(timeout=5)  # 给FFmpeg 5秒时间完成清理
-                                print(f"[DEBUG] 进程 {process.pid} 已通过'q'命令优雅退出")
-                                continue  # 成功退出，继续处理下一个进程
-                            except subprocess.TimeoutExpired:
-                                print(f"[DEBUG] 进程 {process.pid} 未在5秒内通过'q'命令退出")
-                    except Exception as e:
-                        print(f"[DEBUG] 发送'q'命令失败: {e}")
-
-                    # 方法2：如果'q'命令失败，尝试SIGTERM
-                    try:
-                        process.terminate()
-                        print(f"[DEBUG] 已向进程 {process.pid} 发送SIGTERM信号")
-
-                        # 等待SIGTERM生效
-                        try:
-                            process.wait(timeout=3)  # 给FFmpeg 3秒时间完成清理
-                            print(f"[DEBUG] 进程 {process.pid} 已通过SIGTERM信号退出")
-                            continue  # 成功退出，继续处理下一个进程
-                        except subprocess.TimeoutExpired:
-                            print(f"[DEBUG] 进程 {process.pid} 未在3秒内通过SIGTERM退出")
-                    except Exception as e:
-                        print(f"[DEBUG] 发送SIGTERM失败: {e}")
-
-                    # 方法3：最后尝试强制终止
-                    try:
-                        process.kill()
-                        print(f"[DEBUG] 已向进程 {process.pid} 发送SIGKILL信号")
-                        try:
-                            process.wait(timeout=1)
-                            print(f"[DEBUG] 进程 {process.pid} 已被强制终止")
-                        except subprocess.TimeoutExpired:
-                            print(f"[DEBUG] 进程 {process.pid} 无法终止")
-                    except Exception as e:
-                        print(f"[DEBUG] 强制终止失败: {e}")
+    def terminate_all_processes(self, extra_processes=()):
+        """终止所有活跃的FFmpeg进程（以及extra_processes）
 
-            except Exception as e:
-                print(f"[DEBUG] 终止进程时出错: {e}")
+        每个进程依次尝试'q'（5秒）、SIGTERM（3秒）、SIGKILL，所有进程同时进行，
+        总耗时不随进程数增加。
+        """
+        # 监管器登记的进程包括缩略图、预览、估算等不在active_processes中的进程
+        processes = list(dict.fromkeys(self.active_processes.snapshot() + self.supervisor.running.snapshot()
+                                       + list(extra_processes)))
+        print(f"[DEBUG] 发现 {len(processes)} 个活跃进程")
+        self.supervisor.stop_all(processes)
+        for process in processes:
+            state = "已退出" if process.poll() is not None else "无法终止"
+            print(f"[DEBUG] 进程 {process.pid} {state}")
 
         # 清空进程列表
         self.active_processes.clear()
@@ -5662,17 +9910,14 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             if sys.platform == 'win32':
                 print("[DEBUG] 检查并清理残留的FFmpeg进程...")
                 # 检查是否有ffmpeg.exe进程在运行
-                result = subprocess.run(['tasklist', '/FI', 'IMAGENAME eq ffmpeg.exe'],
-                                        capture_output=True, text=True,
-                                        creationflags=subprocess.CREATE_NO_WINDOW)
+                # tasklist按系统代码页输出
+                result = run_command(['tasklist', '/FI', 'IMAGENAME eq ffmpeg.exe'], timeout=10,
+                                     encoding=locale.getpreferredencoding(False))
 
                 if 'ffmpeg.exe' in result.stdout:
                     print("[DEBUG] 发现残留的FFmpeg进程，正在清理...")
                     # 强制终止所有ffmpeg进程
-                    subprocess.run(['taskkill', '/F', '/IM', 'ffmpeg.exe'],
-                                   stdout=subprocess.DEVNULL,
-                                   stderr=subprocess.DEVNULL,
-                                   creationflags=subprocess.CREATE_NO_WINDOW)
+                    run_command(['taskkill', '/F', '/IM', 'ffmpeg.exe'], timeout=10)
                     print("[DEBUG] 残留进程清理完成")
                 else:
                     print("[DEBUG] 未发现残留的FFmpeg进程")
@@ -5692,92 +9937,71 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             # 设置退出标志
             self.is_generating = False
 
-            # 优雅清理：优先使用'q'命令
+            # 优雅清理：优先使用'q'命令，给FFmpeg 10秒时间写完文件尾
             if self.active_processes:
                 print("[DEBUG] 优雅终止所有FFmpeg进程...")
-
-                for process in self.active_processes:
-                    if process.poll() is None:
-                        try:
-                            print(f"[DEBUG] 优雅终止进程 {process.pid}")
-
-                            # 方法1：向FFmpeg的stdin发送'q'命令（最可靠的方式）
-                            try:
-                                if process.stdin and not process.stdin.closed:
-                                    process.stdin.write('q\n')
-                                    process.stdin.flush()
-                                    print(f"[DEBUG] 已向进程 {process.pid} 发送'q'命令")
-
-                                    # 等待FFmpeg优雅退出
-                                    try:
-                                        process.wait(timeout=10)  # 给FFmpeg 10秒时间完成清理
-                                        print(f"[DEBUG] 进程 {process.pid} 已通过'q'命令优雅退出")
-                                        continue  # 成功退出，继续处理下一个进程
-                                    except subprocess.TimeoutExpired:
-                                        print(f"[DEBUG] 进程 {process.pid} 未在10秒内通过'q'命令退出")
-                            except Exception as e:
-                                print(f"[DEBUG] 发送'q'命令失败: {e}")
-
-                            # 方法2：如果'q'命令失败，尝试SIGTERM
-                            try:
-                                process.terminate()
-                                print(f"[DEBUG] 已向进程 {process.pid} 发送SIGTERM信号")
-                            except Exception as e:
-                                print(f"[DEBUG] 发送SIGTERM失败: {e}")
-
-                        except Exception as e:
-                            print(f"[DEBUG] 终止进程失败: {e}")
-
-                # 等待2秒让进程完成清理
-                import time
-                time.sleep(2)
+                self.supervisor.stop_all(self.active_processes.snapshot(), quit_timeout=10.0)
 
             # 不再进行系统级强制清理
             print("[DEBUG] 退出清理完成（已避免强制终止以保护视频文件完整性）")
         except Exception as e:
             print(f"[DEBUG] 退出清理时出错: {e}")
 
-    def check_video_file_integrity(self, file_path):
-        """检查视频文件完整性"""
-        try:
-            # 使用FFmpeg检查文件完整性 - 修复中文路径编码问题
-            check_cmd = [FFMPEG_PATH, '-v', 'error', '-i', file_path, '-f', 'null', '-']
+    def check_video_file_integrity(self, file_path, tier='full'):
+        """检查视频文件完整性（tier见INTEGRITY_TIERS，默认完整解码）"""
+        report = check_video_integrity(file_path, tier=tier, cache=self.probe_cache)
+        self.probe_cache.save()
+        for item in report['verified']:
+            print(f"[{INTEGRITY_TIER_NAMES[tier]}] 已验证: {item}")
+        if not report['ok']:
+            print(f"文件完整性检查失败: {'; '.join(report['errors'])}")
+        return report['ok']
+
+    def preflight_merge_list(self):
+        """对合并列表（列表为空时为选择的文件夹）做批量完整性预检"""
+        paths = self.merge_list.paths()
+        if not paths:
+            folder = filedialog.askdirectory(title="选择要检查的文件夹")
+            if not folder:
+                return
+            paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                     if name.lower().endswith(VIDEO_EXTENSIONS)]
+            if not paths:
+                messagebox.showinfo("提示", "文件夹中没有视频文件")
+                return
 
-            # 根据文件大小动态设置超时时间
-            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)  # 转换为MB
-            timeout_seconds = max(60, int(file_size_mb / 100))  # 每100MB给1分钟，最少60秒
+        names = {name: tier for tier, name in INTEGRITY_TIER_NAMES.items()}
+        tier = names.get(self.integrity_tier_var.get(), 'packets')
+        self.preflight_btn.config(text="检查中...", state="disabled")
+        threading.Thread(target=self._preflight_thread, args=(paths, tier), daemon=True).start()
 
-            print(f"文件大小: {file_size_mb:.1f}MB, 设置超时时间: {timeout_seconds}秒")
+    def _preflight_thread(self, paths, tier):
+        """批量预检线程（工作线程中运行，不访问Tk对象）"""
+        done = [0]
+        lock = threading.Lock()
 
-            if sys.platform == 'win32':
-                # 将命令列表转换为字符串，确保路径编码正确
-                cmd_str = ' '.join(f'"{arg}"' if ' ' in arg or any(ord(c) > 127 for c in arg) else arg for arg in check_cmd)
-                result = subprocess.run(
-                    cmd_str,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout_seconds,
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-            else:
-                result = subprocess.run(
-                    check_cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout_seconds
-                )
+        def on_result(index, report):
+            with lock:
+                done[0] += 1
+                self.ui_bus.progress('merge', done[0] * 100 / len(paths))
+            state = "缓存" if report.get('cached') else f"{report['elapsed']:.1f}秒"
+            print(f"[DEBUG] 预检 {os.path.basename(report['file'])}: {'通过' if report['ok'] else '失败'} ({state})")
 
-            # 如果返回码为0且没有错误输出，说明文件完整
-            if result.returncode == 0 and not result.stderr.strip():
-                return True
+        try:
+            reports = preflight_videos(paths, tier=tier, cache=self.probe_cache, on_result=on_result)
+            failed = [r for r in reports if not r['ok']]
+            summary = f"{INTEGRITY_TIER_NAMES[tier]}：共{len(reports)}个文件，通过{len(reports) - len(failed)}个"
+            if failed:
+                details = "\n".join(f"{os.path.basename(r['file'])}: {r['errors'][0][:120] if r['errors'] else '未知错误'}"
+                                    for r in failed[:20])
+                self.ui_bus.call(messagebox.showwarning, "完整性检查", f"{summary}\n\n失败文件：\n{details}")
             else:
-                print(f"文件完整性检查失败: {result.stderr}")
-                return False
-
+                self.ui_bus.call(messagebox.showinfo, "完整性检查", summary)
         except Exception as e:
-            print(f"文件完整性检查出错: {e}")
-            return False
+            self.ui_bus.call(messagebox.showerror, "错误", f"完整性检查出错: {e}")
+        finally:
+            self.ui_bus.call(self.progress_var.set, 0, delay=2000)
+            self.ui_bus.call(self.preflight_btn.config, text="完整性检查", state="normal")
 
     def disable_subtitle_buttons(self):
         """禁用字幕相关按钮"""
@@ -5786,7 +10010,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         if hasattr(self, 'preview_btn'):
             self.preview_btn.config(state="disabled")
         if hasattr(self, 'save_progress_btn'):
-            self.save_progress_btn.config(state="normal")  # 生成中时启用保存进度按钮
+            self.save_progress_btn.config(state="normal")  # 生成中时启用暂停按钮
 
     def enable_subtitle_buttons(self):
         """启用字幕相关按钮"""
@@ -5795,7 +10019,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         if hasattr(self, 'preview_btn'):
             self.preview_btn.config(state="normal")
         if hasattr(self, 'save_progress_btn'):
-            self.save_progress_btn.config(state="disabled")  # 完成后禁用保存进度按钮
+            self.save_progress_btn.config(state="disabled")  # 完成后禁用暂停按钮
 
     def enable_soft_subtitle_buttons(self):
         """启用软字幕相关按钮"""
@@ -5804,47 +10028,151 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         if hasattr(self, 'soft_preview_btn'):
             self.soft_preview_btn.config(state="normal")
 
-    def save_current_progress(self):
-        """保存当前进度"""
-        if not self.is_generating or not self.active_processes:
+    def pause_subtitle_generation(self):
+        """暂停分段生成：当前段放弃，已完成的段保留，之后可继续"""
+        if not self.is_generating:
             messagebox.showwarning("警告", "当前没有正在生成的视频")
             return
-
-        try:
-            # 使用优雅的方式让FFmpeg保存当前进度
-            for process in self.active_processes:
-                if process.poll() is None:
-                    print(f"[DEBUG] 发送保存进度信号...")
-
-                    # 方法1：向FFmpeg的stdin发送'q'命令（最可靠的方式）
-                    try:
-                        if process.stdin and not process.stdin.closed:
-                            process.stdin.write('q\n')
-                            process.stdin.flush()
-                            print(f"[DEBUG] 已发送'q'命令保存进度")
-
-                            # 等待FFmpeg优雅退出
-                            try:
-                                process.wait(timeout=10)  # 给FFmpeg 10秒时间完成清理
-                                print(f"[DEBUG] 进程已通过'q'命令优雅退出")
-                                messagebox.showinfo("提示", "进度保存完成！")
-                                return
-                            except subprocess.TimeoutExpired:
-                                print(f"[DEBUG] 进程未在10秒内通过'q'命令退出")
-                    except Exception as e:
-                        print(f"[DEBUG] 发送'q'命令失败: {e}")
-
-                    # 方法2：如果'q'命令失败，尝试SIGTERM
+        self.subtitle_pause_requested = True
+        process = self.subtitle_process
+        if process is not None:
+            # 只停止硬字幕当前段的FFmpeg（其他页面的处理不受影响），这一段的输出会被丢弃
+            self.supervisor.stop(process)
+        if hasattr(self, 'save_progress_btn'):
+            self.save_progress_btn.config(state="disabled")
+
+    def _set_subtitle_process(self, process):
+        """记录硬字幕当前的FFmpeg进程；启动前已请求暂停时立即停止"""
+        self.subtitle_process = process
+        if self.subtitle_pause_requested:
+            self.supervisor.stop(process)
+
+    def batch_subtitle_dialog(self):
+        """批量硬字幕：选择视频和字幕，按规则配对并检查，使用当前样式和编码设置加入任务队列"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("批量生成硬字幕")
+        dialog.configure(bg="#333333")
+        dialog.transient(self.root)
+        dialog.geometry("900x500")
+
+        videos, subtitles, manifest = [], [], [None]
+        pairs = []
+
+        source_frame = tk.Frame(dialog, bg="#333333")
+        source_frame.pack(fill=tk.X, padx=15, pady=(10, 5))
+        count_var = tk.StringVar(value="未选择文件")
+
+        def choose_videos():
+            files = filedialog.askopenfilenames(parent=dialog, title="选择视频文件",
+                                                filetypes=[("视频文件", "*.mp4;*.avi;*.mov;*.mkv;*.flv;*.ts;*.wmv"),
+                                                           ("所有文件", "*.*")])
+            if files:
+                videos[:] = sorted(files)
+                refresh_pairs()
+
+        def choose_subtitles():
+            folder = filedialog.askdirectory(parent=dialog, title="选择字幕所在文件夹",
+                                             initialdir=os.path.dirname(videos[0]) if videos else None)
+            if folder:
+                subtitles[:] = [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                                if name.lower().endswith(('.srt', '.ass', '.ssa'))]
+                refresh_pairs()
+
+        def choose_manifest():
+            path = filedialog.askopenfilename(parent=dialog, title="选择配对清单",
+                                              filetypes=[("配对清单", "*.json")])
+            if path:
+                manifest[0] = path
+                rule_var.set(BATCH_PAIR_RULES['manifest'])
+                refresh_pairs()
+
+        ttk.Button(source_frame, text="选择视频", command=choose_videos).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(source_frame, text="选择字幕文件夹", command=choose_subtitles).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(source_frame, text="选择清单文件", command=choose_manifest).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Label(source_frame, text="配对方式：").pack(side=tk.LEFT)
+        rule_labels = {name: rule for rule, name in BATCH_PAIR_RULES.items()}
+        rule_var = tk.StringVar(value=BATCH_PAIR_RULES['name'])
+        rule_combo = ttk.Combobox(source_frame, textvariable=rule_var, values=list(rule_labels),
+                                  state="readonly", width=10)
+        rule_combo.pack(side=tk.LEFT, padx=(0, 10))
+        rule_combo.bind('<<ComboboxSelected>>', lambda e: refresh_pairs())
+        ttk.Label(source_frame, textvariable=count_var).pack(side=tk.LEFT)
+
+        list_frame = tk.Frame(dialog, bg="#1e1e1e")
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=5)
+        columns = ("视频", "字幕", "检查结果")
+        tree = ttk.Treeview(list_frame, columns=columns, show="headings")
+        for column, width in zip(columns, (300, 300, 260)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width, anchor=tk.W)
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+
+        def refresh_pairs():
+            rule = rule_labels.get(rule_var.get(), 'name')
+            pairs.clear()
+            if rule == 'manifest':
+                if manifest[0]:
                     try:
-                        process.terminate()
-                        print(f"[DEBUG] 已发送SIGTERM信号保存进度")
-                    except Exception as e:
-                        print(f"[DEBUG] 发送SIGTERM失败: {e}")
-
-            messagebox.showinfo("提示", "正在保存当前进度，请稍等...")
-
-        except Exception as e:
-            messagebox.showerror("错误", f"保存进度失败: {str(e)}")
+                        pairs.extend((video, subtitle, None) for video, subtitle in load_batch_manifest(manifest[0]))
+                    except (OSError, ValueError) as e:
+                        messagebox.showerror("错误", f"读取清单失败: {e}", parent=dialog)
+            else:
+                pairs.extend(pair_batch_subtitles(videos, subtitles, rule))
+            tree.delete(*tree.get_children())
+            valid = 0
+            for index, (video, subtitle, error) in enumerate(pairs):
+                # 配对成功的再用单个生成时相同的规则检查
+                errors = [error] if error else self.validate_paths(video, subtitle)
+                if not errors:
+                    valid += 1
+                    pairs[index] = (video, subtitle, None)
+                else:
+                    pairs[index] = (video, subtitle, errors[0])
+                tree.insert('', tk.END, values=(os.path.basename(video),
+                                                os.path.basename(subtitle) if subtitle else "",
+                                                errors[0] if errors else "可以生成"))
+            count_var.set(f"共 {len(pairs)} 个视频，{valid} 个可以生成")
+
+        option_frame = tk.Frame(dialog, bg="#333333")
+        option_frame.pack(fill=tk.X, padx=15, pady=(5, 10))
+        ttk.Label(option_frame, text="同时处理：").pack(side=tk.LEFT)
+        workers_var = tk.IntVar(value=self.job_scheduler.workers)
+        ttk.Spinbox(option_frame, from_=1, to=JOB_MAX_WORKERS, textvariable=workers_var, width=4).pack(side=tk.LEFT)
+        limits = ", ".join(f"{name} {count}" for name, count in self.job_scheduler.encoder_limits.items())
+        tk.Label(option_frame, text=f"个（硬件编码器会话上限：{limits}）", bg="#333333", fg="#aaaaaa").pack(
+            side=tk.LEFT, padx=(0, 15))
+
+        def on_submit():
+            ready = [(video, subtitle) for video, subtitle, error in pairs if error is None]
+            if not ready:
+                messagebox.showwarning("警告", "没有可以生成的视频", parent=dialog)
+                return
+            try:
+                self.job_workers_var.set(workers_var.get())
+            except tk.TclError:
+                pass
+            self.apply_job_workers()
+            batch_id = uuid.uuid4().hex[:8]
+            settings = self.current_pipeline_steps()['subtitle']
+            failed = []
+            for video, subtitle in ready:
+                params = dict(settings, source=os.path.abspath(video), subtitle=os.path.abspath(subtitle),
+                              batch=batch_id, prerender=self.subtitle_prerender_var.get())
+                try:
+                    self.job_scheduler.submit('subtitle', params, origin='gui')
+                except ValueError as e:
+                    failed.append(f"{os.path.basename(video)}: {e}")
+            self.current_batch_id = batch_id
+            dialog.destroy()
+            self.tab_control.select(self.job_queue_tab)
+            if failed:
+                messagebox.showwarning("提示", "部分视频未能加入队列：\n" + "\n".join(failed[:20]))
+
+        ttk.Button(option_frame, text="加入任务队列", command=on_submit).pack(side=tk.RIGHT)
+        ttk.Button(option_frame, text="取消", command=dialog.destroy).pack(side=tk.RIGHT, padx=(0, 10))
 
     def create_soft_subtitle_tab(self):
         """创建软字幕标签页（界面与硬字幕一致，但命令不同）"""
@@ -5869,7 +10197,10 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         ttk.Label(file_frame, text="字幕文件：").pack(side=tk.LEFT, padx=(0, 5))
         self.soft_subtitle_path_var = tk.StringVar()
         ttk.Entry(file_frame, textvariable=self.soft_subtitle_path_var).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
-        ttk.Button(file_frame, text="选择字幕", command=self.select_soft_subtitle).pack(side=tk.LEFT)
+        ttk.Button(file_frame, text="添加字幕", command=self.select_soft_subtitle).pack(side=tk.LEFT)
+
+        # 字幕轨道列表：每条轨道单独设置语言、标题、默认和样式
+        self.create_soft_track_panel(main_frame)
 
         # 预览区域 - 最大化显示
         preview_frame = tk.Frame(main_frame, bg="#1e1e1e")
@@ -6000,6 +10331,121 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         )
         self.soft_subtitle_progress_bar.pack(fill=tk.X)
 
+    def create_soft_track_panel(self, parent):
+        """创建软字幕轨道列表区域"""
+        track_frame = tk.Frame(parent, bg="#333333")
+        track_frame.pack(fill=tk.X, pady=(0, 10))
+
+        columns = ("字幕文件", "语言", "标题", "默认", "样式")
+        self.soft_track_tree = ttk.Treeview(track_frame, columns=columns, show="headings", height=3, selectmode="extended")
+        for col in columns:
+            self.soft_track_tree.heading(col, text=col, anchor='w')
+            self.soft_track_tree.column(col, width=260 if col == "字幕文件" else 90, anchor='w')
+        self.soft_track_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.soft_track_tree.bind('<<TreeviewSelect>>', self.on_soft_track_select)
+
+        btn_frame = tk.Frame(track_frame, bg="#333333")
+        btn_frame.pack(side=tk.LEFT, padx=10)
+
+        ttk.Label(btn_frame, text="语言：").grid(row=0, column=0, sticky='w')
+        self.soft_track_language_var = tk.StringVar(value=SUBTITLE_LANGUAGES['chi'])
+        ttk.Combobox(btn_frame, textvariable=self.soft_track_language_var, state="readonly", width=10,
+                     values=list(SUBTITLE_LANGUAGES.values())).grid(row=0, column=1, padx=2, pady=2)
+        ttk.Label(btn_frame, text="标题：").grid(row=1, column=0, sticky='w')
+        self.soft_track_title_var = tk.StringVar()
+        ttk.Entry(btn_frame, textvariable=self.soft_track_title_var, width=12).grid(row=1, column=1, padx=2, pady=2)
+        ttk.Button(btn_frame, text="更新轨道", command=self.update_soft_track).grid(row=0, column=2, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="设为默认", command=self.set_default_soft_track).grid(row=1, column=2, padx=2, pady=2, sticky='ew')
+        ttk.Button(btn_frame, text="移除轨道", command=self.remove_soft_track).grid(row=2, column=2, padx=2, pady=2, sticky='ew')
+
+        ttk.Label(btn_frame, text="原有字幕：").grid(row=2, column=0, sticky='w')
+        self.soft_existing_mode_var = tk.StringVar(value=EXISTING_SUBTITLE_MODES['keep'])
+        ttk.Combobox(btn_frame, textvariable=self.soft_existing_mode_var, state="readonly", width=10,
+                     values=list(EXISTING_SUBTITLE_MODES.values())).grid(row=2, column=1, padx=2, pady=2)
+
+    def refresh_soft_tracks(self, selected=()):
+        """按self.soft_tracks重建轨道列表"""
+        self.soft_track_tree.delete(*self.soft_track_tree.get_children())
+        for index, track in enumerate(self.soft_tracks):
+            if track.stream is not None:
+                codec = self.soft_existing_subtitles[track.stream]['codec']
+                name, style = f"原有轨道 {track.stream + 1}（{codec}）", "原样式"
+            else:
+                name, style = os.path.basename(track.path), " ".join(track.style)
+            self.soft_track_tree.insert('', 'end', iid=str(index), values=(
+                name,
+                SUBTITLE_LANGUAGES.get(track.language, track.language),
+                track.title,
+                "是" if track.default else "",
+                style,
+            ))
+        for index in selected:
+            if 0 <= index < len(self.soft_tracks):
+                self.soft_track_tree.selection_add(str(index))
+
+    def selected_soft_tracks(self):
+        """轨道列表中选中的轨道序号"""
+        return sorted(int(iid) for iid in self.soft_track_tree.selection())
+
+    def add_soft_track(self, subtitle_path):
+        """添加一条字幕轨道：语言按文件名猜测，样式取当前设置，还没有默认轨道时设为默认"""
+        language = guess_subtitle_language(subtitle_path)
+        style = (self.soft_font_size_var.get(), self.soft_font_color_var.get(), self.soft_position_var.get())
+        has_default = any(track.default for track in self.soft_tracks)
+        self.soft_tracks.append(SubtitleTrack(
+            os.path.abspath(subtitle_path), language, SUBTITLE_LANGUAGES[language], not has_default, style))
+        self.refresh_soft_tracks(selected=[len(self.soft_tracks) - 1])
+
+    def on_soft_track_select(self, event=None):
+        """选中轨道时显示其设置，并预览该轨道"""
+        selected = self.selected_soft_tracks()
+        if len(selected) != 1:
+            return
+        track = self.soft_tracks[selected[0]]
+        self.soft_track_language_var.set(SUBTITLE_LANGUAGES.get(track.language, track.language))
+        self.soft_track_title_var.set(track.title)
+        if track.stream is not None:
+            return  # 原有轨道保持原样式，也没有可预览的字幕文件
+        size, color, position = track.style
+        self.soft_font_size_var.set(size)
+        self.soft_font_color_var.set(color)
+        self.soft_position_var.set(position)
+        if self.soft_subtitle_path_var.get() != track.path:
+            self.soft_subtitle_path_var.set(track.path)
+            self.load_soft_subtitles(track.path)
+        self.update_soft_subtitle_style()
+
+    def update_soft_track(self):
+        """把语言和标题应用到选中的轨道"""
+        selected = self.selected_soft_tracks()
+        if not selected:
+            messagebox.showinfo("提示", "请先在列表中选择字幕轨道")
+            return
+        names = {name: code for code, name in SUBTITLE_LANGUAGES.items()}
+        language = names.get(self.soft_track_language_var.get(), 'und')
+        title = self.soft_track_title_var.get().strip()
+        for index in selected:
+            self.soft_tracks[index] = self.soft_tracks[index]._replace(language=language, title=title)
+        self.refresh_soft_tracks(selected)
+
+    def set_default_soft_track(self):
+        """把选中的轨道设为默认字幕（只能有一条）"""
+        selected = self.selected_soft_tracks()
+        if len(selected) != 1:
+            messagebox.showinfo("提示", "请选择一条字幕轨道")
+            return
+        self.soft_tracks = [track._replace(default=index == selected[0])
+                            for index, track in enumerate(self.soft_tracks)]
+        self.refresh_soft_tracks(selected)
+
+    def remove_soft_track(self):
+        """移除选中的轨道"""
+        selected = set(self.selected_soft_tracks())
+        if not selected:
+            return
+        self.soft_tracks = [track for index, track in enumerate(self.soft_tracks) if index not in selected]
+        self.refresh_soft_tracks()
+
     def create_audio_denoise_tab(self):
         """创建音频降噪标签页界面"""
         # 主框架
@@ -6195,6 +10641,50 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         # 保存GPU选项映射
         self.video_convert_gpu_mapping = {opt["label"]: opt["value"] for opt in gpu_options}
 
+        # 码率控制：指定码率 / 恒定质量(CRF/CQ) / 两遍编码
+        rate_frame = tk.Frame(control_frame, bg="#333333")
+        rate_frame.pack(fill=tk.X, pady=(0, 10))
+
+        ttk.Label(rate_frame, text="码率控制：").pack(side=tk.LEFT, padx=(0, 5))
+        self.convert_rate_mode_labels = {name: mode for mode, name in RATE_MODES.items()}
+        self.convert_rate_mode_var = tk.StringVar(value=RATE_MODES['bitrate'])
+        ttk.Combobox(
+            rate_frame,
+            textvariable=self.convert_rate_mode_var,
+            values=list(self.convert_rate_mode_labels),
+            state="readonly",
+            width=10
+        ).pack(side=tk.LEFT, padx=(0, 15))
+
+        ttk.Label(rate_frame, text="质量（CRF/CQ，越小越清晰）：").pack(side=tk.LEFT, padx=(0, 5))
+        self.convert_quality_var = tk.IntVar(value=DEFAULT_QUALITY)
+        ttk.Spinbox(rate_frame, from_=0, to=51, textvariable=self.convert_quality_var, width=5).pack(
+            side=tk.LEFT, padx=(0, 15))
+
+        self.convert_estimate_btn = ttk.Button(rate_frame, text="预估大小", command=self.estimate_video_convert)
+        self.convert_estimate_btn.pack(side=tk.LEFT, padx=(0, 10))
+        self.convert_estimate_var = tk.StringVar()
+        ttk.Label(rate_frame, textvariable=self.convert_estimate_var, foreground="white").pack(side=tk.LEFT)
+
+        # 打包输出：一次解码编码整套码率阶梯，输出HLS/DASH
+        package_frame = tk.Frame(control_frame, bg="#333333")
+        package_frame.pack(fill=tk.X, pady=(0, 10))
+
+        ttk.Label(package_frame, text="输出方式：").pack(side=tk.LEFT, padx=(0, 5))
+        self.package_format_labels = {"单个MP4": "", **{name: fmt for fmt, name in PACKAGE_FORMATS.items()}}
+        self.package_format_var = tk.StringVar(value="单个MP4")
+        ttk.Combobox(
+            package_frame,
+            textvariable=self.package_format_var,
+            values=list(self.package_format_labels),
+            state="readonly",
+            width=12
+        ).pack(side=tk.LEFT, padx=(0, 15))
+
+        ttk.Label(package_frame, text="码率阶梯（高度:码率k）：").pack(side=tk.LEFT, padx=(0, 5))
+        self.package_ladder_var = tk.StringVar(value=",".join(f"{h}:{b}" for h, b in ABR_LADDER))
+        ttk.Entry(package_frame, textvariable=self.package_ladder_var, width=36).pack(side=tk.LEFT, padx=(0, 5))
+
         # 按钮区域
         button_frame = tk.Frame(control_frame, bg="#333333")
         button_frame.pack(fill=tk.X)
@@ -6207,6 +10697,10 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         self.video_convert_btn = ttk.Button(button_frame, text="开始转换", command=self.start_video_convert)
         self.video_convert_btn.pack(side=tk.LEFT, padx=(0, 10))
 
+        # 保存流水线预设（供监视文件夹模式使用）
+        ttk.Button(button_frame, text="加入任务队列", command=self.enqueue_video_convert).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="保存流水线预设", command=self.save_pipeline_preset_dialog).pack(side=tk.LEFT, padx=(0, 10))
+
         # 进度条
         self.video_convert_progress_var = tk.DoubleVar()
         self.video_convert_progress_bar = ttk.Progressbar(main_frame, variable=self.video_convert_progress_var, maximum=100)
@@ -6221,6 +10715,143 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         self.is_video_convert_processing = False
         self.video_convert_process = None
 
+    def create_job_queue_tab(self):
+        """创建任务队列标签页"""
+        main_frame = tk.Frame(self.job_queue_tab, bg="#333333")
+        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        columns = ("来源", "类型", "状态", "进度", "文件", "信息")
+        self.job_tree = ttk.Treeview(main_frame, columns=columns, show="headings", selectmode="extended")
+        widths = {"来源": 60, "类型": 80, "状态": 70, "进度": 70, "文件": 420, "信息": 300}
+        for column in columns:
+            self.job_tree.heading(column, text=column)
+            self.job_tree.column(column, width=widths[column], anchor=tk.W)
+        scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.job_tree.yview)
+        self.job_tree.configure(yscrollcommand=scrollbar.set)
+        self.job_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+
+        button_frame = tk.Frame(self.job_queue_tab, bg="#333333")
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Button(button_frame, text="取消所选任务", command=self.cancel_selected_jobs).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="清除已结束", command=self.job_scheduler.clear_finished).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Label(button_frame, text="同时运行：").pack(side=tk.LEFT)
+        self.job_workers_var = tk.IntVar(value=self.job_scheduler.workers)
+        workers_spinbox = ttk.Spinbox(button_frame, from_=1, to=JOB_MAX_WORKERS, textvariable=self.job_workers_var,
+                                      width=4, command=self.apply_job_workers)
+        workers_spinbox.pack(side=tk.LEFT, padx=(0, 10))
+        workers_spinbox.bind('<Return>', lambda e: self.apply_job_workers())
+        workers_spinbox.bind('<FocusOut>', lambda e: self.apply_job_workers())
+        self.job_batch_label = tk.Label(button_frame, text="", bg="#333333", fg="white")
+        self.job_batch_label.pack(side=tk.LEFT, padx=(10, 0))
+        self.job_api_label = tk.Label(button_frame, text="", bg="#333333", fg="#aaaaaa")
+        self.job_api_label.pack(side=tk.RIGHT)
+
+        self.current_batch_id = None
+        self._job_list_version = -1
+        self.refresh_job_queue()
+
+    def refresh_job_queue(self):
+        """定时把任务队列的快照同步到列表（只在版本号变化时刷新）"""
+        try:
+            if self.job_scheduler.version != self._job_list_version:
+                self._job_list_version = self.job_scheduler.version
+                jobs = self.job_scheduler.list_jobs()
+                existing = set(self.job_tree.get_children())
+                for job in jobs:
+                    params = job['params']
+                    if job['kind'] == 'merge':
+                        name = f"{len(params.get('inputs', []))} 个文件"
+                    else:
+                        name = os.path.basename(params.get('source', ''))
+                    values = (
+                        '接口' if job['origin'] == 'api' else '界面',
+                        JOB_KIND_NAMES[job['kind']],
+                        JOB_STATE_NAMES[job['state']],
+                        f"{job['progress']:.1f}%",
+                        name,
+                        job['error'] or job['output'] or job['message'],
+                    )
+                    if job['id'] in existing:
+                        self.job_tree.item(job['id'], values=values)
+                        existing.discard(job['id'])
+                    else:
+                        self.job_tree.insert('', tk.END, iid=job['id'], values=values)
+                for item in existing:
+                    self.job_tree.delete(item)
+            self.update_batch_summary()
+            if self.api_server is not None and not self.job_api_label.cget('text'):
+                self.job_api_label.config(text=f"任务接口已启用: 端口 {os.getenv('VIDEO_TOOL_API_PORT')}")
+        except Exception as e:
+            print(f"刷新任务队列失败: {e}")
+        self.root.after(500, self.refresh_job_queue)
+
+    def apply_job_workers(self):
+        """把输入的同时运行任务数应用到任务队列"""
+        try:
+            self.job_scheduler.set_workers(self.job_workers_var.get())
+        except (tk.TclError, ValueError):
+            pass
+        self.job_workers_var.set(self.job_scheduler.workers)
+
+    def update_batch_summary(self):
+        """显示最近一批任务的汇总进度、处理速度（倍速）和预计剩余时间"""
+        if not self.current_batch_id:
+            return
+        jobs = [job for job in self.job_scheduler.list_jobs() if job['params'].get('batch') == self.current_batch_id]
+        if not jobs:
+            self.job_batch_label.config(text="")
+            return
+        stats = batch_stats(jobs)
+        text = f"本批 {stats['done']}/{stats['count']} 完成"
+        if stats['failed']:
+            text += f"，{stats['failed']} 失败"
+        if stats['speed'] > 0:
+            text += f"，速度 {stats['speed']:.1f}x"
+        if stats['eta'] is not None:
+            text += f"，预计剩余 {self.format_duration(stats['eta'])[:8]}"
+        self.job_batch_label.config(text=text)
+
+    def cancel_selected_jobs(self):
+        """取消列表中选中的任务"""
+        for job_id in self.job_tree.selection():
+            self.job_scheduler.cancel(job_id)
+
+    def submit_job(self, kind, params):
+        """从界面提交任务到任务队列"""
+        try:
+            self.job_scheduler.submit(kind, params, origin='gui')
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
+        messagebox.showinfo("提示", f"已加入任务队列：{JOB_KIND_NAMES[kind]}")
+
+    def enqueue_trim(self):
+        """把当前剪切区间加入任务队列"""
+        if not self.video_path:
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        start_pos = self.get_slider_position("start")
+        end_pos = self.get_slider_position("end")
+        if start_pos is None or end_pos is None:
+            messagebox.showerror("错误", "无法获取滑块位置")
+            return
+        self.submit_job('trim', {
+            'source': self.video_path,
+            'start': round(self.position_to_time(start_pos), 3),
+            'end': round(self.position_to_time(end_pos), 3),
+        })
+
+    def enqueue_video_convert(self):
+        """按当前转换设置把视频加入任务队列"""
+        video_path = self.video_convert_path_var.get()
+        if not video_path or not os.path.exists(video_path):
+            messagebox.showerror("错误", "请先选择视频文件")
+            return
+        params = {'source': os.path.abspath(video_path)}
+        params.update(self.current_pipeline_steps()['convert'])
+        self.submit_job('convert', params)
+
     def __del__(self):
         """清理资源"""
         try:
@@ -6229,13 +10860,153 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
             pass
 
 
+def serve_job_api(port):
+    """无界面模式：只运行任务队列和HTTP接口，直到Ctrl+C"""
+    discover_toolchain()
+    scheduler = JobScheduler(metrics=MetricsRegistry(), result_cache=ResultCache())
+    server = JobAPIServer(scheduler, token=os.getenv('VIDEO_TOOL_API_TOKEN'))
+    server.serve(port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        scheduler.shutdown()
+    return 0
+
+
+# 硬字幕基准测试：合成视频的分辨率、帧率和字幕文字
+BENCHMARK_SIZES = ((1920, 1080), (3840, 2160))
+BENCHMARK_FPS = 30
+BENCHMARK_LINES = (
+    ("这是一条用于测试的字幕，长度和普通对白差不多", "This is a benchmark subtitle of typical length"),
+    ("第二条字幕：两行文字，中英文混排", "Second cue, two lines, mixed scripts"),
+    ("第三条字幕在画面上停留两秒半", "Each cue stays on screen for two and a half seconds"),
+)
+
+
+def write_benchmark_subtitles(path, seconds):
+    """基准测试字幕：每3秒一条，显示2.5秒，内容循环重复（和对白中反复出现的短句类似）"""
+    with open(path, 'w', encoding='utf-8') as f:
+        start, number = 0.5, 1
+        while start + 2.5 <= seconds:
+            chinese, english = BENCHMARK_LINES[(number - 1) % len(BENCHMARK_LINES)]
+            f.write(f"{number}\n{format_subtitle_time(start)} --> {format_subtitle_time(start + 2.5)}\n"
+                    f"{chinese}\n{english}\n\n")
+            start += 3.0
+            number += 1
+
+
+def build_benchmark_source_cmd(output_path, width, height, seconds):
+    """生成基准测试用的合成视频（testsrc2画面，快速编码）"""
+    return [
+        FFMPEG_PATH, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=s={width}x{height}:r={BENCHMARK_FPS}:d={seconds}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        output_path
+    ]
+
+
+def build_benchmark_burn_cmd(source, subtitle_path, overlay=None):
+    """解码并烧录字幕、不编码（输出到null），只比较字幕本身的开销"""
+    if overlay is None:
+        video_args = ['-vf', subtitle_burn_filter(subtitle_path, 24, 'white', 'bottom')]
+    else:
+        video_args = [*overlay_input_args(overlay), '-filter_complex', overlay_burn_graph(overlay), '-map', '[v]']
+    return [FFMPEG_PATH, '-v', 'error', '-nostdin', '-i', source, *video_args, '-an', '-f', 'null', '-']
+
+
+def run_subtitle_benchmark(seconds=30.0, sizes=BENCHMARK_SIZES):
+    """硬字幕基准测试：在合成视频上比较逐帧渲染（subtitles滤镜）和预渲染叠加的速度，只使用CPU"""
+    discover_toolchain()
+    work_dir = tempfile.mkdtemp(prefix='video_tool_bench_')
+    frames = int(seconds * BENCHMARK_FPS)
+
+    def timed(cmd):
+        started = time.perf_counter()
+        result = run_command(cmd)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr[-500:])
+        return time.perf_counter() - started
+
+    try:
+        subtitle_path = os.path.join(work_dir, 'bench.srt')
+        write_benchmark_subtitles(subtitle_path, seconds)
+        print(f"FFmpeg {FFMPEG_INFO.get('version', '')}，{os.cpu_count()} 个CPU，合成视频 {seconds:g} 秒（{frames} 帧）")
+        print(f"{'分辨率':<10}{'逐帧渲染':>12}{'预渲染':>10}{'叠加':>12}{'加速(仅叠加)':>14}{'加速(含预渲染)':>16}")
+        for width, height in sizes:
+            source = os.path.join(work_dir, f'bench_{height}p.mp4')
+            timed(build_benchmark_source_cmd(source, width, height, seconds))
+            # 先解码一遍，两种方式都从文件缓存读取
+            timed([FFMPEG_PATH, '-v', 'error', '-nostdin', '-i', source, '-f', 'null', '-'])
+            libass = timed(build_benchmark_burn_cmd(source, subtitle_path))
+            started = time.perf_counter()
+            overlay = prerender_subtitle_overlay(subtitle_path, width, height, 24, 'white', 'bottom',
+                                                 os.path.join(work_dir, f'overlay_{height}p'))
+            prerender = time.perf_counter() - started
+            if overlay is None:
+                raise RuntimeError("预渲染字幕失败：没有可见的字幕")
+            burn = timed(build_benchmark_burn_cmd(source, subtitle_path, overlay))
+            print(f"{f'{width}x{height}':<12}{frames / libass:>10.1f}fps{prerender:>9.2f}s{frames / burn:>10.1f}fps"
+                  f"{libass / burn:>13.2f}x{libass / (prerender + burn):>15.2f}x")
+        return 0
+    except RuntimeError as e:
+        print(f"基准测试失败: {e}")
+        return 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    """命令行入口：带--watch时以监视文件夹模式运行，否则启动界面"""
+    parser = argparse.ArgumentParser(description="视频处理工具")
+    parser.add_argument('--watch', metavar='DIR', help="监视文件夹，按预设处理新增的视频")
+    parser.add_argument('--preset', metavar='FILE', help="流水线预设文件（在视频转换页保存）")
+    parser.add_argument('--output', metavar='DIR', help="输出目录（默认为监视目录下的processed）")
+    parser.add_argument('--workers', type=int, default=2, help="同时处理的文件数")
+    parser.add_argument('--interval', type=float, default=2.0, help="扫描间隔（秒）")
+    parser.add_argument('--settle', type=float, default=5.0, help="文件大小保持不变多久后开始处理（秒）")
+    parser.add_argument('--api', type=int, metavar='PORT', help="不启动界面，只在本机端口上提供任务接口")
+    parser.add_argument('--benchmark-subtitles', type=float, nargs='?', const=30.0, metavar='SECONDS',
+                        help="硬字幕基准测试：比较逐帧渲染和预渲染叠加的速度（合成视频时长，默认30秒）")
+    args = parser.parse_args(argv)
+
+    if args.benchmark_subtitles is not None:
+        return run_subtitle_benchmark(args.benchmark_subtitles)
+
+    if args.api is not None and not args.watch:
+        return serve_job_api(args.api)
+
+    if not args.watch:
+        VideoTrimmerPro()
+        return 0
+
+    if args.api is not None:
+        parser.error("--api 不能与 --watch 同时使用")
+    if not args.preset:
+        parser.error("--watch 需要同时指定 --preset")
+    try:
+        preset = load_pipeline_preset(args.preset)
+    except (OSError, ValueError) as e:
+        parser.error(f"无法读取预设: {e}")
+
+    service = WatchFolderService(args.watch, preset, output_dir=args.output, workers=args.workers,
+                                 poll_interval=args.interval, settle_time=args.settle)
+    try:
+        service.run_forever()
+    except KeyboardInterrupt:
+        service.stop()
+    return 0
+
+
 if __name__ == "__main__":
     # 确保异常能够被正确打印
     sys.stdout = sys.__stdout__
     sys.stderr = sys.__stderr__
 
     try:
-        app = VideoTrimmerPro()
+        sys.exit(main())
     except Exception as e:
         logger.error(f"程序启动失败: {str(e)}")
         import traceback